@@ -0,0 +1,70 @@
+"""
+Batch generation for TTRPG Sidekick.
+
+Runs many generator specs concurrently on the async LLM client, so preparing a
+session's worth of content takes about as long as the slowest single sheet.
+"""
+
+import asyncio
+from typing import Optional, Union
+from pydantic import BaseModel
+from core.generator_agent import variation_numbers
+from core.llm_service import llm_service
+from router import generator_for_spec
+
+
+async def generate_many_async(
+    specs: list[BaseModel],
+    concurrency: int = 4,
+    timeout: Optional[float] = None,
+    coalesce: bool = False,
+) -> list[Union[str, Exception]]:
+    """
+    Generates a sheet for every spec, running at most `concurrency` requests at once.
+
+    Args:
+        specs: Generator specs (NPCSpec, QuestSpec, ...), which may be mixed.
+        concurrency: Maximum number of LLM requests in flight at the same time.
+        timeout: Per-request timeout in seconds, counted from when the request starts.
+        coalesce: Let identical specs share one result. Off by default, since a batch
+            repeats a spec to get several variations of it. The repeats are also cached
+            apart, so they aren't answered with the first one's cached sheet.
+
+    Returns:
+        One entry per spec, in the same order as `specs`. A failed or timed-out request
+        yields its exception instead of a sheet, so one failure does not lose the batch.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(spec: BaseModel, variation: int) -> str:
+        agent_class = generator_for_spec(spec).agent_class
+        async with semaphore:
+            agent = agent_class(coalesce=coalesce, variation=variation)
+            return await asyncio.wait_for(agent.generate_sheet_async(spec), timeout)
+
+    variations = variation_numbers(specs)
+    return await asyncio.gather(*(run(spec, variation) for spec, variation in zip(specs, variations)), return_exceptions=True)
+
+
+def generate_many(
+    specs: list[BaseModel],
+    concurrency: int = 4,
+    timeout: Optional[float] = None,
+    coalesce: bool = False,
+) -> list[Union[str, Exception]]:
+    """
+    Synchronous entry point for generate_many_async.
+
+    Example:
+        >>> from features.npc_generator.agent import NPCSpec
+        >>> specs = [NPCSpec(world_name="Eberron", prompt="a tavern regular", brief=True)] * 10
+        >>> sheets = generate_many(specs, concurrency=5, timeout=60)
+    """
+    async def run() -> list[Union[str, Exception]]:
+        try:
+            return await generate_many_async(specs, concurrency=concurrency, timeout=timeout, coalesce=coalesce)
+        finally:
+            # The client's connections belong to this event loop, which asyncio.run closes
+            await llm_service.aclose()
+
+    return asyncio.run(run())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Compares two benchmark result files and flags regressions.
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+
+# Metrics where a higher value is better; for everything else lower is better
+HIGHER_IS_BETTER = ("per_second",)
+
+# Metrics that describe the run rather than its performance
+IGNORED = ("samples", "requests", "errors")
+
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    """Flattens the numeric results into dotted paths, e.g. "latency.npc.brief.p50_ms"."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in IGNORED:
+            flat[path] = float(value)
+    return flat
+
+
+def compare(old: dict, new: dict, threshold: float) -> list[tuple[str, float, float, float, bool]]:
+    """
+    Compares the metrics present in both result sets.
+
+    Returns:
+        (metric, old value, new value, change in percent, regressed) for each metric.
+    """
+    old_metrics = flatten({key: value for key, value in old.items() if key != "meta"})
+    new_metrics = flatten({key: value for key, value in new.items() if key != "meta"})
+    rows = []
+    for metric in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[metric], new_metrics[metric]
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+        rows.append((metric, before, after, change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("old", type=str, help="Baseline results.")
+    parser.add_argument("new", type=str, help="Results to check.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percentage change counted as a regression.")
+    parser.add_argument("--all", action="store_true", help="Show every metric, not only the ones that changed by more than the threshold.")
+    args = parser.parse_args()
+
+    with open(args.old, "r") as f:
+        old = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+
+    print(f"📊 {old['meta']['commit']} → {new['meta']['commit']}")
+    rows = compare(old, new, args.threshold)
+    regressions = 0
+    for metric, before, after, change, regressed in rows:
+        if not args.all and abs(change) <= args.threshold:
+            continue
+        marker = "❌" if regressed else "✅"
+        print(f"{marker} {metric:<45} {before:>10.2f} → {after:>10.2f} ({change:+.1f}%)")
+        regressions += regressed
+
+    if regressions:
+        print(f"\n❌ {regressions} metric(s) regressed by more than {args.threshold:.0f}%")
+        sys.exit(1)
+    print(f"\n✅ No regressions above {args.threshold:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
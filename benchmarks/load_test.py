@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Load test for the TTRPG Sidekick HTTP API.
+
+Starts the stub model server and the API server (interface/api.py) pointed at it, then
+sends many concurrent /generate requests from several clients and reports how many
+were served or turned away with 429, their latency and, for streams, the time to the
+first event. Use --url to load an API server that is already running instead.
+
+Usage:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --requests 500 --concurrency 64 --clients 16 --stream
+    python -m benchmarks.load_test --max-in-flight 8 --max-queue 8 --client-limit 2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+LOAD_TEST_PROMPT = "A retired adventurer who runs a lantern shop and knows every secret of the old road"
+
+
+def wait_until_healthy(url: str, timeout: float = 30.0, process: Optional[subprocess.Popen] = None) -> None:
+    """Polls the API's /health until it answers, or raises TimeoutError (RuntimeError if `process` exits)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"The API server exited with code {process.returncode}; is fastapi installed?")
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"The API server at {url} did not start within {timeout:.0f}s")
+
+
+def send_request(url: str, kind: str, client: str, brief: bool, stream: bool, index: int) -> dict:
+    """
+    Sends one /generate request.
+
+    Returns:
+        The HTTP status (0 if the connection failed), the total seconds and, for a
+        successful stream, the seconds until the first text event.
+    """
+    body = json.dumps({"prompt": f"{LOAD_TEST_PROMPT} #{index}", "brief": brief, "stream": stream}).encode("utf-8")
+    request = urllib.request.Request(
+        f"{url}/generate/{kind}",
+        data=body,
+        headers={"Content-Type": "application/json", "X-Client-Id": client},
+    )
+    start = time.perf_counter()
+    first_event: Optional[float] = None
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            if stream:
+                for line in response:
+                    if first_event is None and line.startswith(b"data:"):
+                        first_event = time.perf_counter() - start
+                    if line.startswith(b"event: error"):
+                        return {"status": 500, "seconds": time.perf_counter() - start, "ttft": None}
+            else:
+                response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return {"status": status, "seconds": time.perf_counter() - start, "ttft": first_event}
+
+
+def run_load(url: str, kind: str, requests: int, concurrency: int, clients: int, brief: bool, stream: bool) -> dict:
+    """Sends `requests` requests, `concurrency` at a time, spread round-robin over `clients` client ids."""
+    from benchmarks.run import summarize
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(send_request, url, kind, f"client-{i % clients}", brief, stream, i)
+            for i in range(requests)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    served = [result for result in results if result["status"] == 200]
+    first_events = [result["ttft"] for result in served if result["ttft"] is not None]
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "statuses": dict(Counter(result["status"] for result in results)),
+        "served_per_second": round(len(served) / elapsed, 3),
+        "latency": summarize([result["seconds"] for result in served]) if served else None,
+        "first_event": summarize(first_events) if first_events else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the TTRPG Sidekick HTTP API.")
+    parser.add_argument("--url", type=str, default=None, help="Base URL of a running API server (default: start one against the stub model).")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the API server started by the test.")
+    parser.add_argument("--kind", type=str, default="npc", help="Generator to request.")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests to send.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at once.")
+    parser.add_argument("--clients", type=int, default=8, help="Distinct client ids the requests are spread over.")
+    parser.add_argument("--brief", action="store_true", help="Request brief sheets.")
+    parser.add_argument("--stream", action="store_true", help="Request server-sent event streams.")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="TTRPG_API_MAX_IN_FLIGHT of the started server.")
+    parser.add_argument("--max-queue", type=int, default=64, help="TTRPG_API_MAX_QUEUE of the started server.")
+    parser.add_argument("--client-limit", type=int, default=4, help="TTRPG_API_CLIENT_LIMIT of the started server.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub server delay before the first token, in seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stub server token rate.")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Tokens per stub response.")
+    parser.add_argument("--output", type=str, default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(PROJECT_ROOT))
+    server = api = None
+    url = args.url.rstrip("/") if args.url else f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.url is None:
+            from benchmarks.stub_server import StubConfig, start_stub_server
+
+            server = start_stub_server(StubConfig(args.latency, args.tokens_per_second, args.completion_tokens))
+            env = {
+                **os.environ,
+                "API_PROVIDER": "ollama",
+                "OLLAMA_BASE_URL": f"http://127.0.0.1:{server.server_port}/v1",
+                "OLLAMA_MODEL": "stub-model",
+                "TTRPG_DATA_DIR": str(Path(temp_dir) / "shared"),
+                "TTRPG_WORLDS_DIR": str(Path(temp_dir) / "shared" / "worlds"),
+                "TTRPG_CACHE_MODE": "off",
+                "TTRPG_API_MAX_IN_FLIGHT": str(args.max_in_flight),
+                "TTRPG_API_MAX_QUEUE": str(args.max_queue),
+                "TTRPG_API_CLIENT_LIMIT": str(args.client_limit),
+            }
+            api = subprocess.Popen(
+                [sys.executable, "-m", "interface.api", "--port", str(args.port)],
+                cwd=PROJECT_ROOT,
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+
+        try:
+            wait_until_healthy(url, process=api)
+            print("🎲 TTRPG Sidekick - API load test")
+            print("=" * 50)
+            print(f"⏱️ {args.requests} requests to /generate/{args.kind}, {args.concurrency} at a time from {args.clients} clients...")
+            results = run_load(url, args.kind, args.requests, args.concurrency, args.clients, args.brief, args.stream)
+        finally:
+            if api is not None:
+                api.terminate()
+                api.wait(timeout=10)
+            if server is not None:
+                server.shutdown()
+
+    statuses = ", ".join(f"{status or 'failed'}: {count}" for status, count in sorted(results["statuses"].items()))
+    print(f"Statuses: {statuses}")
+    print(f"Served: {results['served_per_second']:.1f} requests/s over {results['seconds']:.1f}s")
+    if results["latency"]:
+        print(f"Latency: p50 {results['latency']['p50_ms']:.0f} ms, p95 {results['latency']['p95_ms']:.0f} ms, max {results['latency']['max_ms']:.0f} ms")
+    if results["first_event"]:
+        print(f"First event: p50 {results['first_event']['p50_ms']:.0f} ms, p95 {results['first_event']['p95_ms']:.0f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
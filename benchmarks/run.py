@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the TTRPG Sidekick.
+
+Runs every generator against the local stub server and writes the results to a JSON
+file, so releases can be compared with `python -m benchmarks.compare old.json new.json`.
+
+Measures:
+- latency: end-to-end time of generate_sheet per generator, brief and full
+- overhead: the same requests replayed from a cassette, i.e. everything except the model
+- throughput: sheets per second through generate_many at several concurrency levels
+- startup: import time of the entry points
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --iterations 10 --latency 0.2 --tokens-per-second 50 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+RESULTS_DIR = Path(__file__).parent / "results"
+
+BENCHMARK_WORLD = "Benchmark World"
+BENCHMARK_PROMPT = "A retired adventurer who runs a lantern shop and knows every secret of the old road"
+
+
+def summarize(samples: list[float]) -> dict:
+    """Summary statistics of a list of durations, in milliseconds."""
+    ordered = sorted(samples)
+    return {
+        "samples": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def time_generators(data_dir: Path, iterations: int) -> dict:
+    """
+    Times generate_sheet for every generator, brief and full, with world memory and lore
+    kept in `data_dir`. Running this twice on fresh directories sends identical requests.
+    """
+    from core.llm_service import llm_service
+    from core.lore_tracker import LoreTracker
+    from core.memory import MemoryService
+    from router import GENERATORS
+
+    lore = LoreTracker(data_dir / "lore")
+    memory = MemoryService(str(data_dir / "worlds"), lore=lore)
+    # Untimed first request, so client setup isn't counted against the first generator
+    llm_service.complete([{"role": "user", "content": "Warm up"}], max_tokens=1)
+    results = {}
+    for name, generator in GENERATORS.items():
+        agent = generator.agent_class(memory=memory, lore=lore)
+        results[name] = {}
+        for brief in (True, False):
+            spec = generator.create_spec(BENCHMARK_WORLD, BENCHMARK_PROMPT, brief)
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                agent.generate_sheet(spec)
+                samples.append(time.perf_counter() - start)
+            results[name]["brief" if brief else "full"] = summarize(samples)
+    return results
+
+
+def measure_throughput(levels: list[int], requests_per_level: int) -> dict:
+    """Measures sheets per second through generate_many at each concurrency level."""
+    from batch import generate_many
+    from router import GENERATORS
+
+    generator = GENERATORS["npc"]
+    results = {}
+    for concurrency in levels:
+        count = max(requests_per_level, concurrency)
+        specs = [generator.create_spec(BENCHMARK_WORLD, f"{BENCHMARK_PROMPT} #{i}", True) for i in range(count)]
+        start = time.perf_counter()
+        sheets = generate_many(specs, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        results[str(concurrency)] = {
+            "requests": count,
+            "errors": sum(isinstance(sheet, Exception) for sheet in sheets),
+            "seconds": round(elapsed, 3),
+            "per_second": round(count / elapsed, 3),
+        }
+    return results
+
+
+def measure_startup() -> dict:
+    """Import time of each entry point in a fresh interpreter, in milliseconds."""
+    from test_startup_time import ENTRY_POINTS, measure_import
+
+    return {module: round(measure_import(module)[module] / 1000, 3) for module in ENTRY_POINTS}
+
+
+def git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--iterations", type=int, default=3, help="Requests per generator and template.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub server delay before the first token, in seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="Stub server token rate.")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Tokens per stub response.")
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="Comma-separated concurrency levels for the throughput test.")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per concurrency level.")
+    parser.add_argument("--output", type=str, default=None, help="Where to write the JSON results (default: benchmarks/results/<date>-<commit>.json).")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(PROJECT_ROOT))
+    from benchmarks.stub_server import StubConfig, start_stub_server
+
+    config = StubConfig(args.latency, args.tokens_per_second, args.completion_tokens)
+    server = start_stub_server(config)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        # Point everything at the stub server and keep the benchmark's data out of data/;
+        # set before the core modules are imported, since they read the environment then
+        os.environ.update({
+            "API_PROVIDER": "ollama",
+            "OLLAMA_BASE_URL": f"http://127.0.0.1:{server.server_port}/v1",
+            "OLLAMA_MODEL": "stub-model",
+            "TTRPG_DATA_DIR": str(temp_dir / "shared"),
+            "TTRPG_WORLDS_DIR": str(temp_dir / "shared" / "worlds"),
+            "TTRPG_CACHE_MODE": "off",
+        })
+        from core.llm_service import llm_service
+
+        print("🎲 TTRPG Sidekick - Benchmarks")
+        print("=" * 50)
+
+        print("⏱️ Startup time...")
+        startup = measure_startup()
+
+        print("⏱️ Generator latency against the stub server...")
+        cassette = temp_dir / "benchmark.jsonl"
+        llm_service.configure_cassette(str(cassette), "record")
+        latency = time_generators(temp_dir / "recorded", args.iterations)
+
+        print("⏱️ Overhead outside the model call (cassette replay)...")
+        llm_service.configure_cassette(str(cassette), "replay")
+        overhead = time_generators(temp_dir / "replayed", args.iterations)
+        llm_service.configure_cassette(None)
+
+        print("⏱️ Throughput under concurrency...")
+        levels = [int(level) for level in args.concurrency.split(",")]
+        throughput = measure_throughput(levels, args.requests)
+
+    server.shutdown()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "stub": {"latency": config.latency, "tokens_per_second": config.tokens_per_second, "completion_tokens": config.completion_tokens},
+        },
+        "startup_ms": startup,
+        "latency": latency,
+        "overhead": overhead,
+        "throughput": throughput,
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{results['meta']['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print()
+    print(f"{'Generator':<14}{'Latency p50 (brief/full)':>28}{'Overhead p50 (brief/full)':>30}")
+    for name in latency:
+        lat = f"{latency[name]['brief']['p50_ms']:.1f} / {latency[name]['full']['p50_ms']:.1f} ms"
+        over = f"{overhead[name]['brief']['p50_ms']:.1f} / {overhead[name]['full']['p50_ms']:.1f} ms"
+        print(f"{name:<14}{lat:>28}{over:>30}")
+    for level, result in throughput.items():
+        print(f"Concurrency {level:>3}: {result['per_second']:.1f} sheets/s ({result['errors']} errors)")
+    for module, ms in startup.items():
+        print(f"import {module}: {ms:.1f} ms")
+    print(f"\n✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
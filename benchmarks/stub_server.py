@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible stub server for benchmarks.
+
+Answers /v1/chat/completions (streaming and not) with deterministic text, or a JSON
+object when a JSON schema response_format is given, after a configurable delay, at a configurable token rate, so the application can be measured
+without a real model. Point the app at it like any Ollama server:
+
+    python -m benchmarks.stub_server --port 8089 --latency 0.2 --tokens-per-second 50
+    API_PROVIDER=ollama OLLAMA_BASE_URL=http://127.0.0.1:8089/v1 python main.py "/npc a bard"
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_WORDS = (
+    "the old keeper of the lantern road trades secrets for silver and remembers every face "
+    "that passes beneath the broken arch where the river spirits sing of forgotten kings"
+).split()
+
+
+@dataclass
+class StubConfig:
+    """How the stub server behaves."""
+    latency: float = 0.05  # Seconds before the first token
+    tokens_per_second: float = 500.0
+    completion_tokens: int = 200  # Tokens per response, unless max_tokens is lower
+    error_rate: float = 0.0  # Share of requests answered with a 503
+    slow_rate: float = 0.0  # Share of requests that wait slow_latency instead of latency
+    slow_latency: float = 2.0
+    load_latency: float = 0.0  # Extra seconds for the first request, like a model being loaded
+
+
+def stub_tokens(count: int) -> list[str]:
+    """Deterministic response tokens: words with a line break every twelve of them."""
+    tokens = []
+    for i in range(count):
+        separator = "\n" if i % 12 == 11 else " "
+        tokens.append(STUB_WORDS[i % len(STUB_WORDS)] + separator)
+    return tokens
+
+
+def stub_json_tokens(schema: dict, count: int) -> list[str]:
+    """A JSON object with a few stub words for every property of the schema, split into tokens like stub_tokens."""
+    words = stub_tokens(max(count, 1))
+    properties = list(schema.get("properties", {}))
+    per_field = max(1, len(words) // max(len(properties), 1))
+    values = {
+        name: "".join(words[i * per_field:(i + 1) * per_field]).strip().replace("\n", " ") or STUB_WORDS[0]
+        for i, name in enumerate(properties)
+    }
+    return re.findall(r"\S+\s*", json.dumps(values))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, payload: str) -> None:
+        data = f"data: {payload}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def _load_model(self) -> None:
+        """Waits load_latency the first time, like Ollama loading a model."""
+        with self.server.load_lock:
+            if not self.server.model_loaded:
+                time.sleep(self.config.load_latency)
+                self.server.model_loaded = True
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if path == "/api/generate":
+            # Ollama's native API; without a prompt it only loads the model
+            self._load_model()
+            self._send_json(200, {"model": request.get("model", "stub-model"), "response": "", "done": True})
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        config = self.config
+        count = min(request.get("max_tokens") or config.completion_tokens, config.completion_tokens)
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            tokens = stub_json_tokens(response_format["json_schema"]["schema"], count)
+        else:
+            tokens = stub_tokens(count)
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub-model")}
+        token_delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        if random.random() < config.error_rate:
+            self._send_json(503, {"error": {"message": "Stub server overloaded"}})
+            return
+        self._load_model()
+        time.sleep(config.slow_latency if random.random() < config.slow_rate else config.latency)
+        if not request.get("stream"):
+            time.sleep(token_delay * len(tokens))
+            self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self._send_chunk(json.dumps(chunk))
+            time.sleep(token_delay)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_chunk(json.dumps({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        self._send_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Accept bursts of concurrent connections instead of refusing them
+    request_queue_size = 128
+    model_loaded = False
+    load_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose, e.g. the slower of two hedged requests
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts the stub server in a background thread.
+
+    Args:
+        config: Latency and token rate of the responses.
+        host: Interface to listen on.
+        port: Port to listen on; 0 picks a free one.
+
+    Returns:
+        The running server; its base URL is http://host:server.server_port/v1. Call shutdown() to stop it.
+    """
+    server = StubServer((host, port), type("ConfiguredStubHandler", (StubHandler,), {"config": config}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an OpenAI-compatible stub server for benchmarks.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on.")
+    parser.add_argument("--latency", type=float, default=StubConfig.latency, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=StubConfig.tokens_per_second, help="Rate at which tokens are produced.")
+    parser.add_argument("--completion-tokens", type=int, default=StubConfig.completion_tokens, help="Tokens per response.")
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate, help="Share of requests answered with a 503.")
+    parser.add_argument("--slow-rate", type=float, default=StubConfig.slow_rate, help="Share of requests delayed by --slow-latency.")
+    parser.add_argument("--slow-latency", type=float, default=StubConfig.slow_latency, help="Seconds before the first token of a slow request.")
+    parser.add_argument("--load-latency", type=float, default=StubConfig.load_latency, help="Extra seconds for the first request, like loading a model.")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        args.latency, args.tokens_per_second, args.completion_tokens,
+        args.error_rate, args.slow_rate, args.slow_latency, args.load_latency,
+    )
+    server = StubServer((args.host, args.port), type("ConfiguredStubHandler", (StubHandler,), {"config": config}))
+    print(f"🧪 Stub server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Goodbye!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Admission control for TTRPG Sidekick
+
+Limits how many requests a server works on at once, so a burst of requests waits
+briefly or is turned away instead of piling up on the model:
+- at most `max_in_flight` requests run at once across all clients
+- at most `per_client` requests of any one client run or wait at once, so one busy
+  table can't starve the others
+- at most `max_queue` requests wait for a free slot, each for at most `queue_timeout`
+  seconds
+
+A request that can't be admitted fails at once with OverloadedError, which carries a
+suggested retry delay; interfaces turn it into backpressure such as an HTTP 429 with a
+Retry-After header.
+
+An AdmissionController is used from a single event loop.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+# Weight of the latest request in the moving average of request durations
+DURATION_SMOOTHING = 0.2
+
+
+class OverloadedError(RuntimeError):
+    """Raised when a request can't be admitted; retry_after is the suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global and per-client limits on concurrent requests, with a bounded wait queue."""
+
+    def __init__(self, max_in_flight: int = 16, max_queue: int = 64, per_client: int = 4, queue_timeout: float = 30.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self._clients: dict[str, int] = defaultdict(int)
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._average_duration = 1.0
+
+    @classmethod
+    def from_env(cls, prefix: str = "TTRPG_API") -> "AdmissionController":
+        """Limits read from <prefix>_MAX_IN_FLIGHT, _MAX_QUEUE, _CLIENT_LIMIT and _QUEUE_TIMEOUT."""
+        return cls(
+            max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", "16")),
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", "64")),
+            per_client=int(os.getenv(f"{prefix}_CLIENT_LIMIT", "4")),
+            queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", "30")),
+        )
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until a rejected request is likely to be admitted, from the recent request durations."""
+        backlog = (self.queued + 1) / self.max_in_flight
+        return max(1.0, math.ceil(self._average_duration * backlog))
+
+    def _reject(self, message: str) -> OverloadedError:
+        self.rejected += 1
+        return OverloadedError(message, self.retry_after)
+
+    async def acquire(self, client: str) -> Callable[[], None]:
+        """
+        Waits for a slot for one of the client's requests.
+
+        Returns:
+            A function that frees the slot; call it exactly once, when the request is done.
+
+        Raises:
+            OverloadedError: If the client or the queue is at its limit, or no slot was free
+                within queue_timeout.
+        """
+        if self._clients.get(client, 0) >= self.per_client:
+            raise self._reject(f"Too many requests in progress for this client (limit {self.per_client})")
+        if self.in_flight + self.queued >= self.max_in_flight + self.max_queue:
+            raise self._reject("The server is busy; try again shortly")
+
+        self._clients[client] += 1
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave(client)
+            raise self._reject("Timed out waiting for a free slot; try again shortly") from None
+        except BaseException:
+            self._leave(client)
+            raise
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        started = time.monotonic()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if released:
+                return
+            released = True
+            duration = time.monotonic() - started
+            self._average_duration += DURATION_SMOOTHING * (duration - self._average_duration)
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._leave(client)
+
+        return release
+
+    def _leave(self, client: str) -> None:
+        self._clients[client] -= 1
+        if self._clients[client] <= 0:
+            del self._clients[client]
+
+    @asynccontextmanager
+    async def slot(self, client: str) -> AsyncIterator[None]:
+        """Holds a slot for one of the client's requests while the block runs."""
+        release = await self.acquire(client)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self) -> dict:
+        """Current load, e.g. for a health endpoint."""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "clients": len(self._clients),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "per_client": self.per_client,
+        }
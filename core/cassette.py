@@ -0,0 +1,204 @@
+"""
+Cassettes for TTRPG Sidekick
+
+Records chat completion requests and responses to a JSONL file and plays them back,
+so generators can be tested and benchmarked without an API key or a running model.
+
+A cassette client stands in for the OpenAI client: in "record" mode it forwards each
+request to the real client and saves the response, in "replay" mode it answers from
+the file and never touches the network.
+"""
+
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Optional
+
+CASSETTE_MODES = ("record", "replay")
+
+# Request arguments that identify an interaction; anything else (e.g. stream_options) is ignored
+MATCHED_ARGUMENTS = ("model", "messages", "temperature", "max_tokens", "stream")
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def _usage(recorded: Optional[dict]) -> Optional[SimpleNamespace]:
+    """Rebuilds a usage object with the attributes TokenUsage.from_response reads."""
+    if recorded is None:
+        return None
+    return SimpleNamespace(
+        prompt_tokens=recorded.get("prompt_tokens", 0),
+        completion_tokens=recorded.get("completion_tokens", 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=recorded.get("cached_tokens", 0)),
+    )
+
+
+def _usage_dict(usage: Any) -> Optional[dict]:
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
+
+
+def _completion(response: dict) -> SimpleNamespace:
+    """Rebuilds a chat completion object from a recorded response."""
+    message = SimpleNamespace(content="".join(response["chunks"]), role="assistant")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=_usage(response.get("usage")))
+
+
+def _chunks(response: dict) -> list[SimpleNamespace]:
+    """Rebuilds the stream chunks of a recorded response, ending with a usage-only chunk."""
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+        for text in response["chunks"]
+    ]
+    if response.get("usage"):
+        chunks.append(SimpleNamespace(choices=[], usage=_usage(response["usage"])))
+    return chunks
+
+
+class Cassette:
+    """A file of recorded interactions, one JSON object per line, matched by a hash of the request arguments."""
+
+    def __init__(self, path: str, mode: str = "replay"):
+        """
+        Args:
+            path: JSONL file to record to or replay from.
+            mode: "record" or "replay".
+        """
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}'. Expected one of: {', '.join(CASSETTE_MODES)}")
+        self.path = Path(path)
+        self.mode = mode
+        self._by_key: dict[str, list[dict]] = defaultdict(list)
+        self._played: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._by_key[interaction["key"]].append(interaction)
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+
+    def __len__(self) -> int:
+        return sum(len(interactions) for interactions in self._by_key.values())
+
+    @staticmethod
+    def request_key(request: dict) -> str:
+        """Hashes the arguments that identify a request."""
+        matched = {name: request.get(name) for name in MATCHED_ARGUMENTS}
+        matched["stream"] = bool(matched["stream"])
+        encoded = json.dumps(matched, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def play(self, request: dict) -> dict:
+        """
+        Returns the recorded response for a request.
+
+        The same request recorded several times is answered in recording order; once those
+        are used up, the last recording is repeated.
+        """
+        key = self.request_key(request)
+        with self._lock:
+            matches = self._by_key.get(key)
+            if not matches:
+                raise CassetteMissError(f"No recorded response in {self.path} for this request to {request.get('model')}")
+            index = min(self._played[key], len(matches) - 1)
+            self._played[key] += 1
+        return matches[index]["response"]
+
+    def record(self, request: dict, chunks: list[str], usage: Any) -> None:
+        """Adds an interaction and appends it to the cassette file."""
+        interaction = {
+            "key": self.request_key(request),
+            "request": {name: request.get(name) for name in MATCHED_ARGUMENTS},
+            "response": {"chunks": chunks, "usage": _usage_dict(usage)},
+        }
+        with self._lock:
+            self._by_key[interaction["key"]].append(interaction)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+
+
+class _Completions:
+    def __init__(self, cassette: Cassette, client: Any):
+        self.cassette = cassette
+        self.client = client
+
+    def create(self, **request):
+        if self.cassette.mode == "replay":
+            response = self.cassette.play(request)
+            return iter(_chunks(response)) if request.get("stream") else _completion(response)
+
+        response = self.client.chat.completions.create(**request)
+        if not request.get("stream"):
+            self.cassette.record(request, [response.choices[0].message.content or ""], getattr(response, "usage", None))
+            return response
+        return self._record_stream(request, response)
+
+    def _record_stream(self, request: dict, response):
+        chunks, usage = [], None
+        for chunk in response:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+            yield chunk
+        self.cassette.record(request, chunks, usage)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, **request):
+        if self.cassette.mode == "replay":
+            response = self.cassette.play(request)
+            return self._replay_stream(response) if request.get("stream") else _completion(response)
+
+        response = await self.client.chat.completions.create(**request)
+        if not request.get("stream"):
+            self.cassette.record(request, [response.choices[0].message.content or ""], getattr(response, "usage", None))
+            return response
+        return self._record_stream_async(request, response)
+
+    async def _replay_stream(self, response: dict):
+        for chunk in _chunks(response):
+            yield chunk
+
+    async def _record_stream_async(self, request: dict, response):
+        chunks, usage = [], None
+        async for chunk in response:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+            yield chunk
+        self.cassette.record(request, chunks, usage)
+
+
+class CassetteClient:
+    """Stands in for an OpenAI client, recording to or replaying from a cassette."""
+
+    def __init__(self, cassette: Cassette, client: Any = None):
+        """
+        Args:
+            cassette: The cassette to use.
+            client: The real client requests are forwarded to when recording.
+        """
+        self.chat = SimpleNamespace(completions=_Completions(cassette, client))
+
+
+class AsyncCassetteClient:
+    """Async version of CassetteClient, standing in for an AsyncOpenAI client."""
+
+    def __init__(self, cassette: Cassette, client: Any = None):
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(cassette, client))
@@ -0,0 +1,90 @@
+"""
+Context extraction for chat history.
+
+Each message is scanned once, when it is added to the history, for the things worth
+carrying into later generator prompts: numbered options offered by the assistant,
+option selections and preferences from the user, and references to earlier content.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+from core.token_budget import count_tokens, truncate_to_tokens
+
+# Lines of a numbered list, e.g. "2. A tavern run by retired adventurers"
+NUMBERED_LINE_PATTERN = re.compile(r'^[ \t]*([1-9]\..*)$', re.MULTILINE)
+
+# The user picking an option, e.g. "/npc number 2"
+SELECTION_PATTERN = re.compile(r'number\s+(\d+)', re.IGNORECASE)
+
+
+def _keyword_pattern(keywords: list[str]) -> re.Pattern:
+    """Compiles keywords into one case-insensitive alternation, so a message is scanned once."""
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+
+
+# Assistant messages that look like ideas or concepts rather than plain replies
+IDEA_KEYWORDS = _keyword_pattern([
+    "idea", "concept", "tavern", "quest", "npc", "building", "magic", "battle", "sword",
+    "temple", "artifact", "heist", "wizard", "dragon", "castle",
+])
+
+# User messages that refer back to earlier parts of the conversation
+PREFERENCE_KEYWORDS = _keyword_pattern([
+    "like", "prefer", "choose", "option", "want", "that", "discussed", "earlier", "before", "mentioned",
+])
+
+# User messages that mention a specific kind of content
+CONTENT_KEYWORDS = _keyword_pattern([
+    "heist", "tavern", "sword", "quest", "npc", "building", "battle", "artifact", "temple", "wizard", "dragon",
+])
+
+# Maximum numbered options and excerpt length kept per message
+MAX_OPTIONS = 5
+EXCERPT_TOKENS = 75
+
+
+@dataclass
+class MessageContext:
+    """What a single chat message contributes to generator prompts."""
+    parts: list[str] = field(default_factory=list)
+    tokens: int = 0
+    options: list[str] = field(default_factory=list)  # Numbered options offered by the assistant
+    selected_option: Optional[int] = None  # Option number picked by the user
+
+
+def extract_message_context(role: str, content: str, model: Optional[str] = None) -> MessageContext:
+    """
+    Extracts the context a message adds to later generator prompts.
+
+    Args:
+        role: "user" or "assistant".
+        content: The message text.
+        model: Model name used for token counting.
+
+    Returns:
+        The context parts for the message, with their token count already computed.
+    """
+    context = MessageContext()
+
+    if role == "assistant":
+        # Numbered lists in assistant responses (ideas, options, etc.)
+        context.options = [line.strip() for line in NUMBERED_LINE_PATTERN.findall(content)]
+        if context.options:
+            context.parts.append("Previous options discussed:\n" + "\n".join(context.options[:MAX_OPTIONS]))
+        # Otherwise, responses that seem like ideas or concepts rather than plain replies
+        elif len(content) > 50 and IDEA_KEYWORDS.search(content):
+            context.parts.append(f"Previous discussion: {truncate_to_tokens(content, EXCERPT_TOKENS, model)}")
+
+    elif role == "user":
+        selection = SELECTION_PATTERN.search(content)
+        if selection:
+            context.selected_option = int(selection.group(1))
+            context.parts.append(f"User selected option #{context.selected_option}: {content}")
+        elif PREFERENCE_KEYWORDS.search(content):
+            context.parts.append(f"User preference: {content}")
+        elif CONTENT_KEYWORDS.search(content):
+            context.parts.append(f"User referencing specific content: {content}")
+
+    context.tokens = sum(count_tokens(part, model) for part in context.parts)
+    return context
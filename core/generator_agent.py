@@ -0,0 +1,915 @@
+"""
+Base class shared by the template-filling generator agents.
+
+Each feature agent supplies its own system prompt, templates, filler phrases and
+user prompt; this class owns the LLM call and the cleanup of the response.
+
+Messages are laid out with everything static first (system prompt, guidelines and
+template) and the user's idea last, so consecutive requests share a long identical
+prefix that providers can serve from their prompt cache (OpenAI cached input tokens,
+Ollama KV cache reuse). A short summary of the spec's world sits between the two; it
+only changes when the world does, so requests for the same world share it as well.
+Lore retrieved for the request comes after it, just before the request itself.
+
+Every generated sheet is added to the world's lore, so later requests can build on it.
+
+In structured mode (TTRPG_STRUCTURED_OUTPUT, or structured=True) the model fills in a
+JSON object with the template's fields instead of the template itself (see
+core.sheet_model). The sheet is rendered in the template's layout locally, and also
+stored in world memory as an entity, e.g. an NPC with its name, race and location.
+Streaming yields the whole sheet at once in this mode.
+
+Identical requests made while one of them is in progress share its result (see
+core.single_flight): the same generator, prompt, brief flag, world and model send one
+request to the model, record one sheet, and every caller gets the sheet, streamed or
+not. Set TTRPG_COALESCE=0, or pass coalesce=False, to always make a request of one's
+own, e.g. to get several variations of the same idea.
+
+In sectioned mode (TTRPG_SECTIONED, or sectioned=True) a full sheet is written by
+several requests at once instead of one long one. The first asks for the template's
+first section and a short core concept (names, places, the central conflict) that the
+rest must agree with; then every other section is requested at the same time, each
+given the first section and the concept, and the answers are put back in order. This
+takes about as long as the first section plus the longest other section, rather than
+the whole sheet. Brief and structured sheets are always written in one piece.
+
+A brief sheet can be expanded into the full one without starting over: the values of
+the full template's fields that the brief one already has are copied over, and the
+model is only asked for the rest, given the brief sheet to stay consistent with. That
+takes a fraction of a full sheet's output tokens. The expanded sheet is laid out like
+the full template, as in structured mode.
+
+Each generation is reported to core.metrics as one call, including the time spent
+building the prompt ("context"), cleaning the response ("clean") and adding it to
+the lore ("record"); sectioned sheets also report the first request ("core") and the
+rest ("sections"), and the tokens of all their requests together. A call that shared
+another's result is reported as coalesced.
+"""
+
+import asyncio
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import AsyncIterator, Hashable, Iterable, Iterator, Optional
+from pydantic import BaseModel
+from core.llm_service import LLMService, llm_service
+from core.lore_tracker import LoreTracker, get_lore_tracker, request_source
+from core.memory import MemoryService, get_memory_service
+from core.metrics import CallMetrics, metrics
+from core.sheet_model import (
+    SECTION_SEPARATOR,
+    SheetModel,
+    TemplateLayout,
+    TemplateSection,
+    blank_template,
+    layout_model,
+    parse_template,
+    read_sheet,
+    render_layout,
+    split_template,
+    subset_layout,
+)
+from core.single_flight import single_flight
+from core.text_utils import clean_sheet, clean_sheet_stream, clean_sheet_stream_async
+
+# Sections a template needs for sectioned generation to be worth its extra requests
+MIN_SECTIONS = 3
+
+# Ends the first section in the answer to a sectioned sheet's first request
+CORE_CONCEPT_MARKER = "CORE CONCEPT:"
+
+CORE_REQUEST = """
+This sheet is written in parts, one section at a time. First, decide what the whole sheet is about: fill out only this first section of the template, then add a line starting with "CORE CONCEPT:" and three or four sentences with the facts every other section must agree with (names, places, the central conflict or secret, the tone).
+
+{section}
+"""
+
+# Section of an expanded sheet holding the brief sheet's fields that the full template lacks
+BRIEF_NOTES_HEADING = "📝 Notes from the Brief Sheet"
+
+EXPAND_REQUEST = """
+A brief version of this sheet has already been written:
+
+{brief}
+
+Keep everything it says. Fill out only the remaining fields below, consistent with it, and write nothing else:
+
+{fields}
+"""
+
+SECTION_REQUEST = """
+This sheet is written in parts, one section at a time. Its first section and core concept are already settled:
+
+{core}
+CORE CONCEPT: {concept}
+
+Fill out only the section below, consistent with them and without repeating what they already say. Start with the section heading and don't write any other section.
+
+{section}
+"""
+
+
+def with_heading(text: str, heading: str) -> str:
+    """The text of a section, with the template's heading in front if the model left it out."""
+    first_line = text.lstrip().split("\n", 1)[0]
+    # Compared without emoji and markdown, which models often drop or add
+    bare_line, bare_heading = (re.sub(r"^\W+", "", s).casefold() for s in (first_line, heading))
+    if bare_line.startswith(bare_heading):
+        return text
+    return f"{heading}\n{text}"
+
+
+class _CoreSection:
+    """
+    Splits the cleaned, streamed answer to a sectioned sheet's first request into the
+    first section, passed on as it arrives, and the core concept after it, kept back.
+    """
+
+    def __init__(self, heading: str):
+        self.heading = heading
+        self.section: list[str] = []
+        self.concept: list[str] = []
+
+    def feed(self, text: str) -> list[str]:
+        """Adds a cleaned line and returns the text to show for it."""
+        if self.concept:
+            self.concept.append(text)
+            return []
+        position = text.casefold().find(CORE_CONCEPT_MARKER.casefold())
+        if position >= 0:
+            self.concept.append(text[position + len(CORE_CONCEPT_MARKER):])
+            text = text[:position].rstrip(" *_#")
+            if not text.strip():
+                return []
+        if not self.section:
+            text = with_heading(text, self.heading)
+        self.section.append(text)
+        return [text]
+
+    @property
+    def text(self) -> str:
+        return "".join(self.section) or self.heading
+
+    @property
+    def concept_text(self) -> str:
+        return " ".join("".join(self.concept).split()).strip(" *_")
+
+
+def merge_calls(call: CallMetrics, parts: list[CallMetrics]) -> None:
+    """Adds up the requests of a sectioned sheet into its call."""
+    call.endpoint = parts[0].endpoint
+    call.prompt_tokens = sum(part.prompt_tokens for part in parts)
+    call.completion_tokens = sum(part.completion_tokens for part in parts)
+    call.cached_tokens = sum(part.cached_tokens for part in parts)
+    call.retries = sum(part.retries for part in parts)
+    call.hedged = any(part.hedged for part in parts)
+    call.cache_hit = all(part.cache_hit for part in parts)
+
+
+
+def variation_numbers(specs: Iterable[BaseModel]) -> list[int]:
+    """
+    Numbers the repeats of each spec: 0 for its first occurrence, 1 for the second, and so on.
+
+    A batch repeats a spec to get several variations of it, which must not be answered
+    from the response cache with one and the same sheet (see BaseGeneratorAgent's variation).
+    """
+    seen: Counter = Counter()
+    numbers = []
+    for spec in specs:
+        key = (type(spec).__name__, spec.model_dump_json())
+        numbers.append(seen[key])
+        seen[key] += 1
+    return numbers
+
+class BaseGeneratorAgent:
+    """Base agent that generates a sheet by having the LLM fill out a template."""
+
+    spec_class: type[BaseModel] = BaseModel
+    system_prompt: str = ""
+    template_full: str = ""
+    template_brief: str = ""
+    filler_phrases: list[str] = []
+    temperature: float = 0.9  # High for more creative and diverse outputs
+    max_tokens: int = 2500
+    world_context_tokens: int = 300  # Budget for the world summary; 0 leaves it out
+    lore_context_tokens: int = 300  # Budget for retrieved lore; 0 leaves it out
+    # Seconds for a full or brief sheet, retries included; None uses TTRPG_LLM_DEADLINE
+    deadline: Optional[float] = None
+    brief_deadline: Optional[float] = None
+    sheet_full: Optional[type[SheetModel]] = None  # Fields of template_full, for structured mode
+    sheet_brief: Optional[type[SheetModel]] = None
+    # World memory table structured sheets are stored in, e.g. "npcs", and the entity keys
+    # filled from sheet fields, e.g. {"race": "race_species"}
+    entity_type: Optional[str] = None
+    entity_fields: dict[str, str] = {}
+    core_max_tokens: int = 700  # For the first section and core concept of a sectioned sheet
+    section_max_tokens: int = 700  # For each other section of a sectioned sheet
+
+    def __init__(
+        self,
+        llm: LLMService = None,
+        memory: Optional[MemoryService] = None,
+        lore: Optional[LoreTracker] = None,
+        structured: Optional[bool] = None,
+        coalesce: Optional[bool] = None,
+        sectioned: Optional[bool] = None,
+        variation: int = 0,
+    ):
+        """
+        Args:
+            llm: The LLM service to use (default: the shared one).
+            memory: World memory for world context and structured sheets (default: the shared one).
+            lore: Lore tracker sheets are retrieved from and added to (default: the shared one).
+            structured: Have the model fill in JSON instead of the template
+                (default: $TTRPG_STRUCTURED_OUTPUT).
+            coalesce: Share the result of an identical request in progress
+                (default: $TTRPG_COALESCE, on).
+            sectioned: Write full sheets a section per request, concurrently
+                (default: $TTRPG_SECTIONED).
+            variation: Which repeat of the same spec this is, e.g. in a batch (see
+                variation_numbers); repeats other than the first are cached apart, so they
+                don't get the first one's sheet.
+        """
+        self.llm = llm or llm_service
+        self._memory = memory
+        self._lore = lore
+        if structured is None:
+            structured = os.getenv("TTRPG_STRUCTURED_OUTPUT", "").lower() in ("1", "true", "yes")
+        self.structured = structured
+        if coalesce is None:
+            coalesce = os.getenv("TTRPG_COALESCE", "1").lower() not in ("0", "false", "no")
+        self.coalesce = coalesce
+        if sectioned is None:
+            sectioned = os.getenv("TTRPG_SECTIONED", "").lower() in ("1", "true", "yes")
+        self.sectioned = sectioned
+        self.variation = variation
+        # The chat messages of the last sheet this agent asked the model for (sectioned sheets:
+        # before they are split), so callers can measure the prompt without building it again
+        self.last_messages: Optional[list[dict]] = None
+
+    @property
+    def memory(self) -> MemoryService:
+        """The world memory used for world context, the shared one unless another was given."""
+        if self._memory is None:
+            self._memory = get_memory_service()
+        return self._memory
+
+    @property
+    def lore(self) -> LoreTracker:
+        """
+        The lore tracker sheets are retrieved from and added to, the shared one unless
+        another was given.
+        """
+        if self._lore is None:
+            self._lore = get_lore_tracker()
+        return self._lore
+
+    @property
+    def kind(self) -> str:
+        """Short name of what the agent generates, labelling its sheets in the lore, e.g. "npc"."""
+        return type(self).__name__.removesuffix("GeneratorAgent").lower()
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the guidelines and template of the user message; mustn't depend on the spec."""
+        raise NotImplementedError
+
+    def build_request(self, input_spec: BaseModel) -> str:
+        """Builds the part of the user message that describes what to create."""
+        raise NotImplementedError
+
+    def build_world_context(self, input_spec: BaseModel) -> str:
+        """Builds the summary of the spec's world, or an empty string if nothing is known of it."""
+        if self.world_context_tokens <= 0:
+            return ""
+        summary = self.memory.get_world_summary(
+            input_spec.world_name, self.world_context_tokens, self.llm.model
+        )
+        if not summary:
+            return ""
+        return f"""
+{summary}
+Keep what you create consistent with this world.
+"""
+
+    def build_lore_context(self, input_spec: BaseModel) -> str:
+        """
+        Builds the list of lore facts relevant to the request, or an empty string if there
+        are none.
+        """
+        if self.lore_context_tokens <= 0:
+            return ""
+        # Not this generator's own earlier answers to the request: repeats would copy them,
+        # and the prompt (and so the response cache key) would change after every sheet
+        facts = self.lore.relevant_facts(
+            input_spec.world_name,
+            input_spec.prompt,
+            self.lore_context_tokens,
+            self.llm.model,
+            exclude_source=self.lore_source(input_spec),
+        )
+        if not facts:
+            return ""
+        return f"""
+RELEVANT LORE FROM THIS CAMPAIGN:
+{facts}
+Build on these facts where they fit, and don't contradict them.
+"""
+
+    def build_user_prompt(self, input_spec: BaseModel, template: str) -> str:
+        """Builds the user message asking the LLM to fill out the template, static part first."""
+        return (
+            self.build_instructions(template)
+            + self.build_world_context(input_spec)
+            + self.build_lore_context(input_spec)
+            + self.build_request(input_spec)
+        )
+
+    def sheet_class(self, input_spec: BaseModel) -> Optional[type[SheetModel]]:
+        """The sheet model of the spec in structured mode, or None to fill out the template."""
+        if not self.structured:
+            return None
+        return self.sheet_brief if input_spec.brief else self.sheet_full
+
+    def response_format(self, input_spec: BaseModel) -> Optional[dict]:
+        """
+        The response_format constraining the answer to the spec's sheet model, or None
+        outside structured mode.
+        """
+        sheet_class = self.sheet_class(input_spec)
+        return sheet_class.response_format() if sheet_class else None
+
+    def finish_sheet(
+        self, input_spec: BaseModel, raw_sheet: str
+    ) -> tuple[str, Optional[SheetModel]]:
+        """
+        Turns the model's answer into the sheet text.
+
+        Returns:
+            The text, and in structured mode the parsed sheet. If the answer isn't valid JSON
+            (e.g. a provider that ignores response_format), it is cleaned like a filled-out
+            template instead, and there is no parsed sheet.
+        """
+        sheet_class = self.sheet_class(input_spec)
+        if sheet_class is not None:
+            try:
+                sheet = sheet_class.parse(raw_sheet)
+                return sheet.render(), sheet
+            except ValueError:
+                pass
+        return clean_sheet(raw_sheet, self.filler_phrases), None
+
+    def lore_source(self, input_spec: BaseModel) -> str:
+        """Tag of the lore passages of sheets generated for the spec's request."""
+        return request_source(self.kind, input_spec.prompt)
+
+    def record_sheet(
+        self, input_spec: BaseModel, sheet: str, parsed: Optional[SheetModel] = None
+    ) -> None:
+        """Adds a generated sheet to the world's lore, and a parsed one to world memory as well."""
+        source = self.lore_source(input_spec)
+        if parsed is not None and self.entity_type is not None:
+            self.memory.store_entity(
+                input_spec.world_name,
+                self.entity_type,
+                parsed.as_entity(self.entity_fields),
+                source=source,
+            )
+            if self.memory.lore is self.lore:
+                # World memory has indexed it in the lore already
+                return
+        if sheet.strip():
+            self.lore.add_sheet(input_spec.world_name, self.kind, sheet, source=source)
+
+    def build_messages(self, input_spec: BaseModel) -> list[dict]:
+        """Builds the chat messages for the spec, choosing the template by its 'brief' flag."""
+        sheet_class = self.sheet_class(input_spec)
+        if sheet_class is not None:
+            template = sheet_class.field_guide()
+        else:
+            template = self.template_brief if input_spec.brief else self.template_full
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.build_user_prompt(input_spec, template)},
+        ]
+
+    def request_deadline(self, input_spec: BaseModel) -> Optional[float]:
+        """Seconds the LLM call for the spec may take, retries included; None uses the default."""
+        return self.brief_deadline if input_spec.brief else self.deadline
+
+    def cache_scope(self, input_spec: BaseModel) -> dict:
+        """Values besides the messages that identify a request in the response cache."""
+        scope = {"generator": type(self).__name__, "brief": input_spec.brief}
+        if self.sheet_class(input_spec) is not None:
+            scope["structured"] = True
+        if self.variation:
+            scope["variation"] = self.variation
+        return scope
+
+    def template_sections(self, input_spec: BaseModel) -> Optional[tuple[str, list[str]]]:
+        """
+        The title and sections a sheet is written in, one request per section, or None to
+        write it in one piece.
+        """
+        if not self.sectioned or input_spec.brief or self.sheet_class(input_spec) is not None:
+            return None
+        title, sections = split_template(self.template_full)
+        return (title, sections) if len(sections) >= MIN_SECTIONS else None
+
+    @staticmethod
+    def extend_request(messages: list[dict], text: str) -> list[dict]:
+        """The messages with text added to the end of the user message."""
+        return messages[:-1] + [{**messages[-1], "content": messages[-1]["content"] + text}]
+
+    def build_core_messages(self, messages: list[dict], section: str) -> list[dict]:
+        """
+        Asks for the first section and the core concept, after the whole template so the
+        prompt prefix is shared.
+        """
+        return self.extend_request(messages, CORE_REQUEST.format(section=section))
+
+    def build_section_messages(
+        self, messages: list[dict], core: str, concept: str, section: str
+    ) -> list[dict]:
+        """Asks for one more section, consistent with the first one and the core concept."""
+        return self.extend_request(
+            messages,
+            SECTION_REQUEST.format(
+                core=core, concept=concept or "(see the first section)", section=section
+            ),
+        )
+
+    def finish_section(self, title: str, raw_section: str, heading: str) -> str:
+        # The heading goes in before cleaning, which strips the indent of the first line
+        return clean_sheet(
+            with_heading(raw_section.strip("\n"), heading), self.filler_phrases + [title]
+        )
+
+    def plan_expansion(
+        self, brief_sheet: str
+    ) -> tuple[TemplateLayout, dict[str, str], TemplateLayout]:
+        """
+        Works out what expanding a brief sheet takes.
+
+        Returns:
+            The full template's layout, the values of its fields read from the brief sheet,
+            and the layout of the fields the model still has to fill in. Filled-in brief
+            fields that the full template lacks are kept in a notes section at its end.
+        """
+        full = parse_template(self.template_full)
+        brief = parse_template(self.template_brief)
+        brief_values = read_sheet(brief_sheet, brief)
+        full_names = {template_field.name for template_field in full.fields}
+        values = {
+            name: value for name, value in brief_values.items() if name in full_names and value
+        }
+        missing = subset_layout(full, full_names - set(values))
+        notes = [
+            template_field
+            for template_field in brief.fields
+            if template_field.name not in full_names and brief_values.get(template_field.name)
+        ]
+        if notes:
+            full = TemplateLayout(
+                full.title, full.sections + [TemplateSection(BRIEF_NOTES_HEADING, notes)]
+            )
+            values.update(
+                (template_field.name, brief_values[template_field.name]) for template_field in notes
+            )
+        return full, values, missing
+
+    def build_expand_messages(
+        self, input_spec: BaseModel, brief_sheet: str, missing: TemplateLayout
+    ) -> list[dict]:
+        """
+        Asks for the missing fields, after the whole template so the prompt prefix is shared
+        with full sheets.
+        """
+        if self.sheet_class(input_spec) is not None:
+            fields = layout_model("Expansion", missing).field_guide()
+        else:
+            fields = blank_template(missing)
+        return self.extend_request(
+            self.build_messages(input_spec),
+            EXPAND_REQUEST.format(brief=brief_sheet.strip(), fields=fields),
+        )
+
+    def finish_expansion(
+        self,
+        input_spec: BaseModel,
+        raw_fields: str,
+        full: TemplateLayout,
+        values: dict[str, str],
+        missing: TemplateLayout,
+    ) -> tuple[str, Optional[SheetModel]]:
+        """Puts the brief sheet's values and the model's answer together into the full sheet."""
+        values = dict(values)
+        if self.sheet_class(input_spec) is not None:
+            try:
+                values.update(layout_model("Expansion", missing).parse(raw_fields).model_dump())
+            except ValueError:
+                values.update(read_sheet(clean_sheet(raw_fields, self.filler_phrases), missing))
+            # The full sheet's model, with the notes from the brief sheet if there are any
+            sheet_class = layout_model(self.sheet_full.__name__, full)
+            parsed = sheet_class(
+                **{
+                    template_field.name: values.get(template_field.name, "")
+                    for template_field in full.fields
+                }
+            )
+            return parsed.render(), parsed
+        values.update(read_sheet(clean_sheet(raw_fields, self.filler_phrases), missing))
+        return render_layout(full, values), None
+
+    def expand_sheet(self, input_spec: BaseModel, brief_sheet: str) -> str:
+        """
+        Expands a brief sheet into the full one, asking the model only for what the brief one lacks.
+
+        Args:
+            input_spec: Specification the brief sheet was generated from; its brief flag is ignored.
+            brief_sheet: The brief sheet, as generated (or edited since).
+
+        Returns:
+            The full sheet, in the full template's layout.
+        """
+        input_spec = input_spec.model_copy(update={"brief": False})
+        full, values, missing = self.plan_expansion(brief_sheet)
+        with metrics.track(generator=self.kind, brief=False) as call:
+            call.model, call.provider = self.llm.model, self.llm.provider
+            raw_fields = ""
+            if missing.fields:
+                with call.stage("context"):
+                    messages = self.build_expand_messages(input_spec, brief_sheet, missing)
+                    self.last_messages = messages
+                raw_fields = self.llm.complete(
+                    messages,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    cache_scope={**self.cache_scope(input_spec), "expand": True},
+                    call=call,
+                    deadline=self.request_deadline(input_spec),
+                    response_format=(
+                        layout_model("Expansion", missing).response_format()
+                        if self.sheet_class(input_spec)
+                        else None
+                    ),
+                )
+            with call.stage("clean"):
+                sheet, parsed = self.finish_expansion(input_spec, raw_fields, full, values, missing)
+            with call.stage("record"):
+                self.record_sheet(input_spec, sheet, parsed)
+            return sheet
+
+    async def expand_sheet_async(self, input_spec: BaseModel, brief_sheet: str) -> str:
+        """Async version of expand_sheet."""
+        input_spec = input_spec.model_copy(update={"brief": False})
+        full, values, missing = self.plan_expansion(brief_sheet)
+        with metrics.track(generator=self.kind, brief=False) as call:
+            call.model, call.provider = self.llm.model, self.llm.provider
+            raw_fields = ""
+            if missing.fields:
+                with call.stage("context"):
+                    messages = self.build_expand_messages(input_spec, brief_sheet, missing)
+                    self.last_messages = messages
+                raw_fields = await self.llm.complete_async(
+                    messages,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    cache_scope={**self.cache_scope(input_spec), "expand": True},
+                    call=call,
+                    deadline=self.request_deadline(input_spec),
+                    response_format=(
+                        layout_model("Expansion", missing).response_format()
+                        if self.sheet_class(input_spec)
+                        else None
+                    ),
+                )
+            with call.stage("clean"):
+                sheet, parsed = self.finish_expansion(input_spec, raw_fields, full, values, missing)
+            with call.stage("record"):
+                self.record_sheet(input_spec, sheet, parsed)
+            return sheet
+
+    def flight_key(self, input_spec: BaseModel) -> Hashable:
+        """
+        What makes two requests identical for coalescing: everything that changes the sheet,
+        including structured and sectioned mode; the prompt and world ignore case and spacing.
+        """
+        return (
+            type(self).__name__,
+            " ".join(input_spec.prompt.split()).casefold(),
+            input_spec.brief,
+            " ".join(input_spec.world_name.split()).casefold(),
+            self.llm.model,
+            self.sheet_class(input_spec) is not None,
+            self.template_sections(input_spec) is not None,
+            self.variation,
+        )
+
+    @contextmanager
+    def coalesced_call(self, input_spec: BaseModel) -> Iterator[None]:
+        """Reports a request that waited for an identical one's result as a coalesced call."""
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            call.model, call.provider, call.coalesced = self.llm.model, self.llm.provider, True
+            yield
+
+    def generate_sheet(self, input_spec: BaseModel) -> str:
+        """
+        Generates a complete sheet in a single blocking call.
+
+        Args:
+            input_spec: Specification for the content to generate.
+
+        Returns:
+            The filled-out template with filler phrases removed.
+        """
+        if not self.coalesce:
+            return self._generate_sheet(input_spec)
+        return single_flight.do(
+            self.flight_key(input_spec),
+            lambda: self._generate_sheet(input_spec),
+            lambda: self.coalesced_call(input_spec),
+        )
+
+    def _generate_sheet(self, input_spec: BaseModel) -> str:
+        sections = self.template_sections(input_spec)
+        if sections is not None:
+            return "".join(self._stream_sectioned(input_spec, *sections, streamed=False))
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            with call.stage("context"):
+                messages = self.last_messages = self.build_messages(input_spec)
+            raw_sheet = self.llm.complete(
+                messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                cache_scope=self.cache_scope(input_spec),
+                call=call,
+                deadline=self.request_deadline(input_spec),
+                response_format=self.response_format(input_spec),
+            )
+            with call.stage("clean"):
+                sheet, parsed = self.finish_sheet(input_spec, raw_sheet)
+            with call.stage("record"):
+                self.record_sheet(input_spec, sheet, parsed)
+            return sheet
+
+    def stream_sheet(self, input_spec: BaseModel) -> Iterator[str]:
+        """
+        Generates a sheet and yields it line by line as the model produces it.
+
+        Args:
+            input_spec: Specification for the content to generate.
+
+        Yields:
+            Cleaned fragments of the sheet; joined together they equal generate_sheet's output.
+            In structured mode, the whole sheet once it is complete.
+        """
+        if not self.coalesce:
+            yield from self._stream_sheet(input_spec)
+            return
+        yield from single_flight.stream(
+            self.flight_key(input_spec),
+            lambda: self._stream_sheet(input_spec),
+            lambda: self.coalesced_call(input_spec),
+        )
+
+    def _stream_sheet(self, input_spec: BaseModel) -> Iterator[str]:
+        if self.sheet_class(input_spec) is not None:
+            yield self.generate_sheet(input_spec)
+            return
+        sections = self.template_sections(input_spec)
+        if sections is not None:
+            yield from self._stream_sectioned(input_spec, *sections)
+            return
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            with call.stage("context"):
+                messages = self.last_messages = self.build_messages(input_spec)
+            chunks = self.llm.stream(
+                messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                cache_scope=self.cache_scope(input_spec),
+                call=call,
+                deadline=self.request_deadline(input_spec),
+            )
+            pieces = []
+            for text in clean_sheet_stream(chunks, self.filler_phrases):
+                pieces.append(text)
+                yield text
+            with call.stage("record"):
+                self.record_sheet(input_spec, "".join(pieces))
+
+    async def generate_sheet_async(self, input_spec: BaseModel) -> str:
+        """Async version of generate_sheet, so many sheets can be generated concurrently."""
+        if not self.coalesce:
+            return await self._generate_sheet_async(input_spec)
+        return await single_flight.do_async(
+            self.flight_key(input_spec),
+            lambda: self._generate_sheet_async(input_spec),
+            lambda: self.coalesced_call(input_spec),
+        )
+
+    async def _generate_sheet_async(self, input_spec: BaseModel) -> str:
+        sections = self.template_sections(input_spec)
+        if sections is not None:
+            pieces = self._stream_sectioned_async(input_spec, *sections, streamed=False)
+            return "".join([text async for text in pieces])
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            with call.stage("context"):
+                messages = self.last_messages = self.build_messages(input_spec)
+            raw_sheet = await self.llm.complete_async(
+                messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                cache_scope=self.cache_scope(input_spec),
+                call=call,
+                deadline=self.request_deadline(input_spec),
+                response_format=self.response_format(input_spec),
+            )
+            with call.stage("clean"):
+                sheet, parsed = self.finish_sheet(input_spec, raw_sheet)
+            with call.stage("record"):
+                self.record_sheet(input_spec, sheet, parsed)
+            return sheet
+
+    async def stream_sheet_async(self, input_spec: BaseModel) -> AsyncIterator[str]:
+        """Async version of stream_sheet."""
+        if not self.coalesce:
+            async for text in self._stream_sheet_async(input_spec):
+                yield text
+            return
+        async for text in single_flight.stream_async(
+            self.flight_key(input_spec),
+            lambda: self._stream_sheet_async(input_spec),
+            lambda: self.coalesced_call(input_spec),
+        ):
+            yield text
+
+    async def _stream_sheet_async(self, input_spec: BaseModel) -> AsyncIterator[str]:
+        if self.sheet_class(input_spec) is not None:
+            yield await self.generate_sheet_async(input_spec)
+            return
+        sections = self.template_sections(input_spec)
+        if sections is not None:
+            async for text in self._stream_sectioned_async(input_spec, *sections):
+                yield text
+            return
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            with call.stage("context"):
+                messages = self.last_messages = self.build_messages(input_spec)
+            chunks = self.llm.stream_async(
+                messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                cache_scope=self.cache_scope(input_spec),
+                call=call,
+                deadline=self.request_deadline(input_spec),
+            )
+            pieces = []
+            async for text in clean_sheet_stream_async(chunks, self.filler_phrases):
+                pieces.append(text)
+                yield text
+            with call.stage("record"):
+                self.record_sheet(input_spec, "".join(pieces))
+
+    def _stream_sectioned(
+        self, input_spec: BaseModel, title: str, sections: list[str], streamed: bool = True
+    ) -> Iterator[str]:
+        """
+        Writes a sheet a section per request: the first, then all the others at once,
+        yielded in order.
+        """
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            call.model, call.provider, call.streamed = self.llm.model, self.llm.provider, streamed
+            with call.stage("context"):
+                messages = self.last_messages = self.build_messages(input_spec)
+            scope, deadline = self.cache_scope(input_spec), self.request_deadline(input_spec)
+            parts = [CallMetrics() for _ in sections]
+            headings = [section.split("\n", 1)[0].strip() for section in sections]
+            start = time.perf_counter()
+            yield f"{title}\n\n"
+
+            core = _CoreSection(headings[0])
+            with call.stage("core"):
+                chunks = self.llm.stream(
+                    self.build_core_messages(messages, sections[0]),
+                    temperature=self.temperature,
+                    max_tokens=self.core_max_tokens,
+                    cache_scope={**scope, "section": 1},
+                    call=parts[0],
+                    deadline=deadline,
+                )
+                for cleaned in clean_sheet_stream(chunks, self.filler_phrases + [title]):
+                    for text in core.feed(cleaned):
+                        if call.ttft_seconds is None and streamed:
+                            call.ttft_seconds = time.perf_counter() - start
+                        yield text
+                if not core.section:
+                    yield core.text
+
+            with call.stage("sections"):
+                executor = ThreadPoolExecutor(
+                    max_workers=len(sections) - 1, thread_name_prefix="section"
+                )
+                try:
+                    futures = [
+                        executor.submit(
+                            self.llm.complete,
+                            self.build_section_messages(
+                                messages, core.text, core.concept_text, section
+                            ),
+                            temperature=self.temperature,
+                            max_tokens=self.section_max_tokens,
+                            cache_scope={**scope, "section": number},
+                            call=parts[number - 1],
+                            deadline=deadline,
+                        )
+                        for number, section in enumerate(sections[1:], 2)
+                    ]
+                    texts = [core.text]
+                    for future, heading in zip(futures, headings[1:]):
+                        texts.append(self.finish_section(title, future.result(), heading))
+                        yield f"\n{SECTION_SEPARATOR}\n{texts[-1]}"
+                finally:
+                    # Stops the requests not started yet if the reader gave up
+                    executor.shutdown(wait=False, cancel_futures=True)
+
+            call.model_seconds = time.perf_counter() - start
+            if not streamed:
+                call.ttft_seconds = call.model_seconds
+            merge_calls(call, parts)
+            with call.stage("record"):
+                self.record_sheet(
+                    input_spec, f"{title}\n\n" + f"\n{SECTION_SEPARATOR}\n".join(texts)
+                )
+
+    async def _stream_sectioned_async(
+        self, input_spec: BaseModel, title: str, sections: list[str], streamed: bool = True
+    ) -> AsyncIterator[str]:
+        """Async version of _stream_sectioned."""
+        with metrics.track(generator=self.kind, brief=input_spec.brief) as call:
+            call.model, call.provider, call.streamed = self.llm.model, self.llm.provider, streamed
+            with call.stage("context"):
+                messages = self.last_messages = self.build_messages(input_spec)
+            scope, deadline = self.cache_scope(input_spec), self.request_deadline(input_spec)
+            parts = [CallMetrics() for _ in sections]
+            headings = [section.split("\n", 1)[0].strip() for section in sections]
+            start = time.perf_counter()
+            yield f"{title}\n\n"
+
+            core = _CoreSection(headings[0])
+            with call.stage("core"):
+                chunks = self.llm.stream_async(
+                    self.build_core_messages(messages, sections[0]),
+                    temperature=self.temperature,
+                    max_tokens=self.core_max_tokens,
+                    cache_scope={**scope, "section": 1},
+                    call=parts[0],
+                    deadline=deadline,
+                )
+                async for cleaned in clean_sheet_stream_async(
+                    chunks, self.filler_phrases + [title]
+                ):
+                    for text in core.feed(cleaned):
+                        if call.ttft_seconds is None and streamed:
+                            call.ttft_seconds = time.perf_counter() - start
+                        yield text
+                if not core.section:
+                    yield core.text
+
+            with call.stage("sections"):
+                tasks = [
+                    asyncio.ensure_future(
+                        self.llm.complete_async(
+                            self.build_section_messages(
+                                messages, core.text, core.concept_text, section
+                            ),
+                            temperature=self.temperature,
+                            max_tokens=self.section_max_tokens,
+                            cache_scope={**scope, "section": number},
+                            call=parts[number - 1],
+                            deadline=deadline,
+                        )
+                    )
+                    for number, section in enumerate(sections[1:], 2)
+                ]
+                try:
+                    texts = [core.text]
+                    for task, heading in zip(tasks, headings[1:]):
+                        texts.append(self.finish_section(title, await task, heading))
+                        yield f"\n{SECTION_SEPARATOR}\n{texts[-1]}"
+                finally:
+                    for task in tasks:
+                        task.cancel()
+
+            call.model_seconds = time.perf_counter() - start
+            if not streamed:
+                call.ttft_seconds = call.model_seconds
+            merge_calls(call, parts)
+            with call.stage("record"):
+                self.record_sheet(
+                    input_spec, f"{title}\n\n" + f"\n{SECTION_SEPARATOR}\n".join(texts)
+                )
@@ -0,0 +1,624 @@
+"""
+Job Queue for TTRPG Sidekick
+
+A persistent queue of generation jobs in SQLite, and a pool of workers that runs them,
+for work too long to wait for at the prompt: full sheets, or a night of campaign prep
+with hundreds of entities.
+
+A job is a generator spec (NPCSpec, BuildingSpec, ...) under a batch name. It goes
+from "queued" to "running" to "done", with the sheet as its result, or to "failed"
+with the error once it has failed max_attempts times; failed attempts are retried
+after an exponential backoff with jitter. Queued jobs can also be "cancelled".
+
+Nothing is lost when a process dies. A running job holds a lease that its worker
+renews while it works, and a job whose lease ran out (its worker was killed, or its
+machine went down) is picked up again by the next worker looking for work. A pool
+that starts on the same machine takes back the jobs of dead processes right away.
+
+Jobs are claimed in immediate transactions, like writes to world memory
+(core.world_store), so several worker processes can share one queue file.
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+
+from core.transport import backoff_delay
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+# Times a job is tried before it fails for good
+MAX_ATTEMPTS = int(os.getenv("TTRPG_JOB_ATTEMPTS", "3"))
+
+# Seconds a worker holds a job without renewing its lease before others may take it over
+JOB_LEASE = float(os.getenv("TTRPG_JOB_LEASE", "120"))
+
+# Backoff before a failed job is tried again: up to RETRY_BASE * 2^attempt seconds, capped
+RETRY_BASE = 10.0
+RETRY_CAP = 300.0
+
+# Error of a job whose worker stopped during its last attempt
+WORKER_LOST = "The worker running this job stopped before it finished"
+
+
+@dataclass
+class Job:
+    """A generation job and where it stands."""
+    id: int
+    kind: str  # The generator, e.g. "npc"
+    spec: dict
+    batch: str
+    status: str
+    attempts: int
+    max_attempts: int
+    result: Optional[str]
+    error: Optional[str]
+    worker: Optional[str]
+    created_at: float
+    finished_at: Optional[float]
+    variation: int = 0  # Which repeat of its spec in the queue it is; repeats are cached apart
+
+    def create_spec(self) -> "BaseModel":
+        """The job's spec as the generator's input model."""
+        from router import GENERATORS
+
+        return GENERATORS[self.kind].spec_class(**self.spec)
+
+    @property
+    def title(self) -> str:
+        """A short description for listings, e.g. "npc: a tavern regular"."""
+        prompt = " ".join(str(self.spec.get("prompt", "")).split())
+        return f"{self.kind}: {prompt[:60] + '...' if len(prompt) > 60 else prompt}"
+
+
+def worker_name(index: int) -> str:
+    """Identifies a worker thread of this process, e.g. "tavern-pc:4242:3"."""
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def process_alive(worker: str) -> bool:
+    """Whether the process a worker name belongs to is still running; unknown counts as running."""
+    host, pid, _ = worker.rsplit(":", 2)
+    if host != socket.gethostname() or os.name == "nt":
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    try:
+        # A killed process that nobody has reaped yet still takes signals
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+
+class JobStore:
+    """The queue of jobs, in a SQLite file using write-ahead logging."""
+
+    _COLUMNS = (
+        "id, kind, spec, batch, status, attempts, max_attempts, result, error, worker, "
+        "created_at, finished_at, variation"
+    )
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: SQLite file to use (default: $TTRPG_JOBS_FILE or <data dir>/jobs/jobs.sqlite).
+        """
+        default_path = Path(os.getenv("TTRPG_DATA_DIR", "data")) / "jobs" / "jobs.sqlite"
+        self.path = Path(path or os.getenv("TTRPG_JOBS_FILE", default_path))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are started explicitly by _write()
+        self._conn = sqlite3.connect(
+            str(self.path), check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._write():
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    spec TEXT NOT NULL,
+                    batch TEXT NOT NULL DEFAULT '',
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    lease_until REAL,
+                    run_after REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    variation INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "variation" not in columns:
+                # Queue files from before jobs of the same spec were told apart
+                self._conn.execute(
+                    "ALTER TABLE jobs ADD COLUMN variation INTEGER NOT NULL DEFAULT 0"
+                )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, run_after, id)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch, status)")
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        """Runs a write transaction, holding both the in-process lock and SQLite's write lock."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _job(self, row: tuple) -> Job:
+        return Job(
+            id=row[0],
+            kind=row[1],
+            spec=json.loads(row[2]),
+            batch=row[3],
+            status=row[4],
+            attempts=row[5],
+            max_attempts=row[6],
+            result=row[7],
+            error=row[8],
+            worker=row[9],
+            created_at=row[10],
+            finished_at=row[11],
+            variation=row[12],
+        )
+
+    def submit(
+        self, specs: Iterable["BaseModel"], batch: str = "", max_attempts: int = MAX_ATTEMPTS
+    ) -> list[int]:
+        """
+        Queues a job per spec, in one transaction; returns their ids in order.
+
+        Jobs of a spec already in the queue are numbered as further variations of it, so
+        they don't get the earlier jobs' sheets from the response cache.
+        """
+        from router import generator_for_spec
+
+        now = time.time()
+        rows = [
+            (generator_for_spec(spec).name, spec.model_dump_json(), batch, max_attempts, now)
+            for spec in specs
+        ]
+        ids = []
+        with self._write():
+            queued: dict[tuple[str, str], int] = {}
+            for row in rows:
+                key = row[:2]
+                if key not in queued:
+                    queued[key] = self._conn.execute(
+                        "SELECT COUNT(*) FROM jobs WHERE kind = ? AND spec = ?", key
+                    ).fetchone()[0]
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (kind, spec, batch, max_attempts, created_at, variation) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    row + (queued[key],),
+                )
+                queued[key] += 1
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def claim(self, worker: str, lease: float = JOB_LEASE) -> Optional[Job]:
+        """
+        Takes the oldest job that is ready to run: a queued one past its retry backoff, or
+        a running one whose lease ran out. Returns None if there is none.
+        """
+        now = time.time()
+        with self._write():
+            # A job whose workers died on every attempt would otherwise be retried forever
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, finished_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (WORKER_LOST, now, now),
+            )
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE (status = 'queued' AND run_after <= ?) "
+                "OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "lease_until = ?, started_at = ? WHERE id = ?",
+                (worker, now + lease, now, row[0]),
+            )
+            return self._job(
+                self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (row[0],)
+                ).fetchone()
+            )
+
+    def renew(self, worker_prefix: str, lease: float = JOB_LEASE) -> None:
+        """Extends the leases of every job held by workers whose names start with the prefix."""
+        with self._write():
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE status = 'running' AND worker LIKE ?",
+                (time.time() + lease, worker_prefix + "%"),
+            )
+
+    def complete(self, job_id: int, worker: str, result: str) -> bool:
+        """Stores a job's result; False if the job was taken over by another worker meanwhile."""
+        with self._write():
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, "
+                "finished_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (result, time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """
+        Records a failed attempt: the job is queued again after a backoff, or fails for good
+        once it has used up its attempts. False if the job was taken over meanwhile.
+        """
+        now = time.time()
+        with self._write():
+            row = self._conn.execute(
+                "SELECT attempts, max_attempts FROM jobs "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (job_id, worker),
+            ).fetchone()
+            if row is None:
+                return False
+            attempts, max_attempts = row
+            if attempts < max_attempts:
+                run_after = now + backoff_delay(attempts - 1, RETRY_BASE, RETRY_CAP)
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, worker = NULL, "
+                    "lease_until = NULL, run_after = ? WHERE id = ?",
+                    (error, run_after, job_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, "
+                    "finished_at = ? WHERE id = ?",
+                    (error, now, job_id),
+                )
+            return True
+
+    def release(self, worker_prefix: str) -> int:
+        """Queues the jobs of the given workers again without counting the attempt, e.g. on exit."""
+        with self._write():
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, worker = NULL, "
+                "lease_until = NULL WHERE status = 'running' AND worker LIKE ?",
+                (worker_prefix + "%",),
+            ).rowcount
+
+    def requeue_orphans(self) -> int:
+        """
+        Queues the running jobs of dead processes on this machine again, without waiting for
+        their leases.
+        """
+        with self._write():
+            rows = self._conn.execute(
+                "SELECT id, worker FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            orphans = [job_id for job_id, worker in rows if worker and not process_alive(worker)]
+            self._conn.executemany(
+                "UPDATE jobs SET "
+                "status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                "error = CASE WHEN attempts >= max_attempts THEN ? ELSE error END, "
+                "worker = NULL, lease_until = NULL WHERE id = ?",
+                [(WORKER_LOST, job_id) for job_id in orphans],
+            )
+        return len(orphans)
+
+    def retry(self, job_ids: Optional[list[int]] = None, batch: Optional[str] = None) -> int:
+        """
+        Queues failed or cancelled jobs again with fresh attempts; all of them unless ids or
+        a batch are given.
+        """
+        where, params = self._filter(job_ids, batch)
+        with self._write():
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, run_after = 0, "
+                f"finished_at = NULL WHERE status IN ('failed', 'cancelled'){where}",
+                params,
+            ).rowcount
+
+    def cancel(self, job_ids: Optional[list[int]] = None, batch: Optional[str] = None) -> int:
+        """Cancels queued jobs, all of them unless ids or a batch are given; running ones finish."""
+        where, params = self._filter(job_ids, batch)
+        with self._write():
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                f"WHERE status = 'queued'{where}",
+                (time.time(), *params),
+            ).rowcount
+
+    @staticmethod
+    def _filter(job_ids: Optional[list[int]], batch: Optional[str]) -> tuple[str, tuple]:
+        where, params = "", ()
+        if job_ids:
+            where += f" AND id IN ({', '.join('?' * len(job_ids))})"
+            params += tuple(job_ids)
+        if batch is not None:
+            where += " AND batch = ?"
+            params += (batch,)
+        return where, params
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def jobs(
+        self, status: Optional[str] = None, batch: Optional[str] = None, limit: Optional[int] = None
+    ) -> list[Job]:
+        """Jobs in the order they were submitted, optionally only those with a status or batch."""
+        where, params = self._filter(None, batch)
+        if status is not None:
+            where += " AND status = ?"
+            params += (status,)
+        query = f"SELECT {self._COLUMNS} FROM jobs WHERE 1 = 1{where} ORDER BY id"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [self._job(row) for row in self._conn.execute(query, params).fetchall()]
+
+    def counts(self, batch: Optional[str] = None) -> dict[str, int]:
+        """Number of jobs in each status."""
+        where, params = self._filter(None, batch)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT status, COUNT(*) FROM jobs WHERE 1 = 1{where} GROUP BY status", params
+            ).fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def pending(self) -> int:
+        """Jobs still to be done: queued or running."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+
+def run_job(job: Job) -> str:
+    """
+    Generates a job's sheet. Repeated specs in a batch ask for variations, so they aren't
+    coalesced.
+    """
+    from router import GENERATORS
+
+    agent = GENERATORS[job.kind].agent_class(coalesce=False, variation=job.variation)
+    return agent.generate_sheet(job.create_spec())
+
+
+def work(
+    store: JobStore,
+    worker: str,
+    stop: threading.Event,
+    poll_interval: float = 1.0,
+    until_done: bool = False,
+    lease: float = JOB_LEASE,
+    run: Callable[[Job], str] = run_job,
+    on_finish: Optional[Callable[[Job, Optional[Exception]], None]] = None,
+) -> None:
+    """
+    A worker's loop: claims jobs and runs them until `stop` is set, or with until_done,
+    until no job is queued or running any more.
+    """
+    while not stop.is_set():
+        job = store.claim(worker, lease)
+        if job is None:
+            if until_done and store.pending() == 0:
+                return
+            stop.wait(poll_interval)
+            continue
+        error = None
+        try:
+            store.complete(job.id, worker, run(job))
+        except Exception as e:
+            error = e
+            store.fail(job.id, worker, f"{type(e).__name__}: {e}")
+        if on_finish is not None:
+            on_finish(job, error)
+
+
+class WorkerPool:
+    """Worker threads, or processes, that run the jobs of a queue."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        workers: Optional[int] = None,
+        processes: bool = False,
+        until_done: bool = False,
+        lease: float = JOB_LEASE,
+        poll_interval: float = 1.0,
+        on_finish: Optional[Callable[[Job, Optional[Exception]], None]] = None,
+        stop_event: Optional[threading.Event] = None,
+    ):
+        """
+        Args:
+            path: The queue's SQLite file (default: $TTRPG_JOBS_FILE, or
+                <data dir>/jobs/jobs.sqlite).
+            workers: Jobs run at once (default: $TTRPG_JOB_WORKERS, or as many requests as the
+                model endpoints take at once, or 4 if they have no limit).
+            processes: Run every worker in a process of its own instead of a thread. Each
+                process then has its own model clients and endpoint limits.
+            until_done: Stop once no job is queued or running, instead of waiting for more.
+            lease: Seconds a job's lease lasts; it is renewed every third of that.
+            poll_interval: Seconds an idle worker waits before looking for jobs again.
+            on_finish: Called in a worker thread with each job it finished, and the error if
+                it failed.
+            stop_event: Event that stops the workers when set (default: a new one; see stop()).
+        """
+        self.store = JobStore(path)
+        self.workers = workers or default_workers()
+        self.processes = processes
+        self.until_done = until_done
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.on_finish = on_finish
+        self.stop_event = stop_event or threading.Event()
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}:"
+
+    def run(self) -> None:
+        """
+        Runs the workers until stop() is called or, with until_done, the queue is empty.
+
+        The first Ctrl-C stops taking new jobs and waits for the ones in progress; a second
+        one stops at once, and their jobs are queued again.
+        """
+        requeued = self.store.requeue_orphans()
+        if requeued:
+            print(f"♻️  Resuming {requeued} job(s) left running by a stopped worker")
+        if self.processes:
+            self._run_processes()
+        else:
+            self._run_threads()
+
+    def _run_threads(self) -> None:
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+        threads = [
+            threading.Thread(
+                target=work,
+                args=(
+                    self.store,
+                    worker_name(i),
+                    self.stop_event,
+                    self.poll_interval,
+                    self.until_done,
+                    self.lease,
+                ),
+                kwargs={"on_finish": self.on_finish},
+                name=f"job-worker-{i}",
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self._wait(threads, self.abandon)
+        self.stop_event.set()
+
+    def _run_processes(self) -> None:
+        context = multiprocessing.get_context("spawn")
+        stop_event = context.Event()
+        processes = [
+            context.Process(
+                target=_work_in_process,
+                args=(
+                    str(self.store.path),
+                    self.until_done,
+                    self.lease,
+                    self.poll_interval,
+                    stop_event,
+                ),
+                daemon=True,
+            )
+            for _ in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        def abandon() -> None:
+            for process in processes:
+                process.terminate()
+                process.join()
+            # A terminated process can't give its job back itself
+            self.store.requeue_orphans()
+
+        # The children ignore Ctrl-C; the event tells them to stop taking jobs
+        self.stop_event = stop_event
+        self._wait(processes, abandon)
+
+    def _wait(self, workers: list, abandon: Callable[[], None]) -> None:
+        """Waits for threads or processes to finish, handling Ctrl-C as described in run()."""
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            print("\n⏸️  Finishing the jobs in progress; press Ctrl-C again to stop at once")
+            self.stop()
+            try:
+                for worker in workers:
+                    while worker.is_alive():
+                        worker.join(0.5)
+            except KeyboardInterrupt:
+                abandon()
+                print("⏹️  Stopped; unfinished jobs will be resumed on the next run")
+
+    def _heartbeat(self) -> None:
+        while not self.stop_event.wait(self.lease / 3):
+            self.store.renew(self._prefix, self.lease)
+            # Workers on this machine that died since the pool started
+            self.store.requeue_orphans()
+
+    def stop(self) -> None:
+        """Stops taking jobs; the jobs being run finish first."""
+        self.stop_event.set()
+
+    def abandon(self) -> int:
+        """Queues the jobs this process is running again, for when it exits before they finish."""
+        self.stop_event.set()
+        return self.store.release(self._prefix)
+
+
+def _work_in_process(
+    path: str, until_done: bool, lease: float, poll_interval: float, stop_event: threading.Event
+) -> None:
+    """Entry point of a worker process: one worker thread, with its own lease heartbeat."""
+    import signal
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pool = WorkerPool(
+        path,
+        workers=1,
+        until_done=until_done,
+        lease=lease,
+        poll_interval=poll_interval,
+        stop_event=stop_event,
+    )
+    pool._run_threads()
+
+
+def default_workers() -> int:
+    """
+    $TTRPG_JOB_WORKERS, or as many requests as the model endpoints take at once (4 if they
+    have no limit).
+    """
+    if os.getenv("TTRPG_JOB_WORKERS"):
+        return int(os.getenv("TTRPG_JOB_WORKERS"))
+    from core.llm_service import llm_service
+
+    return llm_service.pool.capacity or 4
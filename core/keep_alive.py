@@ -0,0 +1,127 @@
+"""
+Model keep-alive for TTRPG Sidekick
+
+Ollama unloads a model after a few idle minutes, and the next request waits for it to
+load again, often several seconds for a 7-8B model on CPU. KeepAlive loads the models
+of the Ollama endpoints ahead of time, in the background, and pings them periodically
+while a session is open so they stay loaded. Its state tells the interface whether
+the model is hot.
+
+Loading and pinging use Ollama's native API (/api/generate without a prompt), which
+loads the model and keeps it for the endpoint's keep_alive duration.
+"""
+
+import json
+import threading
+from typing import Optional
+
+from core.provider_pool import Endpoint
+
+# How long a model loaded on the way in may take, in seconds
+LOAD_TIMEOUT = 300.0
+
+# State of a model, from never requested to loaded
+MODEL_STATES = ("cold", "loading", "ready", "failed")
+
+
+def native_url(endpoint: Endpoint) -> str:
+    """The base URL of Ollama's native API, from the endpoint's OpenAI-compatible one."""
+    base_url = endpoint.base_url.rstrip("/")
+    return base_url[: -len("/v1")] if base_url.endswith("/v1") else base_url
+
+
+def load_model(endpoint: Endpoint, timeout: float = LOAD_TIMEOUT) -> None:
+    """
+    Loads the endpoint's model into memory, or keeps it there, for its keep_alive duration.
+
+    Raises:
+        OSError: If the endpoint can't be reached or doesn't answer in time.
+    """
+    import urllib.request
+
+    body = json.dumps({"model": endpoint.model, "keep_alive": endpoint.keep_alive}).encode("utf-8")
+    request = urllib.request.Request(
+        f"{native_url(endpoint)}/api/generate",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+class KeepAlive:
+    """Loads the models of the Ollama endpoints in the background and keeps them loaded."""
+
+    def __init__(self, endpoints: list[Endpoint], interval: float = 240.0):
+        """
+        Args:
+            endpoints: The endpoints to look after; those not served by Ollama are ignored.
+            interval: Seconds between pings while the pinger runs.
+        """
+        self.endpoints = [endpoint for endpoint in endpoints if endpoint.provider == "ollama"]
+        self.interval = interval
+        self.states = {endpoint.name: "cold" for endpoint in self.endpoints}
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._pinger: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        if not self.endpoints:
+            self._ready.set()
+
+    @property
+    def state(self) -> str:
+        """"ready" once any endpoint has its model loaded, else "loading", "failed" or "cold"."""
+        if not self.endpoints:
+            return "ready"
+        states = set(self.states.values())
+        for state in ("ready", "loading", "cold"):
+            if state in states:
+                return state
+        return "failed"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _load(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            if self.states[endpoint.name] == "loading":
+                return
+            if self.states[endpoint.name] != "ready":
+                self.states[endpoint.name] = "loading"
+        try:
+            load_model(endpoint)
+        except (OSError, ValueError):
+            self.states[endpoint.name] = "failed"
+            return
+        self.states[endpoint.name] = "ready"
+        self._ready.set()
+
+    def warm_up(self) -> None:
+        """Starts loading every endpoint's model in the background."""
+        for endpoint in self.endpoints:
+            threading.Thread(target=self._load, args=(endpoint,), name=f"warm-up-{endpoint.name}", daemon=True).start()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Waits until a model is loaded; returns False if none is within `timeout` seconds."""
+        return self._ready.wait(timeout)
+
+    def start(self) -> None:
+        """Warms the models up and pings them every `interval` seconds until stop() is called."""
+        if self._pinger is not None or not self.endpoints:
+            return
+        self._stop.clear()
+        self.warm_up()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                for endpoint in self.endpoints:
+                    self._load(endpoint)
+
+        self._pinger = threading.Thread(target=run, name="keep-alive", daemon=True)
+        self._pinger.start()
+
+    def stop(self) -> None:
+        """Stops the pinger; models stay loaded until their keep_alive runs out."""
+        self._stop.set()
+        self._pinger = None
@@ -1,10 +1,78 @@
 import os
-from openai import OpenAI
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, Optional
+from core.metrics import CallMetrics, metrics
+from core.response_cache import CACHE_MODES, ResponseCache
+from core.keep_alive import KeepAlive
+from core.provider_pool import Endpoint, ProviderPool
+from core.transport import DeadlineExceededError, Transport, TransportPolicy
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+    from core.cassette import Cassette
+
+
+@dataclass
+class TokenUsage:
+    """Token counts reported by the provider for one or more completions."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # Prompt tokens served from the provider's prompt-prefix cache
+
+    @classmethod
+    def from_response(cls, usage) -> "TokenUsage":
+        """Builds a TokenUsage from the `usage` of a chat completion (or its last stream chunk)."""
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+        )
+
+    def __add__(self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(
+            self.prompt_tokens + other.prompt_tokens,
+            self.completion_tokens + other.completion_tokens,
+            self.cached_tokens + other.cached_tokens,
+        )
+
+    @property
+    def cached_ratio(self) -> float:
+        """Share of prompt tokens that were served from the provider's cache."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.prompt_tokens} prompt tokens "
+            f"({self.cached_tokens} cached, {self.cached_ratio:.0%}), "
+            f"{self.completion_tokens} completion tokens"
+        )
 
 class LLMService:
     """
     A centralized service to manage the LLM client.
     This ensures that the client is configured and instantiated in only one place.
+
+    The openai package is only imported, and the client only built, when a completion
+    is first requested, so commands that never call the model start quickly.
+
+    With a cassette configured (see configure_cassette), completions are recorded to or
+    replayed from a file, so runs can be reproduced without an API key or a model.
+
+    Every completion is measured (time to first token, latency, token usage, cache hits)
+    and reported to core.metrics, labelled with the generator from its cache scope.
+
+    Requests go through core.transport: they have a deadline, are retried with backoff on
+    rate limits and server errors, and (with hedging on) are sent twice when the first
+    attempt is unusually slow. Each attempt goes to the least loaded endpoint of the
+    provider pool (core.provider_pool), which is the single configured provider unless
+    TTRPG_PROVIDER_POOL lists several.
+
+    Ollama models can be loaded ahead of the first request and kept loaded while a
+    session is open (see keep_alive and warm_up), so players don't wait for a cold start.
     """
     _instance = None
 
@@ -15,20 +83,512 @@ class LLMService:
         return cls._instance
 
     def _initialize_client(self):
-        """Initializes the OpenAI client based on the environment provider."""
-        api_provider = os.getenv("API_PROVIDER", "openai").lower()
-
-        if api_provider == "ollama":
-            print("🔧 Initializing Ollama LLM Client...")
-            self.client = OpenAI(
-                base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"),
-                api_key="ollama",  # required but unused
+        """
+        Reads the endpoint configuration from the environment; the clients themselves are
+        created lazily.
+        """
+        self.pool = ProviderPool.from_env()
+        # The first endpoint's provider and model name the requests, e.g. in cache keys and
+        # token counts
+        self.provider = self.pool.primary.provider
+        self.model = self.pool.primary.model
+        self.transport = Transport(TransportPolicy.from_env())
+        self.keep_alive = KeepAlive(
+            self.pool.endpoints, float(os.getenv("TTRPG_OLLAMA_PING_INTERVAL", "240"))
+        )
+
+        # Record/replay of completions; see configure_cassette
+        self.cassette: Optional["Cassette"] = None
+        if os.getenv("TTRPG_CASSETTE"):
+            self.configure_cassette(
+                os.getenv("TTRPG_CASSETTE"), os.getenv("TTRPG_CASSETTE_MODE", "replay").lower()
             )
-            self.model = os.getenv("OLLAMA_MODEL", "llama3")
+
+        if os.getenv("TTRPG_OLLAMA_PRELOAD", "").lower() in ("1", "true", "yes"):
+            self.warm_up()
+
+        # Response cache settings; see configure_cache
+        self._cache = None
+        self.cache_mode = os.getenv("TTRPG_CACHE_MODE", "use").lower()
+        self.deterministic = os.getenv("TTRPG_DETERMINISTIC", "").lower() in ("1", "true", "yes")
+
+        # Token usage reported by the provider: the most recent completion and the running total
+        self.last_usage: Optional[TokenUsage] = None
+        self.total_usage = TokenUsage()
+        self._usage_lock = threading.Lock()
+
+    @property
+    def replaying(self) -> bool:
+        """Whether completions are answered from a cassette, so no API key or model is needed."""
+        return self.cassette is not None and self.cassette.mode == "replay"
+
+    @property
+    def model_state(self) -> str:
+        """
+        "ready" if the model is loaded (always, for OpenAI and cassette replay), else "cold",
+        "loading" or "failed".
+        """
+        return "ready" if self.replaying else self.keep_alive.state
+
+    def warm_up(self, keep_warm: bool = False) -> None:
+        """
+        Loads the Ollama models in the background, so the first request doesn't wait for them.
+
+        Args:
+            keep_warm: Also ping them periodically until keep_alive.stop() is called, e.g. for
+                as long as a chat session is open.
+        """
+        if self.replaying:
+            return
+        if keep_warm:
+            self.keep_alive.start()
         else:
-            print("🔧 Initializing OpenAI LLM Client...")
-            self.client = OpenAI()
-            self.model = os.getenv("OPENAI_MODEL", "gpt-4o")
+            self.keep_alive.warm_up()
+
+    @property
+    def client(self) -> "OpenAI":
+        """The OpenAI client of the first endpoint, created on first use."""
+        return self.pool.primary.client
+
+    @client.setter
+    def client(self, client: "OpenAI") -> None:
+        """Replaces the first endpoint's client, e.g. with a preconfigured or fake one."""
+        self.pool.primary.client = client
+
+    @property
+    def async_client(self) -> "AsyncOpenAI":
+        """The asyncio client of the first endpoint; see Endpoint.async_client."""
+        return self.pool.primary.async_client
+
+    async def aclose(self) -> None:
+        """
+        Closes the async clients' connections; call before the event loop that used them ends.
+
+        Otherwise the connections are only cleaned up when the clients are garbage collected,
+        after their loop has closed, which fails noisily.
+        """
+        await self.pool.aclose()
+
+    def configure_cassette(self, path: Optional[str], mode: str = "replay") -> None:
+        """
+        Records completions to, or replays them from, a cassette file.
+
+        Args:
+            path: The cassette file, or None to go back to calling the model directly.
+            mode: "record" (call the model and save every response) or "replay" (answer from
+                the file without calling the model; unrecorded requests raise CassetteMissError).
+        """
+        from core.cassette import Cassette
+
+        self.cassette = Cassette(path, mode) if path else None
+        self.pool.set_cassette(self.cassette)
+
+    def configure_cache(
+        self, mode: Optional[str] = None, deterministic: Optional[bool] = None
+    ) -> None:
+        """
+        Changes how completions use the response cache.
+
+        Args:
+            mode: "use" (read and write), "refresh" (always call the model and overwrite the
+                cached response) or "off" (bypass the cache).
+            deterministic: If True, sample at temperature 0 so cached responses are the ones
+                the model would give anyway.
+        """
+        if mode is not None:
+            if mode not in CACHE_MODES:
+                raise ValueError(
+                    f"Unknown cache mode '{mode}'. Expected one of: {', '.join(CACHE_MODES)}"
+                )
+            self.cache_mode = mode
+        if deterministic is not None:
+            self.deterministic = deterministic
+
+    @property
+    def cache(self) -> ResponseCache:
+        """The on-disk response cache, opened on first use."""
+        if self._cache is None:
+            self._cache = ResponseCache()
+        return self._cache
+
+    def _cache_key(
+        self, messages: list[dict], temperature: float, max_tokens: int, cache_scope: Optional[dict]
+    ) -> Optional[str]:
+        """Returns the cache key for a request, or None if the request should not be cached."""
+        if cache_scope is None or self.cache_mode == "off":
+            return None
+        return ResponseCache.make_key(
+            provider=self.provider,
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            scope=cache_scope,
+        )
+
+    def _cache_get(self, key: Optional[str]) -> Optional[str]:
+        if key is None or self.cache_mode != "use":
+            return None
+        return self.cache.get(key)
+
+    def _cache_set(self, key: Optional[str], text: str, call: CallMetrics) -> None:
+        # Keys name the first endpoint's model; another model's answer mustn't pass for its own
+        if key is None or not text or (call.provider, call.model) != (self.provider, self.model):
+            return
+        self.cache.set(key, text)
+
+    def _record_usage(self, usage, call: CallMetrics) -> None:
+        """
+        Stores the usage reported for a completion; cache hits and providers without usage
+        are skipped.
+        """
+        if usage is None:
+            return
+        token_usage = TokenUsage.from_response(usage)
+        call.prompt_tokens = token_usage.prompt_tokens
+        call.completion_tokens = token_usage.completion_tokens
+        call.cached_tokens = token_usage.cached_tokens
+        with self._usage_lock:
+            self.last_usage = token_usage
+            self.total_usage = self.total_usage + token_usage
+
+    @contextmanager
+    def _track(
+        self, call: Optional[CallMetrics], cache_scope: Optional[dict], streamed: bool
+    ) -> Iterator[CallMetrics]:
+        """
+        Measures a completion. A call passed in by the caller (e.g. an agent that times its
+        own steps as well) is filled in and left for the caller to emit; otherwise a new one
+        is labelled from the cache scope and emitted when the completion ends.
+        """
+        if call is not None:
+            call.model, call.provider, call.streamed = self.model, self.provider, streamed
+            yield call
+            return
+        scope = cache_scope or {}
+        with metrics.track(
+            generator=scope.get("generator", "chat"), brief=scope.get("brief")
+        ) as call:
+            call.model, call.provider, call.streamed = self.model, self.provider, streamed
+            yield call
+
+    def _hedge_delay(self, call: CallMetrics) -> Optional[float]:
+        """
+        Seconds after which a second request is sent, or None if hedging is off or there is
+        no p95 yet.
+        """
+        policy = self.transport.policy
+        if not policy.hedge:
+            return None
+        return policy.hedge_delay or metrics.memory.percentile(call.label, 0.95)
+
+    @staticmethod
+    def _timeout_argument(timeout: Optional[float]) -> dict:
+        return {"timeout": timeout} if timeout is not None else {}
+
+    @staticmethod
+    def _label(call: CallMetrics, endpoint: Endpoint) -> None:
+        call.endpoint, call.provider, call.model = endpoint.name, endpoint.provider, endpoint.model
+
+    def _released(self, endpoint: Endpoint, stream: Iterator) -> Iterator:
+        """Yields the chunks of a stream, freeing its slot on the endpoint when it ends."""
+        error = None
+        try:
+            yield from stream
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.pool.release(endpoint, error)
+
+    async def _released_async(self, endpoint: Endpoint, stream: AsyncIterator) -> AsyncIterator:
+        """Async version of _released."""
+        error = None
+        try:
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.pool.release(endpoint, error)
+
+    def _create(self, call: CallMetrics, deadline: Optional[float], hedge: bool, **request):
+        """
+        Sends a chat completion request through the transport, each attempt to the best
+        endpoint of the pool. A stream keeps its slot on the endpoint until it is closed.
+        """
+        def send(timeout: Optional[float]):
+            endpoint = self.pool.acquire(timeout)
+            try:
+                response = endpoint.client.chat.completions.create(
+                    model=endpoint.model,
+                    **request,
+                    **endpoint.request_options(),
+                    **self._timeout_argument(timeout),
+                )
+            except Exception as e:
+                self.pool.release(endpoint, e)
+                raise
+            except BaseException:
+                # Cancelled, e.g. the slower of two hedged requests: not the endpoint's doing
+                self.pool.release(endpoint, outcome=False)
+                raise
+            if request.get("stream"):
+                return endpoint, self._released(endpoint, response)
+            self.pool.release(endpoint)
+            return endpoint, response
+
+        endpoint, response = self.transport.send(
+            send, call, deadline, self._hedge_delay(call) if hedge else None
+        )
+        self._label(call, endpoint)
+        return response
+
+    async def _create_async(
+        self, call: CallMetrics, deadline: Optional[float], hedge: bool, **request
+    ):
+        """Async version of _create."""
+        async def send(timeout: Optional[float]):
+            endpoint = await self.pool.acquire_async(timeout)
+            try:
+                response = await endpoint.async_client.chat.completions.create(
+                    model=endpoint.model,
+                    **request,
+                    **endpoint.request_options(),
+                    **self._timeout_argument(timeout),
+                )
+            except Exception as e:
+                self.pool.release(endpoint, e)
+                raise
+            except BaseException:
+                # Cancelled, e.g. the slower of two hedged requests: not the endpoint's doing
+                self.pool.release(endpoint, outcome=False)
+                raise
+            if request.get("stream"):
+                return endpoint, self._released_async(endpoint, response)
+            self.pool.release(endpoint)
+            return endpoint, response
+
+        endpoint, response = await self.transport.send_async(
+            send, call, deadline, self._hedge_delay(call) if hedge else None
+        )
+        self._label(call, endpoint)
+        return response
+
+    def complete(
+        self,
+        messages: list[dict],
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        cache_scope: Optional[dict] = None,
+        call: Optional[CallMetrics] = None,
+        deadline: Optional[float] = None,
+        response_format: Optional[dict] = None,
+    ) -> str:
+        """
+        Runs a chat completion and returns the full response text.
+
+        Args:
+            messages: The chat messages to send to the model.
+            temperature: Sampling temperature (forced to 0 in deterministic mode).
+            max_tokens: Maximum number of tokens to generate.
+            cache_scope: Extra values identifying the request (e.g. generator and brief flag).
+                Responses are only cached when this is given.
+            call: Metrics to fill in for this completion; the caller emits them. Without it,
+                the completion is reported to core.metrics on its own.
+            deadline: Seconds for the whole completion, retries included (default:
+                TTRPG_LLM_DEADLINE). Raises DeadlineExceededError when it passes.
+            response_format: Constrains the answer, e.g. to a JSON schema (see core.sheet_model).
+                Give it a cache scope of its own, as it isn't part of the cache key.
+
+        Returns:
+            The content of the first choice.
+        """
+        with self._track(call, cache_scope, streamed=False) as call:
+            if self.deterministic:
+                temperature = 0.0
+            key = self._cache_key(messages, temperature, max_tokens, cache_scope)
+            cached = self._cache_get(key)
+            if cached is not None:
+                call.cache_hit = True
+                return cached
+
+            start = time.perf_counter()
+            response = self._create(
+                call,
+                deadline,
+                hedge=True,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **({"response_format": response_format} if response_format else {}),
+            )
+            call.ttft_seconds = call.model_seconds = time.perf_counter() - start
+            self._record_usage(getattr(response, "usage", None), call)
+            text = response.choices[0].message.content
+            self._cache_set(key, text, call)
+            return text
+
+    def stream(
+        self,
+        messages: list[dict],
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        cache_scope: Optional[dict] = None,
+        call: Optional[CallMetrics] = None,
+        deadline: Optional[float] = None,
+    ) -> Iterator[str]:
+        """
+        Runs a streaming chat completion and yields text deltas as they arrive.
+
+        Args:
+            messages: The chat messages to send to the model.
+            temperature: Sampling temperature (forced to 0 in deterministic mode).
+            max_tokens: Maximum number of tokens to generate.
+            cache_scope: Same as for complete. A cache hit is yielded as a single delta, and a
+                streamed response is only cached once it has been read to the end.
+            call: Same as for complete.
+            deadline: Same as for complete, counted until the last delta. Streams are retried
+                only until the response starts and are never hedged.
+
+        Yields:
+            Non-empty content deltas from the first choice.
+        """
+        with self._track(call, cache_scope, streamed=True) as call:
+            if self.deterministic:
+                temperature = 0.0
+            key = self._cache_key(messages, temperature, max_tokens, cache_scope)
+            cached = self._cache_get(key)
+            if cached is not None:
+                call.cache_hit = True
+                yield cached
+                return
+
+            parts = []
+            start = time.perf_counter()
+            deadline_at = self.transport.deadline_at(deadline)
+            response = self._create(
+                call,
+                deadline,
+                hedge=False,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                for chunk in response:
+                    # With include_usage, the final chunk carries the usage and no choices
+                    self._record_usage(getattr(chunk, "usage", None), call)
+                    if deadline_at is not None and time.monotonic() > deadline_at:
+                        raise DeadlineExceededError(
+                            "The response did not finish before its deadline"
+                        )
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if call.ttft_seconds is None:
+                            call.ttft_seconds = time.perf_counter() - start
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # Frees the endpoint's slot at once if the caller stops reading early
+                response.close()
+            call.model_seconds = time.perf_counter() - start
+            self._cache_set(key, "".join(parts), call)
+
+    async def complete_async(
+        self,
+        messages: list[dict],
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        cache_scope: Optional[dict] = None,
+        call: Optional[CallMetrics] = None,
+        deadline: Optional[float] = None,
+        response_format: Optional[dict] = None,
+    ) -> str:
+        """Async version of complete, using the AsyncOpenAI client."""
+        with self._track(call, cache_scope, streamed=False) as call:
+            if self.deterministic:
+                temperature = 0.0
+            key = self._cache_key(messages, temperature, max_tokens, cache_scope)
+            cached = self._cache_get(key)
+            if cached is not None:
+                call.cache_hit = True
+                return cached
+
+            start = time.perf_counter()
+            response = await self._create_async(
+                call,
+                deadline,
+                hedge=True,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **({"response_format": response_format} if response_format else {}),
+            )
+            call.ttft_seconds = call.model_seconds = time.perf_counter() - start
+            self._record_usage(getattr(response, "usage", None), call)
+            text = response.choices[0].message.content
+            self._cache_set(key, text, call)
+            return text
+
+    async def stream_async(
+        self,
+        messages: list[dict],
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        cache_scope: Optional[dict] = None,
+        call: Optional[CallMetrics] = None,
+        deadline: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """Async version of stream, using the AsyncOpenAI client."""
+        with self._track(call, cache_scope, streamed=True) as call:
+            if self.deterministic:
+                temperature = 0.0
+            key = self._cache_key(messages, temperature, max_tokens, cache_scope)
+            cached = self._cache_get(key)
+            if cached is not None:
+                call.cache_hit = True
+                yield cached
+                return
+
+            parts = []
+            start = time.perf_counter()
+            deadline_at = self.transport.deadline_at(deadline)
+            response = await self._create_async(
+                call,
+                deadline,
+                hedge=False,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                async for chunk in response:
+                    self._record_usage(getattr(chunk, "usage", None), call)
+                    if deadline_at is not None and time.monotonic() > deadline_at:
+                        raise DeadlineExceededError(
+                            "The response did not finish before its deadline"
+                        )
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if call.ttft_seconds is None:
+                            call.ttft_seconds = time.perf_counter() - start
+                        parts.append(delta)
+                        yield delta
+            finally:
+                await response.aclose()
+            call.model_seconds = time.perf_counter() - start
+            self._cache_set(key, "".join(parts), call)
+
 
 # Create a single, shared instance of the service
-llm_service = LLMService() 
\ No newline at end of file
+llm_service = LLMService()
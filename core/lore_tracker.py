@@ -0,0 +1,409 @@
+"""
+Lore Tracker for TTRPG Sidekick
+
+Local retrieval index over everything a campaign has produced: generated sheets and
+stored entities are split into short passages and indexed per world, so prompts can
+include the few facts relevant to a request instead of whole worlds or histories.
+
+Passages are ranked with BM25 over an inverted index. When NumPy is installed, a dense
+index of hashed term vectors is searched as well and the two rankings are fused. Both
+work offline. New passages are searchable immediately and are written to disk in
+immutable segment files, which are merged once there are too many of them.
+
+Passages can be tagged with the request that produced them (see request_source), so a
+generator's prompt can leave out what earlier answers to the same request wrote: those
+would steer repeats and variations into copies of the last result.
+"""
+
+import atexit
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+from core.token_budget import count_tokens, truncate_to_tokens
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# The name of what a sheet describes, e.g. "• Name: Borin", "• **Quest Title:** The Lost Crown"
+NAME_PATTERN = re.compile(r"^[\s•*_-]*(?:[a-z]+ )?(?:name|title)[*_]*:[*_\s]*(.+)$", re.IGNORECASE | re.MULTILINE)
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his in is it its of on or she that the "
+    "their them they this to was were will with".split()
+)
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Passages per segment file before it is written, and segments per world before they are merged
+SEGMENT_SIZE = 64
+MAX_SEGMENTS = 8
+
+# Maximum size of a passage
+PASSAGE_TOKENS = 120
+
+# Dimensions of the hashed term vectors used by the dense index
+DENSE_DIMENSIONS = 512
+
+# Rank constant for reciprocal rank fusion of the BM25 and dense rankings
+RRF_K = 60
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases text and splits it into index terms, dropping stopwords."""
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+def split_passages(text: str, max_tokens: int = PASSAGE_TOKENS) -> list[str]:
+    """Splits text into passages of whole paragraphs, each at most about `max_tokens` tokens."""
+    passages = []
+    current: list[str] = []
+    current_tokens = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if current and current_tokens + tokens > max_tokens:
+            passages.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(truncate_to_tokens(paragraph, max_tokens))
+        current_tokens += min(tokens, max_tokens)
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+def request_source(kind: str, prompt: str) -> str:
+    """Tag for the passages of sheets generated for a request; ignores case and spacing of the prompt."""
+    normalized = " ".join(prompt.split()).casefold()
+    return f"{kind}:{hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]}"
+
+
+def sheet_title(sheet: str) -> str:
+    """
+    The name of what a sheet describes, used to label its passages; the sheet's first
+    line without markdown decoration if it has no name field.
+    """
+    match = NAME_PATTERN.search(sheet)
+    if match and match.group(1).strip("*_ "):
+        return match.group(1).strip("*_ ")[:80]
+    for line in sheet.splitlines():
+        title = line.strip().strip("#*_ ").strip()
+        if title:
+            return title[:80]
+    return "Untitled"
+
+
+def entity_text(entity: Any) -> str:
+    """Flattens a stored entity into indexable text."""
+    if not isinstance(entity, dict):
+        return str(entity)
+    return "\n".join(f"{key}: {value}" for key, value in entity.items() if value not in (None, "", [], {}))
+
+
+@dataclass
+class LorePassage:
+    """An indexed piece of lore."""
+    id: str
+    kind: str  # e.g. "npc", "quest", "npcs" for stored entities
+    title: str
+    text: str
+    created_at: float
+    source: str = ""  # The request that produced it, see request_source; older passages have none
+
+    def as_fact(self) -> str:
+        """The passage as a line for a prompt."""
+        return f"[{self.kind}: {self.title}] {self.text}"
+
+
+@dataclass
+class LoreHit:
+    """A search result."""
+    passage: LorePassage
+    score: float
+
+
+class HashingEmbedder:
+    """Maps text to a fixed-size vector by hashing its terms and term pairs; needs no model or network."""
+
+    def __init__(self, dimensions: int = DENSE_DIMENSIONS):
+        import numpy as np
+
+        self.np = np
+        self.dimensions = dimensions
+
+    def embed(self, text: str):
+        terms = tokenize(text)
+        features = Counter(terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])])
+        vector = self.np.zeros(self.dimensions, dtype=self.np.float32)
+        for feature, count in features.items():
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            vector[hashed % self.dimensions] += sign * (1.0 + math.log(count))
+        norm = self.np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class LoreIndex:
+    """The searchable lore of one world, backed by a directory of segment files."""
+
+    def __init__(self, path: Path, embedder: Optional[HashingEmbedder] = None):
+        self.path = path
+        self.embedder = embedder
+        self.passages: list[LorePassage] = []
+        self.ids: set[str] = set()
+        self.postings: dict[str, dict[int, int]] = {}  # term -> {passage number: term frequency}
+        self.lengths: list[int] = []
+        self.total_length = 0
+        self.by_source: dict[str, list[int]] = {}
+        self.pending: list[LorePassage] = []
+        self.segments: set[str] = set()
+        self._vectors: list = []
+        self._matrix = None
+
+    def _index(self, passage: LorePassage) -> None:
+        number = len(self.passages)
+        self.passages.append(passage)
+        self.ids.add(passage.id)
+        terms = tokenize(f"{passage.title} {passage.text}")
+        for term, frequency in Counter(terms).items():
+            self.postings.setdefault(term, {})[number] = frequency
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        if passage.source:
+            self.by_source.setdefault(passage.source, []).append(number)
+        if self.embedder is not None:
+            self._vectors.append(self.embedder.embed(f"{passage.title} {passage.text}"))
+            self._matrix = None
+
+    def add(self, passage: LorePassage) -> bool:
+        """Indexes a passage unless one with the same id is already indexed."""
+        if passage.id in self.ids:
+            return False
+        self._index(passage)
+        self.pending.append(passage)
+        return True
+
+    def load(self) -> None:
+        """Indexes segment files written since the last load, including ones from other processes."""
+        if not self.path.is_dir():
+            return
+        for segment in sorted(self.path.glob("segment-*.json")):
+            if segment.name in self.segments:
+                continue
+            try:
+                with open(segment, "r") as f:
+                    records = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                # Merged away by another process while we were listing, or not fully written
+                continue
+            self.segments.add(segment.name)
+            for record in records:
+                if record["id"] not in self.ids:
+                    self._index(LorePassage(**record))
+
+    def flush(self) -> None:
+        """Writes pending passages as a new segment, merging all segments if there are too many."""
+        if not self.pending:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.segments.add(self._write_segment(self.pending))
+        self.pending = []
+
+        if len(self.segments) > MAX_SEGMENTS:
+            merged = self._write_segment([passage for passage in self.passages])
+            for name in self.segments:
+                (self.path / name).unlink(missing_ok=True)
+            self.segments = {merged}
+
+    def _write_segment(self, passages: list[LorePassage]) -> str:
+        """Writes passages to a new segment file atomically and returns its name."""
+        name = f"segment-{time.time_ns()}-{os.getpid()}.json"
+        temp_path = self.path / f".{name}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump([passage.__dict__ for passage in passages], f)
+        os.replace(temp_path, self.path / name)
+        return name
+
+    def _bm25(self, terms: list[str], limit: int, excluded: set[int]) -> list[tuple[float, int]]:
+        count = len(self.passages)
+        average_length = self.total_length / count or 1.0
+        scores: dict[int, float] = {}
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for number, frequency in postings.items():
+                if number in excluded:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[number] / average_length)
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return heapq.nlargest(limit, ((score, number) for number, score in scores.items()))
+
+    def _dense(self, query: str, limit: int, excluded: set[int]) -> list[tuple[float, int]]:
+        np = self.embedder.np
+        if self._matrix is None:
+            self._matrix = np.vstack(self._vectors)
+        similarities = self._matrix @ self.embedder.embed(query)
+        if excluded:
+            similarities[list(excluded)] = 0.0
+        limit = min(limit, len(similarities))
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        return sorted(((float(similarities[i]), int(i)) for i in top if similarities[i] > 0), reverse=True)
+
+    def search(self, query: str, k: int, exclude_source: Optional[str] = None) -> list[LoreHit]:
+        """Returns the k passages most relevant to the query, best first, leaving out those of exclude_source."""
+        terms = tokenize(query)
+        if not self.passages or not terms:
+            return []
+
+        excluded = set(self.by_source.get(exclude_source, ())) if exclude_source else set()
+        lexical = self._bm25(terms, k * 4, excluded)
+        if self.embedder is None:
+            return [LoreHit(self.passages[number], score) for score, number in lexical[:k]]
+
+        # Reciprocal rank fusion: rewards passages ranked highly by either index
+        fused: dict[int, float] = {}
+        for ranking in (lexical, self._dense(query, k * 4, excluded)):
+            for rank, (_, number) in enumerate(ranking):
+                fused[number] = fused.get(number, 0.0) + 1.0 / (RRF_K + rank + 1)
+        best = heapq.nlargest(k, ((score, number) for number, score in fused.items()))
+        return [LoreHit(self.passages[number], score) for score, number in best]
+
+
+class LoreTracker:
+    """
+    Retrieval index over a campaign's lore, one index per world.
+
+    Example:
+        >>> lore = LoreTracker()
+        >>> lore.add_sheet("Eberron", "npc", sheet)
+        >>> lore.relevant_facts("Eberron", "the dwarf smith in Sharn", max_tokens=300)
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, dense: Optional[bool] = None):
+        """
+        Args:
+            data_dir: Directory for the per-world indexes (default: $TTRPG_LORE_DIR or <data dir>/lore).
+            dense: Whether to also use the dense index (default: whenever NumPy is installed).
+        """
+        default_dir = Path(os.getenv("TTRPG_DATA_DIR", "data")) / "lore"
+        self.data_dir = Path(data_dir or os.getenv("TTRPG_LORE_DIR", default_dir))
+        self.embedder = None
+        if dense is not False:
+            try:
+                self.embedder = HashingEmbedder()
+            except ImportError:
+                if dense:
+                    raise
+        self._indexes: dict[str, LoreIndex] = {}
+        self._lock = threading.Lock()
+        # Don't lose passages that haven't filled a segment yet
+        atexit.register(self.flush)
+
+    def _world_index(self, world_name: str) -> LoreIndex:
+        """Returns the index for a world, picking up segments written by other processes."""
+        index = self._indexes.get(world_name)
+        if index is None:
+            slug = re.sub(r"[^\w-]+", "_", world_name).strip("_") or "world"
+            digest = hashlib.sha1(world_name.encode("utf-8")).hexdigest()[:8]
+            index = LoreIndex(self.data_dir / f"{slug}-{digest}", self.embedder)
+            self._indexes[world_name] = index
+        index.load()
+        return index
+
+    def add(self, world_name: str, text: str, kind: str = "note", title: Optional[str] = None, source: str = "") -> int:
+        """
+        Splits text into passages and indexes them; passages already indexed are skipped.
+
+        Args:
+            source: The request that produced the text, see request_source.
+
+        Returns:
+            The number of passages added.
+        """
+        title = title or sheet_title(text)
+        added = 0
+        with self._lock:
+            index = self._world_index(world_name)
+            for passage_text in split_passages(text):
+                passage_id = hashlib.sha1(f"{kind}\0{title}\0{passage_text}".encode("utf-8")).hexdigest()
+                added += index.add(LorePassage(passage_id, kind, title, passage_text, time.time(), source))
+            if len(index.pending) >= SEGMENT_SIZE:
+                index.flush()
+        return added
+
+    def add_sheet(self, world_name: str, kind: str, sheet: str, source: str = "") -> int:
+        """Indexes a generated sheet, labelled with the name of what it describes."""
+        return self.add(world_name, sheet, kind=kind, title=sheet_title(sheet), source=source)
+
+    def add_entity(self, world_name: str, entity_type: str, entity: Any, source: str = "") -> int:
+        """Indexes a stored entity such as an NPC record."""
+        title = str(entity.get("name", "Unnamed")) if isinstance(entity, dict) else str(entity)
+        return self.add(world_name, entity_text(entity), kind=entity_type, title=title, source=source)
+
+    def search(self, world_name: str, query: str, k: int = 5, exclude_source: Optional[str] = None) -> list[LoreHit]:
+        """Returns the k passages of a world most relevant to the query, best first, leaving out those of exclude_source."""
+        with self._lock:
+            return self._world_index(world_name).search(query, k, exclude_source)
+
+    def relevant_facts(
+        self,
+        world_name: str,
+        query: str,
+        max_tokens: int,
+        model: Optional[str] = None,
+        k: int = 5,
+        exclude_source: Optional[str] = None,
+    ) -> str:
+        """
+        Returns the passages most relevant to the query as prompt lines, within a token budget.
+
+        Args:
+            exclude_source: Leave out passages of this request, e.g. the generator's earlier answers to it.
+
+        Returns:
+            One fact per line, best first, or an empty string if nothing relevant is indexed.
+        """
+        lines = []
+        used = 0
+        for hit in self.search(world_name, query, k, exclude_source):
+            line = f"- {hit.passage.as_fact()}"
+            tokens = count_tokens(line, model)
+            if used + tokens > max_tokens:
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(lines)
+
+    def flush(self) -> None:
+        """Writes every world's pending passages to disk."""
+        with self._lock:
+            for index in self._indexes.values():
+                index.flush()
+
+
+# Shared instance, created on first use so importing this module doesn't touch the disk
+_lore_tracker: Optional[LoreTracker] = None
+_lore_tracker_lock = threading.Lock()
+
+
+def get_lore_tracker() -> LoreTracker:
+    """Returns the shared LoreTracker, creating it on first use."""
+    global _lore_tracker
+    with _lore_tracker_lock:
+        if _lore_tracker is None:
+            _lore_tracker = LoreTracker()
+        return _lore_tracker
@@ -4,44 +4,234 @@ Memory Service for TTRPG Sidekick
 Handles world-specific memory and context storage.
 """
 
+import atexit
 import json
 import os
+import threading
+from collections import OrderedDict
 from typing import Dict, Any, Optional
 from pathlib import Path
+from core.lore_tracker import LoreTracker, get_lore_tracker
+from core.world_store import ENTITY_TABLES, WorldStore
+from core.world_summary import DEFAULT_SUMMARY_TOKENS, MAX_RECENT_ENTITIES, WorldSummary
+
+# Number of world summaries kept in memory
+SUMMARY_CACHE_SIZE = 32
 
 
 class MemoryService:
-    """Service for managing world-specific memory and context."""
-    
-    def __init__(self, data_dir: Optional[str] = None):
+    """
+    Service for managing world-specific memory and context.
+
+    Stored entities are buffered and written to the world store in batches, one
+    transaction per batch. The buffer is flushed when it reaches `batch_size`, before
+    any read, on `flush()`, when the service is used as a context manager and exits,
+    and when the process exits.
+
+    Example:
+        >>> with MemoryService() as memory:
+        ...     for npc in npcs:
+        ...         memory.store_npc("Eberron", npc)
+    """
+
+    def __init__(
+        self,
+        data_dir: Optional[str] = None,
+        store: Optional[WorldStore] = None,
+        batch_size: Optional[int] = None,
+        lore: Optional[LoreTracker] = None,
+    ):
+        """
+        Args:
+            data_dir: Directory holding world data (default: $TTRPG_WORLDS_DIR or data/worlds).
+            store: World store to use (default: $TTRPG_WORLD_DB or <data dir>/worlds.sqlite).
+            batch_size: Number of buffered entities that triggers a flush (default: $TTRPG_MEMORY_BATCH or 50).
+                Use 1 to write every entity immediately.
+            lore: Lore tracker that stored entities are also indexed in, so they can be retrieved by relevance.
+        """
         # Use environment variable or default
         self.data_dir = Path(data_dir or os.getenv("TTRPG_WORLDS_DIR", "data/worlds"))
         self.data_dir.mkdir(parents=True, exist_ok=True)
-    
-    def get_world_context(self, world_name: str) -> Dict[str, Any]:
-        """Get context for a specific world."""
+        self.store = store or WorldStore(os.getenv("TTRPG_WORLD_DB", self.data_dir / "worlds.sqlite"))
+        self.batch_size = max(1, batch_size or int(os.getenv("TTRPG_MEMORY_BATCH", "50")))
+        self.lore = lore
+        self._checked_worlds: set[str] = set()
+        self._summaries: OrderedDict[str, WorldSummary] = OrderedDict()
+        self._summaries_lock = threading.Lock()
+
+        self._pending: dict[tuple[str, str], list] = {}
+        self._pending_count = 0
+        self._pending_lock = threading.Lock()
+        # Don't lose buffered entities if a script forgets to flush
+        atexit.register(self.flush)
+
+    def __enter__(self) -> "MemoryService":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+    def _buffer(self, world_name: str, entity_type: str, entity: Any, source: str = "") -> None:
+        """Adds an entity to the write buffer, flushing once the buffer is full."""
+        self._import_legacy_world(world_name)
+        if self.lore is not None:
+            self.lore.add_entity(world_name, entity_type, entity, source=source)
+        with self._pending_lock:
+            self._pending.setdefault((world_name, entity_type), []).append(entity)
+            self._pending_count += 1
+            full = self._pending_count >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes all buffered entities to the world store in a single transaction.
+
+        Returns:
+            The number of entities written.
+        """
+        with self._pending_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._pending_count = 0
+        try:
+            return self.store.add_batch(batch)
+        except Exception:
+            # Put the batch back so a later flush can retry it
+            with self._pending_lock:
+                for key, entities in batch.items():
+                    self._pending[key] = entities + self._pending.get(key, [])
+                    self._pending_count += len(entities)
+            raise
+
+    def _import_legacy_world(self, world_name: str) -> None:
+        """Imports a world's old JSON file the first time the world is used, if it hasn't been migrated."""
+        if world_name in self._checked_worlds:
+            return
+        self._checked_worlds.add(world_name)
+
         world_file = self.data_dir / f"{world_name}.json"
-        if world_file.exists():
+        if world_file.exists() and not self.store.has_world(world_name):
             with open(world_file, 'r') as f:
-                return json.load(f)
-        return {"description": "A fantasy world", "npcs": [], "locations": []}
-    
+                self.store.import_world(world_name, json.load(f))
+
+    def _prepare_read(self, world_name: str) -> None:
+        """Makes sure a read sees the world's legacy data and everything stored so far."""
+        self._import_legacy_world(world_name)
+        self.flush()
+
+    def get_world_context(self, world_name: str) -> Dict[str, Any]:
+        """Get context for a specific world."""
+        self._prepare_read(world_name)
+        world_data = self.store.get_world(world_name)
+        if world_data is None:
+            return {"description": "A fantasy world", "npcs": [], "locations": []}
+        return {
+            **world_data,
+            "npcs": self.store.get_entities(world_name, "npcs"),
+            "locations": self.store.get_entities(world_name, "locations"),
+        }
+
+    def store_entity(self, world_name: str, entity_type: str, data: Dict[str, Any], source: str = "") -> None:
+        """
+        Store an entity of any type in world memory, e.g. a quest parsed from a structured sheet.
+
+        Args:
+            source: The request that produced it, for the lore index (see lore_tracker.request_source).
+
+        Raises:
+            ValueError: If the entity type has no table in the world store.
+        """
+        if entity_type not in ENTITY_TABLES:
+            raise ValueError(f"Unknown entity type '{entity_type}'. Expected one of: {', '.join(ENTITY_TABLES)}")
+        self._buffer(world_name, entity_type, data, source)
+
+    def find_entities(self, world_name: str, entity_type: str, **filters: Optional[str]) -> list:
+        """Find the entities of a type in a world, optionally by their indexed fields (case-insensitive)."""
+        self._prepare_read(world_name)
+        return self.store.find_entities(world_name, entity_type, **filters)
+
     def store_npc(self, world_name: str, npc_data: Dict[str, Any]) -> None:
         """Store an NPC in world memory."""
-        world_file = self.data_dir / f"{world_name}.json"
-        
-        if world_file.exists():
-            with open(world_file, 'r') as f:
-                world_data = json.load(f)
-        else:
-            world_data = {"description": "A fantasy world", "npcs": [], "locations": []}
-        
-        world_data["npcs"].append(npc_data)
-        
-        with open(world_file, 'w') as f:
-            json.dump(world_data, f, indent=2)
-    
+        self._buffer(world_name, "npcs", npc_data)
+
     def get_world_npcs(self, world_name: str) -> list:
         """Get all NPCs for a world."""
-        world_context = self.get_world_context(world_name)
-        return world_context.get("npcs", [])
+        self._prepare_read(world_name)
+        return self.store.get_entities(world_name, "npcs")
+
+    def find_npcs(
+        self,
+        world_name: str,
+        name: Optional[str] = None,
+        race: Optional[str] = None,
+        location: Optional[str] = None,
+    ) -> list:
+        """Find NPCs in a world by name, race and/or location (case-insensitive)."""
+        self._prepare_read(world_name)
+        return self.store.find_entities(world_name, "npcs", name=name, race=race, location=location)
+
+    def store_location(self, world_name: str, location_data: Dict[str, Any]) -> None:
+        """Store a location in world memory."""
+        self._buffer(world_name, "locations", location_data)
+
+    def get_world_locations(self, world_name: str) -> list:
+        """Get all locations for a world."""
+        self._prepare_read(world_name)
+        return self.store.get_entities(world_name, "locations")
+
+    def get_world_summary(self, world_name: str, max_tokens: int = DEFAULT_SUMMARY_TOKENS, model: Optional[str] = None) -> str:
+        """
+        Get a compact summary of a world (tone, locations, key NPCs) for generator prompts.
+
+        Summaries are kept in an LRU cache and checked against the world's version on each
+        call. When the world has changed, only the entities added since the summary was
+        built are read.
+
+        Args:
+            world_name: The world to summarize.
+            max_tokens: Maximum size of the summary.
+            model: Model name used for token counting.
+
+        Returns:
+            The summary, or an empty string if nothing is stored for the world.
+        """
+        self._prepare_read(world_name)
+        version = self.store.get_world_version(world_name)
+
+        with self._summaries_lock:
+            summary = self._summaries.get(world_name)
+            if summary is None:
+                summary = WorldSummary(world_name)
+                self._summaries[world_name] = summary
+                if len(self._summaries) > SUMMARY_CACHE_SIZE:
+                    self._summaries.popitem(last=False)
+            else:
+                self._summaries.move_to_end(world_name)
+
+            if version is not None and version != summary.version:
+                entities = {
+                    entity_type: (
+                        self.store.count_entities(world_name, entity_type, summary.last_ids[entity_type]),
+                        self.store.get_recent_entities(world_name, entity_type, summary.last_ids[entity_type], MAX_RECENT_ENTITIES),
+                    )
+                    for entity_type in ENTITY_TABLES
+                }
+                summary.update(self.store.get_world(world_name) or {}, version, entities)
+
+            return summary.render(max_tokens, model)
+
+
+# Shared instance, created on first use so importing this module doesn't touch the disk
+_memory_service: Optional[MemoryService] = None
+_memory_service_lock = threading.Lock()
+
+
+def get_memory_service() -> MemoryService:
+    """Returns the shared MemoryService, creating it on first use."""
+    global _memory_service
+    with _memory_service_lock:
+        if _memory_service is None:
+            _memory_service = MemoryService(lore=get_lore_tracker())
+        return _memory_service
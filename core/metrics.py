@@ -0,0 +1,371 @@
+"""
+Metrics for TTRPG Sidekick
+
+Structured per-call metrics for LLM requests: which generator made the call, how long
+it took (time to first token, time in the model, total time including prompt building
+and cleanup), how many tokens went in and out, and whether it was a cache hit or shared the result
+of an identical call in progress (coalesced).
+
+Every call is sent to the registered sinks:
+- an in-memory summary, always on (the /stats chat command)
+- a JSONL file, when TTRPG_METRICS_FILE is set
+- a Prometheus text endpoint, when TTRPG_METRICS_PORT is set
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Upper bounds of the Prometheus latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Number of recent calls per generator and template kept for the in-memory percentiles
+SUMMARY_WINDOW = 1000
+
+
+@dataclass
+class CallMetrics:
+    """Measurements of one LLM call."""
+    generator: str = "chat"
+    model: str = ""
+    provider: str = ""
+    endpoint: str = ""  # Name of the provider pool endpoint that answered
+    brief: Optional[bool] = None
+    streamed: bool = False
+    cache_hit: bool = False
+    coalesced: bool = False  # Shared the result of an identical call in progress, not the model's
+    error: Optional[str] = None
+    retries: int = 0
+    hedged: bool = False  # A second, identical request was sent because the first was slow
+    ttft_seconds: Optional[float] = None  # Until the first token (the whole response unstreamed)
+    model_seconds: float = 0.0  # Waiting on the model, from request to last token
+    total_seconds: float = 0.0  # Including prompt building and cleanup
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    stages: dict[str, float] = field(default_factory=dict)  # Seconds in named steps, e.g. "context"
+    timestamp: float = field(default_factory=time.time)
+
+    @property
+    def template(self) -> str:
+        """"brief" or "full" for generator calls, "" for calls without a template."""
+        if self.brief is None:
+            return ""
+        return "brief" if self.brief else "full"
+
+    @property
+    def served_by_model(self) -> bool:
+        """Whether the model answered, rather than the response cache or another call."""
+        return not (self.cache_hit or self.coalesced)
+
+    @property
+    def label(self) -> str:
+        """The generator and template the call is summarized under, e.g. "npc/brief"."""
+        return f"{self.generator}/{self.template}" if self.template else self.generator
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Completion tokens per second of model time."""
+        return self.completion_tokens / self.model_seconds if self.model_seconds else 0.0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Times a step of the call, e.g. `with call.stage("clean"): ...`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def as_dict(self) -> dict:
+        """The metrics as a JSON-serializable dict."""
+        return {**asdict(self), "tokens_per_second": round(self.tokens_per_second, 2)}
+
+
+class JsonlSink:
+    """Appends one JSON line per call to a file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def emit(self, call: CallMetrics) -> None:
+        line = json.dumps(call.as_dict())
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class InMemorySink:
+    """Keeps recent calls per generator and template and summarizes them."""
+
+    def __init__(self, window: int = SUMMARY_WINDOW):
+        self._calls: dict[str, deque[CallMetrics]] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def emit(self, call: CallMetrics) -> None:
+        with self._lock:
+            self._calls[call.label].append(call)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._calls.clear()
+
+    def percentile(self, label: str, fraction: float, min_samples: int = 20) -> Optional[float]:
+        """
+        The given percentile (e.g. 0.95) of model time over recent successful, uncached calls
+        with a label, or None if there are fewer than `min_samples` of them.
+        """
+        with self._lock:
+            samples = sorted(
+                call.model_seconds
+                for call in self._calls.get(label, ())
+                if call.served_by_model and call.error is None
+            )
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Per generator and template: call count, errors, cache hits, coalesced calls, latency
+        percentiles, token averages and stage times.
+        """
+        with self._lock:
+            calls_by_label = {label: list(calls) for label, calls in self._calls.items()}
+
+        summary = {}
+        for label, calls in sorted(calls_by_label.items()):
+            latencies = sorted(call.total_seconds for call in calls)
+            ttfts = [
+                call.ttft_seconds
+                for call in calls
+                if call.ttft_seconds is not None and call.served_by_model
+            ]
+            model_calls = [call for call in calls if call.served_by_model and call.error is None]
+            completion_tokens = sum(call.completion_tokens for call in model_calls)
+            model_seconds = sum(call.model_seconds for call in model_calls)
+            stages: dict[str, float] = defaultdict(float)
+            for call in calls:
+                for stage, seconds in call.stages.items():
+                    stages[stage] += seconds
+            summary[label] = {
+                "calls": len(calls),
+                "errors": sum(call.error is not None for call in calls),
+                "retries": sum(call.retries for call in calls),
+                "hedged": sum(call.hedged for call in calls),
+                "cache_hits": sum(call.cache_hit for call in calls),
+                "coalesced": sum(call.coalesced for call in calls),
+                "p50_seconds": latencies[len(latencies) // 2],
+                "p95_seconds": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                "mean_ttft_seconds": sum(ttfts) / len(ttfts) if ttfts else None,
+                "mean_prompt_tokens": (
+                    sum(call.prompt_tokens for call in model_calls) / len(model_calls)
+                    if model_calls
+                    else 0
+                ),
+                "mean_completion_tokens": (
+                    completion_tokens / len(model_calls) if model_calls else 0
+                ),
+                "tokens_per_second": completion_tokens / model_seconds if model_seconds else 0.0,
+                "mean_stage_seconds": {
+                    stage: seconds / len(calls) for stage, seconds in stages.items()
+                },
+            }
+        return summary
+
+    def format_summary(self) -> str:
+        """The summary as a table for the terminal."""
+        summary = self.summary()
+        if not summary:
+            return "No calls recorded yet."
+        lines = [
+            f"{'Generator':<20}{'Calls':>6}{'Err':>5}{'Hits':>6}{'Shared':>8}"
+            f"{'p50':>8}{'p95':>8}{'TTFT':>8}{'In':>7}{'Out':>6}{'Tok/s':>7}"
+        ]
+        for label, stats in summary.items():
+            ttft = (
+                f"{stats['mean_ttft_seconds']:.2f}s"
+                if stats["mean_ttft_seconds"] is not None
+                else "-"
+            )
+            lines.append(
+                f"{label:<20}{stats['calls']:>6}{stats['errors']:>5}"
+                f"{stats['cache_hits']:>6}{stats['coalesced']:>8}"
+                f"{stats['p50_seconds']:>7.2f}s{stats['p95_seconds']:>7.2f}s{ttft:>8}"
+                f"{stats['mean_prompt_tokens']:>7.0f}{stats['mean_completion_tokens']:>6.0f}"
+                f"{stats['tokens_per_second']:>7.1f}"
+            )
+            if stats["mean_stage_seconds"]:
+                stages = ", ".join(
+                    f"{stage} {seconds * 1000:.1f}ms"
+                    for stage, seconds in stats["mean_stage_seconds"].items()
+                )
+                lines.append(f"{'':<20}stages: {stages}")
+        return "\n".join(lines)
+
+
+class PrometheusSink:
+    """
+    Aggregates calls into Prometheus counters and histograms, rendered in the text
+    exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, int] = defaultdict(int)
+        self._tokens: dict[tuple, int] = defaultdict(int)
+        self._histograms: dict[tuple, list] = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._server: Optional["ThreadingHTTPServer"] = None
+
+    @staticmethod
+    def _labels(**labels) -> tuple:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def _observe(self, name: str, labels: tuple, value: float) -> None:
+        histogram = self._histograms.setdefault(
+            (name, labels), [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+        )
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def emit(self, call: CallMetrics) -> None:
+        base = {
+            "generator": call.generator,
+            "template": call.template,
+            "model": call.model,
+            "provider": call.provider,
+            "endpoint": call.endpoint,
+        }
+        with self._lock:
+            self._calls[
+                self._labels(
+                    **base,
+                    cache_hit=str(call.cache_hit).lower(),
+                    coalesced=str(call.coalesced).lower(),
+                    error=call.error or "",
+                )
+            ] += 1
+            for kind in ("prompt", "completion", "cached"):
+                self._tokens[self._labels(**base, type=kind)] += getattr(call, f"{kind}_tokens")
+            self._observe("ttrpg_llm_latency_seconds", self._labels(**base), call.total_seconds)
+            if call.ttft_seconds is not None and call.served_by_model:
+                self._observe("ttrpg_llm_ttft_seconds", self._labels(**base), call.ttft_seconds)
+            for stage, seconds in call.stages.items():
+                self._observe(
+                    "ttrpg_stage_seconds",
+                    self._labels(generator=call.generator, template=call.template, stage=stage),
+                    seconds,
+                )
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: str = "") -> str:
+        parts = [f'{key}="{value}"' for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """The current metrics in the Prometheus text format."""
+        lines = ["# TYPE ttrpg_llm_calls_total counter"]
+        with self._lock:
+            for labels, count in sorted(self._calls.items()):
+                lines.append(f"ttrpg_llm_calls_total{self._format_labels(labels)} {count}")
+            lines.append("# TYPE ttrpg_llm_tokens_total counter")
+            for labels, count in sorted(self._tokens.items()):
+                lines.append(f"ttrpg_llm_tokens_total{self._format_labels(labels)} {count}")
+            current = None
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name != current:
+                    lines.append(f"# TYPE {name} histogram")
+                    current = name
+                for bound, count in zip(
+                    LATENCY_BUCKETS + ("+Inf",), histogram[:-2] + [histogram[-1]]
+                ):
+                    bucket_labels = self._format_labels(labels, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram[-2]}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+        """Serves the metrics at http://host:port/metrics from a background thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.render().encode("utf-8")
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+
+class Metrics:
+    """Sends call metrics to every registered sink."""
+
+    def __init__(self):
+        self.memory = InMemorySink()
+        self.sinks: list = [self.memory]
+        if os.getenv("TTRPG_METRICS_FILE"):
+            self.add_sink(JsonlSink(os.getenv("TTRPG_METRICS_FILE")))
+        if os.getenv("TTRPG_METRICS_PORT"):
+            prometheus = PrometheusSink()
+            prometheus.serve(int(os.getenv("TTRPG_METRICS_PORT")))
+            self.add_sink(prometheus)
+
+    def add_sink(self, sink) -> None:
+        """Registers a sink: any object with an `emit(call: CallMetrics)` method."""
+        self.sinks.append(sink)
+
+    def emit(self, call: CallMetrics) -> None:
+        for sink in self.sinks:
+            sink.emit(call)
+
+    @contextmanager
+    def track(self, call: Optional[CallMetrics] = None, **fields) -> Iterator[CallMetrics]:
+        """
+        Measures a call from start to finish and emits it, also when it fails.
+
+        Example:
+            >>> with metrics.track(generator="npc", brief=True) as call:
+            ...     with call.stage("context"):
+            ...         messages = agent.build_messages(spec)
+        """
+        call = call or CallMetrics(**fields)
+        start = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            call.error = type(e).__name__
+            raise
+        finally:
+            call.total_seconds = time.perf_counter() - start
+            self.emit(call)
+
+
+# Create a single, shared instance
+metrics = Metrics()
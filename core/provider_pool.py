@@ -0,0 +1,423 @@
+"""
+Provider pool for TTRPG Sidekick
+
+Spreads completions over several model endpoints, e.g. a few Ollama machines with
+OpenAI as overflow. Each endpoint has a model, a weight and a maximum number of
+requests in flight, and keeps its own client (and so its own keep-alive connection
+pool) for the life of the process.
+
+Requests go to the primary endpoint with the fewest outstanding requests relative to
+its weight. Spillover endpoints are only used when every primary endpoint is full or
+failing. Endpoints whose circuit breaker is open, or that fail their periodic health
+check, are skipped.
+
+Without a pool file the pool holds the single endpoint configured by API_PROVIDER,
+OLLAMA_BASE_URL, OLLAMA_MODEL and OPENAI_MODEL. A pool file (TTRPG_PROVIDER_POOL)
+looks like:
+
+    {
+        "health_interval": 30,
+        "endpoints": [
+            {"name": "ollama-a", "provider": "ollama", "base_url": "http://10.0.0.5:11434/v1", "model": "llama3", "weight": 2, "max_concurrency": 4},
+            {"name": "ollama-b", "provider": "ollama", "base_url": "http://10.0.0.6:11434/v1", "model": "llama3"},
+            {"name": "openai", "provider": "openai", "model": "gpt-4o", "max_concurrency": 16, "spillover": true}
+        ]
+    }
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Optional
+
+from core.transport import CircuitBreaker, CircuitOpenError, DeadlineExceededError, get_breaker, is_retryable
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+    from core.cassette import Cassette
+
+# Default base URLs of the providers
+DEFAULT_BASE_URLS = {
+    "ollama": "http://localhost:11434/v1",
+    "openai": "https://api.openai.com/v1",
+}
+
+# Seconds a request waiting for a free slot sleeps at most before checking again, for
+# breakers that let a trial request through once their reset timeout has passed
+SLOT_RECHECK_INTERVAL = 1.0
+
+# Seconds a health check waits for an endpoint to answer
+HEALTH_CHECK_TIMEOUT = 2.0
+
+
+@dataclass
+class Endpoint:
+    """A model server the pool can send requests to, with its load and health."""
+    name: str
+    provider: str = "ollama"  # "ollama" or "openai"
+    model: str = "llama3"
+    base_url: Optional[str] = None  # Defaults to the provider's usual URL
+    api_key: Optional[str] = None  # Defaults to OPENAI_API_KEY for OpenAI; Ollama needs none
+    weight: float = 1.0  # Relative share of requests
+    max_concurrency: Optional[int] = 4  # Requests in flight at once; None for no limit
+    spillover: bool = False  # Only used when every primary endpoint is full or failing
+    keep_alive: Optional[str] = None  # How long Ollama keeps the model loaded after a request; defaults to TTRPG_OLLAMA_KEEP_ALIVE
+
+    outstanding: int = field(default=0, init=False)
+    healthy: bool = field(default=True, init=False)
+    cassette: Optional["Cassette"] = field(default=None, init=False, repr=False)
+    _client: Any = field(default=None, init=False, repr=False)
+    _async_client: Any = field(default=None, init=False, repr=False)
+    _async_client_loop: Any = field(default=None, init=False, repr=False)
+    _client_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        self.provider = self.provider.lower()
+        if self.base_url is None:
+            self.base_url = DEFAULT_BASE_URLS.get(self.provider, DEFAULT_BASE_URLS["openai"])
+        if self.api_key is None:
+            self.api_key = "ollama" if self.provider == "ollama" else os.getenv("OPENAI_API_KEY")
+        if self.keep_alive is None:
+            self.keep_alive = os.getenv("TTRPG_OLLAMA_KEEP_ALIVE", "30m")
+
+    def request_options(self) -> dict:
+        """Provider-specific arguments for chat completion requests to this endpoint."""
+        if self.provider == "ollama":
+            # Ollama servers that don't take it here are covered by core.keep_alive's pinger
+            return {"extra_body": {"keep_alive": self.keep_alive}}
+        return {}
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.max_concurrency is None or self.outstanding < self.max_concurrency
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return get_breaker(self.name)
+
+    @property
+    def replaying(self) -> bool:
+        return self.cassette is not None and self.cassette.mode == "replay"
+
+    def _client_kwargs(self, asynchronous: bool) -> dict:
+        # Retries are left to the transport, which knows the deadline
+        kwargs = {"base_url": self.base_url, "api_key": self.api_key, "max_retries": 0}
+        if self.max_concurrency is None:
+            return kwargs
+        try:
+            import httpx
+            from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+        except ImportError:
+            return kwargs
+        # Keep a connection open for every request the endpoint may have in flight, hedges included
+        limits = httpx.Limits(max_connections=self.max_concurrency * 2, max_keepalive_connections=self.max_concurrency * 2)
+        kwargs["http_client"] = (DefaultAsyncHttpxClient if asynchronous else DefaultHttpxClient)(limits=limits)
+        return kwargs
+
+    @property
+    def client(self) -> "OpenAI":
+        """The endpoint's OpenAI client, created on first use and shared by all threads."""
+        if self._client is not None:
+            return self._client
+        with self._client_lock:
+            if self._client is not None:
+                return self._client
+            if self.replaying:
+                from core.cassette import CassetteClient
+
+                self._client = CassetteClient(self.cassette)
+                return self._client
+
+            from openai import OpenAI
+
+            print(f"🔧 Initializing {'Ollama' if self.provider == 'ollama' else 'OpenAI'} LLM Client ({self.name})...")
+            client = OpenAI(**self._client_kwargs(asynchronous=False))
+            if self.cassette is not None:
+                from core.cassette import CassetteClient
+
+                client = CassetteClient(self.cassette, client)
+            self._client = client
+        return self._client
+
+    @client.setter
+    def client(self, client: "OpenAI") -> None:
+        self._client = client
+
+    @property
+    def async_client(self) -> "AsyncOpenAI":
+        """
+        The endpoint's asyncio client. Its connection pool is tied to the event loop it was
+        created in, so a new client is made when called from a different loop.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            if self.replaying:
+                from core.cassette import AsyncCassetteClient
+
+                self._async_client = AsyncCassetteClient(self.cassette)
+            else:
+                from openai import AsyncOpenAI
+
+                self._async_client = AsyncOpenAI(**self._client_kwargs(asynchronous=True))
+                if self.cassette is not None:
+                    from core.cassette import AsyncCassetteClient
+
+                    self._async_client = AsyncCassetteClient(self.cassette, self._async_client)
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aclose(self) -> None:
+        """Closes the async client's connections."""
+        client, self._async_client, self._async_client_loop = self._async_client, None, None
+        close = getattr(client, "close", None)
+        if close is not None:
+            await close()
+
+    def set_cassette(self, cassette: Optional["Cassette"]) -> None:
+        """Records to or replays from a cassette; the clients are rebuilt on next use."""
+        self.cassette = cassette
+        self._client = None
+        self._async_client = None
+        self._async_client_loop = None
+
+    def check_health(self) -> bool:
+        """Asks the endpoint for its model list; any answer but a server error counts as healthy."""
+        import urllib.error
+        import urllib.request
+
+        request = urllib.request.Request(f"{self.base_url.rstrip('/')}/models")
+        if self.api_key:
+            request.add_header("Authorization", f"Bearer {self.api_key}")
+        try:
+            with urllib.request.urlopen(request, timeout=HEALTH_CHECK_TIMEOUT):
+                return True
+        except urllib.error.HTTPError as e:
+            return e.code < 500
+        except (OSError, ValueError):
+            return False
+
+
+class ProviderPool:
+    """Picks an endpoint for each request and keeps track of what is in flight."""
+
+    def __init__(self, endpoints: list[Endpoint], health_interval: float = 30.0):
+        """
+        Args:
+            endpoints: The endpoints, primary ones first; the first one is used when
+                replaying a cassette and for the model name of cache keys.
+            health_interval: Seconds between health checks; 0 turns them off. They only run
+                when there is more than one endpoint to choose from.
+        """
+        if not endpoints:
+            raise ValueError("A provider pool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.health_interval = health_interval
+        self._condition = threading.Condition()
+        # Event loops and events of the async requests waiting for a slot, oldest first
+        self._async_waiters: list[tuple[Any, Any]] = []
+        self._health_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "ProviderPool":
+        """The pool in TTRPG_PROVIDER_POOL, or the single endpoint configured by API_PROVIDER."""
+        if os.getenv("TTRPG_PROVIDER_POOL"):
+            return cls.from_file(os.getenv("TTRPG_PROVIDER_POOL"))
+        provider = os.getenv("API_PROVIDER", "openai").lower()
+        if provider == "ollama":
+            endpoint = Endpoint("ollama", "ollama", os.getenv("OLLAMA_MODEL", "llama3"), os.getenv("OLLAMA_BASE_URL"))
+        else:
+            endpoint = Endpoint("openai", "openai", os.getenv("OPENAI_MODEL", "gpt-4o"))
+        # A single endpoint takes as many requests as it's given, like a plain client
+        endpoint.max_concurrency = None
+        return cls([endpoint])
+
+    @classmethod
+    def from_file(cls, path: str) -> "ProviderPool":
+        """Loads a pool from a JSON file; see the module docstring for the format."""
+        with open(path, "r") as f:
+            config = json.load(f)
+        endpoints = [Endpoint(**endpoint) for endpoint in config["endpoints"]]
+        return cls(endpoints, health_interval=float(config.get("health_interval", 30.0)))
+
+    @property
+    def primary(self) -> Endpoint:
+        return self.endpoints[0]
+
+    @property
+    def capacity(self) -> Optional[int]:
+        """Requests the endpoints take at once, spillover ones included; None if any of them has no limit."""
+        if any(endpoint.max_concurrency is None for endpoint in self.endpoints):
+            return None
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+
+    def set_cassette(self, cassette: Optional["Cassette"]) -> None:
+        """Records to or replays from a cassette on every endpoint."""
+        for endpoint in self.endpoints:
+            endpoint.set_cassette(cassette)
+
+    def _pick(self) -> Optional[Endpoint]:
+        """The least loaded endpoint with a free slot, primary ones first; call with the lock held."""
+        if self.primary.replaying:
+            # Answer from the recording of the first endpoint, so requests match it
+            return self.primary
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy] or self.endpoints
+        for spillover in (False, True):
+            candidates = sorted(
+                (endpoint for endpoint in healthy
+                 if endpoint.spillover == spillover
+                 and endpoint.has_capacity
+                 and endpoint.breaker.state != "open"),
+                key=lambda endpoint: (endpoint.outstanding + 1) / endpoint.weight,
+            )
+            for endpoint in candidates:
+                # A half-open breaker lets a single trial request through
+                if endpoint.breaker.allow():
+                    return endpoint
+        return None
+
+    def try_acquire(self) -> Optional[Endpoint]:
+        """
+        Reserves a slot on the best endpoint.
+
+        Returns:
+            The endpoint, or None if all of them are full. Pass it to release() when done.
+
+        Raises:
+            CircuitOpenError: If every endpoint's circuit breaker is open.
+        """
+        self._start_health_checks()
+        with self._condition:
+            endpoint = self._pick()
+            if endpoint is not None:
+                endpoint.outstanding += 1
+                return endpoint
+            if all(endpoint.breaker.state == "open" for endpoint in self.endpoints):
+                raise CircuitOpenError("Every model endpoint is failing; not sending requests for now")
+            return None
+
+    def acquire(self, timeout: Optional[float] = None) -> Endpoint:
+        """
+        Reserves a slot on the best endpoint, waiting for one to free up if all are full.
+
+        Raises:
+            DeadlineExceededError: If no slot frees up within `timeout` seconds.
+            CircuitOpenError: If every endpoint's circuit breaker is open.
+        """
+        deadline_at = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            endpoint = self.try_acquire()
+            if endpoint is not None:
+                return endpoint
+            with self._condition:
+                remaining = deadline_at - time.monotonic() if deadline_at is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceededError("No model endpoint had a free slot before the deadline")
+                # Woken by release(); the timeout also catches breakers reopening for a trial
+                self._condition.wait(min(remaining, SLOT_RECHECK_INTERVAL) if remaining is not None else SLOT_RECHECK_INTERVAL)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> Endpoint:
+        """Async version of acquire, waiting for a free slot without blocking the event loop."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        deadline_at = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            waiter = (loop, asyncio.Event())
+            # Waiting before trying, so a slot freed in between still wakes the request
+            with self._condition:
+                self._async_waiters.append(waiter)
+            try:
+                endpoint = self.try_acquire()
+                if endpoint is not None:
+                    return endpoint
+                remaining = deadline_at - time.monotonic() if deadline_at is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceededError("No model endpoint had a free slot before the deadline")
+                try:
+                    # Woken by release(); the timeout also catches breakers reopening for a trial
+                    await asyncio.wait_for(waiter[1].wait(), min(remaining, SLOT_RECHECK_INTERVAL) if remaining is not None else SLOT_RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            except BaseException:
+                with self._condition:
+                    if waiter not in self._async_waiters:
+                        # Woken for a free slot it won't take, so another request gets it
+                        self._wake_async()
+                raise
+            finally:
+                with self._condition:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def _wake_async(self, count: Optional[int] = 1) -> None:
+        """Wakes the oldest async requests waiting for a slot, or all of them for None; call with the lock held."""
+        woken = self._async_waiters[:count] if count is not None else list(self._async_waiters)
+        del self._async_waiters[:len(woken)]
+        for loop, event in woken:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Its event loop has closed, so nothing waits on it any more
+                pass
+
+    def release(self, endpoint: Endpoint, error: Optional[Exception] = None, outcome: bool = True) -> None:
+        """
+        Frees a slot taken by acquire, and tells the endpoint's breaker how the request went.
+        With outcome=False the request ended without an answer either way (e.g. it was
+        cancelled), so the breaker only learns that it may let another trial through.
+        """
+        if not outcome:
+            endpoint.breaker.record_abandoned()
+        elif error is None or not is_retryable(error):
+            endpoint.breaker.record_success()
+        else:
+            endpoint.breaker.record_failure()
+        with self._condition:
+            endpoint.outstanding -= 1
+            self._condition.notify()
+            self._wake_async()
+
+    def check_health(self) -> None:
+        """Checks every endpoint once."""
+        for endpoint in self.endpoints:
+            endpoint.healthy = endpoint.check_health()
+        with self._condition:
+            self._condition.notify_all()
+            self._wake_async(None)
+
+    def _start_health_checks(self) -> None:
+        if self._health_thread is not None or len(self.endpoints) < 2 or self.health_interval <= 0:
+            return
+        with self._condition:
+            if self._health_thread is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.health_interval)
+                    self.check_health()
+
+            self._health_thread = threading.Thread(target=run, name="provider-health", daemon=True)
+            self._health_thread.start()
+
+    async def aclose(self) -> None:
+        """Closes the async clients of every endpoint."""
+        for endpoint in self.endpoints:
+            await endpoint.aclose()
+
+    def describe(self) -> list[str]:
+        """One line per endpoint with its load and health, for the terminal."""
+        lines = []
+        for endpoint in self.endpoints:
+            status = "healthy" if endpoint.healthy else "unhealthy"
+            role = "spillover" if endpoint.spillover else "primary"
+            limit = endpoint.max_concurrency if endpoint.max_concurrency is not None else "-"
+            lines.append(
+                f"{endpoint.name:<16}{endpoint.model:<20}{role:<10}{endpoint.outstanding:>4}/{limit:<4}"
+                f"{status} (breaker {endpoint.breaker.state})"
+            )
+        return lines
@@ -0,0 +1,125 @@
+"""
+Response Cache for TTRPG Sidekick
+
+Persistent, content-addressed cache of LLM responses stored in SQLite.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+# Cache modes: "use" reads and writes, "refresh" only writes, "off" bypasses the cache
+CACHE_MODES = ("use", "refresh", "off")
+
+
+class ResponseCache:
+    """SQLite-backed response cache with TTL expiry and least-recently-used eviction."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_entries: int = 5000,
+        max_bytes: int = 50 * 1024 * 1024,
+    ):
+        """
+        Args:
+            path: SQLite file to use (default: $TTRPG_CACHE_FILE or <data dir>/cache/responses.sqlite).
+            ttl_seconds: How long an entry stays valid after it was written.
+            max_entries: Maximum number of entries kept before evicting the least recently used.
+            max_bytes: Maximum total size of the cached responses.
+        """
+        default_path = Path(os.getenv("TTRPG_DATA_DIR", "data")) / "cache" / "responses.sqlite"
+        self.path = Path(path or os.getenv("TTRPG_CACHE_FILE", default_path))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(**parts: Any) -> str:
+        """Builds a stable key by hashing the JSON encoding of all request parts."""
+        encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """Stores a response and evicts old entries if the cache is over its limits."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Removes every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drops expired entries, then the least recently used ones until under the size caps."""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count > self.max_entries:
+            self._delete_oldest(count - self.max_entries)
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+
+        while total_bytes > self.max_bytes and count > 0:
+            # Remove a tenth of the entries at a time rather than one row per query
+            self._delete_oldest(max(1, count // 10))
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+
+    def _delete_oldest(self, n: int) -> None:
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+            (n,),
+        )
@@ -0,0 +1,149 @@
+"""
+Fair scheduling for TTRPG Sidekick
+
+Runs jobs from many groups (e.g. Discord servers) on a fixed number of workers. Every
+group has its own bounded queue, and the workers take turns between the groups with
+waiting jobs, one job each, so a busy group gets the workers to itself only while
+nobody else is waiting: one server's burst of requests can't starve the others.
+
+A job that doesn't fit its group's queue is rejected at once with
+core.admission.OverloadedError, which carries a suggested retry delay.
+
+A FairScheduler is used from a single event loop.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+from core.admission import DURATION_SMOOTHING, OverloadedError
+
+T = TypeVar("T")
+
+
+class FairScheduler:
+    """Round-robin scheduling of jobs over groups, with a bounded queue per group."""
+
+    def __init__(self, workers: int = 8, queue_limit: int = 5):
+        """
+        Args:
+            workers: Jobs run at once, across all groups.
+            queue_limit: Jobs of one group that may wait to run.
+        """
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.running = 0
+        self.rejected = 0
+        self._queues: dict[Hashable, deque] = {}
+        self._turns: deque = deque()  # Groups with waiting jobs, in the order they are served
+        self._waiting: Optional[asyncio.Semaphore] = None  # Counts the waiting jobs
+        self._tasks: list[asyncio.Task] = []
+        self._average_duration = 1.0
+
+    def start(self) -> None:
+        """Starts the workers; call from the event loop the jobs will run on."""
+        if self._tasks:
+            return
+        self._waiting = asyncio.Semaphore(0)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stops the workers; jobs still waiting are cancelled."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for queue in self._queues.values():
+            for _, future in queue:
+                future.cancel()
+        self._queues.clear()
+        self._turns.clear()
+
+    def waiting(self, group: Hashable) -> int:
+        """Jobs of the group waiting to run."""
+        queue = self._queues.get(group)
+        return len(queue) if queue else 0
+
+    def retry_after(self, group: Hashable) -> float:
+        """Seconds until a rejected job of the group is likely to fit in its queue again."""
+        # The group gets one job started per round, and a round serves every waiting group once
+        rounds = self.waiting(group) + 1
+        groups = max(1, len(self._queues))
+        return max(1.0, math.ceil(self._average_duration * rounds * groups / self.workers))
+
+    def submit(self, group: Hashable, job: Callable[[], Awaitable[T]]) -> "asyncio.Future[T]":
+        """
+        Queues a job for the group.
+
+        Returns:
+            A future for the job's result. Cancelling it before the job starts drops the job.
+
+        Raises:
+            OverloadedError: If the group's queue is full.
+        """
+        if not self._tasks:
+            raise RuntimeError("The scheduler hasn't been started")
+        queue = self._queues.setdefault(group, deque())
+        if len(queue) >= self.queue_limit:
+            self.rejected += 1
+            raise OverloadedError(f"Too many requests waiting for this server (limit {self.queue_limit})", self.retry_after(group))
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((job, future))
+        if len(queue) == 1:
+            self._turns.append(group)
+        self._waiting.release()
+        return future
+
+    async def run(self, group: Hashable, job: Callable[[], Awaitable[T]]) -> T:
+        """Queues a job for the group and waits for its result."""
+        return await self.submit(group, job)
+
+    def _next(self) -> tuple[Callable[[], Awaitable], asyncio.Future]:
+        """Takes the next job, from the group whose turn it is; the group goes to the back of the line."""
+        group = self._turns.popleft()
+        queue = self._queues[group]
+        job, future = queue.popleft()
+        if queue:
+            self._turns.append(group)
+        else:
+            del self._queues[group]
+        return job, future
+
+    async def _work(self) -> None:
+        while True:
+            await self._waiting.acquire()
+            job, future = self._next()
+            if future.done():
+                # Cancelled while waiting
+                continue
+            self.running += 1
+            started = time.monotonic()
+            try:
+                result = await job()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+                duration = time.monotonic() - started
+                self._average_duration += DURATION_SMOOTHING * (duration - self._average_duration)
+
+    def stats(self) -> dict:
+        """Current load, e.g. for logging."""
+        return {
+            "running": self.running,
+            "waiting": sum(len(queue) for queue in self._queues.values()),
+            "groups": len(self._queues),
+            "rejected": self.rejected,
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+        }
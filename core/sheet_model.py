@@ -0,0 +1,245 @@
+"""
+Structured sheets for TTRPG Sidekick
+
+In structured mode the model answers with a JSON object holding the values of a sheet's
+fields instead of writing out the whole template, so it doesn't spend output tokens on
+headings, emoji and bullets, and there is no filler to clean up. The JSON is constrained
+by a schema sent as the request's response_format, parsed into a Pydantic model and
+rendered into the template's text layout locally.
+
+Sheet models are built from the template files, so the text and structured modes always
+ask for the same fields:
+
+    >>> NPCSheet = sheet_model("NPCSheet", NPC_TEMPLATE_FULL)
+    >>> sheet = NPCSheet.parse(response_text)
+    >>> print(sheet.render())
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import ClassVar, Optional
+from pydantic import BaseModel, ConfigDict, Field, create_model
+
+# Line between two sections of a template
+SECTION_SEPARATOR = "⸻"
+
+BULLET = "•"
+
+
+@dataclass
+class TemplateField:
+    """A field of a template, e.g. "• Race / Species:"."""
+    name: str  # JSON key, e.g. "race_species"
+    label: str  # As written in the template, e.g. "Race / Species"
+    hint: str = ""  # Guidance after the label, e.g. "(Common, Uncommon, Rare)"
+    separator: str = ": "  # Between label and value; "If cornered…" has no colon
+
+
+@dataclass
+class TemplateSection:
+    """A numbered section of a template and its fields."""
+    heading: str
+    fields: list[TemplateField] = field(default_factory=list)
+
+
+@dataclass
+class TemplateLayout:
+    """The title and sections of a template."""
+    title: str
+    sections: list[TemplateSection]
+
+    @property
+    def fields(self) -> list[TemplateField]:
+        return [template_field for section in self.sections for template_field in section.fields]
+
+
+def field_name(label: str) -> str:
+    """JSON key for a template label: snake case, without parenthesized remarks."""
+    label = re.sub(r"\([^)]*\)", "", label).replace("'", "")
+    return re.sub(r"[^a-z0-9]+", "_", label.lower()).strip("_") or "field"
+
+
+def parse_template(template: str) -> TemplateLayout:
+    """Splits a template into its title, section headings and bullet fields."""
+    title = ""
+    sections: list[TemplateSection] = []
+    names: set[str] = set()
+    for line in template.splitlines():
+        text = line.strip()
+        if not text or text == SECTION_SEPARATOR:
+            continue
+        if text.startswith(BULLET):
+            text = text.lstrip(BULLET).strip()
+            label, colon, hint = text.partition(":")
+            if not colon:
+                label, hint = text, ""
+            name = field_name(label)
+            # Keys must be unique within a sheet
+            unique, number = name, 2
+            while unique in names:
+                unique, number = f"{name}_{number}", number + 1
+            names.add(unique)
+            if not sections:
+                sections.append(TemplateSection(""))
+            sections[-1].fields.append(TemplateField(unique, label.strip(), hint.strip(), ": " if colon else " "))
+        elif not title:
+            title = text
+        else:
+            sections.append(TemplateSection(text))
+    return TemplateLayout(title, sections)
+
+
+def split_template(template: str) -> tuple[str, list[str]]:
+    """Splits a template into its title and the text of each section as written, heading first."""
+    lines = template.strip().splitlines()
+    blocks: list[list[str]] = [[]]
+    for line in lines[1:]:
+        if line.strip() == SECTION_SEPARATOR:
+            blocks.append([])
+        else:
+            blocks[-1].append(line)
+    sections = ["\n".join(block).strip("\n") for block in blocks]
+    return lines[0].strip() if lines else "", [section for section in sections if section.strip()]
+
+
+def render_layout(layout: TemplateLayout, values: dict[str, str]) -> str:
+    """A sheet in the layout of a template, with the given field values; missing ones are left empty."""
+    blocks = []
+    for section in layout.sections:
+        lines = [section.heading] if section.heading else []
+        for template_field in section.fields:
+            value = values.get(template_field.name, "").strip()
+            lines.append(f"  {BULLET} {template_field.label}{template_field.separator}{value}".rstrip())
+        blocks.append("\n".join(lines))
+    return f"{layout.title}\n\n" + f"\n{SECTION_SEPARATOR}\n".join(blocks)
+
+
+def blank_template(layout: TemplateLayout) -> str:
+    """A layout written out as a template to fill in, with each field's hint."""
+    return render_layout(layout, {template_field.name: template_field.hint for template_field in layout.fields})
+
+
+def subset_layout(layout: TemplateLayout, names: set[str]) -> TemplateLayout:
+    """The layout with only the named fields, and only the sections that still have fields."""
+    sections = [
+        TemplateSection(section.heading, [template_field for template_field in section.fields if template_field.name in names])
+        for section in layout.sections
+    ]
+    return TemplateLayout(layout.title, [section for section in sections if section.fields])
+
+
+def _heading_key(heading: str) -> str:
+    """A heading as models tend to repeat it: without emoji, markdown and parenthesized remarks."""
+    return re.sub(r"\s*\(.*", "", re.sub(r"^\W+", "", heading)).casefold()
+
+
+def read_sheet(text: str, layout: TemplateLayout) -> dict[str, str]:
+    """
+    Reads the field values of a filled-out template, e.g. a brief sheet to build on.
+
+    Labels are matched loosely (case, spacing, emoji and markdown are ignored), within the
+    current section first, so fields with the same label in different sections stay apart.
+    Lines that don't start a field continue the previous field's value, joined with a space.
+    """
+    values: dict[str, str] = {}
+    section: Optional[TemplateSection] = None
+    last: Optional[TemplateField] = None
+
+    def find(label: str) -> Optional[TemplateField]:
+        name = field_name(label)
+        candidates = (section.fields if section else []) + layout.fields
+        return next((f for f in candidates if field_name(f.label) == name and f.name not in values), None)
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped == SECTION_SEPARATOR:
+            continue
+        plain = re.sub(r"^\W+", "", stripped)
+        heading = next((s for s in layout.sections if s.heading and _heading_key(s.heading) and plain.casefold().startswith(_heading_key(s.heading))), None)
+        if heading is not None:
+            section, last = heading, None
+            continue
+        label, colon, value = plain.partition(":")
+        template_field = find(label) if colon else None
+        if template_field is None:
+            # Fields without a colon, e.g. "If cornered… they bluff"
+            template_field = next((f for f in layout.fields if f.separator != ": " and f.name not in values and plain.casefold().startswith(f.label.casefold())), None)
+            value = plain[len(template_field.label):] if template_field else value
+        if template_field is not None:
+            values[template_field.name] = value.strip(" *_")
+            last = template_field
+        elif last is not None:
+            values[last.name] = f"{values[last.name]} {stripped}".strip()
+    return values
+
+
+class SheetModel(BaseModel):
+    """A sheet's field values; subclasses are built from a template by sheet_model()."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    layout: ClassVar[TemplateLayout]
+
+    @classmethod
+    def field_guide(cls) -> str:
+        """Describes the JSON object the model must answer with, in place of the template in the prompt."""
+        lines = [f"Respond with only a JSON object for a \"{cls.layout.title}\" with these fields, each a string:"]
+        for template_field in cls.layout.fields:
+            hint = f" {template_field.hint}" if template_field.hint else ""
+            lines.append(f"- {template_field.name}: {template_field.label}{hint}")
+        return "\n".join(lines)
+
+    @classmethod
+    def response_format(cls) -> dict:
+        """The response_format of a chat completion that constrains the answer to this model."""
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": cls.__name__, "schema": cls.model_json_schema(), "strict": True},
+        }
+
+    @classmethod
+    def parse(cls, text: str) -> "SheetModel":
+        """
+        Parses the model's answer.
+
+        Raises:
+            ValueError: If the answer isn't a JSON object with the sheet's fields.
+        """
+        text = text.strip()
+        # Some models wrap JSON in a code fence even when asked not to
+        if text.startswith("```"):
+            text = text.strip("`").removeprefix("json").strip()
+        return cls.model_validate_json(text)
+
+    def render(self) -> str:
+        """The sheet in the template's text layout."""
+        return render_layout(self.layout, self.model_dump())
+
+    def as_entity(self, fields: dict[str, str]) -> dict:
+        """
+        The sheet as a world memory entity.
+
+        Args:
+            fields: Entity keys to fill from sheet fields, e.g. {"race": "race_species"}.
+                They come first; the other fields follow under their own names.
+        """
+        values = self.model_dump()
+        entity = {key: values[name] for key, name in fields.items() if values.get(name)}
+        entity.update((name, value) for name, value in values.items() if name not in fields.values())
+        return entity
+
+
+def sheet_model(name: str, template: str) -> type[SheetModel]:
+    """Builds the Pydantic model of a template's fields, e.g. NPCSheet from the NPC template."""
+    return layout_model(name, parse_template(template))
+
+
+def layout_model(name: str, layout: TemplateLayout) -> type[SheetModel]:
+    """Builds the Pydantic model of a layout's fields."""
+    fields = {
+        template_field.name: (str, Field(description=f"{template_field.label} {template_field.hint}".strip()))
+        for template_field in layout.fields
+    }
+    model = create_model(name, __base__=SheetModel, **fields)
+    model.layout = layout
+    return model
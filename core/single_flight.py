@@ -0,0 +1,229 @@
+"""
+Single-flight request coalescing for TTRPG Sidekick
+
+When identical requests arrive while one of them is still being answered (the same
+/npc prompt sent several times from a Discord channel, a script firing a burst of
+duplicates), only the first is sent to the model; the others wait for its result and
+get the same one. Streams are shared too: a subscriber gets all of the text from the
+start, including what was written before it joined, then each new fragment as it
+arrives.
+
+The work of a flight is done for all of its callers: one of them giving up (a
+cancelled task, a stream closed early) doesn't stop it for the others. It is only
+abandoned once nobody is waiting for it any more.
+
+A flight ends when its result is ready, so a later identical request starts a new
+one (or is answered by the response cache). Keys are compared as given; callers
+normalize them first (see BaseGeneratorAgent.flight_key).
+"""
+
+import threading
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, ContextManager, Hashable, Iterator, Optional, TypeVar
+
+if TYPE_CHECKING:
+    import asyncio
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """A piece of work in progress and the callers waiting for it."""
+
+    def __init__(self):
+        self.result: Any = None
+        self.chunks: list = []  # Fragments of a stream so far
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        self.async_condition: Optional["asyncio.Condition"] = None
+        self.task: Optional["asyncio.Task"] = None
+
+
+class SingleFlight:
+    """
+    Shares the work of identical concurrent calls.
+
+    `follower` arguments are context managers entered while a caller waits on a flight
+    somebody else started, e.g. to report the call as coalesced.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0  # Flights started
+        self.coalesced = 0  # Calls that joined a flight instead of starting one
+
+    def _join(self, key: Hashable, start: Callable[[_Flight], None]) -> tuple[_Flight, bool]:
+        """Finds the flight for a key, or starts one; returns it and whether it was already running."""
+        with self._lock:
+            flight = self._flights.get(key)
+            shared = flight is not None
+            if shared:
+                self.coalesced += 1
+                flight.subscribers += 1
+            else:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                # Counted before the work starts, or a fast producer would find nobody waiting and stop
+                flight.subscribers += 1
+                start(flight)
+        return flight, shared
+
+    def _leave(self, key: Hashable, flight: _Flight) -> bool:
+        """Removes a caller from a flight; returns True if the flight was abandoned, i.e. nobody waits for it now."""
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers > 0 or flight.done:
+                return False
+            # Later calls start afresh instead of joining a flight that is being stopped
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return True
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.condition:
+            flight.done = True
+            flight.condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+    def do(self, key: Hashable, fn: Callable[[], T], follower: Optional[Callable[[], ContextManager]] = None) -> T:
+        """Returns fn(), or the result of the identical call already running."""
+        key = ("do", key)
+        flight, shared = self._join(key, lambda flight: None)
+        if not shared:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                self._leave(key, flight)
+                self._finish(key, flight)
+            return flight.result
+
+        with follower() if follower else nullcontext():
+            try:
+                with flight.condition:
+                    flight.condition.wait_for(lambda: flight.done)
+            finally:
+                self._leave(key, flight)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterator[T]], follower: Optional[Callable[[], ContextManager]] = None) -> Iterator[T]:
+        """Yields the items of fn(), shared with identical streams; fn() runs in a background thread."""
+        key = ("stream", key)
+
+        def start(flight: _Flight) -> None:
+            threading.Thread(target=self._produce, args=(key, flight, fn), name="single-flight", daemon=True).start()
+
+        flight, shared = self._join(key, start)
+        index = 0
+        try:
+            with follower() if follower and shared else nullcontext():
+                while True:
+                    with flight.condition:
+                        flight.condition.wait_for(lambda: len(flight.chunks) > index or flight.done)
+                        chunks, done = flight.chunks[index:], flight.done
+                    index += len(chunks)
+                    yield from chunks
+                    if done:
+                        break
+                if flight.error is not None:
+                    raise flight.error
+        finally:
+            self._leave(key, flight)
+
+    def _produce(self, key: Hashable, flight: _Flight, fn: Callable[[], Iterator]) -> None:
+        iterator = iter(fn())
+        try:
+            for chunk in iterator:
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+                if flight.subscribers == 0:
+                    break
+        except BaseException as e:
+            flight.error = e
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            self._finish(key, flight)
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[T]], follower: Optional[Callable[[], ContextManager]] = None) -> T:
+        """Async version of do; the work runs in a task that is cancelled only when every caller has been."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        key = ("do_async", id(loop), key)
+
+        def start(flight: _Flight) -> None:
+            flight.task = loop.create_task(fn())
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+
+        flight, shared = self._join(key, start)
+        with follower() if follower and shared else nullcontext():
+            try:
+                return await asyncio.shield(flight.task)
+            finally:
+                if self._leave(key, flight):
+                    flight.task.cancel()
+
+    async def stream_async(self, key: Hashable, fn: Callable[[], AsyncIterator[T]], follower: Optional[Callable[[], ContextManager]] = None) -> AsyncIterator[T]:
+        """Async version of stream; fn() runs in a task."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        key = ("stream_async", id(loop), key)
+
+        def start(flight: _Flight) -> None:
+            flight.async_condition = asyncio.Condition()
+            flight.task = loop.create_task(self._produce_async(key, flight, fn))
+
+        flight, shared = self._join(key, start)
+        condition = flight.async_condition
+        index = 0
+        try:
+            with follower() if follower and shared else nullcontext():
+                while True:
+                    async with condition:
+                        await condition.wait_for(lambda: len(flight.chunks) > index or flight.done)
+                        chunks, done = flight.chunks[index:], flight.done
+                    index += len(chunks)
+                    for chunk in chunks:
+                        yield chunk
+                    if done:
+                        break
+                if flight.error is not None:
+                    raise flight.error
+        finally:
+            if self._leave(key, flight):
+                flight.task.cancel()
+
+    async def _produce_async(self, key: Hashable, flight: _Flight, fn: Callable[[], AsyncIterator]) -> None:
+        condition = flight.async_condition
+        try:
+            async for chunk in fn():
+                async with condition:
+                    flight.chunks.append(chunk)
+                    condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(key, flight)
+            async with condition:
+                condition.notify_all()
+
+
+# Shared by all generator agents, so identical requests coalesce whichever agent instance gets them
+single_flight = SingleFlight()
@@ -0,0 +1,357 @@
+"""
+Speculative generation for chat
+
+When the assistant lists numbered ideas of one kind ("1. Grumble Ironfoot, a dwarven
+smith..."), the player usually follows up with "/npc number 2". With speculation on, the
+chat session starts brief sheets for the first few options in the background as soon as
+the list is shown, so the follow-up is answered from a sheet that is already (or mostly)
+written. Speculation is opt-in (TTRPG_SPECULATE=1 or the /speculate chat command) because
+it spends tokens on sheets that may never be asked for:
+
+- at most TTRPG_SPECULATE_OPTIONS options of a list are generated (default 3)
+- a session stops speculating once its sheets used TTRPG_SPECULATE_BUDGET tokens, counting
+  the messages sent for them as well as the text written; a sheet that runs over the
+  budget is cancelled
+- sheets still being written are cancelled as soon as the conversation moves on
+  (another message that isn't a pick from the list, a new list, or /clear)
+
+Chat sessions also expand brief sheets into full ones this way, with TTRPG_AUTO_EXPAND.
+"""
+
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+from core.token_budget import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+# Options of a list generated in the background, and tokens a session may spend on them
+SPECULATE_OPTIONS = int(os.getenv("TTRPG_SPECULATE_OPTIONS", "3"))
+SPECULATE_BUDGET = int(os.getenv("TTRPG_SPECULATE_BUDGET", "20000"))
+
+# Speculative sheets generated at once, shared by all chat sessions of the process
+SPECULATE_WORKERS = int(os.getenv("TTRPG_SPECULATE_WORKERS", "4"))
+
+# A generator prompt that only picks an option, e.g. "number 2", "option 2", "#2" or "2"
+PICK_PATTERN = re.compile(r'^(?:(?:number|option|no\.?|#)\s*)?(\d+)[.!]?$', re.IGNORECASE)
+
+# The number and text of a numbered option line, without markdown emphasis
+OPTION_PATTERN = re.compile(r'^\s*(\d+)\.\s*(.+)$')
+
+
+def _kind_patterns(words: dict[str, list[str]]) -> dict[str, re.Pattern]:
+    return {kind: re.compile(r'\b(?:' + "|".join(words) + r')s?\b', re.IGNORECASE) for kind, words in words.items()}
+
+
+# Generators named outright, and words that suggest one, for telling what a list is of
+GENERATOR_NAMES = _kind_patterns({
+    "npc": ["npc"],
+    "building": ["building"],
+    "quest": ["quest"],
+    "magic_item": ["magic item"],
+    "battlefield": ["battlefield"],
+    "backstory": ["backstory", "backstorie"],
+})
+KIND_KEYWORDS = _kind_patterns({
+    "npc": ["character", "villain", "merchant", "innkeeper", "shopkeeper", "noble", "ally", "rival", "patron", "person", "people", "guard"],
+    "building": ["tavern", "inn", "shop", "store", "tower", "temple", "castle", "keep", "guildhall", "guild hall", "stronghold", "manor"],
+    "quest": ["adventure", "mission", "hook", "plot", "heist", "bounty", "job"],
+    "magic_item": ["item", "artifact", "weapon", "sword", "armor", "ring", "amulet", "staff", "wand", "relic", "trinket"],
+    "battlefield": ["battle", "encounter", "arena", "terrain", "ambush", "fight"],
+    "backstory": ["background", "origin", "history", "histories", "past"],
+})
+
+
+def _first_kind(text: str, patterns: dict[str, re.Pattern]) -> Optional[str]:
+    """The kind whose pattern matches earliest in the text."""
+    found = [(match.start(), kind) for kind, pattern in patterns.items() if (match := pattern.search(text))]
+    return min(found)[1] if found else None
+
+
+def detect_kind(question: str, options: list[str]) -> Optional[str]:
+    """
+    The generator a list of options is for, or None if that isn't clear.
+
+    The question that asked for the list decides, preferring generators named outright
+    ("tavern NPC ideas" are NPCs); otherwise what most of the options are about.
+    """
+    for patterns in (GENERATOR_NAMES, KIND_KEYWORDS):
+        kind = _first_kind(question, patterns)
+        if kind is not None:
+            return kind
+    counts = Counter(kind for option in options if (kind := _first_kind(option, KIND_KEYWORDS)))
+    if counts:
+        kind, count = counts.most_common(1)[0]
+        if count * 2 > len(options):
+            return kind
+    return None
+
+
+def parse_options(lines: list[str]) -> dict[int, str]:
+    """Option text by number, from numbered lines like "2. **The Gilded Goose** - ..."."""
+    options = {}
+    for line in lines:
+        match = OPTION_PATTERN.match(line)
+        if match:
+            options.setdefault(int(match.group(1)), match.group(2).replace("**", "").replace("__", "").strip())
+    return options
+
+
+def picked_option(prompt: str) -> Optional[int]:
+    """The option number a generator prompt picks, if that's all it does."""
+    match = PICK_PATTERN.match(prompt.strip())
+    return int(match.group(1)) if match else None
+
+
+class GeneratorStream:
+    """A generator's sheet as it is written, with the messages it sent once it has started."""
+
+    def __init__(self, kind: str, spec: "BaseModel"):
+        from router import GENERATORS
+
+        self.agent = GENERATORS[kind].agent_class()
+        self._pieces = self.agent.stream_sheet(spec)
+
+    @property
+    def messages(self) -> Optional[list[dict]]:
+        return self.agent.last_messages
+
+    @property
+    def model(self) -> Optional[str]:
+        return self.agent.llm.model
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        return next(self._pieces)
+
+    def close(self) -> None:
+        self._pieces.close()
+
+
+def stream_generator(kind: str, spec: "BaseModel") -> Iterator[str]:
+    return GeneratorStream(kind, spec)
+
+
+def prompt_tokens(pieces: Iterator[str]) -> int:
+    """
+    Tokens of the messages a started stream sent: system prompt, template, context and
+    request. Streams that don't tell their messages, or that sent none (e.g. because they
+    joined an identical request in progress), count 0.
+    """
+    messages = getattr(pieces, "messages", None) or []
+    model = getattr(pieces, "model", None)
+    return sum(
+        count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS for message in messages
+    )
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class Speculation:
+    """A sheet generated in the background, e.g. for one option; readers can follow it while it is written."""
+
+    def __init__(self, kind: str, number: Optional[int], spec: "BaseModel"):
+        self.kind = kind
+        self.number = number
+        self.spec = spec
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.cancelled = threading.Event()
+        self._changed = threading.Condition()
+
+    @property
+    def usable(self) -> bool:
+        """Whether the sheet is, or may still become, complete."""
+        return not self.cancelled.is_set() and self.error is None
+
+    def run(
+        self,
+        stream: Callable[[str, "BaseModel"], Iterator[str]],
+        spend: Callable[[int], bool],
+        measure: Optional[Callable[[Iterator[str]], int]] = None,
+    ) -> None:
+        """
+        Writes the sheet, spending its tokens as it goes.
+
+        Args:
+            stream: Generates a sheet for a generator name and spec, as it is written.
+            spend: Counts tokens against a budget; returns False once the budget is used up,
+                which cancels the sheet.
+            measure: Counts the prompt tokens a stream sent, spent with its first piece, once
+                the messages are built; None doesn't count them.
+        """
+        pieces = None
+        try:
+            if self.cancelled.is_set():
+                return
+            pieces = stream(self.kind, self.spec)
+            for position, piece in enumerate(pieces):
+                if self.cancelled.is_set():
+                    break
+                tokens = count_tokens(piece)
+                if position == 0 and measure is not None:
+                    tokens += measure(pieces)
+                if not spend(tokens):
+                    self.cancel()
+                    break
+                with self._changed:
+                    self.chunks.append(piece)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            # Closing the stream stops a cancelled generation at the model as well
+            close = getattr(pieces, "close", None)
+            if close is not None:
+                close()
+            self._finish()
+
+    def _finish(self) -> None:
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def follow(self) -> Iterator[str]:
+        """Yields the sheet from the start, waiting for the parts not written yet."""
+        position = 0
+        while True:
+            with self._changed:
+                while position == len(self.chunks) and not self.done:
+                    self._changed.wait()
+                chunks, done = self.chunks[position:], self.done
+            position += len(chunks)
+            yield from chunks
+            if done and position == len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+        if self.cancelled.is_set():
+            raise RuntimeError("The sheet was cancelled before it was finished")
+
+    def result(self) -> str:
+        return "".join(self.follow())
+
+
+def start_in_background(
+    speculation: Speculation,
+    stream: Callable[[str, "BaseModel"], Iterator[str]] = stream_generator,
+    spend: Callable[[int], bool] = lambda tokens: True,
+    measure: Optional[Callable[[Iterator[str]], int]] = None,
+) -> Speculation:
+    """Generates a speculative sheet on the threads shared by all chat sessions; see Speculation.run."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SPECULATE_WORKERS, thread_name_prefix="speculate")
+    _executor.submit(speculation.run, stream, spend, measure)
+    return speculation
+
+
+class Speculator:
+    """The speculative sheets of one chat session, for the numbered options it was last shown."""
+
+    def __init__(
+        self,
+        max_options: int = SPECULATE_OPTIONS,
+        budget: int = SPECULATE_BUDGET,
+        stream: Callable[[str, "BaseModel"], Iterator[str]] = stream_generator,
+        measure: Callable[[Iterator[str]], int] = prompt_tokens,
+    ):
+        """
+        Args:
+            max_options: Options of a list generated in the background.
+            budget: Tokens, prompts and sheets together, the session may spend on speculation.
+            stream: Generates a sheet for a generator name and spec, as it is written.
+            measure: Counts the prompt tokens a started stream sent.
+        """
+        self.max_options = max_options
+        self.budget = budget
+        self.stream = stream
+        self.measure = measure
+        self.spent = 0
+        self.counts = Counter()  # started, served, cancelled, skipped (over budget)
+        self._speculations: dict[int, Speculation] = {}
+        self._lock = threading.Lock()
+
+    def _spend(self, tokens: int) -> bool:
+        """Adds to the tokens spent; False once they reach the budget."""
+        with self._lock:
+            self.spent += tokens
+            return self.spent < self.budget
+
+    def start(self, kind: str, options: dict[int, str], spec_for: Callable[[str], "BaseModel"]) -> list[int]:
+        """
+        Starts brief sheets for the first options of a new list, replacing those of the last one.
+
+        Args:
+            kind: The generator the options are for.
+            options: Option text by number.
+            spec_for: Builds the generator spec for an option's text.
+
+        Returns:
+            The numbers of the options being generated.
+        """
+        self.cancel()
+        started = []
+        for number in sorted(options)[:self.max_options]:
+            if self.spent >= self.budget:
+                self.counts["skipped"] += 1
+                continue
+            speculation = Speculation(kind, number, spec_for(options[number]))
+            with self._lock:
+                self._speculations[number] = speculation
+            start_in_background(speculation, self.stream, self._spend, self.measure)
+            self.counts["started"] += 1
+            started.append(number)
+        return started
+
+    def is_pick(self, kind: str, prompt: str) -> bool:
+        """Whether a generator request picks one of the options being generated."""
+        speculation = self._speculations.get(picked_option(prompt))
+        return speculation is not None and speculation.kind == kind
+
+    def take(self, kind: str, prompt: str, world_name: str, brief: bool) -> Optional[Speculation]:
+        """The speculative sheet answering a request, if there is one and it matches the session's settings."""
+        number = picked_option(prompt)
+        with self._lock:
+            speculation = self._speculations.get(number)
+            if speculation is None or speculation.kind != kind or not speculation.usable:
+                return None
+            if speculation.spec.world_name != world_name or speculation.spec.brief != brief:
+                return None
+            del self._speculations[number]
+        self.counts["served"] += 1
+        return speculation
+
+    def cancel(self) -> None:
+        """Drops the speculative sheets, stopping those still being written."""
+        with self._lock:
+            speculations, self._speculations = list(self._speculations.values()), {}
+        for speculation in speculations:
+            if not speculation.done:
+                speculation.cancel()
+                self.counts["cancelled"] += 1
+
+    def reset(self) -> None:
+        """Cancels everything and starts the token budget over."""
+        self.cancel()
+        self.spent = 0
+
+    def describe(self) -> str:
+        return (
+            f"{self.counts['started']} sheet(s) started, {self.counts['served']} served, "
+            f"{self.counts['cancelled']} cancelled, {self.spent}/{self.budget} tokens used"
+        )
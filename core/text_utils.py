@@ -2,6 +2,8 @@
 Shared text utilities for cleaning and formatting LLM responses.
 """
 
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
 def clean_sheet(raw_text: str, filler_phrases: list[str]) -> str:
     """
     Generic function to clean up common artifacts and conversational filler from LLM output.
@@ -29,4 +31,80 @@ def clean_sheet(raw_text: str, filler_phrases: list[str]) -> str:
     ]
     
     # Join back with real newlines
-    return '\n'.join(cleaned_lines).strip() 
\ No newline at end of file
+    return '\n'.join(cleaned_lines).strip()
+
+
+class _StreamingSheetCleaner:
+    """Push-based line cleaner shared by the sync and async streaming helpers."""
+
+    def __init__(self, filler_phrases: list[str]):
+        self.filler_phrases = filler_phrases
+        self.buffer = ""
+        self.pending = ""
+        self.emitted = False
+
+    def feed(self, chunk: str) -> list[str]:
+        """Adds a text fragment and returns the cleaned text for any lines it completed."""
+        # Literal '\\n' sequences are treated as line breaks, like in clean_sheet
+        self.buffer = (self.buffer + chunk).replace('\\n', '\n')
+        *lines, self.buffer = self.buffer.split('\n')
+        return [text for text in map(self._clean_line, lines) if text]
+
+    def finish(self) -> list[str]:
+        """Flushes the last, unterminated line."""
+        text = self._clean_line(self.buffer) if self.buffer else ""
+        self.buffer = ""
+        return [text] if text else []
+
+    def _clean_line(self, line: str) -> str:
+        stripped = line.strip()
+        if stripped in self.filler_phrases:
+            return ""
+
+        if not self.emitted:
+            # Skip leading blank lines, like the final strip() in clean_sheet
+            if not stripped:
+                return ""
+            self.pending = line.lstrip()
+        else:
+            self.pending += '\n' + line
+
+        # Hold back blank lines and trailing whitespace until more text follows
+        if not stripped:
+            return ""
+        text = self.pending.rstrip()
+        self.pending = self.pending[len(text):]
+        self.emitted = True
+        return text
+
+
+def clean_sheet_stream(chunks: Iterable[str], filler_phrases: list[str]) -> Iterator[str]:
+    """
+    Incremental version of clean_sheet for streamed LLM output.
+
+    Filler lines are dropped as soon as each line is complete, so cleaned text can be
+    shown while the model is still generating. Concatenating everything this yields
+    gives the same result as calling clean_sheet on the full response.
+
+    Args:
+        chunks: Text fragments as they arrive from the LLM
+        filler_phrases: List of phrases to remove (exact matches only)
+
+    Yields:
+        Cleaned text, one line at a time. Newlines are emitted in front of the next
+        line rather than after the current one, so trailing whitespace is never yielded.
+    """
+    cleaner = _StreamingSheetCleaner(filler_phrases)
+    for chunk in chunks:
+        yield from cleaner.feed(chunk)
+    yield from cleaner.finish()
+
+
+async def clean_sheet_stream_async(chunks: AsyncIterable[str], filler_phrases: list[str]) -> AsyncIterator[str]:
+    """Async version of clean_sheet_stream for chunks from an async iterator."""
+    cleaner = _StreamingSheetCleaner(filler_phrases)
+    async for chunk in chunks:
+        for text in cleaner.feed(chunk):
+            yield text
+    for text in cleaner.finish():
+        yield text
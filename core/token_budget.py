@@ -0,0 +1,185 @@
+"""
+Token counting and token-budgeted conversation history.
+
+Token counts come from tiktoken when it is installed and from a character-based
+estimate otherwise, so budgets work for both OpenAI and local models.
+"""
+
+import os
+from functools import lru_cache
+from typing import Optional
+
+# Context window sizes (in tokens) for common models; prefixes match model variants
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4.1": 1000000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "llama3.2": 128000,
+    "llama3.1": 128000,
+    "llama3": 8192,
+    "phi3.5": 128000,
+    "phi3": 4096,
+    "mistral": 32768,
+    "codellama": 16384,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Upper bound on the conversation history sent with each chat turn, whatever the model allows.
+# Keeps long sessions from getting slower and more expensive with every turn.
+DEFAULT_HISTORY_BUDGET = int(os.getenv("TTRPG_HISTORY_TOKENS", "3000"))
+
+# Approximate per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: Optional[str]):
+    """Returns the tiktoken encoding for a model, or None if tiktoken is not installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except KeyError:
+        # Unknown (e.g. local) models: any modern BPE gives a close enough count
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Counts the tokens in a piece of text.
+
+    Args:
+        text: The text to measure.
+        model: Model name used to pick the tokenizer.
+
+    Returns:
+        The exact count with tiktoken, otherwise an estimate of one token per four characters.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Shortens text to at most `max_tokens` tokens, adding "..." if anything was cut."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[: max_tokens * 4].rstrip() + "..."
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]).rstrip() + "..."
+
+
+def context_window(model: Optional[str]) -> int:
+    """Returns the context window of a model, matching the longest known name prefix."""
+    name = (model or "").lower()
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def history_budget(model: Optional[str], reserved_tokens: int = 0) -> int:
+    """
+    Returns how many tokens of conversation history to send with a request.
+
+    Args:
+        model: Model the request goes to.
+        reserved_tokens: Tokens needed for everything else (system prompt, completion).
+    """
+    return max(0, min(DEFAULT_HISTORY_BUDGET, context_window(model) - reserved_tokens))
+
+
+class HistoryEntry:
+    """A conversation message with its token count, computed once when it is added."""
+
+    def __init__(self, role: str, content: str, model: Optional[str] = None):
+        self.role = role
+        self.content = content
+        self.tokens = count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
+        self.extracted = None  # Context extracted from the message, if the caller stores any
+
+    def as_message(self) -> dict:
+        """The entry as a chat message for the API."""
+        return {"role": self.role, "content": self.content}
+
+
+class ConversationContext:
+    """Conversation history that can be packed into a fixed token budget."""
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self.entries: list[HistoryEntry] = []
+
+    def add(self, role: str, content: str) -> HistoryEntry:
+        """Adds a message, counting its tokens once."""
+        entry = HistoryEntry(role, content, self.model)
+        self.entries.append(entry)
+        return entry
+
+    def clear(self) -> None:
+        """Removes all messages."""
+        self.entries.clear()
+
+    def recent(self, budget: int) -> list[HistoryEntry]:
+        """Returns the most recent entries whose total token count fits in the budget, oldest first."""
+        selected = []
+        used = 0
+        for entry in reversed(self.entries):
+            if used + entry.tokens > budget:
+                break
+            selected.append(entry)
+            used += entry.tokens
+        selected.reverse()
+        return selected
+
+    def pack(self, budget: int, summary_budget: Optional[int] = None) -> list[dict]:
+        """
+        Packs as much recent history as fits into the budget.
+
+        Turns that don't fit are not dropped silently: the start of each is kept in a short
+        summary message placed before the history, using up to `summary_budget` tokens
+        (default: a tenth of the budget).
+
+        Returns:
+            Chat messages ready to send, oldest first.
+        """
+        if summary_budget is None:
+            summary_budget = budget // 10
+
+        recent = self.recent(budget)
+        evicted = self.entries[: len(self.entries) - len(recent)]
+        if not evicted or summary_budget <= 0:
+            return [entry.as_message() for entry in recent]
+
+        # Make room for the summary by dropping the oldest of the kept turns if needed
+        while recent and sum(entry.tokens for entry in recent) + summary_budget > budget:
+            evicted.append(recent.pop(0))
+
+        lines = []
+        used = count_tokens("Summary of earlier conversation:", self.model) + MESSAGE_OVERHEAD_TOKENS
+        for entry in reversed(evicted):
+            first_line = entry.content.strip().split("\n", 1)[0]
+            line = f"- {entry.role}: {truncate_to_tokens(first_line, 40, self.model)}"
+            line_tokens = count_tokens(line, self.model)
+            if used + line_tokens > summary_budget:
+                break
+            lines.append(line)
+            used += line_tokens
+
+        messages = [entry.as_message() for entry in recent]
+        if lines:
+            summary = "Summary of earlier conversation:\n" + "\n".join(reversed(lines))
+            messages.insert(0, {"role": "system", "content": summary})
+        return messages
+
+    def count(self, messages: list[dict]) -> int:
+        """Counts the tokens of a list of chat messages."""
+        return sum(count_tokens(message["content"], self.model) + MESSAGE_OVERHEAD_TOKENS for message in messages)
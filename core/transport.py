@@ -0,0 +1,337 @@
+"""
+Transport policy for TTRPG Sidekick
+
+Wraps every request to the model in the policies that keep one slow or failing request
+from stalling the table:
+- a deadline for the whole call, retries included
+- retries with exponential backoff and full jitter on rate limits, server errors,
+  timeouts and dropped connections
+- a circuit breaker per endpoint, so an endpoint that keeps failing is skipped
+  quickly instead of being waited on for every request (used by core.provider_pool)
+- optional hedging: when a request is slower than usual, an identical second request
+  is sent and whichever answers first is used
+
+A request is given to Transport as a function taking the per-attempt timeout, so the
+same policies work for the sync and the async client, and each attempt can go to a
+different endpoint.
+"""
+
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypeVar
+
+from core.metrics import CallMetrics
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying besides 5xx: request timeout, conflict and rate limiting
+RETRYABLE_STATUSES = (408, 409, 429)
+
+# Exception class names of the openai package that mean the request never got an answer
+RETRYABLE_ERRORS = ("APITimeoutError", "APIConnectionError")
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a call's deadline passes before it succeeds."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without sending the request while every endpoint's circuit breaker is open."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request may succeed when sent again."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The delay a rate-limited response asked for in its Retry-After header, in seconds."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def hedge_timeout(timeout: Optional[float], started: float) -> Optional[float]:
+    """The time an attempt that started at `started` (time.monotonic()) with `timeout` seconds has left."""
+    return timeout - (time.monotonic() - started) if timeout is not None else None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, minimum: Optional[float] = None) -> float:
+    """
+    Delay before retry number `attempt` (0 for the first retry): a random time up to
+    base * 2^attempt, capped, so clients that failed together don't retry together.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, minimum) if minimum else delay
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an endpoint after repeated failures.
+
+    After `failure_threshold` failures in a row the circuit opens and requests fail at
+    once with CircuitOpenError. After `reset_timeout` seconds a single trial request is
+    let through: if it succeeds the circuit closes, otherwise it stays open for another
+    `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """"closed" (requests pass), "open" (requests fail fast) or "half-open" (a trial request may pass)."""
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def record_abandoned(self) -> None:
+        """A request ended without succeeding or failing, e.g. cancelled; another trial may go."""
+        with self._lock:
+            self._trial_running = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """The shared circuit breaker of an endpoint, configured from the environment."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                failure_threshold=int(os.getenv("TTRPG_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("TTRPG_BREAKER_RESET", "30")),
+            )
+        return _breakers[name]
+
+
+@dataclass
+class TransportPolicy:
+    """How requests are timed out, retried and hedged."""
+    deadline: Optional[float] = 180.0  # Seconds for the whole call, retries included; None waits forever
+    max_retries: int = 3
+    backoff_base: float = 0.5  # Seconds; the backoff doubles with every retry
+    backoff_max: float = 8.0
+    hedge: bool = False  # Send a second request when the first is slower than hedge_delay
+    hedge_delay: Optional[float] = None  # Seconds; None uses the p95 latency of recent calls
+
+    @classmethod
+    def from_env(cls) -> "TransportPolicy":
+        """The policy configured by the TTRPG_LLM_* and TTRPG_HEDGE* environment variables."""
+        deadline = os.getenv("TTRPG_LLM_DEADLINE", "180")
+        hedge_delay = os.getenv("TTRPG_HEDGE_DELAY")
+        return cls(
+            deadline=float(deadline) if float(deadline) > 0 else None,
+            max_retries=int(os.getenv("TTRPG_LLM_RETRIES", "3")),
+            hedge=os.getenv("TTRPG_HEDGE", "").lower() in ("1", "true", "yes"),
+            hedge_delay=float(hedge_delay) if hedge_delay else None,
+        )
+
+
+class Transport:
+    """Sends requests under a TransportPolicy."""
+
+    def __init__(self, policy: TransportPolicy):
+        self.policy = policy
+
+    def deadline_at(self, deadline: Optional[float]) -> Optional[float]:
+        """The time.monotonic() time a call with the given deadline (or the policy's) must end by."""
+        deadline = deadline if deadline is not None else self.policy.deadline
+        return time.monotonic() + deadline if deadline else None
+
+    def _before_attempt(self, deadline_at: Optional[float]) -> Optional[float]:
+        """Checks the deadline; returns the time left for the attempt."""
+        remaining = deadline_at - time.monotonic() if deadline_at is not None else None
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError("The request did not finish before its deadline")
+        return remaining
+
+    def _after_failure(self, error: Exception, attempt: int, deadline_at: Optional[float], call: CallMetrics) -> float:
+        """Records a failed attempt; returns the delay before the next one, or re-raises if there is none."""
+        if not is_retryable(error):
+            raise error
+        if attempt >= self.policy.max_retries:
+            raise error
+        delay = backoff_delay(attempt, self.policy.backoff_base, self.policy.backoff_max, retry_after(error))
+        if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+            raise DeadlineExceededError("The request did not finish before its deadline") from error
+        call.retries += 1
+        return delay
+
+    def send(self, request: Callable[[Optional[float]], T], call: CallMetrics, deadline: Optional[float] = None, hedge_delay: Optional[float] = None) -> T:
+        """
+        Sends a request, retrying it as the policy allows.
+
+        Args:
+            request: Sends the request once, given the seconds left before the deadline (or None).
+            call: Metrics of the call; retries and hedging are counted on it.
+            deadline: Seconds for the whole call, overriding the policy's deadline.
+            hedge_delay: Send a second request if the first hasn't answered after this many
+                seconds; None sends only one.
+
+        Returns:
+            The first successful response.
+        """
+        deadline_at = self.deadline_at(deadline)
+        attempt = 0
+        while True:
+            timeout = self._before_attempt(deadline_at)
+            try:
+                response = self._hedged(request, timeout, hedge_delay, call) if hedge_delay else request(timeout)
+            except Exception as e:
+                time.sleep(self._after_failure(e, attempt, deadline_at, call))
+                attempt += 1
+                continue
+            return response
+
+    @staticmethod
+    def _start(request: Callable[[Optional[float]], T], timeout: Optional[float]) -> "Future[T]":
+        """
+        Sends a request on a thread of its own, so a hedge never waits behind other slow
+        requests for a free worker.
+        """
+        from concurrent.futures import Future
+
+        future: "Future[T]" = Future()
+
+        def run() -> None:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(request(timeout))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="hedge", daemon=True).start()
+        return future
+
+    def _hedged(self, request: Callable[[Optional[float]], T], timeout: Optional[float], delay: float, call: CallMetrics) -> T:
+        """
+        Sends the request, and again if it is slower than `delay`; returns the first success.
+
+        A blocking request can't be interrupted, so the slower one finishes in the background
+        and its answer is dropped (the async version cancels it). No hedge is sent when the
+        deadline leaves no time for one.
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+
+        started = time.monotonic()
+        first = self._start(request, timeout)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+
+        remaining = hedge_timeout(timeout, started)
+        if remaining is not None and remaining <= 0:
+            return first.result()
+
+        call.hedged = True
+        second = self._start(request, remaining)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def send_async(self, request: Callable[[Optional[float]], Awaitable[T]], call: CallMetrics, deadline: Optional[float] = None, hedge_delay: Optional[float] = None) -> T:
+        """Async version of send; the slower of two hedged requests is cancelled."""
+        import asyncio
+
+        deadline_at = self.deadline_at(deadline)
+        attempt = 0
+        while True:
+            timeout = self._before_attempt(deadline_at)
+            try:
+                if hedge_delay:
+                    response = await self._hedged_async(request, timeout, hedge_delay, call)
+                else:
+                    response = await asyncio.wait_for(request(timeout), timeout)
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(e, attempt, deadline_at, call))
+                attempt += 1
+                continue
+            return response
+
+    async def _hedged_async(self, request: Callable[[Optional[float]], Awaitable[T]], timeout: Optional[float], delay: float, call: CallMetrics) -> T:
+        import asyncio
+
+        started = time.monotonic()
+        first = asyncio.ensure_future(request(timeout))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+
+            remaining = hedge_timeout(timeout, started)
+            if remaining is not None and remaining <= 0:
+                # No time left for a hedge; the first request's own timeout ends it
+                return await first
+
+            call.hedged = True
+            tasks.append(asyncio.ensure_future(request(remaining)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # However this ends, the caller being cancelled included, no request is left running
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,273 @@
+"""
+World Store for TTRPG Sidekick
+
+Indexed SQLite storage for world memory. Each kind of entity has its own table,
+so adding an NPC is a single row insert instead of a rewrite of the whole world.
+
+Every write runs in an immediate transaction, which takes SQLite's write lock up
+front, so several processes can write to the same world without losing rows.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+# Entity tables and the fields pulled out of each entity into indexed columns
+ENTITY_TABLES = {
+    "npcs": ("name", "race", "location"),
+    "locations": ("name", "region"),
+    "quests": ("name",),
+    "items": ("name", "rarity"),
+    "battlefields": ("name", "location"),
+    "backstories": ("name", "race"),
+}
+
+# World-level data for worlds that have no description yet
+DEFAULT_WORLD_DATA = {"description": "A fantasy world"}
+
+
+class WorldStore:
+    """SQLite-backed store of worlds and their entities, using write-ahead logging."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite file to use.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are started explicitly by _write()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30, isolation_level=None)
+        # WAL lets readers work while a write is in progress and keeps writes crash-safe
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._write():
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS worlds (
+                    name TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            for table, columns in ENTITY_TABLES.items():
+                indexed = "".join(f"{column} TEXT COLLATE NOCASE,\n" for column in columns)
+                self._conn.execute(
+                    f"""CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        world TEXT NOT NULL,
+                        {indexed}data TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )"""
+                )
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_world ON {table} (world, id)")
+                for column in columns:
+                    self._conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} (world, {column})"
+                    )
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        """
+        Runs a write transaction, holding both the in-process lock and SQLite's write lock.
+
+        Other processes wait for the lock (up to the connection timeout) instead of failing,
+        and the transaction is rolled back if anything inside it raises.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _columns(entity_type: str) -> tuple[str, ...]:
+        """Returns the indexed columns of an entity table, rejecting unknown entity types."""
+        if entity_type not in ENTITY_TABLES:
+            raise ValueError(f"Unknown entity type '{entity_type}'. Expected one of: {', '.join(ENTITY_TABLES)}")
+        return ENTITY_TABLES[entity_type]
+
+    @staticmethod
+    def _indexed_values(entity: Any, columns: tuple[str, ...]) -> list[Optional[str]]:
+        """Pulls the indexed fields out of an entity; plain strings are treated as a name."""
+        if isinstance(entity, dict):
+            return [None if entity.get(column) is None else str(entity[column]) for column in columns]
+        return [str(entity) if column == "name" else None for column in columns]
+
+    def _ensure_world(self, world_name: str, now: float) -> None:
+        self._conn.execute(
+            "INSERT OR IGNORE INTO worlds (name, data, updated_at) VALUES (?, ?, ?)",
+            (world_name, json.dumps(DEFAULT_WORLD_DATA), now),
+        )
+
+    def _insert(self, world_name: str, entity_type: str, entities: Iterable[Any], now: float) -> int:
+        columns = self._columns(entity_type)
+        rows = [
+            (world_name, *self._indexed_values(entity, columns), json.dumps(entity), now)
+            for entity in entities
+        ]
+        placeholders = ", ".join("?" * (len(columns) + 3))
+        self._conn.executemany(
+            f"INSERT INTO {entity_type} (world, {', '.join(columns)}, data, created_at) VALUES ({placeholders})",
+            rows,
+        )
+        return len(rows)
+
+    def has_world(self, world_name: str) -> bool:
+        """Whether the world exists in the store."""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM worlds WHERE name = ?", (world_name,)).fetchone()
+        return row is not None
+
+    def get_world(self, world_name: str) -> Optional[dict[str, Any]]:
+        """Returns the world-level data (description, etc.), or None if the world doesn't exist."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM worlds WHERE name = ?", (world_name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_world_version(self, world_name: str) -> Optional[float]:
+        """Returns a value that changes whenever the world is written to, or None if it doesn't exist."""
+        with self._lock:
+            row = self._conn.execute("SELECT updated_at FROM worlds WHERE name = ?", (world_name,)).fetchone()
+        return row[0] if row else None
+
+    def set_world(self, world_name: str, data: dict[str, Any]) -> None:
+        """Replaces the world-level data, creating the world if needed."""
+        with self._write():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO worlds (name, data, updated_at) VALUES (?, ?, ?)",
+                (world_name, json.dumps(data), time.time()),
+            )
+
+    def add_entities(self, world_name: str, entity_type: str, entities: Iterable[Any]) -> int:
+        """
+        Adds entities to a world in a single transaction, creating the world if needed.
+
+        Returns:
+            The number of entities added.
+        """
+        return self.add_batch({(world_name, entity_type): list(entities)})
+
+    def add_batch(self, batch: dict[tuple[str, str], list[Any]]) -> int:
+        """
+        Adds entities to any number of worlds in a single transaction.
+
+        Args:
+            batch: Entities to add, keyed by (world name, entity type).
+
+        Returns:
+            The number of entities added.
+        """
+        now = time.time()
+        count = 0
+        with self._write():
+            for (world_name, entity_type), entities in batch.items():
+                self._ensure_world(world_name, now)
+                count += self._insert(world_name, entity_type, entities, now)
+                # Always move the version forward, even if the clock hasn't
+                self._conn.execute(
+                    "UPDATE worlds SET updated_at = MAX(?, updated_at + 0.000001) WHERE name = ?", (now, world_name)
+                )
+        return count
+
+    def add_entity(self, world_name: str, entity_type: str, entity: Any) -> None:
+        """Adds one entity to a world, creating the world if needed."""
+        self.add_entities(world_name, entity_type, [entity])
+
+    def get_entities(self, world_name: str, entity_type: str) -> list[Any]:
+        """Returns all entities of a type in a world, in the order they were added."""
+        return self.find_entities(world_name, entity_type)
+
+    def find_entities(self, world_name: str, entity_type: str, **filters: Optional[str]) -> list[Any]:
+        """
+        Looks up entities by their indexed fields. Matching is case-insensitive.
+
+        Example:
+            >>> store.find_entities("Eberron", "npcs", race="dwarf", location="Sharn")
+        """
+        columns = self._columns(entity_type)
+        unknown = set(filters) - set(columns)
+        if unknown:
+            raise ValueError(f"Cannot look up {entity_type} by {', '.join(sorted(unknown))}")
+
+        conditions = ["world = ?"]
+        params: list[Any] = [world_name]
+        for column, value in filters.items():
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM {entity_type} WHERE {' AND '.join(conditions)} ORDER BY id", params
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_recent_entities(self, world_name: str, entity_type: str, after_id: int = 0, limit: int = 20) -> list[tuple[int, Any]]:
+        """
+        Returns the most recently added entities of a type, newest first, with their row ids.
+
+        Args:
+            after_id: Only consider entities added after the one with this id.
+            limit: Maximum number of entities to return.
+        """
+        self._columns(entity_type)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM {entity_type} WHERE world = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                (world_name, after_id, limit),
+            ).fetchall()
+        return [(row_id, json.loads(data)) for row_id, data in rows]
+
+    def count_entities(self, world_name: str, entity_type: str, after_id: int = 0) -> int:
+        """Counts the entities of a type in a world, optionally only those added after a given id."""
+        self._columns(entity_type)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) FROM {entity_type} WHERE world = ? AND id > ?", (world_name, after_id)
+            ).fetchone()
+        return row[0]
+
+    def import_world(self, world_name: str, world_data: dict[str, Any], replace: bool = False) -> int:
+        """
+        Imports a world in the legacy JSON layout ({"description": ..., "npcs": [...], ...}).
+
+        The import is atomic: either the whole world is stored or nothing is.
+
+        Args:
+            world_name: Name to store the world under.
+            world_data: The parsed JSON file.
+            replace: Replace the world if it already exists, instead of leaving it untouched.
+
+        Returns:
+            The number of entities imported, or 0 if the world already existed.
+        """
+        world_level = {key: value for key, value in world_data.items() if key not in ENTITY_TABLES}
+        now = time.time()
+        with self._write():
+            exists = self._conn.execute("SELECT 1 FROM worlds WHERE name = ?", (world_name,)).fetchone()
+            if exists and not replace:
+                return 0
+            for entity_type in ENTITY_TABLES:
+                self._conn.execute(f"DELETE FROM {entity_type} WHERE world = ?", (world_name,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO worlds (name, data, updated_at) VALUES (?, ?, ?)",
+                (world_name, json.dumps(world_level or DEFAULT_WORLD_DATA), now),
+            )
+            return sum(
+                self._insert(world_name, entity_type, world_data.get(entity_type) or [], now)
+                for entity_type in ENTITY_TABLES
+            )
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,103 @@
+"""
+World Summary for TTRPG Sidekick
+
+A compact description of a world (tone, locations, key NPCs) that generators add
+to their prompts. Summaries are kept up to date incrementally: a refresh only reads
+the entities added since the last one, never the whole world.
+"""
+
+from collections import deque
+from typing import Any, Optional
+from core.token_budget import count_tokens, truncate_to_tokens
+from core.world_store import ENTITY_TABLES
+
+# Number of most recent entities of each type kept as summary candidates
+MAX_RECENT_ENTITIES = 20
+
+# Token budget for the world summary in generator prompts
+DEFAULT_SUMMARY_TOKENS = 300
+
+
+def entity_label(entity: Any) -> str:
+    """One-line label for an entity, e.g. "Brom Ironfist (Dwarf, Sharn)"."""
+    if not isinstance(entity, dict):
+        return str(entity)
+    details = [str(entity[key]) for key in ("race", "role", "location", "region") if entity.get(key)]
+    name = str(entity.get("name", "Unnamed"))
+    return f"{name} ({', '.join(details)})" if details else name
+
+
+class WorldSummary:
+    """The parts of a world worth putting in a prompt, updated as entities are added."""
+
+    def __init__(self, world_name: str):
+        self.world_name = world_name
+        self.version: Optional[float] = None
+        self.world_data: dict[str, Any] = {}
+        self.counts = {entity_type: 0 for entity_type in ENTITY_TABLES}
+        self.last_ids = {entity_type: 0 for entity_type in ENTITY_TABLES}
+        self.recent = {entity_type: deque(maxlen=MAX_RECENT_ENTITIES) for entity_type in ENTITY_TABLES}
+        self._rendered: dict[tuple[int, Optional[str]], str] = {}
+
+    def update(self, world_data: dict[str, Any], version: float, entities: dict[str, tuple[int, list[tuple[int, Any]]]]) -> None:
+        """
+        Folds newly added entities into the summary.
+
+        Args:
+            world_data: Current world-level data (description, tone, etc.).
+            version: The world version the update brings the summary to.
+            entities: Per entity type, the number of entities added since the last update and
+                the most recent of them as (id, entity) pairs, newest first.
+        """
+        self.world_data = world_data
+        self.version = version
+        for entity_type, (added, recent) in entities.items():
+            self.counts[entity_type] += added
+            for entity_id, entity in reversed(recent):
+                self.recent[entity_type].append(entity)
+                self.last_ids[entity_type] = max(self.last_ids[entity_type], entity_id)
+        self._rendered.clear()
+
+    def render(self, max_tokens: int = DEFAULT_SUMMARY_TOKENS, model: Optional[str] = None) -> str:
+        """
+        Renders the summary as prompt text of at most `max_tokens` tokens.
+
+        Returns:
+            The summary, or an empty string if there is nothing known about the world.
+        """
+        key = (max_tokens, model)
+        if key not in self._rendered:
+            self._rendered[key] = self._render(max_tokens, model)
+        return self._rendered[key]
+
+    def _render(self, max_tokens: int, model: Optional[str]) -> str:
+        if self.version is None or max_tokens <= 0:
+            return ""
+
+        header = f"WORLD CONTEXT ({self.world_name}):"
+        lines = [header]
+        used = count_tokens(header, model)
+
+        def add_line(line: str) -> bool:
+            nonlocal used
+            tokens = count_tokens(line, model)
+            if used + tokens > max_tokens:
+                return False
+            lines.append(line)
+            used += tokens
+            return True
+
+        for key in ("description", "tone"):
+            if self.world_data.get(key):
+                add_line(f"{key.title()}: {truncate_to_tokens(str(self.world_data[key]), max_tokens // 4, model)}")
+
+        for entity_type, title in (("locations", "Locations"), ("npcs", "Known NPCs")):
+            labels = [entity_label(entity) for entity in reversed(self.recent[entity_type])]
+            if not labels:
+                continue
+            # Newest first, as many as fit
+            for count in range(len(labels), 0, -1):
+                if add_line(f"{title} ({self.counts[entity_type]} total): " + "; ".join(labels[:count])):
+                    break
+
+        return "\n".join(lines) if len(lines) > 1 else ""
@@ -4,12 +4,11 @@ Character Backstory Generator Agent
 Generates detailed character backstories with personal history, motivations, and character development.
 """
 
-import os
+from typing import Iterator
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from pathlib import Path
-from core.llm_service import llm_service
-from core.text_utils import clean_sheet
+from core.generator_agent import BaseGeneratorAgent
+from core.sheet_model import sheet_model
 
 # Path to the directory containing prompts
 PROMPT_DIR = Path(__file__).parent / "prompts"
@@ -21,6 +20,10 @@ with open(PROMPT_DIR / "full.prompt", "r") as f:
 with open(PROMPT_DIR / "brief.prompt", "r") as f:
     BACKSTORY_TEMPLATE_BRIEF = f.read()
 
+# Fields of the templates, for structured output
+BackstorySheet = sheet_model("BackstorySheet", BACKSTORY_TEMPLATE_FULL)
+BackstoryBriefSheet = sheet_model("BackstoryBriefSheet", BACKSTORY_TEMPLATE_BRIEF)
+
 # Backstory-specific filler phrases to remove
 BACKSTORY_FILLER_PHRASES = [
     "Here is the character backstory",
@@ -30,31 +33,8 @@ BACKSTORY_FILLER_PHRASES = [
     "Behold the character's tale"
 ]
 
-class BackstorySpec(BaseModel):
-    """Input specification for character backstory generation."""
-    world_name: str = Field(..., description="Name of the world/campaign")
-    prompt: str = Field(..., description="A freeform text prompt describing the character backstory.")
-    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
-
-
-class BackstoryGeneratorAgent:
-    """Agent for generating detailed character backstories by filling out a template."""
-    
-    def __init__(self):
-        self.client = llm_service.client
-        self.model = llm_service.model
-
-    def generate_backstory_sheet(self, input_spec: BackstorySpec) -> str:
-        """
-        Generates a detailed character backstory sheet based on a freeform prompt.
-        
-        Args:
-            input_spec: Specification for the character backstory to generate.
-            
-        Returns:
-            A formatted string containing the completed backstory template.
-        """
-        system_prompt = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided character backstory sheet template using the user's prompt.
+# Backstory-specific system prompt
+BACKSTORY_SYSTEM_PROMPT = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided character backstory sheet template using the user's prompt.
 
 IMPORTANT CREATIVITY GUIDELINES:
 - Be unexpected and avoid common tropes and stereotypes
@@ -76,15 +56,31 @@ D&D SETTING CONSTRAINTS:
 - Be creative with personal history and character development, but stay within D&D lore
 
 You must fill out the template directly. Do not add any extra comments, introductions, or sign-offs. Your response should only contain the filled-out template."""
-        
-        # Choose the template based on the 'brief' flag
-        template = BACKSTORY_TEMPLATE_BRIEF if input_spec.brief else BACKSTORY_TEMPLATE_FULL
-        
-        user_prompt = f"""
-Please create a character backstory based on the following idea:
----
-USER PROMPT: "{input_spec.prompt}"
----
+
+class BackstorySpec(BaseModel):
+    """Input specification for character backstory generation."""
+    world_name: str = Field(..., description="Name of the world/campaign")
+    prompt: str = Field(..., description="A freeform text prompt describing the character backstory.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+
+
+class BackstoryGeneratorAgent(BaseGeneratorAgent):
+    """Agent for generating detailed character backstories by filling out a template."""
+
+    spec_class = BackstorySpec
+    system_prompt = BACKSTORY_SYSTEM_PROMPT
+    template_full = BACKSTORY_TEMPLATE_FULL
+    template_brief = BACKSTORY_TEMPLATE_BRIEF
+    filler_phrases = BACKSTORY_FILLER_PHRASES
+    sheet_full = BackstorySheet
+    sheet_brief = BackstoryBriefSheet
+    entity_type = "backstories"
+    entity_fields = {"name": "character_name", "race": "race_species"}
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the static guidelines and template, which are the same for every request."""
+        return f"""
+You will create a character backstory from an idea given at the end of this message.
 
 CREATIVITY CHALLENGE: Make this character's story truly unique and memorable. Avoid obvious tropes and create something that will surprise players. Think about what would make this character's background stand out in a world full of fantasy heroes and villains.
 
@@ -92,24 +88,39 @@ IMPORTANT: Use only standard D&D settings and elements. Be creative with persona
 
 CONTEXT AWARENESS: If the prompt includes context from a previous conversation (like numbered ideas or user preferences), make sure to incorporate those specific elements into your backstory creation. Don't ignore the context - build upon it!
 
-Now, take that idea and fill out this template completely. Be creative and make the character's story come alive with depth, emotion, and compelling narrative elements.
+Fill out this template completely. Be creative and make the character's story come alive with depth, emotion, and compelling narrative elements.
 
 {template}
 """
+
+    def build_request(self, input_spec: BackstorySpec) -> str:
+        """Builds the part of the message that changes with each request."""
+        return f"""
+Please create a character backstory based on the following idea:
+---
+USER PROMPT: "{input_spec.prompt}"
+---
+"""
+
+    def generate_backstory_sheet(self, input_spec: BackstorySpec) -> str:
+        """
+        Generates a detailed character backstory sheet based on a freeform prompt.
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.9, # Increased for more creative and diverse outputs
-            max_tokens=2500,
-        )
-        
-        raw_sheet = response.choices[0].message.content
-        cleaned_sheet = clean_sheet(raw_sheet, BACKSTORY_FILLER_PHRASES)
-        return cleaned_sheet
+        Args:
+            input_spec: Specification for the character backstory to generate.
+            
+        Returns:
+            A formatted string containing the completed backstory template.
+        """
+        return self.generate_sheet(input_spec)
+
+    def stream_backstory_sheet(self, input_spec: BackstorySpec) -> Iterator[str]:
+        """Generates a character backstory sheet, yielding it line by line as the model writes it."""
+        return self.stream_sheet(input_spec)
+
+    async def generate_backstory_sheet_async(self, input_spec: BackstorySpec) -> str:
+        """Async version of generate_backstory_sheet."""
+        return await self.generate_sheet_async(input_spec)
 
 
 # Convenience function for direct usage
@@ -118,4 +129,16 @@ def generate_backstory(input_spec: BackstorySpec) -> str:
     Generates a character backstory sheet using the BackstoryGeneratorAgent.
     """
     agent = BackstoryGeneratorAgent()
-    return agent.generate_backstory_sheet(input_spec) 
\ No newline at end of file
+    return agent.generate_backstory_sheet(input_spec)
+
+
+def stream_backstory(input_spec: BackstorySpec) -> Iterator[str]:
+    """Streams a character backstory sheet line by line using the BackstoryGeneratorAgent."""
+    agent = BackstoryGeneratorAgent()
+    return agent.stream_backstory_sheet(input_spec)
+
+
+async def generate_backstory_async(input_spec: BackstorySpec) -> str:
+    """Generates a character backstory sheet without blocking the event loop."""
+    agent = BackstoryGeneratorAgent()
+    return await agent.generate_backstory_sheet_async(input_spec)
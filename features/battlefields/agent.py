@@ -4,12 +4,11 @@ Battlefield Generator Agent
 Generates detailed battlefield descriptions with terrain, hazards, and tactical considerations.
 """
 
-import os
+from typing import Iterator
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from pathlib import Path
-from core.llm_service import llm_service
-from core.text_utils import clean_sheet
+from core.generator_agent import BaseGeneratorAgent
+from core.sheet_model import sheet_model
 
 # Path to the directory containing prompts
 PROMPT_DIR = Path(__file__).parent / "prompts"
@@ -21,6 +20,10 @@ with open(PROMPT_DIR / "full.prompt", "r") as f:
 with open(PROMPT_DIR / "brief.prompt", "r") as f:
     BATTLEFIELD_TEMPLATE_BRIEF = f.read()
 
+# Fields of the templates, for structured output
+BattlefieldSheet = sheet_model("BattlefieldSheet", BATTLEFIELD_TEMPLATE_FULL)
+BattlefieldBriefSheet = sheet_model("BattlefieldBriefSheet", BATTLEFIELD_TEMPLATE_BRIEF)
+
 # Battlefield-specific filler phrases to remove
 BATTLEFIELD_FILLER_PHRASES = [
     "Here is the battlefield profile",
@@ -30,31 +33,8 @@ BATTLEFIELD_FILLER_PHRASES = [
     "Behold the battlefield"
 ]
 
-class BattlefieldSpec(BaseModel):
-    """Input specification for battlefield generation."""
-    world_name: str = Field(..., description="Name of the world/campaign")
-    prompt: str = Field(..., description="A freeform text prompt describing the battlefield.")
-    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
-
-
-class BattlefieldGeneratorAgent:
-    """Agent for generating detailed battlefields by filling out a template."""
-    
-    def __init__(self):
-        self.client = llm_service.client
-        self.model = llm_service.model
-
-    def generate_battlefield_sheet(self, input_spec: BattlefieldSpec) -> str:
-        """
-        Generates a detailed battlefield sheet based on a freeform prompt.
-        
-        Args:
-            input_spec: Specification for the battlefield to generate.
-            
-        Returns:
-            A formatted string containing the completed battlefield template.
-        """
-        system_prompt = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided battlefield sheet template using the user's prompt.
+# Battlefield-specific system prompt
+BATTLEFIELD_SYSTEM_PROMPT = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided battlefield sheet template using the user's prompt.
 
 IMPORTANT CREATIVITY GUIDELINES:
 - Be unexpected and avoid common tropes and stereotypes
@@ -76,15 +56,31 @@ D&D SETTING CONSTRAINTS:
 - Be creative with terrain and tactical features, but stay within D&D lore
 
 You must fill out the template directly. Do not add any extra comments, introductions, or sign-offs. Your response should only contain the filled-out template."""
-        
-        # Choose the template based on the 'brief' flag
-        template = BATTLEFIELD_TEMPLATE_BRIEF if input_spec.brief else BATTLEFIELD_TEMPLATE_FULL
-        
-        user_prompt = f"""
-Please create a battlefield based on the following idea:
----
-USER PROMPT: "{input_spec.prompt}"
----
+
+class BattlefieldSpec(BaseModel):
+    """Input specification for battlefield generation."""
+    world_name: str = Field(..., description="Name of the world/campaign")
+    prompt: str = Field(..., description="A freeform text prompt describing the battlefield.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+
+
+class BattlefieldGeneratorAgent(BaseGeneratorAgent):
+    """Agent for generating detailed battlefields by filling out a template."""
+
+    spec_class = BattlefieldSpec
+    system_prompt = BATTLEFIELD_SYSTEM_PROMPT
+    template_full = BATTLEFIELD_TEMPLATE_FULL
+    template_brief = BATTLEFIELD_TEMPLATE_BRIEF
+    filler_phrases = BATTLEFIELD_FILLER_PHRASES
+    sheet_full = BattlefieldSheet
+    sheet_brief = BattlefieldBriefSheet
+    entity_type = "battlefields"
+    entity_fields = {"name": "battlefield_name", "location": "location"}
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the static guidelines and template, which are the same for every request."""
+        return f"""
+You will create a battlefield from an idea given at the end of this message.
 
 CREATIVITY CHALLENGE: Make this battlefield truly unique and memorable. Avoid obvious tropes and create something that will surprise players. Think about what would make this battlefield stand out in a world full of fantasy combat environments.
 
@@ -92,24 +88,39 @@ IMPORTANT: Use only standard D&D settings and elements. Be creative with terrain
 
 CONTEXT AWARENESS: If the prompt includes context from a previous conversation (like numbered ideas or user preferences), make sure to incorporate those specific elements into your battlefield creation. Don't ignore the context - build upon it!
 
-Now, take that idea and fill out this template completely. Be creative and make the battlefield come alive with tactical depth and environmental storytelling.
+Fill out this template completely. Be creative and make the battlefield come alive with tactical depth and environmental storytelling.
 
 {template}
 """
+
+    def build_request(self, input_spec: BattlefieldSpec) -> str:
+        """Builds the part of the message that changes with each request."""
+        return f"""
+Please create a battlefield based on the following idea:
+---
+USER PROMPT: "{input_spec.prompt}"
+---
+"""
+
+    def generate_battlefield_sheet(self, input_spec: BattlefieldSpec) -> str:
+        """
+        Generates a detailed battlefield sheet based on a freeform prompt.
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.9, # Increased for more creative and diverse outputs
-            max_tokens=2500,
-        )
-        
-        raw_sheet = response.choices[0].message.content
-        cleaned_sheet = clean_sheet(raw_sheet, BATTLEFIELD_FILLER_PHRASES)
-        return cleaned_sheet
+        Args:
+            input_spec: Specification for the battlefield to generate.
+            
+        Returns:
+            A formatted string containing the completed battlefield template.
+        """
+        return self.generate_sheet(input_spec)
+
+    def stream_battlefield_sheet(self, input_spec: BattlefieldSpec) -> Iterator[str]:
+        """Generates a battlefield sheet, yielding it line by line as the model writes it."""
+        return self.stream_sheet(input_spec)
+
+    async def generate_battlefield_sheet_async(self, input_spec: BattlefieldSpec) -> str:
+        """Async version of generate_battlefield_sheet."""
+        return await self.generate_sheet_async(input_spec)
 
 
 # Convenience function for direct usage
@@ -118,4 +129,16 @@ def generate_battlefield(input_spec: BattlefieldSpec) -> str:
     Generates a battlefield sheet using the BattlefieldGeneratorAgent.
     """
     agent = BattlefieldGeneratorAgent()
-    return agent.generate_battlefield_sheet(input_spec) 
\ No newline at end of file
+    return agent.generate_battlefield_sheet(input_spec)
+
+
+def stream_battlefield(input_spec: BattlefieldSpec) -> Iterator[str]:
+    """Streams a battlefield sheet line by line using the BattlefieldGeneratorAgent."""
+    agent = BattlefieldGeneratorAgent()
+    return agent.stream_battlefield_sheet(input_spec)
+
+
+async def generate_battlefield_async(input_spec: BattlefieldSpec) -> str:
+    """Generates a battlefield sheet without blocking the event loop."""
+    agent = BattlefieldGeneratorAgent()
+    return await agent.generate_battlefield_sheet_async(input_spec)
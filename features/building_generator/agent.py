@@ -1,10 +1,8 @@
-from typing import Optional
-import os
+from typing import Iterator, Optional
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from pathlib import Path
-from core.llm_service import llm_service
-from core.text_utils import clean_sheet
+from core.generator_agent import BaseGeneratorAgent
+from core.sheet_model import sheet_model
 
 # Path to the directory containing prompts
 PROMPT_DIR = Path(__file__).parent / "prompts"
@@ -16,6 +14,10 @@ with open(PROMPT_DIR / "full.prompt", "r") as f:
 with open(PROMPT_DIR / "brief.prompt", "r") as f:
     BUILDING_TEMPLATE_BRIEF = f.read()
 
+# Fields of the templates, for structured output
+BuildingSheet = sheet_model("BuildingSheet", BUILDING_TEMPLATE_FULL)
+BuildingBriefSheet = sheet_model("BuildingBriefSheet", BUILDING_TEMPLATE_BRIEF)
+
 # Building-specific filler phrases to remove
 BUILDING_FILLER_PHRASES = [
     "Here is the building profile",
@@ -24,23 +26,8 @@ BUILDING_FILLER_PHRASES = [
     "Of course, here is the filled-out template"
 ]
 
-class BuildingSpec(BaseModel):
-    """Input specification for building generation."""
-    world_name: str = Field(..., description="Name of the world/campaign")
-    prompt: str = Field(..., description="A freeform text prompt describing the building.")
-    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
-
-
-class BuildingGeneratorAgent:
-    """Agent for generating detailed buildings by filling out a template."""
-    
-    def __init__(self):
-        self.client = llm_service.client
-        self.model = llm_service.model
-
-    def generate_building_sheet(self, input_spec: BuildingSpec) -> str:
-        """Generates a detailed building sheet based on a freeform prompt."""
-        system_prompt = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided location sheet template using the user's prompt.
+# Building-specific system prompt
+BUILDING_SYSTEM_PROMPT = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided location sheet template using the user's prompt.
 
 IMPORTANT CREATIVITY GUIDELINES:
 - Be unexpected and avoid common tropes and stereotypes
@@ -62,15 +49,31 @@ D&D SETTING CONSTRAINTS:
 - Be creative with design, atmosphere, and features, but stay within D&D lore
 
 You must fill out the template directly. Do not add any extra comments, introductions, or sign-offs. Your response should only contain the filled-out template."""
-        
-        # Choose the template based on the 'brief' flag
-        template = BUILDING_TEMPLATE_BRIEF if input_spec.brief else BUILDING_TEMPLATE_FULL
 
-        user_prompt = f"""
-Please create a building based on the following idea:
----
-USER PROMPT: "{input_spec.prompt}"
----
+class BuildingSpec(BaseModel):
+    """Input specification for building generation."""
+    world_name: str = Field(..., description="Name of the world/campaign")
+    prompt: str = Field(..., description="A freeform text prompt describing the building.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+
+
+class BuildingGeneratorAgent(BaseGeneratorAgent):
+    """Agent for generating detailed buildings by filling out a template."""
+
+    spec_class = BuildingSpec
+    system_prompt = BUILDING_SYSTEM_PROMPT
+    template_full = BUILDING_TEMPLATE_FULL
+    template_brief = BUILDING_TEMPLATE_BRIEF
+    filler_phrases = BUILDING_FILLER_PHRASES
+    sheet_full = BuildingSheet
+    sheet_brief = BuildingBriefSheet
+    entity_type = "locations"
+    entity_fields = {"name": "building_name", "region": "location"}
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the static guidelines and template, which are the same for every request."""
+        return f"""
+You will create a building from an idea given at the end of this message.
 
 CREATIVITY CHALLENGE: Make this location truly unique and memorable. Avoid obvious tropes and create something that will surprise players. Think about what would make this building stand out in a world full of fantasy locations.
 
@@ -78,28 +81,47 @@ IMPORTANT: Use only standard D&D settings and elements. Be creative with design
 
 CONTEXT AWARENESS: If the prompt includes context from a previous conversation (like numbered ideas or user preferences), make sure to incorporate those specific elements into your location creation. Don't ignore the context - build upon it!
 
-Now, take that idea and fill out this template completely. Be creative and make the location come alive.
+Fill out this template completely. Be creative and make the location come alive.
 
 {template}
 """
-        
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.9,
-            max_tokens=2500,
-        )
-        
-        raw_sheet = response.choices[0].message.content
-        cleaned_sheet = clean_sheet(raw_sheet, BUILDING_FILLER_PHRASES)
-        return cleaned_sheet
+
+    def build_request(self, input_spec: BuildingSpec) -> str:
+        """Builds the part of the message that changes with each request."""
+        return f"""
+Please create a building based on the following idea:
+---
+USER PROMPT: "{input_spec.prompt}"
+---
+"""
+
+    def generate_building_sheet(self, input_spec: BuildingSpec) -> str:
+        """Generates a detailed building sheet based on a freeform prompt."""
+        return self.generate_sheet(input_spec)
+
+    def stream_building_sheet(self, input_spec: BuildingSpec) -> Iterator[str]:
+        """Generates a building sheet, yielding it line by line as the model writes it."""
+        return self.stream_sheet(input_spec)
+
+    async def generate_building_sheet_async(self, input_spec: BuildingSpec) -> str:
+        """Async version of generate_building_sheet."""
+        return await self.generate_sheet_async(input_spec)
 
 
 # Convenience function for direct usage
 def generate_building(input_spec: BuildingSpec) -> str:
     """Generates a building sheet using the BuildingGeneratorAgent."""
     agent = BuildingGeneratorAgent()
-    return agent.generate_building_sheet(input_spec) 
\ No newline at end of file
+    return agent.generate_building_sheet(input_spec)
+
+
+def stream_building(input_spec: BuildingSpec) -> Iterator[str]:
+    """Streams a building sheet line by line using the BuildingGeneratorAgent."""
+    agent = BuildingGeneratorAgent()
+    return agent.stream_building_sheet(input_spec)
+
+
+async def generate_building_async(input_spec: BuildingSpec) -> str:
+    """Generates a building sheet without blocking the event loop."""
+    agent = BuildingGeneratorAgent()
+    return await agent.generate_building_sheet_async(input_spec)
@@ -4,12 +4,11 @@ Magic Item Generator Agent
 Generates detailed magic items with properties, lore, and mechanics.
 """
 
-import os
+from typing import Iterator
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from pathlib import Path
-from core.llm_service import llm_service
-from core.text_utils import clean_sheet
+from core.generator_agent import BaseGeneratorAgent
+from core.sheet_model import sheet_model
 
 # Path to the directory containing prompts
 PROMPT_DIR = Path(__file__).parent / "prompts"
@@ -21,6 +20,10 @@ with open(PROMPT_DIR / "full.prompt", "r") as f:
 with open(PROMPT_DIR / "brief.prompt", "r") as f:
     MAGIC_ITEM_TEMPLATE_BRIEF = f.read()
 
+# Fields of the templates, for structured output
+MagicItemSheet = sheet_model("MagicItemSheet", MAGIC_ITEM_TEMPLATE_FULL)
+MagicItemBriefSheet = sheet_model("MagicItemBriefSheet", MAGIC_ITEM_TEMPLATE_BRIEF)
+
 # Magic item-specific filler phrases to remove
 MAGIC_ITEM_FILLER_PHRASES = [
     "Here is the magic item profile",
@@ -30,31 +33,8 @@ MAGIC_ITEM_FILLER_PHRASES = [
     "Behold the magical artifact"
 ]
 
-class MagicItemSpec(BaseModel):
-    """Input specification for magic item generation."""
-    world_name: str = Field(..., description="Name of the world/campaign")
-    prompt: str = Field(..., description="A freeform text prompt describing the magic item.")
-    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
-
-
-class MagicItemGeneratorAgent:
-    """Agent for generating detailed magic items by filling out a template."""
-    
-    def __init__(self):
-        self.client = llm_service.client
-        self.model = llm_service.model
-
-    def generate_magic_item_sheet(self, input_spec: MagicItemSpec) -> str:
-        """
-        Generates a detailed magic item sheet based on a freeform prompt.
-        
-        Args:
-            input_spec: Specification for the magic item to generate.
-            
-        Returns:
-            A formatted string containing the completed magic item template.
-        """
-        system_prompt = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided magic item sheet template using the user's prompt.
+# Magic item-specific system prompt
+MAGIC_ITEM_SYSTEM_PROMPT = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided magic item sheet template using the user's prompt.
 
 IMPORTANT CREATIVITY GUIDELINES:
 - Be unexpected and avoid common tropes and stereotypes
@@ -76,15 +56,31 @@ D&D SETTING CONSTRAINTS:
 - Be creative with properties and lore, but stay within D&D magical systems
 
 You must fill out the template directly. Do not add any extra comments, introductions, or sign-offs. Your response should only contain the filled-out template."""
-        
-        # Choose the template based on the 'brief' flag
-        template = MAGIC_ITEM_TEMPLATE_BRIEF if input_spec.brief else MAGIC_ITEM_TEMPLATE_FULL
-        
-        user_prompt = f"""
-Please create a magic item based on the following idea:
----
-USER PROMPT: "{input_spec.prompt}"
----
+
+class MagicItemSpec(BaseModel):
+    """Input specification for magic item generation."""
+    world_name: str = Field(..., description="Name of the world/campaign")
+    prompt: str = Field(..., description="A freeform text prompt describing the magic item.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+
+
+class MagicItemGeneratorAgent(BaseGeneratorAgent):
+    """Agent for generating detailed magic items by filling out a template."""
+
+    spec_class = MagicItemSpec
+    system_prompt = MAGIC_ITEM_SYSTEM_PROMPT
+    template_full = MAGIC_ITEM_TEMPLATE_FULL
+    template_brief = MAGIC_ITEM_TEMPLATE_BRIEF
+    filler_phrases = MAGIC_ITEM_FILLER_PHRASES
+    sheet_full = MagicItemSheet
+    sheet_brief = MagicItemBriefSheet
+    entity_type = "items"
+    entity_fields = {"name": "item_name", "rarity": "rarity"}
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the static guidelines and template, which are the same for every request."""
+        return f"""
+You will create a magic item from an idea given at the end of this message.
 
 CREATIVITY CHALLENGE: Make this magic item truly unique and memorable. Avoid obvious tropes and create something that will surprise players. Think about what would make this item stand out in a world full of fantasy artifacts.
 
@@ -92,24 +88,39 @@ IMPORTANT: Use only standard D&D magic and lore. Be creative with properties and
 
 CONTEXT AWARENESS: If the prompt includes context from a previous conversation (like numbered ideas or user preferences), make sure to incorporate those specific elements into your magic item creation. Don't ignore the context - build upon it!
 
-Now, take that idea and fill out this template completely. Be creative and make the magic item come alive with interesting properties and lore.
+Fill out this template completely. Be creative and make the magic item come alive with interesting properties and lore.
 
 {template}
 """
+
+    def build_request(self, input_spec: MagicItemSpec) -> str:
+        """Builds the part of the message that changes with each request."""
+        return f"""
+Please create a magic item based on the following idea:
+---
+USER PROMPT: "{input_spec.prompt}"
+---
+"""
+
+    def generate_magic_item_sheet(self, input_spec: MagicItemSpec) -> str:
+        """
+        Generates a detailed magic item sheet based on a freeform prompt.
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.9, # Increased for more creative and diverse outputs
-            max_tokens=2500,
-        )
-        
-        raw_sheet = response.choices[0].message.content
-        cleaned_sheet = clean_sheet(raw_sheet, MAGIC_ITEM_FILLER_PHRASES)
-        return cleaned_sheet
+        Args:
+            input_spec: Specification for the magic item to generate.
+            
+        Returns:
+            A formatted string containing the completed magic item template.
+        """
+        return self.generate_sheet(input_spec)
+
+    def stream_magic_item_sheet(self, input_spec: MagicItemSpec) -> Iterator[str]:
+        """Generates a magic item sheet, yielding it line by line as the model writes it."""
+        return self.stream_sheet(input_spec)
+
+    async def generate_magic_item_sheet_async(self, input_spec: MagicItemSpec) -> str:
+        """Async version of generate_magic_item_sheet."""
+        return await self.generate_sheet_async(input_spec)
 
 
 # Convenience function for direct usage
@@ -118,4 +129,16 @@ def generate_magic_item(input_spec: MagicItemSpec) -> str:
     Generates a magic item sheet using the MagicItemGeneratorAgent.
     """
     agent = MagicItemGeneratorAgent()
-    return agent.generate_magic_item_sheet(input_spec) 
\ No newline at end of file
+    return agent.generate_magic_item_sheet(input_spec)
+
+
+def stream_magic_item(input_spec: MagicItemSpec) -> Iterator[str]:
+    """Streams a magic item sheet line by line using the MagicItemGeneratorAgent."""
+    agent = MagicItemGeneratorAgent()
+    return agent.stream_magic_item_sheet(input_spec)
+
+
+async def generate_magic_item_async(input_spec: MagicItemSpec) -> str:
+    """Generates a magic item sheet without blocking the event loop."""
+    agent = MagicItemGeneratorAgent()
+    return await agent.generate_magic_item_sheet_async(input_spec)
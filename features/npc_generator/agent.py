@@ -4,12 +4,11 @@ NPC Generator Agent
 Generates detailed NPCs with names, races, classes, motives, secrets, and dialogue.
 """
 
-import os
+from typing import Iterator
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from pathlib import Path
-from core.llm_service import llm_service
-from core.text_utils import clean_sheet
+from core.generator_agent import BaseGeneratorAgent
+from core.sheet_model import sheet_model
 
 # Path to the directory containing prompts
 PROMPT_DIR = Path(__file__).parent / "prompts"
@@ -21,6 +20,10 @@ with open(PROMPT_DIR / "full.prompt", "r") as f:
 with open(PROMPT_DIR / "brief.prompt", "r") as f:
     NPC_TEMPLATE_BRIEF = f.read()
 
+# Fields of the templates, for structured output
+NPCSheet = sheet_model("NPCSheet", NPC_TEMPLATE_FULL)
+NPCBriefSheet = sheet_model("NPCBriefSheet", NPC_TEMPLATE_BRIEF)
+
 # NPC-specific filler phrases to remove
 NPC_FILLER_PHRASES = [
     "Here is the NPC template filled out",
@@ -30,31 +33,8 @@ NPC_FILLER_PHRASES = [
     "Oh, behold the enigmatic"
 ]
 
-class NPCSpec(BaseModel):
-    """Input specification for NPC generation."""
-    world_name: str = Field(..., description="Name of the world/campaign")
-    prompt: str = Field(..., description="A freeform text prompt describing the NPC.")
-    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
-
-
-class NPCGeneratorAgent:
-    """Agent for generating detailed NPCs by filling out a template."""
-    
-    def __init__(self):
-        self.client = llm_service.client
-        self.model = llm_service.model
-
-    def generate_npc_sheet(self, input_spec: NPCSpec) -> str:
-        """
-        Generates a detailed NPC character sheet based on a freeform prompt.
-        
-        Args:
-            input_spec: Specification for the NPC to generate.
-            
-        Returns:
-            A formatted string containing the completed NPC template.
-        """
-        system_prompt = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided character sheet template using the user's prompt.
+# NPC-specific system prompt
+NPC_SYSTEM_PROMPT = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided character sheet template using the user's prompt.
 
 IMPORTANT CREATIVITY GUIDELINES:
 - Be unexpected and avoid common tropes and stereotypes
@@ -76,15 +56,31 @@ D&D RACE CONSTRAINTS:
 - Be creative with personality, background, and role, but stay within D&D lore
 
 You must fill out the template directly. Do not add any extra comments, introductions, or sign-offs. Your response should only contain the filled-out template."""
-        
-        # Choose the template based on the 'brief' flag
-        template = NPC_TEMPLATE_BRIEF if input_spec.brief else NPC_TEMPLATE_FULL
-        
-        user_prompt = f"""
-Please create an NPC based on the following idea:
----
-USER PROMPT: "{input_spec.prompt}"
----
+
+class NPCSpec(BaseModel):
+    """Input specification for NPC generation."""
+    world_name: str = Field(..., description="Name of the world/campaign")
+    prompt: str = Field(..., description="A freeform text prompt describing the NPC.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+
+
+class NPCGeneratorAgent(BaseGeneratorAgent):
+    """Agent for generating detailed NPCs by filling out a template."""
+
+    spec_class = NPCSpec
+    system_prompt = NPC_SYSTEM_PROMPT
+    template_full = NPC_TEMPLATE_FULL
+    template_brief = NPC_TEMPLATE_BRIEF
+    filler_phrases = NPC_FILLER_PHRASES
+    sheet_full = NPCSheet
+    sheet_brief = NPCBriefSheet
+    entity_type = "npcs"
+    entity_fields = {"name": "name", "race": "race_species", "role": "occupation_role", "location": "location_where_usually_found"}
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the static guidelines and template, which are the same for every request."""
+        return f"""
+You will create an NPC from an idea given at the end of this message.
 
 CREATIVITY CHALLENGE: Make this character truly unique and memorable. Avoid obvious tropes and create something that will surprise players. Think about what would make this character stand out in a world full of fantasy characters.
 
@@ -92,24 +88,39 @@ IMPORTANT: Use only standard D&D races and creatures. Be creative with personali
 
 CONTEXT AWARENESS: If the prompt includes context from a previous conversation (like numbered ideas or user preferences), make sure to incorporate those specific elements into your character creation. Don't ignore the context - build upon it!
 
-Now, take that idea and fill out this template completely. Be creative and make the character come alive.
+Fill out this template completely. Be creative and make the character come alive.
 
 {template}
 """
+
+    def build_request(self, input_spec: NPCSpec) -> str:
+        """Builds the part of the message that changes with each request."""
+        return f"""
+Please create an NPC based on the following idea:
+---
+USER PROMPT: "{input_spec.prompt}"
+---
+"""
+
+    def generate_npc_sheet(self, input_spec: NPCSpec) -> str:
+        """
+        Generates a detailed NPC character sheet based on a freeform prompt.
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.9, # Increased for more creative and diverse outputs
-            max_tokens=2500,
-        )
-        
-        raw_sheet = response.choices[0].message.content
-        cleaned_sheet = clean_sheet(raw_sheet, NPC_FILLER_PHRASES)
-        return cleaned_sheet
+        Args:
+            input_spec: Specification for the NPC to generate.
+            
+        Returns:
+            A formatted string containing the completed NPC template.
+        """
+        return self.generate_sheet(input_spec)
+
+    def stream_npc_sheet(self, input_spec: NPCSpec) -> Iterator[str]:
+        """Generates an NPC character sheet, yielding it line by line as the model writes it."""
+        return self.stream_sheet(input_spec)
+
+    async def generate_npc_sheet_async(self, input_spec: NPCSpec) -> str:
+        """Async version of generate_npc_sheet."""
+        return await self.generate_sheet_async(input_spec)
 
 
 # Convenience function for direct usage
@@ -118,4 +129,16 @@ def generate_npc(input_spec: NPCSpec) -> str:
     Generates an NPC character sheet using the NPC generator agent.
     """
     agent = NPCGeneratorAgent()
-    return agent.generate_npc_sheet(input_spec) 
\ No newline at end of file
+    return agent.generate_npc_sheet(input_spec)
+
+
+def stream_npc(input_spec: NPCSpec) -> Iterator[str]:
+    """Streams an NPC character sheet line by line using the NPCGeneratorAgent."""
+    agent = NPCGeneratorAgent()
+    return agent.stream_npc_sheet(input_spec)
+
+
+async def generate_npc_async(input_spec: NPCSpec) -> str:
+    """Generates an NPC character sheet without blocking the event loop."""
+    agent = NPCGeneratorAgent()
+    return await agent.generate_npc_sheet_async(input_spec)
@@ -4,12 +4,11 @@ Quest Generator Agent
 Generates detailed TTRPG quests with objectives, rewards, NPCs, and plot hooks.
 """
 
-import os
+from typing import Iterator
 from pydantic import BaseModel, Field
-from openai import OpenAI
 from pathlib import Path
-from core.llm_service import llm_service
-from core.text_utils import clean_sheet
+from core.generator_agent import BaseGeneratorAgent
+from core.sheet_model import sheet_model
 
 # Path to the directory containing prompts
 PROMPT_DIR = Path(__file__).parent / "prompts"
@@ -21,6 +20,10 @@ with open(PROMPT_DIR / "full.prompt", "r") as f:
 with open(PROMPT_DIR / "brief.prompt", "r") as f:
     QUEST_TEMPLATE_BRIEF = f.read()
 
+# Fields of the templates, for structured output
+QuestSheet = sheet_model("QuestSheet", QUEST_TEMPLATE_FULL)
+QuestBriefSheet = sheet_model("QuestBriefSheet", QUEST_TEMPLATE_BRIEF)
+
 # Quest-specific filler phrases to remove
 QUEST_FILLER_PHRASES = [
     "Here is the quest profile",
@@ -29,23 +32,8 @@ QUEST_FILLER_PHRASES = [
     "Of course, here is the filled-out template"
 ]
 
-class QuestSpec(BaseModel):
-    """Input specification for quest generation."""
-    world_name: str = Field(..., description="Name of the world/campaign")
-    prompt: str = Field(..., description="A freeform text prompt describing the quest.")
-    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
-
-
-class QuestGeneratorAgent:
-    """Agent for generating detailed quests by filling out a template."""
-    
-    def __init__(self):
-        self.client = llm_service.client
-        self.model = llm_service.model
-
-    def generate_quest_sheet(self, input_spec: QuestSpec) -> str:
-        """Generates a detailed quest sheet based on a freeform prompt."""
-        system_prompt = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided quest sheet template using the user's prompt.
+# Quest-specific system prompt
+QUEST_SYSTEM_PROMPT = """You are a creative and imaginative TTRPG assistant. Your job is to fill out the provided quest sheet template using the user's prompt.
 
 IMPORTANT CREATIVITY GUIDELINES:
 - Be unexpected and avoid common tropes and stereotypes
@@ -67,15 +55,31 @@ D&D SETTING CONSTRAINTS:
 - Be creative with plot, challenges, and rewards, but stay within D&D lore
 
 You must fill out the template directly. Do not add any extra comments, introductions, or sign-offs. Your response should only contain the filled-out template."""
-        
-        # Choose the template based on the 'brief' flag
-        template = QUEST_TEMPLATE_BRIEF if input_spec.brief else QUEST_TEMPLATE_FULL
 
-        user_prompt = f"""
-Please create a quest based on the following idea:
----
-USER PROMPT: "{input_spec.prompt}"
----
+class QuestSpec(BaseModel):
+    """Input specification for quest generation."""
+    world_name: str = Field(..., description="Name of the world/campaign")
+    prompt: str = Field(..., description="A freeform text prompt describing the quest.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+
+
+class QuestGeneratorAgent(BaseGeneratorAgent):
+    """Agent for generating detailed quests by filling out a template."""
+
+    spec_class = QuestSpec
+    system_prompt = QUEST_SYSTEM_PROMPT
+    template_full = QUEST_TEMPLATE_FULL
+    template_brief = QUEST_TEMPLATE_BRIEF
+    filler_phrases = QUEST_FILLER_PHRASES
+    sheet_full = QuestSheet
+    sheet_brief = QuestBriefSheet
+    entity_type = "quests"
+    entity_fields = {"name": "quest_title"}
+
+    def build_instructions(self, template: str) -> str:
+        """Builds the static guidelines and template, which are the same for every request."""
+        return f"""
+You will create a quest from an idea given at the end of this message.
 
 CREATIVITY CHALLENGE: Make this quest truly unique and memorable. Avoid obvious tropes and create something that will surprise players. Think about what would make this quest stand out in a world full of fantasy adventures.
 
@@ -83,28 +87,47 @@ IMPORTANT: Use only standard D&D settings and elements. Be creative with plot an
 
 CONTEXT AWARENESS: If the prompt includes context from a previous conversation (like numbered ideas or user preferences), make sure to incorporate those specific elements into your quest creation. Don't ignore the context - build upon it!
 
-Now, take that idea and fill out this template completely. Be creative and make the quest come alive with interesting challenges, meaningful choices, and compelling rewards.
+Fill out this template completely. Be creative and make the quest come alive with interesting challenges, meaningful choices, and compelling rewards.
 
 {template}
 """
-        
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.9, # Increased for more creative and diverse outputs
-            max_tokens=2500,
-        )
-        
-        raw_sheet = response.choices[0].message.content
-        cleaned_sheet = clean_sheet(raw_sheet, QUEST_FILLER_PHRASES)
-        return cleaned_sheet
+
+    def build_request(self, input_spec: QuestSpec) -> str:
+        """Builds the part of the message that changes with each request."""
+        return f"""
+Please create a quest based on the following idea:
+---
+USER PROMPT: "{input_spec.prompt}"
+---
+"""
+
+    def generate_quest_sheet(self, input_spec: QuestSpec) -> str:
+        """Generates a detailed quest sheet based on a freeform prompt."""
+        return self.generate_sheet(input_spec)
+
+    def stream_quest_sheet(self, input_spec: QuestSpec) -> Iterator[str]:
+        """Generates a quest sheet, yielding it line by line as the model writes it."""
+        return self.stream_sheet(input_spec)
+
+    async def generate_quest_sheet_async(self, input_spec: QuestSpec) -> str:
+        """Async version of generate_quest_sheet."""
+        return await self.generate_sheet_async(input_spec)
 
 
 # Convenience function for direct usage
 def generate_quest(input_spec: QuestSpec) -> str:
     """Generates a quest sheet using the QuestGeneratorAgent."""
     agent = QuestGeneratorAgent()
-    return agent.generate_quest_sheet(input_spec) 
\ No newline at end of file
+    return agent.generate_quest_sheet(input_spec)
+
+
+def stream_quest(input_spec: QuestSpec) -> Iterator[str]:
+    """Streams a quest sheet line by line using the QuestGeneratorAgent."""
+    agent = QuestGeneratorAgent()
+    return agent.stream_quest_sheet(input_spec)
+
+
+async def generate_quest_async(input_spec: QuestSpec) -> str:
+    """Generates a quest sheet without blocking the event loop."""
+    agent = QuestGeneratorAgent()
+    return await agent.generate_quest_sheet_async(input_spec)
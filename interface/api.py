@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+HTTP API for TTRPG Sidekick
+
+An async FastAPI server that keeps one warm LLM service (clients, connection pools,
+loaded model, caches) for every request, instead of starting a process per request.
+
+Routes:
+- GET /health: model state and current load
+- GET /generators: the generators and what they create
+- POST /generate/{kind}: generates a sheet, e.g. /generate/npc with
+  {"prompt": "a grumpy dwarf", "world": "Eberron", "brief": true}
+- POST /expand/{kind}: expands a brief sheet into the full one, generating only the
+  fields it lacks, e.g. /expand/npc with {"prompt": "a grumpy dwarf", "sheet": "..."}
+- POST /chat: starts a chat session; POST /chat/{session_id} sends it a message;
+  DELETE /chat/{session_id} ends it
+
+With "stream": true, generation and chat replies are sent as server-sent events as the
+model writes them: one `data: {"text": ...}` event per fragment, then an `event: done`
+(or `event: error`) event.
+
+Requests are admitted by core.admission: at most TTRPG_API_MAX_IN_FLIGHT at once, at
+most TTRPG_API_CLIENT_LIMIT per client (the X-Client-Id header, or the client's
+address), and at most TTRPG_API_MAX_QUEUE waiting. Anything beyond that is answered
+with 429 and a Retry-After header.
+
+Usage:
+    python -m interface.api --port 8000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+
+from core.admission import AdmissionController, OverloadedError
+from core.llm_service import llm_service
+from core.single_flight import single_flight
+from core.transport import CircuitOpenError, DeadlineExceededError
+from interface.cli import SmartChatSession
+from router import GENERATORS
+
+# Chat sessions kept at once; the least recently used one is dropped beyond this
+MAX_CHAT_SESSIONS = int(os.getenv("TTRPG_API_MAX_SESSIONS", "256"))
+
+# Seconds a chat session may sit idle before it is dropped
+CHAT_SESSION_TTL = float(os.getenv("TTRPG_API_SESSION_TTL", "3600"))
+
+DEFAULT_WORLD = "Forgotten Realms"
+
+
+class GenerateRequest(BaseModel):
+    """Body of POST /generate/{kind}."""
+    prompt: str = Field(..., description="What to create, e.g. 'a grumpy dwarf blacksmith'.")
+    world: str = Field(DEFAULT_WORLD, description="Name of the world/campaign.")
+    brief: bool = Field(False, description="Whether to generate a brief version of the sheet.")
+    stream: bool = Field(False, description="Send the sheet as server-sent events as it is written.")
+    structured: Optional[bool] = Field(None, description="Have the model fill in JSON fields (default: TTRPG_STRUCTURED_OUTPUT).")
+    sectioned: Optional[bool] = Field(None, description="Write a full sheet's sections with concurrent requests (default: TTRPG_SECTIONED).")
+
+
+class ExpandRequest(BaseModel):
+    """Body of POST /expand/{kind}."""
+    prompt: str = Field(..., description="What the brief sheet was created from.")
+    sheet: str = Field(..., description="The brief sheet to expand.")
+    world: str = Field(DEFAULT_WORLD, description="Name of the world/campaign.")
+    structured: Optional[bool] = Field(None, description="Have the model fill in JSON fields (default: TTRPG_STRUCTURED_OUTPUT).")
+
+
+class ChatStartRequest(BaseModel):
+    """Body of POST /chat."""
+    world: Optional[str] = Field(None, description="Name of the world/campaign.")
+    brief: bool = Field(True, description="Whether generators in this chat write brief sheets.")
+
+
+class ChatMessageRequest(BaseModel):
+    """Body of POST /chat/{session_id}."""
+    message: str = Field(..., description="The player's message; qualifiers like '/npc ...' work as in the CLI.")
+    stream: bool = Field(False, description="Send the reply as server-sent events as it is written.")
+
+
+class ChatSessions:
+    """Chat sessions by id, dropping the least recently used and idle ones."""
+
+    def __init__(self, max_sessions: int = MAX_CHAT_SESSIONS, ttl: float = CHAT_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, tuple[SmartChatSession, asyncio.Lock, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, world: Optional[str], brief: bool) -> str:
+        self._expire()
+        session = SmartChatSession(world)
+        session.brief_mode = brief
+        session_id = os.urandom(12).hex()
+        self._sessions[session_id] = (session, asyncio.Lock(), time.monotonic())
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id: str) -> tuple[SmartChatSession, asyncio.Lock]:
+        """The session and the lock that keeps its messages in order; raises 404 if it doesn't exist."""
+        self._expire()
+        if session_id not in self._sessions:
+            raise HTTPException(status_code=404, detail="Unknown or expired chat session")
+        session, lock, _ = self._sessions[session_id]
+        self._sessions[session_id] = (session, lock, time.monotonic())
+        self._sessions.move_to_end(session_id)
+        return session, lock
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, (_, _, last_used) = next(iter(self._sessions.items()))
+            if last_used >= cutoff:
+                break
+            del self._sessions[session_id]
+
+
+admission = AdmissionController.from_env()
+sessions = ChatSessions()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Load the model before the first request arrives and keep it loaded
+    llm_service.warm_up(keep_warm=True)
+    yield
+    llm_service.keep_alive.stop()
+    await llm_service.aclose()
+
+
+app = FastAPI(title="TTRPG Sidekick", lifespan=lifespan)
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded(request: Request, error: OverloadedError) -> JSONResponse:
+    return JSONResponse({"detail": str(error)}, status_code=429, headers={"Retry-After": str(int(error.retry_after))})
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded(request: Request, error: DeadlineExceededError) -> JSONResponse:
+    return JSONResponse({"detail": str(error)}, status_code=504)
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open(request: Request, error: CircuitOpenError) -> JSONResponse:
+    return JSONResponse({"detail": str(error)}, status_code=503, headers={"Retry-After": "5"})
+
+
+def client_id(request: Request) -> str:
+    """Who a request counts against for the per-client limit."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def iterate_in_thread(iterator: Iterator[str]) -> AsyncIterator[str]:
+    """
+    Runs a blocking iterator in worker threads, so it doesn't hold up the event loop. The
+    iterator is closed however the loop ends, e.g. when the client disconnects mid-stream.
+    """
+    done = object()
+    step = None
+    try:
+        while True:
+            # Shielded, so a cancelled caller doesn't leave the thread running the iterator unseen
+            step = asyncio.ensure_future(asyncio.to_thread(next, iterator, done))
+            piece = await asyncio.shield(step)
+            if piece is done:
+                return
+            yield piece
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            if step is not None and not step.done():
+                # A generator can't be closed while a thread is still running it
+                await asyncio.wait({step})
+            await asyncio.to_thread(close)
+
+
+def sse_response(pieces: AsyncIterator[str], release: Callable[[], None], on_complete: Optional[Callable[[str], None]] = None) -> StreamingResponse:
+    """
+    Streams text fragments as server-sent events, freeing the admission slot when the
+    stream ends or the client disconnects. `release` must be safe to call twice: it also
+    runs after the response, in case the client left before the stream started.
+    """
+    async def events() -> AsyncIterator[str]:
+        parts = []
+        try:
+            async for piece in pieces:
+                parts.append(piece)
+                yield sse_event({"text": piece})
+            if on_complete is not None:
+                on_complete("".join(parts))
+            yield sse_event({}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e), "type": type(e).__name__}, event="error")
+        finally:
+            release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
+
+
+@app.get("/health")
+async def health() -> dict:
+    return {
+        "status": "ok",
+        "model": llm_service.model,
+        "provider": llm_service.provider,
+        "model_state": llm_service.model_state,
+        "load": admission.stats(),
+        "coalescing": single_flight.stats(),
+        "chat_sessions": len(sessions),
+    }
+
+
+@app.get("/generators")
+async def generators() -> dict:
+    return {name: entry.description for name, entry in GENERATORS.items()}
+
+
+@app.post("/generate/{kind}")
+async def generate(kind: str, body: GenerateRequest, request: Request):
+    generator = GENERATORS.get(kind)
+    if generator is None:
+        raise HTTPException(status_code=404, detail=f"Unknown generator '{kind}'. Available: {', '.join(GENERATORS)}")
+    spec = generator.create_spec(body.world, body.prompt, body.brief)
+    agent = generator.agent_class(structured=body.structured, sectioned=body.sectioned)
+
+    release = await admission.acquire(client_id(request))
+    if body.stream:
+        return sse_response(agent.stream_sheet_async(spec), release)
+    try:
+        sheet = await agent.generate_sheet_async(spec)
+    finally:
+        release()
+    return {"kind": kind, "world": body.world, "brief": body.brief, "sheet": sheet}
+
+
+@app.post("/expand/{kind}")
+async def expand(kind: str, body: ExpandRequest, request: Request) -> dict:
+    generator = GENERATORS.get(kind)
+    if generator is None:
+        raise HTTPException(status_code=404, detail=f"Unknown generator '{kind}'. Available: {', '.join(GENERATORS)}")
+    spec = generator.create_spec(body.world, body.prompt, False)
+    agent = generator.agent_class(structured=body.structured)
+
+    release = await admission.acquire(client_id(request))
+    try:
+        sheet = await agent.expand_sheet_async(spec, body.sheet)
+    finally:
+        release()
+    return {"kind": kind, "world": body.world, "brief": False, "sheet": sheet}
+
+
+@app.post("/chat")
+async def start_chat(body: ChatStartRequest) -> dict:
+    return {"session_id": sessions.create(body.world, body.brief)}
+
+
+@app.post("/chat/{session_id}")
+async def chat(session_id: str, body: ChatMessageRequest, request: Request):
+    session, lock = sessions.get(session_id)
+    # One message at a time per session, so the history stays in order. The lock is taken
+    # first, so a message waiting behind another of its session doesn't hold an admission slot
+    await lock.acquire()
+    try:
+        release = await admission.acquire(client_id(request))
+    except BaseException:
+        lock.release()
+        raise
+
+    finished = False
+
+    def finish() -> None:
+        nonlocal finished
+        if not finished:
+            finished = True
+            release()
+            lock.release()
+
+    session.add_message("user", body.message)
+    if body.stream:
+        return sse_response(
+            iterate_in_thread(session.handle_input_stream(body.message)),
+            finish,
+            on_complete=lambda reply: session.add_message("assistant", reply),
+        )
+    try:
+        reply = await asyncio.to_thread(session.handle_input, body.message)
+        session.add_message("assistant", reply)
+    finally:
+        finish()
+    return {"session_id": session_id, "reply": reply}
+
+
+@app.delete("/chat/{session_id}")
+async def end_chat(session_id: str) -> dict:
+    sessions.delete(session_id)
+    return {"session_id": session_id, "deleted": True}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the TTRPG Sidekick HTTP API.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    args = parser.parse_args()
+    # A single worker, so every request shares the warm LLM service and the admission limits
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,63 @@ Provides an interactive chat interface that intelligently routes to specific gen
 when appropriate, while maintaining conversational capabilities for general questions.
 """
 
+import argparse
 import os
 import sys
+from typing import Iterator, Optional
 from core.llm_service import llm_service
-from router import Router
-from features.npc_generator.agent import NPCSpec, generate_npc
-from features.building_generator.agent import BuildingSpec, generate_building
-from features.quest_generator.agent import QuestSpec, generate_quest
-from features.magic_items.agent import MagicItemSpec, generate_magic_item
-from features.battlefields.agent import BattlefieldSpec, generate_battlefield
-from features.backstories.agent import BackstorySpec, generate_backstory
+from core.context_extractor import extract_message_context
+from core.lore_tracker import get_lore_tracker
+from core.metrics import metrics
+from core.speculation import (
+    Speculation,
+    Speculator,
+    detect_kind,
+    parse_options,
+    start_in_background,
+)
+from core.token_budget import ConversationContext, history_budget
+from router import GENERATORS, Router, describe_generators
+
+
+# Token budget for the conversation context added to generator prompts, and how many
+# recent messages to look through when filling it
+ENHANCED_CONTEXT_BUDGET = 600
+ENHANCED_CONTEXT_MESSAGES = 20
+
+# Maximum completion length for conversational replies
+CONVERSATION_MAX_TOKENS = 1000
+
+# Token budget for campaign lore retrieved for conversational replies
+CONVERSATION_LORE_BUDGET = 300
+
+# Whether chat sessions pre-generate brief sheets for numbered options (see core.speculation)
+SPECULATE = os.getenv("TTRPG_SPECULATE", "").lower() in ("1", "true", "yes")
+
+# Whether chat sessions expand each brief sheet into the full one in the background, ready
+# for /expand
+AUTO_EXPAND = os.getenv("TTRPG_AUTO_EXPAND", "").lower() in ("1", "true", "yes")
+
+# Shown in the prompt while the Ollama model isn't loaded yet; nothing once it's ready
+MODEL_STATE_ICONS = {"cold": " ❄️", "loading": " ⏳", "failed": " ⚠️"}
+
+CONVERSATION_SYSTEM_PROMPT = """You are a creative and helpful TTRPG assistant. Your job is to be engaging, imaginative, and guide users effectively.
+
+IMPORTANT: You can help with TTRPG content in two ways:
+1. **Conversational help** - Answering questions, brainstorming ideas, giving advice
+2. **Content generation** - Creating specific NPCs, quests, items, etc. (users must use qualifiers like /npc, /quest, etc.)
+
+When someone asks for specific content generation (like "create an NPC" or "make a quest"), guide them to use the appropriate qualifier:
+- For NPCs: "/npc [description]" (e.g., "/npc a wise old wizard who lives in a tower")
+- For buildings: "/building [description]" (e.g., "/building a mysterious tavern in the docks")
+- For quests: "/quest [description]" (e.g., "/quest rescue the kidnapped merchant")
+- For magic items: "/magic_item [description]" (e.g., "/magic_item a sword that glows in the dark")
+- For battlefields: "/battlefield [description]" (e.g., "/battlefield a narrow mountain pass")
+- For backstories: "/backstory [description]" (e.g., "/backstory an orphan who discovered magical powers")
+
+When brainstorming or giving ideas, be creative and specific. Provide multiple options and explain why they might work well.
+
+Be enthusiastic, helpful, and make TTRPG creation fun!"""
 
 
 def print_welcome():
@@ -33,18 +80,26 @@ def print_welcome():
     print("   Example: '/npc a wise old wizard who lives in a tower'")
     print()
     print("Available generators:")
-    print("• /npc - Characters, merchants, villains, etc.")
-    print("• /building - Taverns, shops, towers, etc.")
-    print("• /quest - Missions, adventures, objectives")
-    print("• /magic_item - Weapons, artifacts, enchanted objects")
-    print("• /battlefield - Combat environments, tactical situations")
-    print("• /backstory - Character histories, personal stories")
+    for name, generator in GENERATORS.items():
+        print(f"• /{name} - {generator.description}")
     print()
     print("Commands:")
     print("• /help - Show this help message")
     print("• /clear - Clear conversation history")
     print("• /world <name> - Set the campaign world (optional)")
     print("• /brief - Toggle between brief and full mode (brief is default)")
+    print("• /stream - Toggle streaming responses as they are generated (on by default)")
+    print(
+        "• /speculate - Toggle pre-generating brief sheets for numbered ideas, "
+        "so '/npc number 2' is instant"
+    )
+    print("• /expand - Expand the last brief sheet into the full one, keeping what it says")
+    print(
+        "• /expand auto - Toggle expanding every brief sheet in the background, "
+        "so /expand is instant"
+    )
+    print("• /usage - Show token usage for this session, including cached prompt tokens")
+    print("• /stats - Show latency, time to first token and token throughput per generator")
     print("• /quit or /exit - Exit the chat")
     print()
     print("Start chatting! (Type /help for commands)")
@@ -52,108 +107,203 @@ def print_welcome():
 
 
 class SmartChatSession:
-    """Manages a smart chat session that can route to generators or provide conversational responses."""
+    """
+    Manages a smart chat session that can route to generators or provide conversational
+    responses.
+    """
     
-    def __init__(self, world_name: str = None):
+    def __init__(self, world_name: str = None, speculate: bool = None):
         self.world_name = world_name
-        self.conversation_history = []
+        self.context = ConversationContext(llm_service.model)
         self.router = Router()
         self.brief_mode = True  # Default to brief mode for faster chat experience
+        self.stream_mode = True  # Show responses as they are generated
+        # Pre-generate sheets for numbered options
+        self.speculate = SPECULATE if speculate is None else speculate
+        self.speculator = Speculator()
+        self.auto_expand = AUTO_EXPAND  # Expand brief sheets in the background once shown
+        self.last_brief_sheet = None  # (intent, spec, sheet) of the last brief sheet, for /expand
+        self.expansion: Optional[Speculation] = None  # Its full sheet, written in the background
+        self.last_prompt_tokens = 0  # Size of the prompt sent for the most recent turn
+
+    @property
+    def conversation_history(self) -> list[dict]:
+        """The conversation so far as chat messages."""
+        return [entry.as_message() for entry in self.context.entries]
         
     def add_message(self, role: str, content: str):
-        """Add a message to the conversation history."""
-        self.conversation_history.append({"role": role, "content": content})
-        
+        """Add a message to the conversation history, extracting its context once."""
+        entry = self.context.add(role, content)
+        entry.extracted = extract_message_context(role, content, self.context.model)
+        if role == "user":
+            # Sheets for the options shown are only worth finishing if this message picks one
+            routed_request = self.router.route_request(content)
+            if not self.speculator.is_pick(
+                routed_request.get("intent"), routed_request.get("prompt", content)
+            ):
+                self.speculator.cancel()
+        elif entry.extracted.options and self.speculate and self.brief_mode:
+            self._speculate(entry.extracted.options)
+
+    def _speculate(self, option_lines: list[str]) -> None:
+        """Starts brief sheets for the numbered options just shown, if it's clear what they are."""
+        entries = self.context.entries
+        question = entries[-2].content if len(entries) > 1 and entries[-2].role == "user" else ""
+        kind = detect_kind(question, option_lines)
+        if kind is None:
+            return
+        generator = GENERATORS[kind]
+        world_name = self.world_name if self.world_name else "Generic Fantasy"
+        self.speculator.start(
+            kind,
+            parse_options(option_lines),
+            lambda option: generator.create_spec(
+                world_name, self._build_enhanced_prompt(option), True
+            ),
+        )
+
+    def _take_speculation(self, intent: str, prompt: str) -> Optional[Speculation]:
+        """
+        The pre-generated sheet for a request that picks one of the numbered options, if
+        there is one.
+        """
+        world_name = self.world_name if self.world_name else "Generic Fantasy"
+        speculation = self.speculator.take(intent, prompt, world_name, self.brief_mode)
+        if speculation is not None:
+            print(f"🔮 Using the sheet prepared for option {speculation.number}")
+            self.last_prompt_tokens = 0  # Its prompt was sent in the background
+        return speculation
+
+    def _remember_sheet(self, intent: str, spec, sheet: str) -> None:
+        """Keeps a finished brief sheet for /expand, and starts expanding it if that's automatic."""
+        if not spec.brief or not sheet.strip():
+            return
+        if self.expansion is not None:
+            self.expansion.cancel()
+        self.last_brief_sheet = (intent, spec, sheet)
+        self.expansion = None
+        if self.auto_expand:
+            self.expansion = start_in_background(
+                Speculation(intent, None, spec),
+                lambda kind, spec: iter([GENERATORS[kind].agent_class().expand_sheet(spec, sheet)]),
+            )
+
+    def stream_expanded_sheet(self) -> Iterator[str]:
+        """
+        Expands the last brief sheet into the full one, using the background expansion if
+        there is one.
+        """
+        if self.last_brief_sheet is None:
+            yield "Nothing to expand yet: generate a brief sheet first, e.g. '/npc a merchant'."
+            return
+        intent, spec, sheet = self.last_brief_sheet
+        print(f"🔎 Expanding the last {intent.upper()} sheet")
+        expansion, self.expansion = self.expansion, None
+        try:
+            if expansion is not None and expansion.usable:
+                print("🔮 Using the full sheet prepared in the background")
+                yield from expansion.follow()
+                return
+            yield GENERATORS[intent].agent_class().expand_sheet(spec, sheet)
+        except Exception as e:
+            yield f"❌ Error expanding the sheet: {str(e)}"
+
     def clear_history(self):
         """Clear the conversation history."""
-        self.conversation_history.clear()
+        self.context.clear()
+        self.speculator.reset()
+        if self.expansion is not None:
+            self.expansion.cancel()
+        self.last_brief_sheet = self.expansion = None
+
+    def _create_generator_request(self, intent: str, prompt: str):
+        """Builds the agent and spec for a generator request."""
+        generator = GENERATORS.get(intent)
+        if generator is None:
+            return None, None
+
+        # Use a generic world name if none is specified
+        world_name = self.world_name if self.world_name else "Generic Fantasy"
+
+        # Build enhanced prompt with conversation context
+        enhanced_prompt = self._build_enhanced_prompt(prompt)
+
+        spec = generator.create_spec(world_name, enhanced_prompt, self.brief_mode)
+        agent = generator.agent_class()
+        self.last_prompt_tokens = 0  # Until the agent has sent its prompt; see _record_prompt
+        return agent, spec
+
+    def _record_prompt(self, agent) -> None:
+        """Records the size of the prompt the agent sent, without building it again."""
+        self.last_prompt_tokens = self.context.count(agent.last_messages or [])
         
     def generate_with_generator(self, intent: str, prompt: str) -> str:
         """Generate content using the appropriate generator."""
         try:
-            # Use a generic world name if none is specified
-            world_name = self.world_name if self.world_name else "Generic Fantasy"
-            
-            # Build enhanced prompt with conversation context
-            enhanced_prompt = self._build_enhanced_prompt(prompt)
-            
-            if intent == "npc":
-                spec = NPCSpec(world_name=world_name, prompt=enhanced_prompt, brief=self.brief_mode)
-                result = generate_npc(spec)
-            elif intent == "building":
-                spec = BuildingSpec(world_name=world_name, prompt=enhanced_prompt, brief=self.brief_mode)
-                result = generate_building(spec)
-            elif intent == "quest":
-                spec = QuestSpec(world_name=world_name, prompt=enhanced_prompt, brief=self.brief_mode)
-                result = generate_quest(spec)
-            elif intent == "magic_item":
-                spec = MagicItemSpec(world_name=world_name, prompt=enhanced_prompt, brief=self.brief_mode)
-                result = generate_magic_item(spec)
-            elif intent == "battlefield":
-                spec = BattlefieldSpec(world_name=world_name, prompt=enhanced_prompt, brief=self.brief_mode)
-                result = generate_battlefield(spec)
-            elif intent == "backstory":
-                spec = BackstorySpec(world_name=world_name, prompt=enhanced_prompt, brief=self.brief_mode)
-                result = generate_backstory(spec)
-            else:
-                result = f"Sorry, I'm not sure how to handle that request. I can currently generate 'npc', 'building', 'quest', 'magic_item', 'battlefield', or 'backstory'."
+            speculation = self._take_speculation(intent, prompt)
+            if speculation is not None:
+                result = speculation.result()
+                self._remember_sheet(intent, speculation.spec, result)
+                return result
+
+            agent, spec = self._create_generator_request(intent, prompt)
+            if agent is None:
+                return (
+                    "Sorry, I'm not sure how to handle that request. "
+                    f"I can currently generate {describe_generators()}."
+                )
+
+            result = agent.generate_sheet(spec)
+            self._record_prompt(agent)
+            self._remember_sheet(intent, spec, result)
             
             return result
         except Exception as e:
             return f"❌ Error generating content: {str(e)}"
+
+    def stream_with_generator(self, intent: str, prompt: str) -> Iterator[str]:
+        """Generate content using the appropriate generator, yielding it as it is written."""
+        try:
+            speculation = self._take_speculation(intent, prompt)
+            agent = None
+            if speculation is not None:
+                pieces, spec = speculation.follow(), speculation.spec
+            else:
+                agent, spec = self._create_generator_request(intent, prompt)
+                if agent is None:
+                    yield (
+                        "Sorry, I'm not sure how to handle that request. "
+                        f"I can currently generate {describe_generators()}."
+                    )
+                    return
+                pieces = agent.stream_sheet(spec)
+
+            sheet = []
+            for piece in pieces:
+                sheet.append(piece)
+                yield piece
+            if agent is not None:
+                self._record_prompt(agent)
+            self._remember_sheet(intent, spec, "".join(sheet))
+        except Exception as e:
+            yield f"❌ Error generating content: {str(e)}"
     
     def _build_enhanced_prompt(self, current_prompt: str) -> str:
         """Build an enhanced prompt that includes relevant conversation context."""
-        # Get recent conversation history (last 8 messages to capture more context)
-        recent_history = self.conversation_history[-8:] if len(self.conversation_history) > 8 else self.conversation_history
-        
-        if not recent_history:
+        if not self.context.entries:
             return current_prompt
         
-        # Look for relevant context in recent messages
+        # Collect context from the newest messages back, until the token budget is used up
         context_parts = []
-        
-        for message in recent_history:
-            content = message.get("content", "")
-            role = message.get("role", "")
-            
-            # Look for numbered lists in assistant responses (ideas, options, etc.)
-            if role == "assistant" and any(f"{i}." in content for i in range(1, 10)):
-                # Extract the numbered list content
-                lines = content.split('\n')
-                numbered_content = []
-                for line in lines:
-                    if any(line.strip().startswith(f"{i}.") for i in range(1, 10)):
-                        numbered_content.append(line.strip())
-                
-                if numbered_content:
-                    context_parts.append(f"Previous options discussed:\n" + "\n".join(numbered_content[:5]))  # Limit to first 5 items
-            
-            # Look for any assistant responses that contain ideas, concepts, or descriptions
-            elif role == "assistant" and len(content) > 50:
-                # Look for content that seems like ideas or concepts (not just responses)
-                if any(keyword in content.lower() for keyword in ["idea", "concept", "tavern", "quest", "npc", "building", "magic", "battle", "sword", "temple", "artifact", "heist", "wizard", "dragon", "castle"]):
-                    # Extract the most relevant part (first 300 chars to avoid token bloat)
-                    context_parts.append(f"Previous discussion: {content[:300]}...")
-            
-            # Look for user preferences or selections
-            if role == "user":
-                content_lower = content.lower()
-                
-                # Check for specific number references
-                import re
-                number_match = re.search(r'number\s+(\d+)', content_lower)
-                if number_match:
-                    selected_number = number_match.group(1)
-                    context_parts.append(f"User selected option #{selected_number}: {content}")
-                
-                # Check for general references to previous content
-                elif any(word in content_lower for word in ["like", "prefer", "choose", "option", "want", "that", "discussed", "earlier", "before", "mentioned"]):
-                    context_parts.append(f"User preference: {content}")
-                
-                # Check for specific content references
-                elif any(word in content_lower for word in ["heist", "tavern", "sword", "quest", "npc", "building", "battle", "artifact", "temple", "wizard", "dragon"]):
-                    context_parts.append(f"User referencing specific content: {content}")
+        used_tokens = 0
+        for entry in reversed(self.context.entries[-ENHANCED_CONTEXT_MESSAGES:]):
+            extracted = entry.extracted
+            if extracted is None:
+                continue
+            if used_tokens + extracted.tokens > ENHANCED_CONTEXT_BUDGET:
+                break
+            context_parts[:0] = extracted.parts
+            used_tokens += extracted.tokens
         
         if context_parts:
             context_text = "\n\n".join(context_parts)
@@ -169,10 +319,15 @@ IMPORTANT: Please incorporate the context from our previous conversation when cr
             return enhanced_prompt
         
         return current_prompt
-    
+
     def handle_input(self, user_input: str) -> str:
-        """Handle user input by either routing to a generator or providing conversational response."""
-        
+        """
+        Handle user input by either routing to a generator or providing conversational
+        response.
+        """
+        if user_input.strip().lower() == "/expand":
+            return "".join(self.stream_expanded_sheet())
+
         # Route the request to see if it matches any generator
         routed_request = self.router.route_request(user_input)
         intent = routed_request.get("intent")
@@ -181,10 +336,11 @@ IMPORTANT: Please incorporate the context from our previous conversation when cr
         # Handle unknown qualifiers
         if intent == "unknown_qualifier":
             unknown_qualifier = routed_request.get("unknown_qualifier", "unknown")
-            return f"❌ Unknown qualifier '/{unknown_qualifier}'. Available qualifiers: /npc, /building, /quest, /magic_item, /battlefield, /backstory"
+            qualifiers = ", ".join("/" + name for name in GENERATORS)
+            return f"❌ Unknown qualifier '/{unknown_qualifier}'. Available qualifiers: {qualifiers}"
         
         # If we detected a specific generator intent, use it
-        if intent in ['npc', 'building', 'quest', 'magic_item', 'battlefield', 'backstory']:
+        if intent in GENERATORS:
             print(f"🔎 Intent Detected: {intent.upper()}")
             if self.brief_mode:
                 print("📜 Brief mode enabled")
@@ -194,58 +350,117 @@ IMPORTANT: Please incorporate the context from our previous conversation when cr
         
         # Otherwise, provide a conversational response
         return self._get_conversational_response(user_input)
-    
-    def _get_conversational_response(self, user_input: str) -> str:
-        """Get a conversational response from the model."""
-        try:
-            # Create messages for the API call
-            messages = [
-                {"role": "system", "content": """You are a creative and helpful TTRPG assistant. Your job is to be engaging, imaginative, and guide users effectively.
 
-IMPORTANT: You can help with TTRPG content in two ways:
-1. **Conversational help** - Answering questions, brainstorming ideas, giving advice
-2. **Content generation** - Creating specific NPCs, quests, items, etc. (users must use qualifiers like /npc, /quest, etc.)
+    def handle_input_stream(self, user_input: str) -> Iterator[str]:
+        """Streaming version of handle_input that yields the response as it is generated."""
+        if user_input.strip().lower() == "/expand":
+            yield from self.stream_expanded_sheet()
+            return
 
-When someone asks for specific content generation (like "create an NPC" or "make a quest"), guide them to use the appropriate qualifier:
-- For NPCs: "/npc [description]" (e.g., "/npc a wise old wizard who lives in a tower")
-- For buildings: "/building [description]" (e.g., "/building a mysterious tavern in the docks")
-- For quests: "/quest [description]" (e.g., "/quest rescue the kidnapped merchant")
-- For magic items: "/magic_item [description]" (e.g., "/magic_item a sword that glows in the dark")
-- For battlefields: "/battlefield [description]" (e.g., "/battlefield a narrow mountain pass")
-- For backstories: "/backstory [description]" (e.g., "/backstory an orphan who discovered magical powers")
+        routed_request = self.router.route_request(user_input)
+        intent = routed_request.get("intent")
+        prompt = routed_request.get("prompt", user_input)
 
-When brainstorming or giving ideas, be creative and specific. Provide multiple options and explain why they might work well.
+        if intent == "unknown_qualifier":
+            unknown_qualifier = routed_request.get("unknown_qualifier", "unknown")
+            qualifiers = ", ".join("/" + name for name in GENERATORS)
+            yield f"❌ Unknown qualifier '/{unknown_qualifier}'. Available qualifiers: {qualifiers}"
+            return
+
+        if intent in GENERATORS:
+            print(f"🔎 Intent Detected: {intent.upper()}")
+            if self.brief_mode:
+                print("📜 Brief mode enabled")
+
+            yield from self.stream_with_generator(intent, prompt)
+            return
+
+        yield from self._stream_conversational_response(user_input)
+
+    def _build_conversational_messages(self, user_input: str) -> list[dict]:
+        """
+        Build the messages for a conversational reply from the system prompt, relevant lore
+        and recent history.
+        """
+        messages = [{"role": "system", "content": CONVERSATION_SYSTEM_PROMPT}]
+
+        # Add the few pieces of campaign lore relevant to the message, rather than whole sheets
+        world_name = self.world_name if self.world_name else "Generic Fantasy"
+        facts = get_lore_tracker().relevant_facts(
+            world_name, user_input, CONVERSATION_LORE_BUDGET, self.context.model
+        )
+        if facts:
+            messages.append(
+                {"role": "system", "content": f"Relevant lore from this campaign:\n{facts}"}
+            )
+
+        # Add as much recent history as fits the model's token budget; older turns are summarized
+        reserved = self.context.count(messages) + CONVERSATION_MAX_TOKENS
+        messages.extend(self.context.pack(history_budget(self.context.model, reserved)))
+        self.last_prompt_tokens = self.context.count(messages)
+        return messages
+
+    def _get_conversational_response(self, user_input: str) -> str:
+        """Get a conversational response from the model."""
+        try:
+            messages = self._build_conversational_messages(user_input)
 
-Be enthusiastic, helpful, and make TTRPG creation fun!"""}
-            ]
-            
-            # Add conversation history (keep last 10 messages to avoid token limits)
-            recent_history = self.conversation_history[-10:] if len(self.conversation_history) > 10 else self.conversation_history
-            messages.extend(recent_history)
-            
             # Get response from the model
-            response = llm_service.client.chat.completions.create(
-                model=llm_service.model,
-                messages=messages,
-                temperature=0.8,
-                max_tokens=1000,
+            return llm_service.complete(
+                messages, temperature=0.8, max_tokens=CONVERSATION_MAX_TOKENS
             )
-            
-            return response.choices[0].message.content
-            
+
         except Exception as e:
             return f"❌ Error generating response: {str(e)}"
 
+    def _stream_conversational_response(self, user_input: str) -> Iterator[str]:
+        """Get a conversational response from the model, yielding tokens as they arrive."""
+        try:
+            messages = self._build_conversational_messages(user_input)
+            yield from llm_service.stream(
+                messages, temperature=0.8, max_tokens=CONVERSATION_MAX_TOKENS
+            )
+        except Exception as e:
+            yield f"❌ Error generating response: {str(e)}"
+
 
 def main():
     """Main chat loop."""
+    parser = argparse.ArgumentParser(description="Chat with the TTRPG Sidekick.")
+    parser.add_argument(
+        "--cache-mode",
+        choices=["use", "refresh", "off"],
+        default=None,
+        help="How generators use the response cache (default: use).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache_mode",
+        action="store_const",
+        const="off",
+        help="Bypass the response cache.",
+    )
+    parser.add_argument(
+        "--deterministic",
+        action="store_true",
+        help="Sample at temperature 0 so repeated prompts give cacheable, identical results.",
+    )
+    args = parser.parse_args()
+    llm_service.configure_cache(mode=args.cache_mode, deterministic=args.deterministic or None)
+
     # Check environment
     api_provider = os.getenv("API_PROVIDER", "openai").lower()
-    if api_provider == "openai" and (not os.getenv("OPENAI_API_KEY") or "your-api-key" in os.getenv("OPENAI_API_KEY")):
+    if llm_service.replaying:
+        print(f"📼 Replaying recorded responses from {llm_service.cassette.path}")
+    elif api_provider == "openai" and (
+        not os.getenv("OPENAI_API_KEY") or "your-api-key" in os.getenv("OPENAI_API_KEY")
+    ):
         print("❌ API_PROVIDER is set to 'openai', but OPENAI_API_KEY is not configured in .envrc.")
         sys.exit(1)
     elif api_provider == "ollama":
-        print("✅ Using Ollama. Ensure the Ollama application is running.")
+        # Load the model while the player reads the welcome, and keep it loaded while chatting
+        print("✅ Using Ollama. Loading the model in the background...")
+        llm_service.warm_up(keep_warm=True)
     
     # Initialize chat session
     session = SmartChatSession()
@@ -257,7 +472,8 @@ def main():
             # Get user input
             try:
                 world_display = session.world_name if session.world_name else "General"
-                user_input = input(f"🎲 [{world_display}] > ").strip()
+                state_display = MODEL_STATE_ICONS.get(llm_service.model_state, "")
+                user_input = input(f"🎲 [{world_display}]{state_display} > ").strip()
             except (EOFError, KeyboardInterrupt):
                 print("\n👋 Goodbye!")
                 break
@@ -292,13 +508,41 @@ def main():
                     status = "enabled" if session.brief_mode else "disabled"
                     print(f"📜 Brief mode {status}")
                     continue
+                elif command == "/usage":
+                    print(f"📊 Token usage: {llm_service.total_usage}")
+                    continue
+                elif command == "/stats":
+                    print("📊 Call metrics for this session:")
+                    print(metrics.memory.format_summary())
+                    if len(llm_service.pool.endpoints) > 1:
+                        print("\n🌐 Model endpoints:")
+                        print("\n".join(llm_service.pool.describe()))
+                    if session.speculate or session.speculator.counts:
+                        print(f"\n🔮 Speculation: {session.speculator.describe()}")
+                    continue
+                elif command == "/stream":
+                    session.stream_mode = not session.stream_mode
+                    status = "enabled" if session.stream_mode else "disabled"
+                    print(f"📡 Streaming {status}")
+                    continue
+                elif command == "/expand" and user_input.lower().split()[1:] == ["auto"]:
+                    session.auto_expand = not session.auto_expand
+                    status = "enabled" if session.auto_expand else "disabled"
+                    print(f"🔮 Expanding brief sheets in the background {status}")
+                    continue
+                elif command == "/speculate":
+                    session.speculate = not session.speculate
+                    if not session.speculate:
+                        session.speculator.cancel()
+                    status = "enabled" if session.speculate else "disabled"
+                    print(f"🔮 Speculative sheets {status}")
+                    continue
                 else:
                     # Check if this might be a qualifier (like /npc, /quest, etc.)
                     qualifier = command[1:]  # Remove the leading slash
-                    valid_qualifiers = ['npc', 'building', 'quest', 'magic_item', 'battlefield', 'backstory']
                     
-                    if qualifier in valid_qualifiers:
-                        # This is a valid qualifier, let the router handle it
+                    if qualifier in GENERATORS or command == "/expand":
+                        # This is a valid qualifier (or /expand), let the router handle it
                         pass  # Continue to the normal processing below
                     else:
                         print(f"❌ Unknown command: {command}")
@@ -309,18 +553,33 @@ def main():
             
             # Generate response
             print("🧠 Thinking...")
-            response = session.handle_input(user_input)
-            
+            if session.stream_mode:
+                # Print the response as it arrives while collecting it for the history
+                pieces = []
+                for piece in session.handle_input_stream(user_input):
+                    if not pieces:
+                        print("-" * 50)
+                    print(piece, end="", flush=True)
+                    pieces.append(piece)
+                print()
+                print("-" * 50)
+                response = "".join(pieces)
+            else:
+                response = session.handle_input(user_input)
+
+                # Print response
+                print("-" * 50)
+                print(response)
+                print("-" * 50)
+
             # Add assistant response to history
             session.add_message("assistant", response)
-            
-            # Print response
-            print("-" * 50)
-            print(response)
-            print("-" * 50)
+            print(f"📏 Prompt size: {session.last_prompt_tokens} tokens")
             
     except KeyboardInterrupt:
         print("\n👋 Goodbye!")
+    finally:
+        llm_service.keep_alive.stop()
 
 
 if __name__ == "__main__":
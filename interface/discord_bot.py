@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Discord bot for TTRPG Sidekick
+
+Serves the chat and the generators to many Discord servers from one asyncio process:
+- a slash command for every generator (/npc, /quest, ...), plus /chat to talk to the
+  sidekick and /world, /brief and /clear, which work as in the CLI
+- one SmartChatSession per channel, so every table keeps its own conversation, world
+  and brief setting; a channel's messages are answered in order
+- generations go through core.scheduler: a bounded queue per server, with the
+  TTRPG_DISCORD_WORKERS workers taking turns between servers, so one busy server
+  can't starve the rest
+- replies are streamed by editing the message as the model writes, at most once per
+  TTRPG_DISCORD_EDIT_INTERVAL seconds to stay within Discord's edit rate limits, and
+  continue in another message past Discord's 2000 character limit
+
+SidekickBot only talks to Discord through CommandContext (send a message, edit it), so
+the same bot runs on discord.py (run_discord) or on the local fake gateway in
+testing/fake_discord.py.
+
+Usage:
+    DISCORD_TOKEN=... python -m interface.discord_bot
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Union
+
+from core.admission import OverloadedError
+from core.llm_service import llm_service
+from core.scheduler import FairScheduler
+from interface.cli import SmartChatSession
+from router import GENERATORS
+
+# Longest message Discord accepts, in characters
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Generations running at once, across all servers
+WORKERS = int(os.getenv("TTRPG_DISCORD_WORKERS", "8"))
+
+# Generations of one server that may wait for a worker
+GUILD_QUEUE_LIMIT = int(os.getenv("TTRPG_DISCORD_GUILD_QUEUE", "5"))
+
+# Messages of one channel that may wait behind the one being answered
+CHANNEL_QUEUE_LIMIT = int(os.getenv("TTRPG_DISCORD_CHANNEL_QUEUE", "2"))
+
+# Seconds between edits of a streamed reply; Discord allows about 5 edits per 5 seconds per channel
+EDIT_INTERVAL = float(os.getenv("TTRPG_DISCORD_EDIT_INTERVAL", "1.2"))
+
+# Channel sessions kept at once; the least recently used one is dropped beyond this
+MAX_CHANNEL_SESSIONS = int(os.getenv("TTRPG_DISCORD_MAX_SESSIONS", "1000"))
+
+
+@dataclass
+class SlashCommand:
+    """A slash command and its one option."""
+    name: str
+    description: str
+    option: Optional[str] = None
+    option_description: str = ""
+
+
+def slash_commands() -> list[SlashCommand]:
+    """The bot's slash commands: one per generator, then chat and the session settings."""
+    commands = [
+        SlashCommand(name, f"Generate {entry.description}"[:100], "prompt", "What to create, with any details that matter")
+        for name, entry in GENERATORS.items()
+    ]
+    return commands + [
+        SlashCommand("chat", "Talk to the sidekick: questions, brainstorming, advice", "message", "Your message"),
+        SlashCommand("world", "Set the world/campaign for this channel", "name", "Name of the world"),
+        SlashCommand("brief", "Toggle brief sheets for this channel"),
+        SlashCommand("expand", "Expand this channel's last brief sheet into the full one"),
+        SlashCommand("clear", "Clear this channel's conversation history"),
+    ]
+
+
+class Message:
+    """A message the bot has sent."""
+
+    async def edit(self, content: str) -> None:
+        raise NotImplementedError
+
+
+class CommandContext:
+    """A slash command being answered: where it came from, and how to reply to it."""
+
+    guild_id: str = ""  # The server, or a stand-in for direct messages
+    channel_id: str = ""
+
+    async def defer(self) -> None:
+        """Acknowledges the command, so Discord waits for the reply."""
+        raise NotImplementedError
+
+    async def send(self, content: str) -> Message:
+        """Sends a reply message."""
+        raise NotImplementedError
+
+
+def split_pages(text: str, page_size: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """
+    Splits text into messages of at most page_size characters, at a line break where
+    possible. Appending text only ever changes the last page.
+    """
+    pages = []
+    while len(text) > page_size:
+        cut = text.rfind("\n", 0, page_size) + 1 or page_size
+        pages.append(text[:cut])
+        text = text[cut:]
+    pages.append(text)
+    return [page for page in pages if page.strip()]
+
+
+class StreamedReply:
+    """A reply that grows as text arrives, shown by sending and editing messages at a limited rate."""
+
+    def __init__(self, context: CommandContext, interval: float = EDIT_INTERVAL, page_size: int = DISCORD_MESSAGE_LIMIT):
+        self.context = context
+        self.interval = interval
+        self.page_size = page_size
+        self.messages: list[tuple[Message, str]] = []  # Sent messages and what they show
+        self._last_update = 0.0
+
+    async def show(self, text: str) -> None:
+        """Updates the messages to show the text, waiting first if the last update was too recent."""
+        pages = split_pages(text, self.page_size)
+        changes = [(index, page) for index, page in enumerate(pages) if index >= len(self.messages) or self.messages[index][1] != page]
+        if not changes:
+            return
+        delay = self._last_update + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        for index, page in changes:
+            if index < len(self.messages):
+                await self.messages[index][0].edit(page)
+                self.messages[index] = (self.messages[index][0], page)
+            else:
+                self.messages.append((await self.context.send(page), page))
+        self._last_update = time.monotonic()
+
+
+class ChannelSessions:
+    """Chat sessions by channel, dropping the least recently used ones."""
+
+    def __init__(self, session_factory: Callable[[Optional[str]], SmartChatSession], world: Optional[str] = None, max_sessions: int = MAX_CHANNEL_SESSIONS):
+        self.session_factory = session_factory
+        self.world = world
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, tuple[SmartChatSession, asyncio.Lock]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, channel_id: str) -> tuple[SmartChatSession, asyncio.Lock]:
+        """The channel's session and the lock that keeps its messages in order, created on first use."""
+        if channel_id in self._sessions:
+            self._sessions.move_to_end(channel_id)
+        else:
+            self._sessions[channel_id] = (self.session_factory(self.world), asyncio.Lock())
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return self._sessions[channel_id]
+
+
+class SidekickBot:
+    """The bot's behaviour, independent of the Discord library that delivers the commands."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[Optional[str]], SmartChatSession] = SmartChatSession,
+        world: Optional[str] = None,
+        workers: int = WORKERS,
+        guild_queue: int = GUILD_QUEUE_LIMIT,
+        channel_queue: int = CHANNEL_QUEUE_LIMIT,
+        edit_interval: float = EDIT_INTERVAL,
+    ):
+        """
+        Args:
+            session_factory: Creates a channel's chat session from the default world.
+            world: Default world of new channel sessions (default: $TTRPG_DISCORD_WORLD).
+            workers: Generations running at once, across all servers.
+            guild_queue: Generations of one server that may wait for a worker.
+            channel_queue: Messages of one channel that may wait behind the one being answered.
+            edit_interval: Seconds between edits of a streamed reply.
+        """
+        self.sessions = ChannelSessions(session_factory, world or os.getenv("TTRPG_DISCORD_WORLD"))
+        self.scheduler = FairScheduler(workers, guild_queue)
+        self.channel_queue = channel_queue
+        self.edit_interval = edit_interval
+        self._pending: dict[str, int] = {}  # Messages per channel being answered or waiting
+
+    def start(self) -> None:
+        """Starts the generation workers; call from the bot's event loop."""
+        self.scheduler.start()
+
+    async def close(self) -> None:
+        await self.scheduler.stop()
+
+    async def handle(self, context: CommandContext, command: str, value: Union[str, bool, None] = None) -> None:
+        """Answers a slash command, e.g. handle(context, "npc", "a grumpy dwarf")."""
+        session, lock = self.sessions.get(context.channel_id)
+        if command == "world":
+            session.world_name = value
+            await context.send(f"🌍 World changed to: {session.world_name}")
+        elif command == "brief":
+            session.brief_mode = not session.brief_mode
+            await context.send(f"📜 Brief mode {'enabled' if session.brief_mode else 'disabled'}")
+        elif command == "clear":
+            session.clear_history()
+            await context.send("🗑️ Conversation history cleared.")
+        elif command == "expand":
+            await self.reply(context, session, lock, "/expand")
+        elif command == "chat" or command in GENERATORS:
+            message = value if command == "chat" else f"/{command} {value}"
+            await self.reply(context, session, lock, message)
+        else:
+            await context.send(f"❌ Unknown command: /{command}")
+
+    async def reply(self, context: CommandContext, session: SmartChatSession, lock: asyncio.Lock, message: str) -> None:
+        """Answers a message in the channel's session, after the channel's earlier messages."""
+        channel = context.channel_id
+        if self._pending.get(channel, 0) > self.channel_queue:
+            await context.send("⏳ I'm still answering earlier messages in this channel; try again in a moment.")
+            return
+        await context.defer()
+        self._pending[channel] = self._pending.get(channel, 0) + 1
+        try:
+            async with lock:
+                await self.scheduler.run(context.guild_id, lambda: self.converse(context, session, message))
+        except OverloadedError as e:
+            await context.send(f"⏳ This server has too many requests waiting; try again in {e.retry_after:.0f}s.")
+        except Exception as e:
+            await context.send(f"❌ Error: {e}")
+        finally:
+            self._pending[channel] -= 1
+            if not self._pending[channel]:
+                del self._pending[channel]
+
+    async def converse(self, context: CommandContext, session: SmartChatSession, message: str) -> None:
+        """Adds the message to the session and streams the reply to Discord."""
+        await asyncio.to_thread(session.add_message, "user", message)
+        reply = await self.stream_reply(context, session.handle_input_stream(message))
+        await asyncio.to_thread(session.add_message, "assistant", reply)
+
+    async def stream_reply(self, context: CommandContext, pieces: Iterator[str]) -> str:
+        """Runs a blocking stream of text in a worker thread, showing it in Discord as it grows."""
+        parts = []
+
+        def consume() -> None:
+            for piece in pieces:
+                parts.append(piece)
+
+        reply = StreamedReply(context, self.edit_interval)
+        task = asyncio.ensure_future(asyncio.to_thread(consume))
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.edit_interval)
+            if not task.done():
+                await reply.show("".join(parts))
+        task.result()
+        text = "".join(parts)
+        await reply.show(text if text.strip() else "(no reply)")
+        return text
+
+
+def run_discord(bot: SidekickBot, token: str) -> None:
+    """Connects the bot to Discord with discord.py and serves until interrupted."""
+    import discord
+    from discord import app_commands
+
+    class InteractionMessage(Message):
+        def __init__(self, message: "discord.WebhookMessage"):
+            self.message = message
+
+        async def edit(self, content: str) -> None:
+            await self.message.edit(content=content)
+
+    class InteractionContext(CommandContext):
+        def __init__(self, interaction: discord.Interaction):
+            self.interaction = interaction
+            self.guild_id = str(interaction.guild_id or f"dm-{interaction.user.id}")
+            self.channel_id = str(interaction.channel_id)
+
+        async def defer(self) -> None:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.defer(thinking=True)
+
+        async def send(self, content: str) -> Message:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.send_message(content)
+                return InteractionMessage(await self.interaction.original_response())
+            return InteractionMessage(await self.interaction.followup.send(content, wait=True))
+
+    def command_callback(command: SlashCommand) -> Callable:
+        if command.option is None:
+            async def callback(interaction: discord.Interaction) -> None:
+                await bot.handle(InteractionContext(interaction), command.name)
+            return callback
+
+        async def callback_with_option(interaction: discord.Interaction, value: str) -> None:
+            await bot.handle(InteractionContext(interaction), command.name, value)
+        # The option is named after the command's, e.g. "prompt" rather than "value"
+        return app_commands.rename(value=command.option)(app_commands.describe(value=command.option_description)(callback_with_option))
+
+    class SidekickClient(discord.Client):
+        def __init__(self):
+            super().__init__(intents=discord.Intents.default())
+            self.tree = app_commands.CommandTree(self)
+            for command in slash_commands():
+                self.tree.add_command(app_commands.Command(name=command.name, description=command.description, callback=command_callback(command)))
+
+        async def setup_hook(self) -> None:
+            bot.start()
+            await self.tree.sync()
+
+        async def close(self) -> None:
+            await bot.close()
+            await super().close()
+
+    # Load the model before the first command arrives and keep it loaded
+    llm_service.warm_up(keep_warm=True)
+    try:
+        SidekickClient().run(token)
+    finally:
+        llm_service.keep_alive.stop()
+
+
+def main():
+    token = os.getenv("DISCORD_TOKEN")
+    if not token:
+        raise SystemExit("❌ Set DISCORD_TOKEN to the bot's token (see the Discord Bot section of the README).")
+    print("🤖 TTRPG Sidekick Discord bot starting...")
+    run_discord(SidekickBot(), token)
+
+
+if __name__ == "__main__":
+    main()
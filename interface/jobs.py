@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Job queue commands for TTRPG Sidekick
+
+Submits generations to the persistent job queue (core.job_queue), runs workers on it,
+and shows what they did:
+
+    python main.py jobs submit "/npc a tavern regular" --world Eberron --count 20 --batch prep
+    python main.py jobs submit --file prep.jsonl --batch prep
+    python main.py jobs run --until-done
+    python main.py jobs status --batch prep --watch
+    python main.py jobs list --status failed
+    python main.py jobs result 42
+    python main.py jobs results --batch prep --output prep/
+    python main.py jobs retry --batch prep
+    python main.py jobs cancel --batch prep
+
+Each line of a --file is a JSON object like
+{"kind": "npc", "prompt": "a tavern regular", "world": "Eberron", "brief": false};
+"kind" may be left out when the prompt starts with a qualifier, and "world" and
+"brief" default to the command's --world and --brief.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from core.job_queue import JOB_STATUSES, MAX_ATTEMPTS, Job, JobStore, WorkerPool
+from router import GENERATORS, Router, describe_generators
+
+STATUS_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌", "cancelled": "🚫"}
+
+
+def spec_for(prompt: str, world: str, brief: bool, kind: Optional[str] = None):
+    """The generator spec for a prompt; the generator is detected from the prompt unless given."""
+    if kind is None:
+        routed_request = Router().route_request(prompt)
+        kind = routed_request.get("intent")
+        prompt = routed_request.get("prompt", prompt)
+    generator = GENERATORS.get(kind)
+    if generator is None:
+        raise ValueError(
+            f"No generator for {prompt!r}; start it with a qualifier for {describe_generators()}"
+        )
+    return generator.create_spec(world, prompt, brief)
+
+
+def read_specs(path: str, world: str, brief: bool) -> list:
+    """The specs of a JSONL file, one job per line."""
+    specs = []
+    with open(path, "r") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                specs.append(
+                    spec_for(
+                        entry["prompt"],
+                        entry.get("world", world),
+                        entry.get("brief", brief),
+                        entry.get("kind"),
+                    )
+                )
+            except (KeyError, ValueError, TypeError) as e:
+                raise SystemExit(f"❌ {path}, line {number}: {e}")
+    return specs
+
+
+def positive_int(text: str) -> int:
+    """An argparse type for counts of at least one."""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+def format_counts(counts: dict[str, int]) -> str:
+    return "  ".join(
+        f"{STATUS_ICONS[status]} {status} {counts[status]}"
+        for status in JOB_STATUSES
+        if counts[status]
+    )
+
+
+def print_job(job: Job) -> None:
+    attempts = (
+        f" (attempt {job.attempts}/{job.max_attempts})"
+        if job.attempts > 1 or job.status == "failed"
+        else ""
+    )
+    batch = f" [{job.batch}]" if job.batch else ""
+    print(f"{job.id:>6} {STATUS_ICONS[job.status]} {job.status:<10}{job.title}{batch}{attempts}")
+    if job.error and job.status in ("queued", "failed"):
+        print(f"{'':>8}{job.error}")
+
+
+def submit(store: JobStore, args: argparse.Namespace) -> None:
+    if args.file:
+        specs = read_specs(args.file, args.world, args.brief)
+    elif args.prompt:
+        try:
+            specs = [spec_for(args.prompt, args.world, args.brief)] * args.count
+        except ValueError as e:
+            raise SystemExit(f"❌ {e}")
+    else:
+        raise SystemExit("❌ Give a prompt or --file")
+    if not specs:
+        raise SystemExit(f"❌ {args.file} has no jobs in it")
+    ids = store.submit(specs, batch=args.batch, max_attempts=args.attempts)
+    in_batch = f" in batch {args.batch!r}" if args.batch else ""
+    print(f"📥 Queued {len(ids)} job(s) (ids {ids[0]}-{ids[-1]}){in_batch}")
+    print("   Run them with: python main.py jobs run")
+
+
+def run(args: argparse.Namespace) -> None:
+    from main import check_environment
+
+    if not check_environment():
+        sys.exit(1)
+
+    print_lock = threading.Lock()
+
+    def on_finish(job: Job, error: Optional[Exception]) -> None:
+        with print_lock:
+            if error is None:
+                print(f"✅ #{job.id} {job.title}")
+            else:
+                print(
+                    f"❌ #{job.id} {job.title} (attempt {job.attempts}/{job.max_attempts}): {error}"
+                )
+
+    pool = WorkerPool(
+        workers=args.workers,
+        processes=args.processes,
+        until_done=args.until_done,
+        on_finish=on_finish,
+    )
+    mode = "processes" if args.processes else "threads"
+    print(
+        f"⚙️  Running jobs from {pool.store.path} with {pool.workers} worker {mode}; Ctrl-C to stop"
+    )
+    pool.run()
+    print(f"📋 {format_counts(pool.store.counts()) or 'No jobs'}")
+
+
+def status(store: JobStore, args: argparse.Namespace) -> None:
+    while True:
+        counts = store.counts(args.batch)
+        total = sum(counts.values())
+        finished = counts["done"] + counts["failed"] + counts["cancelled"]
+        line = f"📋 {finished}/{total} finished  {format_counts(counts)}"
+        if not args.watch:
+            print(line)
+            return
+        print(f"\r{line}\033[K", end="", flush=True)
+        if counts["queued"] + counts["running"] == 0:
+            print()
+            return
+        time.sleep(args.interval)
+
+
+def results(store: JobStore, args: argparse.Namespace) -> None:
+    jobs = store.jobs(status="done", batch=args.batch)
+    if args.output:
+        output = Path(args.output)
+        output.mkdir(parents=True, exist_ok=True)
+        for job in jobs:
+            (output / f"{job.id:05d}-{job.kind}.md").write_text(job.result)
+        print(f"✅ Wrote {len(jobs)} sheet(s) to {output}")
+        return
+    for job in jobs:
+        print("-" * 50)
+        print(f"#{job.id} {job.title}")
+        print("-" * 50)
+        print(job.result)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py jobs",
+        description="Run generations in the background from a persistent queue.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = commands.add_parser("submit", help="Queue generations.")
+    submit_parser.add_argument(
+        "prompt", nargs="?", help="What to generate, e.g. '/npc a tavern regular'."
+    )
+    submit_parser.add_argument("--file", help="JSONL file with one job per line.")
+    submit_parser.add_argument(
+        "--world", default="Forgotten Realms", help="The campaign world for context."
+    )
+    submit_parser.add_argument("--brief", action="store_true", help="Generate brief sheets.")
+    submit_parser.add_argument(
+        "--count",
+        type=positive_int,
+        default=1,
+        help="Jobs to queue for the prompt, for several variations.",
+    )
+    submit_parser.add_argument("--batch", default="", help="Name to group the jobs under.")
+    submit_parser.add_argument(
+        "--attempts", type=int, default=MAX_ATTEMPTS, help="Times a job is tried before it fails."
+    )
+
+    run_parser = commands.add_parser("run", help="Run workers on the queue.")
+    run_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Jobs run at once (default: what the model endpoints take at once).",
+    )
+    run_parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Run each worker in its own process instead of a thread.",
+    )
+    run_parser.add_argument(
+        "--until-done",
+        action="store_true",
+        help="Exit once the queue is empty instead of waiting for more jobs.",
+    )
+
+    status_parser = commands.add_parser("status", help="Count the jobs in each state.")
+    status_parser.add_argument("--batch", default=None, help="Only count this batch.")
+    status_parser.add_argument(
+        "--watch", action="store_true", help="Keep updating until every job has finished."
+    )
+    status_parser.add_argument(
+        "--interval", type=float, default=2.0, help="Seconds between updates with --watch."
+    )
+
+    list_parser = commands.add_parser("list", help="List jobs.")
+    list_parser.add_argument(
+        "--status", choices=JOB_STATUSES, default=None, help="Only list jobs in this state."
+    )
+    list_parser.add_argument("--batch", default=None, help="Only list this batch.")
+    list_parser.add_argument("--limit", type=int, default=None, help="List at most this many jobs.")
+
+    result_parser = commands.add_parser("result", help="Print the sheet of a finished job.")
+    result_parser.add_argument("id", type=int)
+
+    results_parser = commands.add_parser(
+        "results", help="Print or save the sheets of all finished jobs."
+    )
+    results_parser.add_argument("--batch", default=None, help="Only this batch.")
+    results_parser.add_argument(
+        "--output", default=None, help="Directory to write one file per sheet to."
+    )
+
+    for name, action in (
+        ("retry", "Queue failed or cancelled jobs again"),
+        ("cancel", "Cancel queued jobs"),
+    ):
+        command_parser = commands.add_parser(name, help=f"{action}.")
+        command_parser.add_argument(
+            "ids", type=int, nargs="*", help="Job ids (default: all of them)."
+        )
+        command_parser.add_argument("--batch", default=None, help="Only this batch.")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return
+
+    store = JobStore()
+    if args.command == "submit":
+        submit(store, args)
+    elif args.command == "status":
+        status(store, args)
+    elif args.command == "list":
+        jobs = store.jobs(args.status, args.batch, args.limit)
+        for job in jobs:
+            print_job(job)
+        if not jobs:
+            print("No jobs.")
+    elif args.command == "result":
+        job = store.get(args.id)
+        if job is None:
+            raise SystemExit(f"❌ No job {args.id}")
+        if job.status != "done":
+            print_job(job)
+            sys.exit(1)
+        print(job.result)
+    elif args.command == "results":
+        results(store, args)
+    elif args.command == "retry":
+        print(f"♻️  Queued {store.retry(args.ids, args.batch)} job(s) again")
+    elif args.command == "cancel":
+        print(f"🚫 Cancelled {store.cancel(args.ids, args.batch)} job(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,16 @@ TTRPG Sidekick: Your AI-powered assistant for tabletop role-playing games.
 import argparse
 import sys
 import os
-from router import Router
-from features.npc_generator.agent import NPCSpec, generate_npc
-from features.building_generator.agent import BuildingSpec, generate_building
-from features.quest_generator.agent import QuestSpec, generate_quest
-from features.magic_items.agent import MagicItemSpec, generate_magic_item
-from features.battlefields.agent import BattlefieldSpec, generate_battlefield
-from features.backstories.agent import BackstorySpec, generate_backstory
+from core.llm_service import llm_service
+from core.metrics import metrics
+from router import GENERATORS, Router, describe_generators
 
 def check_environment():
     """Checks for the necessary environment variables."""
     api_provider = os.getenv("API_PROVIDER", "openai").lower()
-    if api_provider == "openai" and (not os.getenv("OPENAI_API_KEY") or "your-api-key" in os.getenv("OPENAI_API_KEY")):
+    if llm_service.replaying:
+        print(f"📼 Replaying recorded responses from {llm_service.cassette.path}")
+    elif api_provider == "openai" and (not os.getenv("OPENAI_API_KEY") or "your-api-key" in os.getenv("OPENAI_API_KEY")):
         print("❌ API_PROVIDER is set to 'openai', but OPENAI_API_KEY is not configured in .envrc.")
         return False
     elif api_provider == "ollama":
@@ -26,15 +24,42 @@ def check_environment():
 
 def main():
     """Main entry point for the TTRPG Sidekick application."""
+    if sys.argv[1:2] == ["jobs"]:
+        # The background job queue has its own commands; only running jobs needs a model
+        from interface.jobs import main as jobs_main
+
+        jobs_main(sys.argv[2:])
+        return
+
     if not check_environment():
         sys.exit(1)
 
-    parser = argparse.ArgumentParser(description="AI-powered assistant for TTRPGs.")
+    parser = argparse.ArgumentParser(
+        description="AI-powered assistant for TTRPGs.",
+        epilog="Long runs can go through the background job queue: python main.py jobs --help",
+    )
     parser.add_argument("prompt", type=str, help="Your creative prompt for what you want to generate.")
     parser.add_argument("--world", type=str, default="Forgotten Realms", help="The name of the campaign world for context.")
     parser.add_argument("--brief", action="store_true", help="Generate a brief, slimmed-down version of the output.")
+    parser.add_argument("--stream", action="store_true", help="Print the output as it is generated instead of all at once.")
+    parser.add_argument("--count", type=int, default=1, help="Number of results to generate concurrently from the same prompt.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of concurrent requests when --count is above 1.")
+    parser.add_argument("--cache-mode", choices=["use", "refresh", "off"], default=None, help="How to use the response cache (default: use).")
+    parser.add_argument("--no-cache", dest="cache_mode", action="store_const", const="off", help="Bypass the response cache.")
+    parser.add_argument("--deterministic", action="store_true", help="Sample at temperature 0 so repeated prompts give cacheable, identical results.")
+    parser.add_argument("--structured", action="store_true", help="Have the model fill in the sheet's fields as JSON, which is laid out locally; saves output tokens.")
+    parser.add_argument("--sectioned", action="store_true", help="Write a full sheet's sections with concurrent requests, after its first section; faster for long templates.")
+    parser.add_argument("--expand", type=str, default=None, metavar="FILE", help="Expand the brief sheet in FILE into the full one, generating only the fields it lacks.")
+    parser.add_argument("--usage", action="store_true", help="Print the token usage reported by the provider, including cached prompt tokens.")
+    parser.add_argument("--stats", action="store_true", help="Print latency, time to first token and token throughput of the generation.")
     
     args = parser.parse_args()
+    llm_service.configure_cache(mode=args.cache_mode, deterministic=args.deterministic or None)
+    if args.structured:
+        # Read by every generator agent, including those of a batch
+        os.environ["TTRPG_STRUCTURED_OUTPUT"] = "1"
+    if args.sectioned:
+        os.environ["TTRPG_SECTIONED"] = "1"
 
     print("🧠 Thinking...")
     
@@ -47,32 +72,57 @@ def main():
     if args.brief:
         print("📜 Brief mode enabled")
 
-    # 2. Call the appropriate generator
-    if intent == "npc":
-        spec = NPCSpec(world_name=args.world, prompt=args.prompt, brief=args.brief)
-        result = generate_npc(spec)
-    elif intent == "building":
-        spec = BuildingSpec(world_name=args.world, prompt=args.prompt, brief=args.brief)
-        result = generate_building(spec)
-    elif intent == "quest":
-        spec = QuestSpec(world_name=args.world, prompt=args.prompt, brief=args.brief)
-        result = generate_quest(spec)
-    elif intent == "magic_item":
-        spec = MagicItemSpec(world_name=args.world, prompt=args.prompt, brief=args.brief)
-        result = generate_magic_item(spec)
-    elif intent == "battlefield":
-        spec = BattlefieldSpec(world_name=args.world, prompt=args.prompt, brief=args.brief)
-        result = generate_battlefield(spec)
-    elif intent == "backstory":
-        spec = BackstorySpec(world_name=args.world, prompt=args.prompt, brief=args.brief)
-        result = generate_backstory(spec)
-    else:
-        result = f"Sorry, I'm not sure how to handle that request. I can currently generate 'npc', 'building', 'quest', 'magic_item', 'battlefield', or 'backstory'."
+    generator = GENERATORS.get(intent)
+    if generator is None:
+        result = f"Sorry, I'm not sure how to handle that request. I can currently generate {describe_generators()}."
+        print("-" * 50)
+        print(result)
+        print("-" * 50)
+        return
+
+    # 2. Generate several results at once if requested
+    if args.count > 1:
+        from batch import generate_many
 
-    # 3. Print the result
-    print("-" * 50)
-    print(result)
-    print("-" * 50)
+        specs = [generator.create_spec(args.world, args.prompt, args.brief) for _ in range(args.count)]
+        results = generate_many(specs, concurrency=args.concurrency)
+        for i, result in enumerate(results, 1):
+            print("-" * 50)
+            print(f"#{i}")
+            print(result if isinstance(result, str) else f"❌ Error generating content: {result}")
+        print("-" * 50)
+        if args.usage:
+            print(f"📊 Token usage: {llm_service.total_usage}")
+        if args.stats:
+            print(metrics.memory.format_summary())
+        return
+
+    # 3. Call the generator (only its feature module gets imported)
+    spec = generator.create_spec(args.world, args.prompt, args.brief)
+    agent = generator.agent_class()
+    try:
+        if args.expand:
+            with open(args.expand, "r") as f:
+                result = agent.expand_sheet(spec, f.read())
+        else:
+            result = agent.stream_sheet(spec) if args.stream else agent.generate_sheet(spec)
+
+        # 4. Print the result (streamed results are printed line by line as they arrive)
+        print("-" * 50)
+        if isinstance(result, str):
+            print(result)
+        else:
+            for piece in result:
+                print(piece, end="", flush=True)
+            print()
+        print("-" * 50)
+    except Exception as e:
+        print(f"\n❌ Error generating content: {e}")
+        sys.exit(1)
+    if args.usage:
+        print(f"📊 Token usage: {llm_service.total_usage}")
+    if args.stats:
+        print(metrics.memory.format_summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Migrates world memory from the old per-world JSON files to the SQLite world store.
+
+The JSON files are left in place. Worlds that are already in the store are skipped
+unless --replace is given.
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from core.world_store import WorldStore
+
+
+def migrate_worlds(data_dir: Path, store: WorldStore, replace: bool = False) -> dict[str, int]:
+    """
+    Imports every <world>.json file in a directory into the store.
+
+    Returns:
+        The number of entities imported per world; skipped worlds are not included.
+    """
+    imported = {}
+    for world_file in sorted(data_dir.glob("*.json")):
+        with open(world_file, 'r') as f:
+            world_data = json.load(f)
+        world_name = world_file.stem
+        if not replace and store.has_world(world_name):
+            continue
+        imported[world_name] = store.import_world(world_name, world_data, replace=replace)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate world JSON files to the SQLite world store.")
+    parser.add_argument("--data-dir", type=str, default=os.getenv("TTRPG_WORLDS_DIR", "data/worlds"), help="Directory holding the <world>.json files.")
+    parser.add_argument("--db", type=str, default=None, help="World store to write to (default: $TTRPG_WORLD_DB or <data dir>/worlds.sqlite).")
+    parser.add_argument("--replace", action="store_true", help="Re-import worlds that are already in the store.")
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    if not data_dir.is_dir():
+        print(f"❌ World data directory not found: {data_dir}")
+        sys.exit(1)
+
+    store = WorldStore(args.db or os.getenv("TTRPG_WORLD_DB", data_dir / "worlds.sqlite"))
+    imported = migrate_worlds(data_dir, store, replace=args.replace)
+    store.close()
+
+    for world_name, count in imported.items():
+        print(f"✅ {world_name}: {count} entities")
+    print(f"🎲 Migrated {len(imported)} world(s) to {store.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,91 @@
 import os
 import json
 import re
-from core.llm_service import llm_service
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+# Explicit qualifier at the start of a prompt, e.g. "/npc a grumpy dwarf"
+QUALIFIER_PATTERN = re.compile(r'^/(\w+)\s+(.+)$')
+
+
+class GeneratorEntry:
+    """
+    A generator reachable through a qualifier.
+
+    The feature module is only imported the first time the generator is used, so
+    commands that never touch a generator don't pay for loading it.
+    """
+
+    def __init__(self, name: str, target: str, description: str):
+        """
+        Args:
+            name: The qualifier and intent name, e.g. "npc".
+            target: Where the agent class lives, as "package.module:ClassName".
+            description: Short description shown in help text.
+        """
+        self.name = name
+        self.module_name, self.class_name = target.split(":")
+        self.description = description
+        self._agent_class = None
+
+    @property
+    def agent_class(self) -> type:
+        """The generator agent class, importing its feature module on first access."""
+        if self._agent_class is None:
+            module = importlib.import_module(self.module_name)
+            self._agent_class = getattr(module, self.class_name)
+        return self._agent_class
+
+    @property
+    def spec_class(self) -> "type[BaseModel]":
+        """The Pydantic model the agent takes as input."""
+        return self.agent_class.spec_class
+
+    def create_spec(self, world_name: str, prompt: str, brief: bool) -> "BaseModel":
+        """Builds the input spec for this generator."""
+        return self.spec_class(world_name=world_name, prompt=prompt, brief=brief)
+
+
+# All available generators, keyed by qualifier
+GENERATORS: dict[str, GeneratorEntry] = {}
+
+
+def register_generator(name: str, target: str, description: str) -> GeneratorEntry:
+    """
+    Makes a generator available to the router, main.py, the chat interface and batch runs.
+
+    Example:
+        >>> register_generator("recap", "features.recaps.agent:RecapGeneratorAgent", "Session recaps")
+    """
+    entry = GeneratorEntry(name, target, description)
+    GENERATORS[name] = entry
+    return entry
+
+
+def generator_for_spec(spec: "BaseModel") -> GeneratorEntry:
+    """Finds the generator whose feature module defines the given spec's type."""
+    for entry in GENERATORS.values():
+        if entry.module_name == type(spec).__module__:
+            return entry
+    raise ValueError(f"No generator available for {type(spec).__name__}")
+
+
+def describe_generators() -> str:
+    """Lists the generator names for messages, e.g. "'npc', 'quest', or 'backstory'"."""
+    names = [f"'{name}'" for name in GENERATORS]
+    return ", ".join(names[:-1]) + f", or {names[-1]}" if len(names) > 1 else "".join(names)
+
+
+register_generator("npc", "features.npc_generator.agent:NPCGeneratorAgent", "Characters, merchants, villains, etc.")
+register_generator("building", "features.building_generator.agent:BuildingGeneratorAgent", "Taverns, shops, towers, etc.")
+register_generator("quest", "features.quest_generator.agent:QuestGeneratorAgent", "Missions, adventures, objectives")
+register_generator("magic_item", "features.magic_items.agent:MagicItemGeneratorAgent", "Weapons, artifacts, enchanted objects")
+register_generator("battlefield", "features.battlefields.agent:BattlefieldGeneratorAgent", "Combat environments, tactical situations")
+register_generator("backstory", "features.backstories.agent:BackstoryGeneratorAgent", "Character histories, personal stories")
+
 
 class Router:
     """
@@ -9,11 +93,6 @@ class Router:
     and routes the request to the appropriate generator.
     """
 
-    def __init__(self):
-        # The client is now managed by the shared service
-        self.client = llm_service.client
-        self.model = llm_service.model
-
     def _parse_response(self, response_text: str) -> dict:
         """
         Parses the model's response to extract the JSON object.
@@ -33,26 +112,15 @@ class Router:
         Returns a dictionary containing the 'intent' and the original 'prompt'.
         """
         # Check for explicit qualifiers only
-        qualifier_pattern = r'^/(\w+)\s+(.+)$'
-        match = re.match(qualifier_pattern, user_prompt.strip())
-        
+        match = QUALIFIER_PATTERN.match(user_prompt.strip())
+
         if match:
             qualifier = match.group(1).lower()
             actual_prompt = match.group(2).strip()
-            
-            # Map qualifiers to intents
-            qualifier_map = {
-                'npc': 'npc',
-                'backstory': 'backstory', 
-                'quest': 'quest',
-                'building': 'building',
-                'magic_item': 'magic_item',
-                'battlefield': 'battlefield'
-            }
-            
-            if qualifier in qualifier_map:
+
+            if qualifier in GENERATORS:
                 return {
-                    "intent": qualifier_map[qualifier],
+                    "intent": qualifier,
                     "prompt": actual_prompt
                 }
             else:
@@ -62,7 +130,7 @@ class Router:
                     "prompt": user_prompt,
                     "unknown_qualifier": qualifier
                 }
-        
+
         # No qualifier found - this should be handled by conversational chat
         return {
             "intent": "conversational",
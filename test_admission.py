@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for admission control.
+
+Requests are slots held and freed by the test, so no model or server is needed: the
+tests check the accounting of acquire and release, and that requests over the
+per-client, queue and wait limits are turned away with a retry delay.
+"""
+
+import asyncio
+
+import pytest
+
+from core.admission import AdmissionController, OverloadedError
+
+
+def test_slots_are_counted_and_freed_once():
+    async def main():
+        admission = AdmissionController(max_in_flight=2, per_client=2)
+        first = await admission.acquire("table-1")
+        second = await admission.acquire("table-2")
+        assert admission.stats()["in_flight"] == 2 and admission.stats()["clients"] == 2
+
+        first()
+        first()  # Freeing twice frees once
+        assert admission.stats()["in_flight"] == 1 and admission.stats()["clients"] == 1
+        second()
+        return admission.stats()
+
+    stats = asyncio.run(main())
+    assert stats["in_flight"] == stats["queued"] == stats["clients"] == stats["rejected"] == 0
+
+
+def test_a_client_over_its_limit_is_turned_away():
+    async def main():
+        admission = AdmissionController(per_client=1)
+        release = await admission.acquire("table-1")
+        with pytest.raises(OverloadedError) as error:
+            await admission.acquire("table-1")
+        assert error.value.retry_after >= 1
+        # Other clients still get in
+        (await admission.acquire("table-2"))()
+        release()
+        (await admission.acquire("table-1"))()
+        return admission.stats()
+
+    stats = asyncio.run(main())
+    assert stats["rejected"] == 1 and stats["in_flight"] == 0
+
+
+def test_requests_wait_in_a_bounded_queue():
+    async def main():
+        admission = AdmissionController(max_in_flight=1, max_queue=1, per_client=5, queue_timeout=1)
+        release = await admission.acquire("a")
+        waiting = asyncio.ensure_future(admission.acquire("b"))
+        await asyncio.sleep(0.01)
+        assert admission.stats()["queued"] == 1
+        with pytest.raises(OverloadedError):
+            await admission.acquire("c")
+
+        release()
+        (await waiting)()
+        return admission.stats()
+
+    stats = asyncio.run(main())
+    assert stats == {**stats, "in_flight": 0, "queued": 0, "clients": 0, "rejected": 1}
+
+
+def test_waiting_too_long_or_giving_up_frees_the_place_in_the_queue():
+    async def main():
+        admission = AdmissionController(max_in_flight=1, max_queue=2, per_client=5, queue_timeout=0.05)
+        release = await admission.acquire("a")
+        with pytest.raises(OverloadedError):
+            await admission.acquire("b")
+
+        cancelled = asyncio.ensure_future(admission.acquire("c"))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        stats = admission.stats()
+        release()
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats["in_flight"] == 1 and stats["queued"] == 0 and stats["clients"] == 1
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Tests for the HTTP API.
+
+Sheets and chat replies come from stand-ins, so no model is needed: the tests check
+that requests over the admission limits get a 429 with Retry-After, the framing of
+streamed responses, that a client leaving mid-stream closes the stream, and the life of
+a chat session. They need fastapi and httpx.
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+import interface.api as api
+from core.admission import AdmissionController
+from features.npc_generator.agent import NPCSpec
+from interface.cli import SmartChatSession
+from router import GENERATORS
+
+
+class SheetWriter:
+    """Writes the same sheet in two pieces."""
+
+    spec_class = NPCSpec
+
+    def __init__(self, **options):
+        pass
+
+    async def generate_sheet_async(self, spec):
+        return f"Borin the smith, for {spec.prompt}"
+
+    async def stream_sheet_async(self, spec):
+        for piece in ("Borin ", "the smith"):
+            yield piece
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "admission", AdmissionController(max_in_flight=1, max_queue=0, per_client=1))
+    monkeypatch.setattr(api, "sessions", api.ChatSessions())
+    monkeypatch.setattr(GENERATORS["npc"], "_agent_class", SheetWriter)
+    monkeypatch.setattr(SmartChatSession, "handle_input", lambda session, message: f"You said: {message}")
+    # Without the with block, the lifespan (which loads the model) doesn't run
+    return TestClient(api.app)
+
+
+def hold_slot(client_id: str):
+    """Takes an admission slot as if a request of the client were in progress."""
+    return asyncio.run(api.admission.acquire(client_id))
+
+
+def test_generate(client):
+    response = client.post("/generate/npc", json={"prompt": "a smith", "brief": True})
+    assert response.status_code == 200
+    assert response.json()["sheet"] == "Borin the smith, for a smith"
+    assert client.post("/generate/dragon", json={"prompt": "a dragon"}).status_code == 404
+
+
+def test_requests_over_the_limits_get_429(client):
+    release = hold_slot("table-1")
+    # Over the client's limit
+    response = client.post("/generate/npc", json={"prompt": "a smith"}, headers={"X-Client-Id": "table-1"})
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1
+    # Over the server's limit: no slot free and no room to wait
+    response = client.post("/generate/npc", json={"prompt": "a smith"}, headers={"X-Client-Id": "table-2"})
+    assert response.status_code == 429 and "busy" in response.json()["detail"]
+
+    release()
+    assert client.post("/generate/npc", json={"prompt": "a smith"}, headers={"X-Client-Id": "table-2"}).status_code == 200
+    assert api.admission.stats()["rejected"] == 2 and api.admission.stats()["in_flight"] == 0
+
+
+def test_streamed_sheets_are_server_sent_events(client):
+    response = client.post("/generate/npc", json={"prompt": "a smith", "stream": True})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = response.text.split("\n\n")
+    assert [json.loads(event.removeprefix("data: ")) for event in events[:2]] == [{"text": "Borin "}, {"text": "the smith"}]
+    assert events[2] == "event: done\ndata: {}" and events[3:] == [""]
+    # The slot is freed once the stream ends
+    assert api.admission.stats()["in_flight"] == 0
+
+
+def test_chat_sessions(client, monkeypatch):
+    session_id = client.post("/chat", json={"world": "Eberron"}).json()["session_id"]
+    response = client.post(f"/chat/{session_id}", json={"message": "hello"})
+    assert response.json() == {"session_id": session_id, "reply": "You said: hello"}
+
+    assert client.delete(f"/chat/{session_id}").json()["deleted"]
+    assert client.post(f"/chat/{session_id}", json={"message": "hello?"}).status_code == 404
+
+    # Sessions left idle past their TTL are dropped
+    monkeypatch.setattr(api, "sessions", api.ChatSessions(ttl=0.05))
+    session_id = client.post("/chat", json={}).json()["session_id"]
+    assert client.post(f"/chat/{session_id}", json={"message": "hi"}).status_code == 200
+    time.sleep(0.1)
+    assert client.post(f"/chat/{session_id}", json={"message": "still there?"}).status_code == 404
+
+
+def test_streams_are_closed_when_the_client_disconnects(client, monkeypatch):
+    sent, closed = [], []
+
+    def handle_input_stream(session, message):
+        try:
+            for i in range(100):
+                sent.append(i)
+                yield f"piece {i} "
+                time.sleep(0.01)
+        finally:
+            closed.append(len(sent))
+
+    monkeypatch.setattr(SmartChatSession, "handle_input_stream", handle_input_stream)
+    session_id = client.post("/chat", json={}).json()["session_id"]
+
+    async def disconnect_after_the_first_event():
+        first_event = asyncio.Event()
+        body = json.dumps({"message": "hi", "stream": True}).encode()
+        messages = [{"type": "http.request", "body": body}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await first_event.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message.get("body"):
+                first_event.set()
+
+        path = f"/chat/{session_id}"
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": b"", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        }
+        await api.app(scope, receive, send)
+
+    asyncio.run(disconnect_after_the_first_event())
+    # The stream was closed early rather than left to run to the end
+    assert closed and closed[0] < 100
+    # The slot and the session are free again
+    assert api.admission.stats()["in_flight"] == 0
+    assert client.post(f"/chat/{session_id}", json={"message": "still there?"}).status_code == 200
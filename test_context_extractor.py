@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for chat context extraction.
+
+Only message text is scanned, so no model is needed: the tests check that numbered
+options are read from assistant messages, and that picks, preferences and mentions of
+content are read from user messages, with their tokens counted once.
+"""
+
+from core.context_extractor import EXCERPT_TOKENS, MAX_OPTIONS, extract_message_context
+from core.token_budget import count_tokens
+
+IDEAS = """Here are some taverns for the docks:
+
+1. The Gilded Goose - run by a retired pirate
+  2. The Salty Anchor - smugglers meet in the cellar
+3. The Drowned Rat
+not an option: 4 coins a drink
+7. The Tipsy Kraken
+8. The Barnacle
+9. The Last Lantern
+"""
+
+
+def test_options_are_read_from_numbered_lists():
+    context = extract_message_context("assistant", IDEAS)
+    assert context.options[:3] == [
+        "1. The Gilded Goose - run by a retired pirate",
+        "2. The Salty Anchor - smugglers meet in the cellar",
+        "3. The Drowned Rat",
+    ]
+    assert len(context.options) == 6
+    part, = context.parts
+    assert part.startswith("Previous options discussed:\n1. The Gilded Goose")
+    assert part.count("\n") == MAX_OPTIONS and "The Last Lantern" not in part
+    assert context.tokens == count_tokens(part)
+
+
+def test_ideas_without_a_list_are_excerpted():
+    idea = "A heist at the wizard's tower could go wrong in many ways. " * 20
+    part, = extract_message_context("assistant", idea).parts
+    assert part.startswith("Previous discussion: A heist") and part.endswith("...")
+    assert count_tokens(part) <= EXCERPT_TOKENS + 10
+
+    # Short or unrelated replies carry nothing over
+    assert extract_message_context("assistant", "Sure!").parts == []
+    assert extract_message_context("assistant", "It's raining in the city this evening, so everyone stays inside.").parts == []
+
+
+def test_user_picks_preferences_and_mentions():
+    pick = extract_message_context("user", "/npc number 2")
+    assert pick.selected_option == 2 and pick.parts == ["User selected option #2: /npc number 2"]
+
+    preference = extract_message_context("user", "I prefer the one with smugglers")
+    assert preference.selected_option is None and preference.parts == ["User preference: I prefer the one with smugglers"]
+
+    mention = extract_message_context("user", "Make a dragon for the finale")
+    assert mention.parts == ["User referencing specific content: Make a dragon for the finale"]
+
+    nothing = extract_message_context("user", "Hello there")
+    assert nothing.parts == [] and nothing.tokens == 0 and nothing.options == []
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests for the Discord bot against the fake gateway in testing/fake_discord.py.
+
+The channel sessions are scripted, so no model is needed: they stream a fixed reply
+in small pieces, the way SmartChatSession streams a generated sheet.
+"""
+
+import asyncio
+import time
+
+from core.admission import OverloadedError
+from core.scheduler import FairScheduler
+from fake_discord import FakeGateway
+from interface.discord_bot import SidekickBot, split_pages
+
+
+class ScriptedSession:
+    """A chat session that answers every message with the same reply, a piece at a time."""
+
+    reply = "".join(f"Line {i} of the sheet.\n" for i in range(20))
+    delay = 0.02  # Seconds between pieces
+
+    def __init__(self, world_name=None):
+        self.world_name = world_name
+        self.brief_mode = True
+        self.history = []
+
+    def add_message(self, role, content):
+        self.history.append((role, content))
+
+    def clear_history(self):
+        self.history.clear()
+
+    def handle_input_stream(self, user_input):
+        for line in self.reply.splitlines(keepends=True):
+            time.sleep(self.delay)
+            yield line
+
+
+class LongSession(ScriptedSession):
+    reply = "".join(f"A rather long line of lore, number {i}.\n" for i in range(150))
+    delay = 0.0
+
+
+def run_bot(coroutine_function, **options):
+    """Runs a test coroutine with a started bot and a gateway for it."""
+    async def run():
+        bot = SidekickBot(**{"session_factory": ScriptedSession, "edit_interval": 0.1, **options})
+        bot.start()
+        try:
+            return await coroutine_function(bot, FakeGateway(bot))
+        finally:
+            await bot.close()
+
+    return asyncio.run(run())
+
+
+def test_replies_stream_as_throttled_edits():
+    async def scenario(bot, gateway):
+        context = await gateway.command("guild", "table", "npc", "a grumpy dwarf")
+        channel = gateway.channel("table")
+        assert context.deferred
+        assert channel.text == ScriptedSession.reply
+        assert len(channel.messages) == 1 and channel.messages[0].edits >= 2
+        gaps = [b - a for a, b in zip(channel.operations, channel.operations[1:])]
+        assert min(gaps) >= 0.1 * 0.95
+        session, _ = bot.sessions.get("table")
+        assert session.history == [("user", "/npc a grumpy dwarf"), ("assistant", ScriptedSession.reply)]
+
+    run_bot(scenario)
+
+
+def test_long_replies_continue_in_new_messages():
+    async def scenario(bot, gateway):
+        await gateway.command("guild", "table", "chat", "tell me everything")
+        channel = gateway.channel("table")
+        assert len(channel.messages) == 3
+        assert all(len(message.content) <= 2000 for message in channel.messages)
+        assert channel.text == LongSession.reply
+
+    run_bot(scenario, session_factory=LongSession)
+    text = "x" * 4500
+    assert split_pages(text) == ["x" * 2000, "x" * 2000, "x" * 500]
+
+
+def test_channels_keep_their_own_sessions():
+    async def scenario(bot, gateway):
+        await gateway.command("guild", "eberron-table", "world", "Eberron")
+        await gateway.command("guild", "other-table", "brief")
+        await gateway.command("guild", "eberron-table", "chat", "hello")
+        eberron, _ = bot.sessions.get("eberron-table")
+        other, _ = bot.sessions.get("other-table")
+        assert (eberron.world_name, eberron.brief_mode) == ("Eberron", True)
+        assert (other.world_name, other.brief_mode) == (None, False)
+        assert other.history == []
+
+    run_bot(scenario)
+
+
+def test_busy_server_does_not_starve_others():
+    async def scenario():
+        scheduler = FairScheduler(workers=1, queue_limit=10)
+        scheduler.start()
+        order = []
+
+        def job(name):
+            async def run():
+                await asyncio.sleep(0.01)
+                order.append(name)
+            return run
+
+        busy = [scheduler.submit("busy", job(f"busy-{i}")) for i in range(6)]
+        await asyncio.sleep(0)
+        quiet = scheduler.submit("quiet", job("quiet"))
+        await asyncio.gather(*busy, quiet)
+        await scheduler.stop()
+        # The quiet server's job runs right after the busy server's first two, not after all six
+        assert order.index("quiet") <= 2
+
+        scheduler = FairScheduler(workers=1, queue_limit=1)
+        scheduler.start()
+        scheduler.submit("busy", job("a"))
+        try:
+            scheduler.submit("busy", job("b"))
+            raise AssertionError("A full server queue should reject the job")
+        except OverloadedError as e:
+            assert e.retry_after >= 1
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+
+
+def test_full_server_queue_is_answered_with_a_busy_message():
+    async def scenario(bot, gateway):
+        commands = [gateway.command("guild", f"table-{i}", "chat", "hi") for i in range(4)]
+        await asyncio.gather(*commands)
+        texts = [gateway.channel(f"table-{i}").text for i in range(4)]
+        assert sum(text.startswith("⏳") for text in texts) == 2
+        assert sum(text == ScriptedSession.reply for text in texts) == 2
+
+    run_bot(scenario, workers=1, guild_queue=2)
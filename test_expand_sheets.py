@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for expanding brief sheets into full ones.
+
+The model is a stand-in that fills in whatever fields it is asked for, so no model is
+needed: the tests check that only the fields the brief sheet lacks are requested, that
+what the brief sheet says is kept, and that chat sessions can expand in the background.
+"""
+
+import json
+import re
+
+from core.generator_agent import BRIEF_NOTES_HEADING
+from core.sheet_model import SECTION_SEPARATOR, parse_template
+from fake_services import Entities, StubLLM, offline_agent
+from features.npc_generator.agent import NPC_TEMPLATE_FULL, NPCGeneratorAgent, NPCSpec
+from interface.cli import SmartChatSession
+from router import GENERATORS
+
+BRIEF_SHEET = """🧾 NPC Template (Brief)
+
+📌 1. Quick Overview
+  • Name: Grumble Ironfoot
+  • Race / Species: Dwarf
+  • Occupation / Role: Blacksmith
+  • Brief Personality Tagline: Gruff, but never turns away a customer
+  • One interesting thing you know about them: Forged the city gates
+  • Voice inspiration: A creaky bellows
+⸻
+👀 2. Appearance & Vibe
+  • **Physical traits:** Soot-black beard, burn scars on both forearms,
+    and a missing left ear
+  • Clothing / Gear: Leather apron, hammer on his belt
+⸻
+🧠 3. Personality & Social Profile
+  • Core traits: Stubborn, loyal
+  • Motivations: Pay off the forge
+  • Fears: Fire he can't control
+  • Quirks: Hums while he works
+"""
+
+FULL = parse_template(NPC_TEMPLATE_FULL)
+
+SPEC = NPCSpec(world_name="Eberron", prompt="a grumpy dwarf blacksmith", brief=True)
+
+
+class FieldWriter(StubLLM):
+    """Fills in every field of the request's blank template (or field guide) with a made-up value."""
+
+    def asked_for(self, request):
+        fields = request.split("Fill out only the remaining fields below", 1)[1]
+        return re.findall(r"^\s*• ([^:\n]+)", fields, re.MULTILINE), re.findall(r"^- (\w+):", fields, re.MULTILINE)
+
+    def complete(self, messages, call=None, response_format=None, **options):
+        request = messages[-1]["content"]
+        self.requests.append((request, response_format))
+        labels, names = self.asked_for(request)
+        if response_format is not None:
+            return json.dumps({name: f"written {name}" for name in names})
+        return "Here you go!\n\n" + "\n".join(f"  • {label}: written {label.lower()}" for label in labels)
+
+
+def agent(llm, structured=False, memory=None):
+    return offline_agent(NPCGeneratorAgent, llm, memory=memory, structured=structured)
+
+
+def sheet_values(sheet):
+    """Field values by label, from the bullet lines with a colon."""
+    lines = [line.strip(" •") for line in sheet.splitlines() if line.strip().startswith("•")]
+    return dict(line.split(": ", 1) for line in lines if ": " in line), len(lines)
+
+
+def test_only_the_missing_fields_are_generated():
+    llm = FieldWriter()
+    sheet = agent(llm).expand_sheet(SPEC, BRIEF_SHEET)
+
+    (request, response_format), = llm.requests
+    labels, _ = llm.asked_for(request)
+    assert "Grumble Ironfoot" in request and response_format is None
+    assert "Name" not in labels and "Motivations" not in labels
+    assert len(labels) == len(FULL.fields) - 11
+    assert "Smells like" in labels and "Secret they're hiding" in labels
+
+    # The full layout, with the brief sheet's values where the templates share a field
+    values, count = sheet_values(sheet)
+    assert count == len(FULL.fields) + 1
+    assert sheet.startswith(FULL.title) and sheet.count(SECTION_SEPARATOR) == len(FULL.sections)
+    assert values["Name"] == "Grumble Ironfoot" and values["Quirks"] == "Hums while he works"
+    assert values["Physical traits"].endswith("and a missing left ear")
+    assert values["Smells like"] == "written smells like"
+    # The brief sheet's field that the full template lacks is kept at the end
+    notes = sheet.split(f"\n{SECTION_SEPARATOR}\n")[-1]
+    assert notes == f"{BRIEF_NOTES_HEADING}\n  • One interesting thing you know about them: Forged the city gates"
+
+
+def test_structured_expansion_asks_for_the_missing_fields_as_json():
+    llm, memory = FieldWriter(), Entities()
+    sheet = agent(llm, structured=True, memory=memory).expand_sheet(SPEC, BRIEF_SHEET)
+
+    (request, response_format), = llm.requests
+    properties = response_format["json_schema"]["schema"]["properties"]
+    assert "smells_like" in properties and "name" not in properties
+    assert "Name: Grumble Ironfoot" in sheet and "Smells like: written smells_like" in sheet
+    entity, = memory.stored
+    assert entity["name"] == "Grumble Ironfoot" and entity["smells_like"] == "written smells_like"
+    assert entity["one_interesting_thing_you_know_about_them"] == "Forged the city gates"
+    assert sheet.endswith("One interesting thing you know about them: Forged the city gates")
+
+
+def test_chat_expands_the_last_brief_sheet_in_the_background(monkeypatch):
+    llm = FieldWriter()
+    monkeypatch.setattr(GENERATORS["npc"], "_agent_class", lambda: agent(llm))
+    session = SmartChatSession("Eberron")
+    assert session.handle_input("/expand").startswith("Nothing to expand yet")
+
+    session.auto_expand = True
+    session._remember_sheet("npc", SPEC, BRIEF_SHEET)
+    session.expansion.result()
+    assert len(llm.requests) == 1
+
+    sheet = "".join(session.handle_input_stream("/expand"))
+    # Answered from the background expansion, without asking the model again
+    assert len(llm.requests) == 1
+    assert sheet.startswith(FULL.title) and "Name: Grumble Ironfoot" in sheet
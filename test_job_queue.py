@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent job queue.
+
+Jobs are run by a stand-in for the generators, so no model is needed: the tests check
+that every job is run exactly once by concurrent workers, that failures are retried and
+then given up on, that the jobs of a worker that died are picked up again, and that bad
+job files are refused with the line at fault.
+"""
+
+import re
+import socket
+import threading
+
+import pytest
+
+import core.job_queue as job_queue
+from core.job_queue import JobStore, work, worker_name
+from core.generator_agent import variation_numbers
+from features.npc_generator.agent import NPCGeneratorAgent, NPCSpec
+
+
+def npc_specs(count: int) -> list:
+    return [NPCSpec(world_name="Test World", prompt=f"villager {i}", brief=True) for i in range(count)]
+
+
+def test_concurrent_workers_run_every_job_once(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    ids = store.submit(npc_specs(40), batch="prep")
+    runs = []
+    lock = threading.Lock()
+
+    def run(job):
+        with lock:
+            runs.append(job.id)
+        return f"sheet for {job.spec['prompt']}"
+
+    stop = threading.Event()
+    workers = [
+        threading.Thread(target=work, args=(store, worker_name(i), stop, 0.01, True), kwargs={"run": run})
+        for i in range(8)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(runs) == ids
+    assert store.counts("prep")["done"] == 40
+    assert store.get(ids[3]).result == "sheet for villager 3"
+
+
+def test_failed_jobs_are_retried_then_given_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BASE", 0.01)
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    broken, flaky = store.submit(npc_specs(2), max_attempts=3)
+    attempts = {broken: 0, flaky: 0}
+
+    def run(job):
+        attempts[job.id] += 1
+        if job.id == broken or attempts[job.id] == 1:
+            raise RuntimeError("the model fell over")
+        return "sheet"
+
+    work(store, worker_name(0), threading.Event(), 0.01, True, run=run)
+
+    assert attempts == {broken: 3, flaky: 2}
+    assert store.get(broken).status == "failed" and "fell over" in store.get(broken).error
+    assert store.get(flaky).status == "done"
+    assert store.retry() == 1 and store.get(broken).status == "queued"
+
+
+def test_jobs_of_dead_workers_are_resumed(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    job_id, = store.submit(npc_specs(1))
+    # Claimed by a process on this machine that no longer exists
+    dead_worker = f"{socket.gethostname()}:999999999:0"
+    assert store.claim(dead_worker).id == job_id
+    assert store.claim(worker_name(0)) is None
+
+    assert store.requeue_orphans() == 1
+    job = store.claim(worker_name(0))
+    assert job.id == job_id and job.attempts == 2
+    # The dead worker's late answer, if any, doesn't overwrite the new attempt
+    assert not store.complete(job_id, dead_worker, "stale sheet")
+    assert store.complete(job_id, worker_name(0), "sheet")
+
+
+def test_expired_leases_are_taken_over(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    job_id, = store.submit(npc_specs(1), max_attempts=2)
+    assert store.claim("other-machine:1:0", lease=-1).id == job_id
+    assert store.claim(worker_name(0), lease=-1).id == job_id
+    # Both attempts were used up by workers that stopped
+    assert store.claim(worker_name(1)) is None
+    assert store.get(job_id).status == "failed"
+
+
+def test_repeated_specs_are_cached_as_variations(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    first = store.submit(npc_specs(1) * 3)
+    more = store.submit(npc_specs(2))
+    assert [store.get(job_id).variation for job_id in first + more] == [0, 1, 2, 3, 0]
+
+    regular, other = npc_specs(2)
+    assert variation_numbers([regular, regular, other, regular]) == [0, 1, 0, 2]
+    scopes = [NPCGeneratorAgent(variation=n).cache_scope(regular) for n in (0, 1, 2)]
+    assert "variation" not in scopes[0] and scopes[1] != scopes[2]
+
+
+def test_submitting_nothing_is_refused(tmp_path, monkeypatch):
+    from interface import jobs
+
+    monkeypatch.setenv("TTRPG_DATA_DIR", str(tmp_path))
+    empty = tmp_path / "prep.jsonl"
+    empty.write_text("\n")
+    with pytest.raises(SystemExit, match="has no jobs"):
+        jobs.main(["submit", "--file", str(empty)])
+    with pytest.raises(SystemExit) as error:
+        jobs.main(["submit", "/npc a tavern regular", "--count", "0"])
+    assert error.value.code == 2
+    assert JobStore(str(tmp_path / "jobs" / "jobs.sqlite")).counts()["queued"] == 0
+
+
+@pytest.mark.parametrize("line", ['{"prompt": "a smith"', '["a smith"]', '"a smith"', '{"world": "Eberron"}'])
+def test_bad_lines_are_reported_by_number(tmp_path, line):
+    from interface import jobs
+
+    prep = tmp_path / "prep.jsonl"
+    prep.write_text('{"prompt": "/npc a tavern regular"}\n' + line + "\n")
+    with pytest.raises(SystemExit, match=re.escape(f"❌ {prep}, line 2: ")):
+        jobs.read_specs(str(prep), "Eberron", True)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the lore index.
+
+Sheets are written by a stand-in for the model, so no model is needed: the tests check
+that passages are labelled with what they describe, and that a generator's prompt gets
+the lore of other requests but not its own earlier answers to the same one.
+"""
+
+from core.lore_tracker import LoreTracker, request_source, sheet_title
+from fake_services import StubLLM, offline_agent
+from features.npc_generator.agent import NPCGeneratorAgent, NPCSpec
+
+BORIN = """🧾 NPC Template (Brief)
+
+📌 1. Quick Overview
+  • **Name:** Borin Emberhand
+  • Occupation / Role: Blacksmith in the Sharn undercity, grumpy about everything
+"""
+
+
+class SheetWriter(StubLLM):
+    """Answers every request with the same sheet, keeping the requests."""
+
+    def complete(self, messages, call=None, **options):
+        self.requests.append(messages[-1]["content"])
+        return BORIN
+
+
+def test_passages_are_titled_with_the_name():
+    assert sheet_title(BORIN) == "Borin Emberhand"
+    assert sheet_title("🎯 Quest Profile (Brief)\n  • Quest Title: The Lost Crown\n") == "The Lost Crown"
+    assert sheet_title("# Notes\nNothing named here") == "Notes"
+    assert request_source("npc", "A grumpy  blacksmith") == request_source("npc", "a grumpy blacksmith")
+
+
+def test_search_leaves_out_the_excluded_source(tmp_path):
+    lore = LoreTracker(str(tmp_path), dense=False)
+    lore.add_sheet("Eberron", "npc", BORIN, source=request_source("npc", "a grumpy blacksmith"))
+    lore.add("Eberron", "The blacksmith guild of Sharn meets at dawn.", title="Guild")
+
+    titles = [hit.passage.title for hit in lore.search("Eberron", "blacksmith Sharn")]
+    assert titles[0] in ("Borin Emberhand", "Guild") and len(titles) == 2
+    facts = lore.relevant_facts("Eberron", "blacksmith Sharn", 500, exclude_source=request_source("npc", "A grumpy blacksmith"))
+    assert "Borin" not in facts and "[note: Guild]" in facts
+
+
+def test_repeated_requests_dont_get_their_own_sheets(tmp_path):
+    llm = SheetWriter()
+    agent = offline_agent(NPCGeneratorAgent, llm, lore=LoreTracker(str(tmp_path)))
+    spec = NPCSpec(world_name="Eberron", prompt="a grumpy blacksmith in Sharn", brief=True)
+
+    agent.generate_sheet(spec)
+    agent.generate_sheet(spec)
+    assert llm.requests[0] == llm.requests[1]
+    assert "Borin" not in llm.requests[1]
+
+    # Another request builds on the blacksmith
+    agent.generate_sheet(spec.model_copy(update={"prompt": "the blacksmith's apprentice in Sharn"}))
+    assert "[npc: Borin Emberhand]" in llm.requests[2]
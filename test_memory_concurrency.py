@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Stress test for concurrent writes to world memory.
+
+Several processes store NPCs in the same world at once, some writing each NPC
+immediately and some through the write buffer, and the test checks that every
+NPC made it into the world exactly once.
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROCESSES = int(os.getenv("TTRPG_STRESS_PROCESSES", "8"))
+NPCS_PER_PROCESS = int(os.getenv("TTRPG_STRESS_NPCS", "200"))
+WORLD_NAME = "Stress Test"
+
+
+def store_npcs(data_dir: str, worker: int, batch_size: int) -> None:
+    """Stores this worker's NPCs in the shared world."""
+    from core.memory import MemoryService
+
+    with MemoryService(data_dir, batch_size=batch_size) as memory:
+        for i in range(NPCS_PER_PROCESS):
+            memory.store_npc(WORLD_NAME, {"name": f"npc-{worker}-{i}", "race": "human", "location": f"district-{worker}"})
+
+
+def run_stress(data_dir: str) -> tuple[list, float]:
+    """
+    Hammers one world from many processes.
+
+    Returns:
+        The NPCs stored in the world afterwards and the time taken, in seconds.
+    """
+    from core.memory import MemoryService
+
+    # A world from before the SQLite store, so every process also races to import it
+    legacy_npcs = [{"name": "legacy-npc", "race": "dwarf", "location": "Old Town"}]
+    with open(Path(data_dir) / f"{WORLD_NAME}.json", "w") as f:
+        json.dump({"description": "A crowded world", "npcs": legacy_npcs, "locations": []}, f)
+
+    context = multiprocessing.get_context("spawn")
+    # Alternate between writing every NPC immediately and writing in batches
+    processes = [
+        context.Process(target=store_npcs, args=(data_dir, worker, 1 if worker % 2 else 25))
+        for worker in range(PROCESSES)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    assert all(process.exitcode == 0 for process in processes), "A writer process failed"
+    return MemoryService(data_dir).get_world_npcs(WORLD_NAME), elapsed
+
+
+def check_npcs(npcs: list) -> None:
+    """Checks that the legacy NPC and every stored NPC are present exactly once."""
+    names = [npc["name"] for npc in npcs]
+    expected = {"legacy-npc"} | {
+        f"npc-{worker}-{i}" for worker in range(PROCESSES) for i in range(NPCS_PER_PROCESS)
+    }
+    assert len(names) == len(set(names)), f"{len(names) - len(set(names))} NPCs were stored more than once"
+    assert set(names) == expected, f"{len(expected - set(names))} NPCs were lost"
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    npcs, _ = run_stress(str(tmp_path))
+    check_npcs(npcs)
+
+
+def test_buffered_writes_are_visible_to_reads(tmp_path):
+    from core.memory import MemoryService
+
+    memory = MemoryService(str(tmp_path), batch_size=100)
+    memory.store_npc(WORLD_NAME, {"name": "buffered"})
+    assert memory.find_npcs(WORLD_NAME, name="BUFFERED") == [{"name": "buffered"}]
+
+
+def main():
+    """Runs the stress test and prints the results."""
+    print("🎲 TTRPG Sidekick - World Memory Stress Test")
+    print("=" * 50)
+    print(f"{PROCESSES} processes x {NPCS_PER_PROCESS} NPCs")
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        npcs, elapsed = run_stress(data_dir)
+        try:
+            check_npcs(npcs)
+        except AssertionError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+    print(f"✅ All {len(npcs)} NPCs stored exactly once in {elapsed:.2f}s ({len(npcs) / elapsed:.0f} NPCs/s)")
+
+
+if __name__ == "__main__":
+    main()
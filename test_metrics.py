@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for call metrics.
+
+Calls are made-up CallMetrics, so no model is needed: the tests check what the JSONL
+and Prometheus sinks write, including for failed calls, and the in-memory summary
+behind /stats.
+"""
+
+import json
+import urllib.request
+
+import pytest
+
+from core.metrics import LATENCY_BUCKETS, CallMetrics, InMemorySink, Metrics, PrometheusSink
+
+
+def npc_call(**fields) -> CallMetrics:
+    values = {"generator": "npc", "brief": True, "model": "llama3", "provider": "ollama", "endpoint": "ollama", **fields}
+    return CallMetrics(**values)
+
+
+def test_jsonl_sink_writes_a_line_per_call(tmp_path, monkeypatch):
+    path = tmp_path / "metrics" / "calls.jsonl"
+    monkeypatch.setenv("TTRPG_METRICS_FILE", str(path))
+    monkeypatch.delenv("TTRPG_METRICS_PORT", raising=False)
+    metrics = Metrics()
+
+    with metrics.track(generator="npc", brief=True) as call:
+        call.completion_tokens, call.model_seconds = 100, 2.0
+        with call.stage("context"):
+            pass
+    with pytest.raises(TimeoutError):
+        with metrics.track(generator="quest", brief=False):
+            raise TimeoutError()
+
+    first, failed = [json.loads(line) for line in path.read_text().splitlines()]
+    assert first["generator"] == "npc" and first["brief"] is True and first["error"] is None
+    assert first["tokens_per_second"] == 50.0 and "context" in first["stages"] and first["total_seconds"] > 0
+    assert failed["generator"] == "quest" and failed["error"] == "TimeoutError"
+    assert metrics.memory.summary()["quest/full"]["errors"] == 1
+
+
+def test_prometheus_sink_counts_calls_and_tokens():
+    sink = PrometheusSink()
+    sink.emit(npc_call(total_seconds=0.3, ttft_seconds=0.1, prompt_tokens=500, completion_tokens=80, stages={"clean": 0.01}))
+    sink.emit(npc_call(total_seconds=20.0, ttft_seconds=0.2, prompt_tokens=500, completion_tokens=120))
+    sink.emit(npc_call(total_seconds=0.01, ttft_seconds=0.01, cache_hit=True))
+    lines = sink.render().splitlines()
+
+    base = 'endpoint="ollama",generator="npc",model="llama3",provider="ollama",template="brief"'
+    calls = 'ttrpg_llm_calls_total{{cache_hit="{}",coalesced="false",endpoint="ollama",error="",generator="npc",model="llama3",provider="ollama",template="brief"}}'
+    assert calls.format("false") + " 2" in lines and calls.format("true") + " 1" in lines
+    assert f'ttrpg_llm_tokens_total{{{base},type="prompt"}} 1000' in lines
+    assert f'ttrpg_llm_tokens_total{{{base},type="completion"}} 200' in lines
+
+    # Buckets count the calls at or under their bound, and +Inf all of them
+    assert f'ttrpg_llm_latency_seconds_bucket{{{base},le="0.05"}} 1' in lines
+    assert f'ttrpg_llm_latency_seconds_bucket{{{base},le="0.5"}} 2' in lines
+    assert f'ttrpg_llm_latency_seconds_bucket{{{base},le="{LATENCY_BUCKETS[-1]}"}} 3' in lines
+    assert f'ttrpg_llm_latency_seconds_bucket{{{base},le="+Inf"}} 3' in lines
+    assert f'ttrpg_llm_latency_seconds_count{{{base}}} 3' in lines
+    # Cache hits have no time to first token of their own
+    assert f'ttrpg_llm_ttft_seconds_count{{{base}}} 2' in lines
+    assert 'ttrpg_stage_seconds_count{generator="npc",stage="clean",template="brief"} 1' in lines
+    assert lines.count("# TYPE ttrpg_llm_latency_seconds histogram") == 1
+
+
+def test_prometheus_sink_serves_the_metrics():
+    sink = PrometheusSink()
+    sink.emit(npc_call(total_seconds=1.0))
+    server = sink.serve(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode("utf-8") == sink.render()
+    finally:
+        server.shutdown()
+
+
+def test_in_memory_summary():
+    sink = InMemorySink()
+    for seconds in range(1, 21):
+        sink.emit(npc_call(total_seconds=seconds, model_seconds=seconds, completion_tokens=10))
+    sink.emit(npc_call(total_seconds=0.01, cache_hit=True))
+    sink.emit(npc_call(total_seconds=0.02, coalesced=True))
+
+    stats = sink.summary()["npc/brief"]
+    assert stats["calls"] == 22 and stats["cache_hits"] == 1 and stats["coalesced"] == 1
+    assert stats["mean_completion_tokens"] == 10 and stats["tokens_per_second"] == 200 / 210
+    # Only calls answered by the model count towards its percentiles
+    assert sink.percentile("npc/brief", 0.95) == 20 and sink.percentile("npc/full", 0.95) is None
+    assert "npc/brief" in sink.format_summary()
+    sink.clear()
+    assert sink.format_summary() == "No calls recorded yet."
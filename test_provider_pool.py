@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the provider pool's slots.
+
+No request is sent, so no model is needed: the tests take and free slots of endpoints
+and check that requests waiting for one are woken as soon as a slot is freed.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.provider_pool import SLOT_RECHECK_INTERVAL, Endpoint, ProviderPool
+from core.transport import DeadlineExceededError
+
+
+def pool(name: str, max_concurrency: int = 1) -> ProviderPool:
+    return ProviderPool([Endpoint(name, max_concurrency=max_concurrency)], health_interval=0)
+
+
+def test_waiting_requests_are_woken_when_a_slot_is_freed():
+    providers = pool("wake-async")
+    endpoint = providers.acquire()
+
+    async def main():
+        started = time.monotonic()
+        threading.Timer(0.05, providers.release, [endpoint]).start()
+        acquired = await providers.acquire_async(timeout=5)
+        return acquired, time.monotonic() - started
+
+    acquired, waited = asyncio.run(main())
+    assert acquired is endpoint and endpoint.outstanding == 1
+    assert waited < SLOT_RECHECK_INTERVAL / 2
+    assert providers._async_waiters == []
+
+
+def test_waiting_requests_take_turns():
+    providers = pool("turns-async", max_concurrency=2)
+    held = [providers.acquire(), providers.acquire()]
+    order = []
+
+    async def wait(number):
+        endpoint = await providers.acquire_async(timeout=5)
+        order.append(number)
+        await asyncio.sleep(0.01)
+        providers.release(endpoint)
+
+    async def main():
+        waiters = [asyncio.ensure_future(wait(number)) for number in range(4)]
+        await asyncio.sleep(0.01)
+        for endpoint in held:
+            providers.release(endpoint)
+        await asyncio.gather(*waiters)
+
+    started = time.monotonic()
+    asyncio.run(main())
+    assert sorted(order) == [0, 1, 2, 3] and time.monotonic() - started < SLOT_RECHECK_INTERVAL / 2
+    assert providers.primary.outstanding == 0
+
+
+def test_giving_up_passes_the_slot_on():
+    providers = pool("give-up-async")
+    endpoint = providers.acquire()
+
+    async def main():
+        with pytest.raises(DeadlineExceededError):
+            await providers.acquire_async(timeout=0.05)
+
+        impatient = asyncio.ensure_future(providers.acquire_async(timeout=5))
+        patient = asyncio.ensure_future(providers.acquire_async(timeout=5))
+        await asyncio.sleep(0.01)
+        # The slot goes to the first waiter, which is cancelled before it takes it
+        providers.release(endpoint)
+        impatient.cancel()
+        started = time.monotonic()
+        acquired = await patient
+        return acquired, time.monotonic() - started
+
+    acquired, waited = asyncio.run(main())
+    assert acquired is endpoint and waited < SLOT_RECHECK_INTERVAL / 2
+
+
+def test_cancelled_requests_leave_the_breaker_alone():
+    providers = pool("cancelled-async")
+    breaker = providers.primary.breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker._opened_at -= breaker.reset_timeout
+
+    # A cancelled trial request neither closes the circuit nor keeps other trials out
+    providers.release(providers.acquire(timeout=1), outcome=False)
+    assert breaker.state == "half-open"
+    providers.release(providers.acquire(timeout=1))
+    assert breaker.state == "closed" and providers.primary.outstanding == 0
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the response cache.
+
+The clock is a stand-in the tests move forward, so nothing waits: the tests check that
+entries expire after their TTL, and that the least recently used entries are evicted
+when the cache is over its entry or byte limit.
+"""
+
+import core.response_cache as response_cache
+from core.response_cache import ResponseCache
+
+
+class Clock:
+    """A time.time() that only moves when the test says so."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def cache(tmp_path, monkeypatch, **limits):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return ResponseCache(str(tmp_path / "responses.sqlite"), **limits), clock
+
+
+def test_keys_are_stable():
+    assert ResponseCache.make_key(model="llama3", messages=["hi"]) == ResponseCache.make_key(messages=["hi"], model="llama3")
+    assert ResponseCache.make_key(model="llama3") != ResponseCache.make_key(model="gpt-4o")
+
+
+def test_entries_expire_after_their_ttl(tmp_path, monkeypatch):
+    responses, clock = cache(tmp_path, monkeypatch, ttl_seconds=60)
+    responses.set("a", "sheet")
+    clock.now += 59
+    assert responses.get("a") == "sheet"
+    # Reading an entry doesn't make it live longer
+    clock.now += 2
+    assert responses.get("a") is None
+
+    # Expired entries are dropped on the next write
+    responses.set("b", "sheet")
+    clock.now += 61
+    responses.set("c", "sheet")
+    assert responses._conn.execute("SELECT key FROM responses").fetchall() == [("c",)]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    responses, clock = cache(tmp_path, monkeypatch, max_entries=2)
+    responses.set("a", "first")
+    clock.now += 1
+    responses.set("b", "second")
+    clock.now += 1
+    assert responses.get("a") == "first"
+    clock.now += 1
+    responses.set("c", "third")
+
+    assert responses.get("b") is None
+    assert responses.get("a") == "first" and responses.get("c") == "third"
+
+
+def test_entries_are_evicted_to_stay_under_the_byte_cap(tmp_path, monkeypatch):
+    responses, clock = cache(tmp_path, monkeypatch, max_bytes=250)
+    for key in "abc":
+        responses.set(key, "x" * 100)
+        clock.now += 1
+
+    assert responses.get("a") is None
+    assert responses.get("c")
+    clock.now += 1
+    # Sizes are counted in bytes, not characters: 50 of these are 150 bytes
+    responses.set("d", "⚔" * 50)
+    assert responses._conn.execute("SELECT key FROM responses ORDER BY key").fetchall() == [("c",), ("d",)]
+
+    responses.clear()
+    assert responses.get("d") is None
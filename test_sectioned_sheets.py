@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for sectioned sheets.
+
+The model is a stand-in that answers each request with the section it asks for, so no
+model is needed: the tests check that the sections after the first are requested at the
+same time, given the first section and the core concept, and put back in template order.
+"""
+
+import asyncio
+import threading
+
+from core.sheet_model import SECTION_SEPARATOR, split_template
+from fake_services import StubLLM, offline_agent
+from features.backstories.agent import BACKSTORY_TEMPLATE_FULL, BackstoryGeneratorAgent, BackstorySpec
+
+TITLE, SECTIONS = split_template(BACKSTORY_TEMPLATE_FULL)
+HEADINGS = [section.splitlines()[0] for section in SECTIONS]
+
+CORE_ANSWER = f"{TITLE}\n{HEADINGS[0]}\n  • Character Name: Vex Morrow\n\n**CORE CONCEPT:** Vex, a tiefling orphan from Sharn, hears the dead.\n"
+
+
+class SectionWriter(StubLLM):
+    """Answers the first request with the first section and a concept, and the others with their section."""
+
+    def __init__(self, drop_headings: bool = False):
+        super().__init__()
+        self.drop_headings = drop_headings
+        self.concurrent = threading.Barrier(len(SECTIONS) - 1, timeout=5)
+        self.in_flight = self.most_in_flight = 0
+
+    def section_answer(self, messages):
+        request = messages[-1]["content"]
+        self.requests.append(request)
+        heading = next(heading for heading in reversed(HEADINGS) if heading in request.rsplit("CORE CONCEPT:", 1)[-1])
+        body = f"  • Written for {heading[2:].strip()}"
+        return body if self.drop_headings else f"{heading}\n{body}"
+
+    def stream(self, messages, call=None, **options):
+        self.requests.append(messages[-1]["content"])
+        call.completion_tokens = 30
+        for i in range(0, len(CORE_ANSWER), 7):
+            yield CORE_ANSWER[i:i + 7]
+
+    def complete(self, messages, call=None, **options):
+        answer = self.section_answer(messages)
+        call.completion_tokens = 10
+        # Every section request must be waiting here at once, or this times out
+        self.concurrent.wait()
+        return answer
+
+    async def complete_async(self, messages, call=None, **options):
+        answer = self.section_answer(messages)
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return answer
+
+
+def agent(llm, sectioned=True):
+    return offline_agent(BackstoryGeneratorAgent, llm, sectioned=sectioned)
+
+
+SPEC = BackstorySpec(world_name="Eberron", prompt="an orphan who hears the dead")
+
+
+def check_sheet(sheet, llm):
+    sections = sheet.split(f"\n{SECTION_SEPARATOR}\n")
+    assert sheet.startswith(f"{TITLE}\n\n{HEADINGS[0]}\n  • Character Name: Vex Morrow")
+    assert [section.splitlines()[0] for section in sections[1:]] == HEADINGS[1:]
+    assert "CORE CONCEPT" not in sections[0] and sheet.count(TITLE) == 1
+    # Every later section was asked for with the first section and the concept
+    for request in llm.requests[1:]:
+        assert "Character Name: Vex Morrow" in request and "CORE CONCEPT: Vex, a tiefling orphan from Sharn, hears the dead." in request
+
+
+def test_sections_are_written_at_once_and_stitched_in_order():
+    llm = SectionWriter()
+    sheet = agent(llm).generate_sheet(SPEC)
+    check_sheet(sheet, llm)
+    assert len(llm.requests) == len(SECTIONS)
+
+
+def test_streamed_and_async_sheets_match():
+    llm = SectionWriter()
+    streamed = "".join(agent(llm).stream_sheet(SPEC))
+    check_sheet(streamed, llm)
+
+    llm = SectionWriter(drop_headings=True)
+    sheet = asyncio.run(agent(llm).generate_sheet_async(SPEC))
+    # Headings the model leaves out are put back
+    assert sheet == streamed
+    assert llm.most_in_flight == len(SECTIONS) - 1
+
+
+def test_brief_sheets_are_written_in_one_piece():
+    generator = agent(SectionWriter())
+    assert generator.template_sections(BackstorySpec(world_name="Eberron", prompt="a spy", brief=True)) is None
+    assert agent(SectionWriter(), sectioned=False).template_sections(SPEC) is None
+    title, sections = generator.template_sections(SPEC)
+    assert title == TITLE and len(sections) == 10
+
+
+def test_sectioned_and_whole_sheets_dont_share_a_flight():
+    llm = SectionWriter()
+    assert agent(llm).flight_key(SPEC) != agent(llm, sectioned=False).flight_key(SPEC)
+    brief = BackstorySpec(world_name="Eberron", prompt="a spy", brief=True)
+    assert agent(llm).flight_key(brief) == agent(llm, sectioned=False).flight_key(brief)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for structured sheets.
+
+The answers are written by the tests, so no model is needed: the tests check that every
+generator's templates go through template → model → JSON → rendered sheet and back
+without losing or mixing up fields, and that answers that don't fit are refused.
+"""
+
+import json
+
+import pytest
+
+from core.sheet_model import SECTION_SEPARATOR, field_name, parse_template, read_sheet, sheet_model
+from router import GENERATORS
+
+TEMPLATES = [
+    (f"{name}/{template}", getattr(entry.agent_class, f"template_{template}"))
+    for name, entry in GENERATORS.items()
+    for template in ("brief", "full")
+]
+
+
+@pytest.mark.parametrize("label, template", TEMPLATES, ids=[label for label, _ in TEMPLATES])
+def test_templates_round_trip(label, template):
+    layout = parse_template(template)
+    model = sheet_model("Sheet", template)
+    assert list(model.model_fields) == [template_field.name for template_field in layout.fields]
+
+    values = {name: f"Value of {name}, with: a colon" for name in model.model_fields}
+    sheet = model.parse(json.dumps(values))
+    assert sheet.model_dump() == values
+
+    text = sheet.render()
+    assert text.startswith(layout.title) and text.count(SECTION_SEPARATOR) == len(layout.sections) - 1
+    # Reading the rendered sheet gives the same values, even for labels used in more than one section
+    assert read_sheet(text, layout) == values
+
+
+def test_answers_that_dont_fit_are_refused():
+    _, template = TEMPLATES[0]
+    model = sheet_model("Sheet", template)
+    values = {name: "x" for name in model.model_fields}
+
+    # Code fences around the JSON are tolerated
+    assert model.parse(f"```json\n{json.dumps(values)}\n```").model_dump() == values
+    with pytest.raises(ValueError):
+        model.parse(json.dumps({**values, "extra": "x"}))
+    with pytest.raises(ValueError):
+        model.parse(json.dumps({name: "x" for name in list(values)[1:]}))
+    with pytest.raises(ValueError):
+        model.parse("Sure! Here's your NPC.")
+
+
+def test_field_names():
+    assert field_name("Race / Species") == "race_species"
+    assert field_name("Secret they're hiding") == "secret_theyre_hiding"
+    assert field_name("Power Level (1-10)") == "power_level"
+    layout = parse_template("Title\n\n📌 1. Part\n  • Name: (their name)\n  • If cornered…\n⸻\n🧠 2. More\n  • Name:\n")
+    assert [(f.name, f.separator) for f in layout.fields] == [("name", ": "), ("if_cornered", " "), ("name_2", ": ")]
+    assert layout.fields[0].hint == "(their name)"
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests for single-flight request coalescing.
+
+The work is a stand-in that waits until the test lets it finish, so no model is needed:
+the tests check that identical calls share one piece of work, that late stream
+subscribers get all of the text, and that the work only stops once nobody waits for it.
+"""
+
+import asyncio
+import threading
+import time
+
+from core.single_flight import SingleFlight
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def test_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(2)
+        return "sheet"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("npc", work))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: flight.stats()["coalesced"] == 7)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1] and results == ["sheet"] * 8
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 7}
+
+
+def test_concurrent_async_calls_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "sheet"
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("npc", work) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["sheet"] * 5
+    assert calls == [1] and flight.coalesced == 4
+
+
+def test_late_subscriber_gets_the_whole_stream():
+    flight = SingleFlight()
+    step = threading.Semaphore(0)
+
+    def work():
+        for word in ("Borin ", "the ", "smith"):
+            step.acquire()
+            yield word
+
+    first = flight.stream("npc", work)
+    step.release()
+    assert next(first) == "Borin "
+    late = flight.stream("npc", work)
+    # Joins the flight, and gets what was written before it did
+    assert next(late) == "Borin "
+    step.release()
+    step.release()
+    assert "Borin " + "".join(late) == "Borin the smith"
+    assert "".join(first) == "the smith"
+    assert flight.coalesced == 1
+
+
+def test_a_cancelled_waiter_leaves_the_flight_to_the_others():
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "sheet"
+
+    async def main():
+        impatient = asyncio.ensure_future(flight.do_async("npc", work))
+        patient = asyncio.ensure_future(flight.do_async("npc", work))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient
+
+    assert asyncio.run(main()) == "sheet" and finished == [1]
+
+
+def test_the_flight_stops_once_everybody_left():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        waiters = [asyncio.ensure_future(flight.do_async("npc", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [1] and flight.stats()["in_flight"] == 0
+
+    # A stream closed by all of its readers stops being produced
+    produced, closed = [], threading.Event()
+
+    def words():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                time.sleep(0.001)
+                yield f"{i} "
+        finally:
+            closed.set()
+
+    readers = [flight.stream("quest", words) for _ in range(2)]
+    for reader in readers:
+        next(reader)
+    for reader in readers:
+        reader.close()
+    assert closed.wait(1) and len(produced) < 1000
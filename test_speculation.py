@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Tests for speculative sheets in chat.
+
+The sheets are written by a stand-in for the generators, so no model is needed: the tests
+check that a numbered list of ideas starts sheets for its options, that picking one is
+answered from its sheet, that the rest are cancelled once the conversation moves on, and
+that the prompt tokens spent are those of the messages sent.
+"""
+
+import threading
+import time
+
+from core.speculation import (
+    Speculator,
+    detect_kind,
+    parse_options,
+    picked_option,
+    prompt_tokens,
+    stream_generator,
+)
+from core.token_budget import MESSAGE_OVERHEAD_TOKENS, count_tokens
+from fake_services import Entities, StubLLM, offline_agent
+from features.npc_generator.agent import NPCGeneratorAgent, NPCSpec
+from interface.cli import SmartChatSession
+from router import GENERATORS
+
+IDEAS = """Here are some regulars for your tavern:
+
+1. **Grumble Ironfoot** - a dwarven smith who drinks to forget a forge accident
+2. **Mira Quickfingers** - a halfling card sharp with debts all over town
+3. **Old Tom** - a retired guard who knows every secret of the city watch
+4. **Sister Elowen** - a priestess who hears confessions at the corner table
+
+Want me to flesh one of them out?"""
+
+
+class SlowSheets:
+    """Writes a sheet per option a line at a time, counting the lines written."""
+
+    delay = 0.01
+
+    def __init__(self):
+        self.lines_written = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, kind, spec):
+        name = spec.prompt.split("CURRENT REQUEST:")[-1].split(" - ")[0].strip()
+        for i in range(20):
+            time.sleep(self.delay)
+            with self.lock:
+                self.lines_written += 1
+            yield f"{kind} sheet for {name}, line {i}\n"
+
+
+def chat_with_ideas(sheets, question="What are some good NPC ideas for a fantasy tavern?"):
+    session = SmartChatSession("Eberron", speculate=True)
+    session.speculator.stream = sheets
+    session.add_message("user", question)
+    session.add_message("assistant", IDEAS)
+    return session
+
+
+def test_detects_what_a_list_is_of():
+    options = IDEAS.splitlines()[2:6]
+    assert detect_kind("Any tavern NPC ideas?", options) == "npc"
+    assert detect_kind("Give me ideas for taverns in the docks", options) == "building"
+    assert detect_kind("Help me out", ["1. A cursed sword", "2. A ring of whispers", "3. A cloak"]) == "magic_item"
+    assert detect_kind("Help me out", ["1. Go left", "2. Go right"]) is None
+    assert parse_options(options)[2] == "Mira Quickfingers - a halfling card sharp with debts all over town"
+    assert [picked_option(prompt) for prompt in ("number 2", "#3", "Option 1", "2", "number 2 but an elf")] == [2, 3, 1, 2, None]
+
+
+def test_picking_an_option_uses_its_sheet():
+    sheets = SlowSheets()
+    session = chat_with_ideas(sheets)
+    assert session.speculator.counts["started"] == 3
+
+    session.add_message("user", "/npc number 2")
+    reply = "".join(session.handle_input_stream("/npc number 2"))
+    assert reply.startswith("npc sheet for Mira Quickfingers, line 0\n") and reply.endswith("line 19\n")
+
+    # The other options are kept for another pick
+    session.add_message("user", "/npc number 3")
+    assert session.handle_input("/npc number 3").startswith("npc sheet for Old Tom")
+    assert session.speculator.counts["served"] == 2
+
+
+def test_moving_on_cancels_the_sheets():
+    sheets = SlowSheets()
+    session = chat_with_ideas(sheets)
+    time.sleep(0.05)
+    session.add_message("user", "Thanks! What's the weather like in Sharn?")
+    written = sheets.lines_written
+    time.sleep(0.2)
+
+    assert session.speculator.counts["cancelled"] == 3
+    assert sheets.lines_written < written + 3 * 2 < 3 * 20
+    assert session.speculator.take("npc", "number 1", "Eberron", True) is None
+
+
+def test_speculation_is_skipped_when_unclear_or_over_budget():
+    sheets = SlowSheets()
+    session = chat_with_ideas(sheets, question="Help me out")
+    assert session.speculator.counts["started"] == 0
+
+    speculator = Speculator(max_options=3, budget=0, stream=sheets)
+    assert speculator.start("npc", parse_options(IDEAS.splitlines()), lambda option: None) == []
+    assert speculator.counts["skipped"] == 3
+
+
+def test_a_sheet_over_budget_is_cancelled():
+    sheets = SlowSheets()
+    sheets.delay = 0
+    speculator = Speculator(max_options=1, budget=100, stream=sheets, measure=lambda pieces: 40)
+    speculator.start("npc", {1: "Grumble Ironfoot"}, lambda option: NPCSpec(world_name="Eberron", prompt=option, brief=True))
+    speculation = speculator._speculations[1]
+    for _ in range(200):
+        if speculation.done:
+            break
+        time.sleep(0.01)
+
+    # The prompt and the first lines used up the budget, so the rest wasn't written
+    assert speculation.cancelled.is_set() and speculator.take("npc", "number 1", "Eberron", True) is None
+    assert 100 <= speculator.spent < 100 + count_tokens("npc sheet for Grumble Ironfoot, line 10\n")
+    assert sheets.lines_written < 20
+
+
+def test_prompt_tokens_are_those_of_the_messages_sent(monkeypatch):
+    class Smith(StubLLM):
+        def complete(self, messages, call=None, **options):
+            self.requests.append(messages)
+            return "  • Name: Grumble Ironfoot"
+
+    llm, built = Smith(), []
+    build_messages = NPCGeneratorAgent.build_messages
+
+    def counted_build_messages(agent, spec):
+        built.append(spec)
+        return build_messages(agent, spec)
+
+    monkeypatch.setattr(NPCGeneratorAgent, "build_messages", counted_build_messages)
+    def agent():
+        return offline_agent(NPCGeneratorAgent, llm, memory=Entities())
+
+    monkeypatch.setattr(GENERATORS["npc"], "_agent_class", agent)
+
+    spec = NPCSpec(world_name="Eberron", prompt="Grumble Ironfoot", brief=True)
+    pieces = stream_generator("npc", spec)
+    assert prompt_tokens(pieces) == 0
+    assert "Grumble Ironfoot" in "".join(pieces)
+    sent, = llm.requests
+    per_message = [count_tokens(m["content"], "stub") + MESSAGE_OVERHEAD_TOKENS for m in sent]
+    assert prompt_tokens(pieces) == sum(per_message)
+    # Measuring the prompt didn't build it again
+    assert len(built) == 1
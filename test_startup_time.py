@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Startup time test for the TTRPG Sidekick entry points.
+
+Imports each entry point in a fresh interpreter with `python -X importtime` and
+checks that the OpenAI client stack and the generator features are not loaded
+until they are actually needed.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent
+
+ENTRY_POINTS = ["main", "interface.cli", "router"]
+
+# Packages that should only be imported once a completion is requested
+HEAVY_PACKAGES = ["openai", "httpx", "pydantic", "features"]
+
+# Ceiling on the cumulative import time of each entry point, in seconds
+IMPORT_BUDGET_SECONDS = float(os.getenv("TTRPG_IMPORT_BUDGET", "0.5"))
+
+
+def measure_import(module: str) -> dict[str, int]:
+    """
+    Imports a module in a fresh interpreter.
+
+    Returns:
+        The cumulative import time in microseconds of every module that got imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def test_entry_points_skip_heavy_imports():
+    for module in ENTRY_POINTS:
+        timings = measure_import(module)
+        heavy = sorted(name for name in timings if name.split(".")[0] in HEAVY_PACKAGES)
+        assert not heavy, f"Importing {module} also imported {heavy}"
+
+
+def test_entry_points_import_within_budget():
+    for module in ENTRY_POINTS:
+        seconds = measure_import(module)[module] / 1_000_000
+        assert seconds < IMPORT_BUDGET_SECONDS, f"Importing {module} took {seconds:.3f}s"
+
+
+def main():
+    """Prints the import time of each entry point and its slowest dependencies."""
+    print("🎲 TTRPG Sidekick - Startup Time Test")
+    print("=" * 50)
+
+    for module in ENTRY_POINTS:
+        timings = measure_import(module)
+        print(f"\n⏱️ import {module}: {timings[module] / 1000:.1f} ms")
+        slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[1:6]
+        for name, cumulative in slowest:
+            print(f"   {name}: {cumulative / 1000:.1f} ms")
+
+        heavy = sorted(name for name in timings if name.split(".")[0] in HEAVY_PACKAGES)
+        if heavy:
+            print(f"❌ Heavy modules imported at startup: {', '.join(heavy)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for token budgets.
+
+Only text is measured, so no model is needed: the tests check the history budget for
+a model, that packed history keeps the newest turns within the budget, and that the
+turns left out are summarized within the summary budget.
+"""
+
+from core.token_budget import (
+    DEFAULT_CONTEXT_WINDOW,
+    DEFAULT_HISTORY_BUDGET,
+    ConversationContext,
+    context_window,
+    count_tokens,
+    history_budget,
+    truncate_to_tokens,
+)
+
+
+def conversation(turns: int) -> ConversationContext:
+    context = ConversationContext()
+    for i in range(turns):
+        context.add("user" if i % 2 == 0 else "assistant", f"Turn {i}: " + "the party argues about the map " * 5)
+    return context
+
+
+def test_budgets_follow_the_model():
+    assert context_window("gpt-4o-mini") == 128000 and context_window("llama3:8b") == 8192
+    assert context_window("llama3.1:70b") == 128000 and context_window(None) == DEFAULT_CONTEXT_WINDOW
+    assert history_budget("gpt-4o") == DEFAULT_HISTORY_BUDGET
+    assert history_budget("phi3", reserved_tokens=3000) == min(DEFAULT_HISTORY_BUDGET, 4096 - 3000)
+    assert history_budget("phi3", reserved_tokens=5000) == 0
+
+    text = "A long description of the dungeon " * 20
+    assert count_tokens("") == 0 and count_tokens(text) > 100
+    short = truncate_to_tokens(text, 10)
+    assert short.endswith("...") and count_tokens(short) <= 12
+    assert truncate_to_tokens("Short", 10) == "Short"
+
+
+def test_recent_history_fits_the_budget():
+    context = conversation(10)
+    per_turn = context.entries[0].tokens
+    recent = context.recent(per_turn * 3 + 1)
+    assert recent == context.entries[-3:]
+    assert context.recent(0) == [] and context.recent(10**6) == context.entries
+
+
+def test_packed_history_summarizes_the_turns_left_out():
+    context = conversation(10)
+    per_turn = context.entries[0].tokens
+
+    # Everything fits: no summary
+    assert context.pack(per_turn * 20) == [entry.as_message() for entry in context.entries]
+
+    budget, summary_budget = per_turn * 5, per_turn * 2
+    messages = context.pack(budget, summary_budget=summary_budget)
+    summary, history = messages[0], messages[1:]
+    assert summary["role"] == "system" and summary["content"].startswith("Summary of earlier conversation:")
+    # Room was made for the summary, and the newest turns are kept whole
+    assert [message["content"] for message in history] == [entry.content for entry in context.entries[-3:]]
+    assert context.count(history) + summary_budget <= budget
+    # The summary keeps the newest of the turns left out, within its budget
+    assert "- user: Turn 6" in summary["content"] and "Turn 5" not in summary["content"]
+    assert context.count([summary]) <= summary_budget
+
+    # Without a summary budget, older turns are just left out
+    assert context.pack(budget, summary_budget=0) == [entry.as_message() for entry in context.entries[-5:]]
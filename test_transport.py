@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the transport policies.
+
+Requests are stand-ins that fail or take as long as a test needs, so no model is needed:
+the tests check the circuit breaker's states, that retries honour Retry-After and the
+deadline, that a hedge is only sent while there is time left for it, and that cancelling
+a hedged call cancels its requests.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.metrics import CallMetrics
+from core.transport import CircuitBreaker, DeadlineExceededError, Transport, TransportPolicy, retry_after
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("slow down")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+class Rejected(Exception):
+    status_code = 400
+
+
+def transport(**policy):
+    return Transport(TransportPolicy(**{"backoff_base": 0.001, "backoff_max": 0.001, **policy}))
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow() and not breaker.allow()
+    # A failed trial opens the circuit again for a whole reset_timeout
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_retries_wait_as_long_as_retry_after_asks():
+    assert retry_after(RateLimited("2")) == 2.0 and retry_after(RateLimited()) is None
+    attempts = []
+
+    def request(timeout):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited("0.1")
+        return "sheet"
+
+    call = CallMetrics()
+    assert transport().send(request, call) == "sheet"
+    assert call.retries == 1 and attempts[1] - attempts[0] >= 0.1
+
+    # Errors that won't go away aren't retried
+    with pytest.raises(Rejected):
+        transport().send(lambda timeout: (_ for _ in ()).throw(Rejected()), CallMetrics())
+
+
+def test_deadline_ends_the_retries():
+    attempts = []
+
+    def request(timeout):
+        attempts.append(timeout)
+        raise RateLimited("10")
+
+    with pytest.raises(DeadlineExceededError):
+        transport(max_retries=5).send(request, CallMetrics(), deadline=1)
+    # Waiting as long as Retry-After asks would pass the deadline
+    assert len(attempts) == 1 and 0 < attempts[0] <= 1
+
+    with pytest.raises(DeadlineExceededError):
+        transport(max_retries=100).send(lambda timeout: (_ for _ in ()).throw(TimeoutError()), CallMetrics(), deadline=0.05)
+
+
+def test_hedge_answers_for_a_slow_request():
+    first_done = threading.Event()
+    timeouts = []
+
+    def request(timeout):
+        timeouts.append(timeout)
+        if len(timeouts) == 1:
+            first_done.wait(1)
+            return "slow"
+        return "fast"
+
+    call = CallMetrics()
+    assert transport().send(request, call, deadline=5, hedge_delay=0.05) == "fast"
+    first_done.set()
+    assert call.hedged and 0 < timeouts[1] < timeouts[0]
+
+
+def test_no_hedge_without_time_left():
+    timeouts = []
+
+    def request(timeout):
+        timeouts.append(timeout)
+        time.sleep(0.1)
+        return "sheet"
+
+    call = CallMetrics()
+    assert transport().send(request, call, deadline=0.05, hedge_delay=0.05) == "sheet"
+    assert not call.hedged and len(timeouts) == 1
+
+    async def request_async(timeout):
+        timeouts.append(timeout)
+        await asyncio.sleep(0.15)
+        return "sheet"
+
+    timeouts.clear()
+    assert asyncio.run(transport().send_async(request_async, call, deadline=0.05, hedge_delay=0.1)) == "sheet"
+    assert not call.hedged and len(timeouts) == 1
+
+
+def test_cancelling_a_hedged_call_cancels_its_requests():
+    cancelled = []
+
+    async def request_async(timeout):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(timeout)
+            raise
+
+    async def main():
+        # Cancelled while still waiting to see whether the first request needs a hedge
+        hedged = transport().send_async(request_async, CallMetrics(), deadline=5, hedge_delay=1)
+        call = asyncio.ensure_future(hedged)
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0.01)
+        # Not left to run until the event loop closes
+        assert len(cancelled) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for world summaries.
+
+Worlds are stored in a temporary SQLite file, so no model is needed: the tests check
+what a summary shows within its token budget, and that summaries are cached by world
+version, reading only the entities added since they were built.
+"""
+
+from core.memory import MemoryService
+from core.token_budget import count_tokens
+from core.world_summary import WorldSummary, entity_label
+
+
+def test_summary_shows_the_newest_entities_that_fit():
+    summary = WorldSummary("Eberron")
+    assert summary.render() == ""
+
+    npcs = [(i, {"name": f"Villager {i}", "race": "Human", "location": "Sharn"}) for i in range(12, 0, -1)]
+    summary.update({"description": "A world of magic and industry", "tone": "Noir"}, 1.0, {"npcs": (12, npcs)})
+    text = summary.render(300)
+    assert text.startswith("WORLD CONTEXT (Eberron):\nDescription: A world of magic and industry\nTone: Noir\n")
+    assert "Known NPCs (12 total): Villager 12 (Human, Sharn); Villager 11" in text
+    assert summary.last_ids["npcs"] == 12
+
+    # A smaller budget keeps the newest entities
+    short = summary.render(40)
+    assert count_tokens(short) <= 40 and "Villager 12" in short and "Villager 1 " not in short
+    # Renders are cached until the next update
+    assert summary.render(40) is short
+    summary.update({}, 2.0, {"npcs": (1, [(13, "Mayor Dunmore")])})
+    assert "(13 total): Mayor Dunmore; Villager 12" in summary.render(40)
+
+    assert entity_label({"name": "Brom", "race": "Dwarf", "location": "Sharn"}) == "Brom (Dwarf, Sharn)"
+    assert entity_label({"race": "Elf"}) == "Unnamed (Elf)" and entity_label("Old Tom") == "Old Tom"
+
+
+def test_summaries_are_cached_by_world_version(tmp_path):
+    memory = MemoryService(data_dir=str(tmp_path), batch_size=1)
+    reads = []
+    get_recent_entities = memory.store.get_recent_entities
+
+    def recent_entities(world_name, entity_type, after_id=0, limit=20):
+        reads.append((entity_type, after_id))
+        return get_recent_entities(world_name, entity_type, after_id, limit)
+
+    memory.store.get_recent_entities = recent_entities
+    assert memory.get_world_summary("Eberron") == "" and reads == []
+
+    memory.store_npc("Eberron", {"name": "Brom", "race": "Dwarf"})
+    assert "Brom (Dwarf)" in memory.get_world_summary("Eberron")
+    assert ("npcs", 0) in reads
+
+    # Unchanged world: nothing is read again
+    reads.clear()
+    memory.get_world_summary("Eberron")
+    memory.get_world_summary("Eberron", max_tokens=100)
+    assert reads == []
+
+    # Changed world: only what was added since
+    memory.store_npc("Eberron", {"name": "Vex", "race": "Tiefling"})
+    assert "Known NPCs (2 total): Vex (Tiefling); Brom (Dwarf)" in memory.get_world_summary("Eberron")
+    assert ("npcs", 1) in reads and ("npcs", 0) not in reads
+    memory.store.close()
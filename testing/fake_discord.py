@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Fake Discord gateway for testing the Discord bot without Discord.
+
+Delivers slash commands to a SidekickBot the way discord.py does, and records every
+message the bot sends or edits with the time it happened, so tests can check what
+each channel ended up showing and that the bot kept to Discord's rate limits.
+"""
+
+import asyncio
+import time
+from typing import Optional, Union
+
+from interface.discord_bot import CommandContext, Message, SidekickBot
+
+
+class FakeChannel:
+    """A channel, with the messages the bot sent to it and when it sent or edited them."""
+
+    def __init__(self, channel_id: str):
+        self.id = channel_id
+        self.messages: list["FakeMessage"] = []
+        self.operations: list[float] = []  # Monotonic times of every send and edit
+
+    @property
+    def text(self) -> str:
+        """What the channel's messages show, joined together."""
+        return "".join(message.content for message in self.messages)
+
+    def busiest_window(self, seconds: float = 5.0) -> int:
+        """The most sends and edits in any window of the given length."""
+        busiest = 0
+        for i, start in enumerate(self.operations):
+            busiest = max(busiest, sum(1 for t in self.operations[i:] if t - start < seconds))
+        return busiest
+
+
+class FakeMessage(Message):
+    def __init__(self, gateway: "FakeGateway", channel: FakeChannel, content: str):
+        self.gateway = gateway
+        self.channel = channel
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content: str) -> None:
+        await self.gateway.call(self.channel, content)
+        self.content = content
+        self.edits += 1
+
+
+class FakeContext(CommandContext):
+    def __init__(self, gateway: "FakeGateway", guild_id: str, channel: FakeChannel):
+        self.gateway = gateway
+        self.guild_id = guild_id
+        self.channel_id = channel.id
+        self.channel = channel
+        self.deferred = False
+
+    async def defer(self) -> None:
+        self.deferred = True
+
+    async def send(self, content: str) -> Message:
+        await self.gateway.call(self.channel, content)
+        message = FakeMessage(self.gateway, self.channel, content)
+        self.channel.messages.append(message)
+        return message
+
+
+class FakeGateway:
+    """Stands in for Discord: channels by id, and a latency for every API call."""
+
+    def __init__(self, bot: SidekickBot, latency: float = 0.0):
+        self.bot = bot
+        self.latency = latency
+        self.channels: dict[str, FakeChannel] = {}
+
+    def channel(self, channel_id: str) -> FakeChannel:
+        return self.channels.setdefault(channel_id, FakeChannel(channel_id))
+
+    async def call(self, channel: FakeChannel, content: str) -> None:
+        """One send or edit; rejects messages Discord would reject."""
+        if not content.strip() or len(content) > 2000:
+            raise ValueError(f"Discord would reject a message of {len(content)} characters")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        channel.operations.append(time.monotonic())
+
+    async def command(self, guild_id: str, channel_id: str, name: str, value: Union[str, bool, None] = None) -> FakeContext:
+        """Delivers a slash command and waits until the bot has answered it."""
+        context = FakeContext(self, guild_id, self.channel(channel_id))
+        await self.bot.handle(context, name, value)
+        return context
+
+    def last_message(self, channel_id: str) -> Optional[str]:
+        messages = self.channel(channel_id).messages
+        return messages[-1].content if messages else None
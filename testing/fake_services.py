@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Stand-ins for the services a generator agent uses, for testing agents without a model.
+
+StubLLM is the base of fake LLM services: subclasses write the answers, and the rest of
+the LLMService interface is built on them. NoLore and Entities replace the lore index and
+world memory, and offline_agent() builds an agent that uses nothing else.
+"""
+
+from typing import Optional
+
+
+class StubLLM:
+    """A fake LLMService; subclasses answer complete(), and may override the other calls."""
+
+    model, provider = "stub", "stub"
+
+    def __init__(self):
+        self.requests = []
+
+    def complete(self, messages, call=None, **options) -> str:
+        raise NotImplementedError
+
+    def stream(self, messages, call=None, **options):
+        yield self.complete(messages, call, **options)
+
+    async def complete_async(self, messages, call=None, **options) -> str:
+        return self.complete(messages, call, **options)
+
+    async def stream_async(self, messages, call=None, **options):
+        for text in self.stream(messages, call, **options):
+            yield text
+
+
+class NoLore:
+    """A lore index that knows nothing and forgets every sheet."""
+
+    def relevant_facts(self, *args, **kwargs):
+        return ""
+
+    def add_sheet(self, *args, **kwargs):
+        pass
+
+
+class Entities:
+    """A world memory that keeps the entities stored in it, and has no lore of its own."""
+
+    lore = None
+
+    def __init__(self):
+        self.stored = []
+
+    def store_entity(self, world, entity_type, entity, source=""):
+        self.stored.append(entity)
+
+
+def offline_agent(agent_class: type, llm, lore=None, memory: Optional[Entities] = None, **options):
+    """
+    A generator agent that only talks to the given services: no world summary, no
+    coalescing, and no lore unless one is given.
+    """
+    agent = agent_class(llm=llm, lore=lore if lore is not None else NoLore(), memory=memory, coalesce=False, **options)
+    agent.world_context_tokens = 0
+    return agent
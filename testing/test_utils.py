@@ -13,6 +13,10 @@ def check_environment():
     
     print(f"API Provider: {api_provider.upper()}")
 
+    if os.getenv("TTRPG_CASSETTE") and os.getenv("TTRPG_CASSETTE_MODE", "replay").lower() == "replay":
+        print(f"Replaying recorded responses from {os.getenv('TTRPG_CASSETTE')}")
+        return True
+
     if api_provider == "openai":
         if not os.getenv("OPENAI_API_KEY") or "your-api-key" in os.getenv("OPENAI_API_KEY"):
             print("❌ OPENAI_API_KEY is not set correctly in your .envrc file.")